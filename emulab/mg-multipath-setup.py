@@ -6,6 +6,15 @@ import sys
 import json
 import argparse
 
+import mgutil
+import mgprofile
+import mgdist
+import mghuge
+import mgnlink
+import mgpreflight
+import mgtrace
+import mgroute
+
 moongen_dir = "MoonGen"
 
 nodeinfo_skeleton = {
@@ -107,13 +116,15 @@ def get_expinfo():
     return tokens[1], tokens[2]
 
 # locate_nodes(nodeinfo, exp_name, project)
+@mgtrace.traced()
 def locate_nodes(nodeinfo, exp_name, project='rnlab'):
     for n in nodeinfo.keys():
         print("locating node ",n, file=sys.stderr)
         node_located = False
         nslookup_cmd = "nslookup "+n+"."+exp_name+"."+project+".filab.uni-hannover.de"
-        ns_out =  subprocess.run("nslookup "+n+"."+exp_name+"."+project+".filab.uni-hannover.de",
-                                 shell=True, stdout=subprocess.PIPE)
+        with mgtrace.span("dns", n):
+            ns_out =  subprocess.run("nslookup "+n+"."+exp_name+"."+project+".filab.uni-hannover.de",
+                                     shell=True, stdout=subprocess.PIPE)
         for line in ns_out.stdout.decode().split("\n"):
             #print("\tprocessing line: ",line, file=sys.stderr)
             cname = re.search(r"canonical\s+name\s+=\s+(\S+.uni-hannover.de)", line)
@@ -131,6 +142,7 @@ def locate_nodes(nodeinfo, exp_name, project='rnlab'):
             sys.exit(-1)
 
 
+@mgtrace.traced()
 def query_node(nodeinfo):
     # given the pc name, and the skeleton of the node info that is common to all
     # dumbells, fill in the interface names and (for routers) the links
@@ -164,6 +176,7 @@ def query_node(nodeinfo):
 
 
 
+@mgtrace.traced()
 def query_moongen(nodeinfo):
     # given the pc name, and the skeleton of the node info that is common to all
     # dumbells, fill in the interface names and (for routers) the links
@@ -210,6 +223,7 @@ def query_moongen(nodeinfo):
         print("\tlinks: ", nodeinfo['links'], file=sys.stderr)
 
 
+@mgtrace.traced()
 def setup_endpoint(nodeinfo, routerip):
     # on the tx/rx nodes, the only thing to set up is the routing table
     # first we have to clear out the junk entries that emulab put
@@ -239,6 +253,7 @@ def setup_endpoint(nodeinfo, routerip):
     print("response: ", response, file=sys.stderr)
     
 
+@mgtrace.traced()
 def setup_router(nodeinfo, routerip):
     # on the router we need to delete extraneous route junk,
     # and set up the default through the other router
@@ -273,10 +288,15 @@ def setup_router(nodeinfo, routerip):
     print("response: ", response, file=sys.stderr)
 
 
+@mgtrace.traced()
 def install_moongen_dependencies(nodeinfo):
     # to just run moongen we only need to add:
     # libtbb2 libtbb-dev
     deps = ["htop", "libtbb2", "libtbb-dev"]
+    if nodeinfo.get('bundle'):
+        # the .debs came with the MoonGen bundle (see mgdist.py)
+        print("dependencies installed from bundle "+nodeinfo['bundle'], file=sys.stderr)
+        return
     quagga_sed_cmd = "sudo sed -i \"/\b\(quagga\)\b/d\" /var/lib/dpkg/statoverride"
     print("quagga sed command: ", quagga_sed_cmd, file=sys.stderr)
     response = subprocess.Popen("ssh -o StrictHostKeyChecking=no "+nodeinfo['cn-name']+" '"+quagga_sed_cmd+"'",
@@ -290,17 +310,21 @@ def install_moongen_dependencies(nodeinfo):
     print("response: ", response, file=sys.stderr)
 
     
-def setup_moongen(nodeinfo, rate, latency=[0], queue=[0]):
+@mgtrace.traced()
+def setup_moongen(nodeinfo, rate, latency=[0], queue=[0], loss=[0], profile=None, profile_tasks=None):
     # this is the tough one!
     # assume thr nodeinfo already contains the info about which
     # interfaces to link together
 
-    # dont worry about the length of the latency and queue param lists
-    # those arguments are only used in the case of a single link
+    # the latency, queue and loss lists may be shorter than the links,
+    # their last value is used for the remaining links
     if len(nodeinfo['links']) != len(rate):
         print("ERROR: rate parameters not equal to the number of links.")
         sys.exit(-1)
 
+    # remember what the links emulate, the workload results refer to it
+    nodeinfo['forwarder'] = {"rate": rate, "latency": latency, "queue": queue, "loss": loss}
+
     install_moongen_dependencies(nodeinfo)
 
     print("\n\nconfiguring moongen ",nodeinfo['hostname'], file=sys.stderr)
@@ -309,52 +333,63 @@ def setup_moongen(nodeinfo, rate, latency=[0], queue=[0]):
     for iface in nodeinfo['ifaces']:
         if_down_cmd += "sudo ifconfig "+iface['dev']+" down; "
     print("ifdown command: ",if_down_cmd, file=sys.stderr)
-    response = subprocess.Popen("ssh -o StrictHostKeyChecking=no "+nodeinfo['cn-name']+" '"+if_down_cmd+"'",
-                                shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+    with mgtrace.span("ifdown", nodeinfo):
+        response = subprocess.Popen("ssh -o StrictHostKeyChecking=no "+nodeinfo['cn-name']+" '"+if_down_cmd+"'",
+                                    shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
     print("response: ", response, file=sys.stderr)
     
-    # setup hugepages
-    hugepage_cmd = "cd "+moongen_dir+"; sudo ./setup-hugetlbfs.sh"
-    #response = subprocess.Popen("ssh -o StrictHostKeyChecking=no "+nodeinfo['cn-name']+" '"+hugepage_cmd+"'",
-    #                            shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-    print("hugepage_cmd: "+hugepage_cmd, file=sys.stderr)
-    response = subprocess.Popen("ssh -o StrictHostKeyChecking=no "+nodeinfo['cn-name']+" '"+hugepage_cmd+"'",
-                                shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-    print("response: ", response, file=sys.stderr)
+    # reserve hugepages for the rings and mempools of the forwarder (see mghuge.py)
+    if not mghuge.setup_hugepages(nodeinfo, rate, latency=latency, queue=queue):
+        print("ERROR: not enough hugepage memory on "+nodeinfo['cn-name']+", not starting moongen", file=sys.stderr)
+        sys.exit(-1)
     
     # bind the interfaces
     bind_interfaces_cmd = "cd "+moongen_dir+"; sudo ./bind-interfaces.sh"
     #response = subprocess.Popen("ssh -o StrictHostKeyChecking=no "+nodeinfo['cn-name']+" '"+bind_interfaces_cmd+"'",
     #                            shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
     print("bind_interfaces_cmd: "+bind_interfaces_cmd, file=sys.stderr)
-    response = subprocess.Popen("ssh -o StrictHostKeyChecking=no "+nodeinfo['cn-name']+" '"+bind_interfaces_cmd+"'",
-                                shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+    with mgtrace.span("bind-interfaces", nodeinfo):
+        response = subprocess.Popen("ssh -o StrictHostKeyChecking=no "+nodeinfo['cn-name']+" '"+bind_interfaces_cmd+"'",
+                                    shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
     print("response: ", response, file=sys.stderr)
 
     # cleanup old moongen processes
     mg_kill_cmd = "sudo killall MoonGen; sleep 5; sudo killall MoonGen"
-    response = subprocess.Popen("ssh -o StrictHostKeyChecking=no "+nodeinfo['cn-name']+" '"+mg_kill_cmd+"'",
-                                shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+    with mgtrace.span("kill", nodeinfo):
+        response = subprocess.Popen("ssh -o StrictHostKeyChecking=no "+nodeinfo['cn-name']+" '"+mg_kill_cmd+"'",
+                                    shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
     print("response: ", response, file=sys.stderr)
     
+    # optionally profile the forwarding tasks
+    extra_args = mgprofile.profile_args(profile, profile_tasks)
+    if profile:
+        response = mgprofile.clear_profiles(nodeinfo)
+        print("response: ", response, file=sys.stderr)
+
     # run moongen
     links = nodeinfo['links']
     moongen_cmd = ""
-    if len(links) == 1:
+    if len(links) == 1 and loss[0] == 0:
         if latency[0]==0:
-            moongen_cmd = "sudo nohup MoonGen/build/MoonGen MoonGen/examples/l2-forward-rate-crc.lua "+str(links[0][0])+" "+str(links[0][1])+" "+str(rate[0])+" "+str(rate[0])+" > /tmp/mglog-"+str(links[0][0])+".log 2>&1 &"
+            moongen_cmd = "sudo nohup MoonGen/build/MoonGen MoonGen/examples/l2-forward-rate-crc.lua "+str(links[0][0])+" "+str(links[0][1])+" "+str(rate[0])+" "+str(rate[0])+extra_args+" > /tmp/mglog-"+str(links[0][0])+".log 2>&1 &"
         else:
             if queue[0]==0:
-                moongen_cmd = "sudo nohup MoonGen/build/MoonGen MoonGen/examples/l2-forward-bsring-lrl.lua -d "+str(links[0][0])+" "+str(links[0][1])+" -r "+str(rate[0])+" "+str(rate[0])+" -l "+str(latency[0])+" "+str(latency[0])+" -x 20000 20000 > /tmp/mglog-"+str(links[0][0])+".log 2>&1 &"
+                moongen_cmd = "sudo nohup MoonGen/build/MoonGen MoonGen/examples/l2-forward-bsring-lrl.lua -d "+str(links[0][0])+" "+str(links[0][1])+" -r "+str(rate[0])+" "+str(rate[0])+" -l "+str(latency[0])+" "+str(latency[0])+" -x 20000 20000"+extra_args+" > /tmp/mglog-"+str(links[0][0])+".log 2>&1 &"
             else:
-                moongen_cmd = "sudo nohup MoonGen/build/MoonGen MoonGen/examples/l2-forward-psring-lrl.lua -d "+str(links[0][0])+" "+str(links[0][1])+" -r "+str(rate[0])+" "+str(rate[0])+" -l "+str(latency[0])+" "+str(latency[0])+" -q "+str(queue[0])+" "+str(queue[0])+" > /tmp/mglog-"+str(links[0][0])+".log 2>&1 &"
-    elif len(links) == 2:
-        moongen_cmd = "sudo nohup MoonGen/build/MoonGen MoonGen/examples/l2-multi-forward-rate-crc.lua "+str(links[0][0])+" "+str(links[0][1])+" "+str(links[1][0])+" "+str(links[1][1])+" "+str(rate[0])+" "+str(rate[0])+" "+str(rate[1])+" "+str(rate[1])+" > /tmp/mglog-"+str(links[0][0])+".log 2>&1 &"
+                moongen_cmd = "sudo nohup MoonGen/build/MoonGen MoonGen/examples/l2-forward-psring-lrl.lua -d "+str(links[0][0])+" "+str(links[0][1])+" -r "+str(rate[0])+" "+str(rate[0])+" -l "+str(latency[0])+" "+str(latency[0])+" -q "+str(queue[0])+" "+str(queue[0])+extra_args+" > /tmp/mglog-"+str(links[0][0])+".log 2>&1 &"
+    elif len(links) > 0:
+        # per link rate/latency/queue/loss, a core per direction (see mgnlink.py)
+        moongen_cmd = mgnlink.command(links, rate, latency=latency, queue=queue, loss=loss, extra_args=extra_args)
             
     print("moongen_cmd: "+moongen_cmd, file=sys.stderr)
-    response = subprocess.Popen("ssh -o StrictHostKeyChecking=no "+nodeinfo['cn-name']+" '"+moongen_cmd+"'",
-                                shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+    with mgtrace.span("launch", nodeinfo):
+        response = subprocess.Popen("ssh -o StrictHostKeyChecking=no "+nodeinfo['cn-name']+" '"+moongen_cmd+"'",
+                                    shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+        launched = mgtrace.now_us()
     print("response: ", response, file=sys.stderr)
+    if mgtrace.enabled():
+        # wait for the startup markers of the forwarder (lua/phase-trace.lua)
+        mgtrace.wait_forwarder(nodeinfo, "/tmp/mglog-"+str(links[0][0])+".log", launched)
     
 
 def gather_config(nodeinfo, exp_name, proj_name):
@@ -384,10 +419,10 @@ def print_config(nodeinfo):
 
 
 def load_config(filename):
-    # load the json format config file for this experiment
-    with open(filename, 'r') as f:
-        nodeinfo = json.load(f)
-        #print("read file: \n", nodeinfo)
+    # load the json format config file for this experiment, with the state
+    # recorded by earlier runs (see mgutil.save_config)
+    nodeinfo = mgutil.load_config(filename)
+    #print("read file: \n", nodeinfo)
     return nodeinfo
 
     
@@ -417,20 +452,41 @@ def main():
     parser.add_argument("-s", '--sender_rate', help='sender nodes\' link rate in Mbps', type=int, default=10)
     parser.add_argument("-r", '--receiver_rate', help='receiver nodes\' link rate in Mbps', type=int, default=10)
     parser.add_argument("-l", '--bottleneck_latency', nargs='+', help='bottleneck link latency in ms', type=float, default=[0])
-    parser.add_argument("-q", '--queue', help='use the packet-sized ring, and manually set queue depth', type=int, default=[0])
+    parser.add_argument("--profile", nargs=2, type=float, metavar=('DELAY', 'DURATION'), help='profile the forwarding tasks for DURATION s, starting DELAY s after launch')
+    parser.add_argument("--profile-tasks", nargs='+', help='only profile these forwarder tasks (e.g. forward receive)')
+    parser.add_argument("-q", '--queue', nargs='+', help='use the packet-sized ring, and manually set queue depth (one per link)', type=int, default=[0])
+    parser.add_argument("-o", '--loss', nargs='+', help='packet loss rate of the links (one per link)', type=float, default=[0])
+    parser.add_argument("--distribute", action='store_true', help='build MoonGen once and fan it out to the moongen nodes first (see mgdist.py)')
+    parser.add_argument("--skip-preflight", action='store_true', help='launch even if the preflight checks of the moongen nodes fail (see mgpreflight.py)')
+    parser.add_argument("--trace", metavar='FILE', help='write a timeline of the bring-up phases to FILE (see mgtrace.py)')
     parser.add_argument("-m", '--mgnode', help='moongen node to set up')
+    parser.add_argument('--routes', help='install (weighted multipath) routes on all hosts, computed from the link graph', action='store_true')
     args = parser.parse_args()
+    if args.trace:
+        mgtrace.start(args.trace)
 
     #if args.exp_name:
     if args.nodeinfo:
         nodeinfo = load_config(args.nodeinfo)
+        if args.distribute:
+            mgdist.distribute(nodeinfo)
+            mgutil.save_config(nodeinfo, args.nodeinfo)
         #configure_nodes(nodeinfo, args.bottleneck_rate, args.sender_rate, args.receiver_rate, args.bottleneck_latency, args.queue)
         if args.mgnode:
             mgnode = args.mgnode
             print("bottleneck_rate", args.bottleneck_rate)
-            setup_moongen(nodeinfo[mgnode], args.bottleneck_rate, latency=args.bottleneck_latency, queue=args.queue)
-        else:
-            print("ERROR: must specify the moongen node to configure with '-m'", file=sys.stderr)
+            if not args.skip_preflight and not mgpreflight.preflight(nodeinfo, {mgnode: (args.bottleneck_rate, args.bottleneck_latency, args.queue)}):
+                print("ERROR: preflight checks failed, not starting (override with --skip-preflight)", file=sys.stderr)
+                mgutil.save_config(nodeinfo, args.nodeinfo)
+                sys.exit(-1)
+            setup_moongen(nodeinfo[mgnode], args.bottleneck_rate, latency=args.bottleneck_latency, queue=args.queue, loss=args.loss, profile=args.profile, profile_tasks=args.profile_tasks)
+            mgutil.save_config(nodeinfo, args.nodeinfo)
+        if args.routes:
+            # after the moongen nodes, so the emulated rates set the nexthop weights
+            mgroute.install_routes(nodeinfo)
+            mgutil.save_config(nodeinfo, args.nodeinfo)
+        if not args.mgnode and not args.routes and not args.distribute:
+            print("ERROR: must specify the moongen node to configure with '-m', or --routes", file=sys.stderr)
     else:
         nodeinfo = get_node_list()
         exp_name, proj_name = get_expinfo()    
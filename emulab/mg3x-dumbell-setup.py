@@ -6,6 +6,16 @@ import sys
 import json
 import argparse
 
+import mgutil
+import mgprofile
+import mgdist
+import mghuge
+import mgnlink
+import mgpreflight
+import mgtrace
+import mgcalibrate
+import mgtune
+
 moongen_dir = "MoonGen"
 
 nodeinfo_skeleton = {
@@ -62,13 +72,15 @@ nodeinfo_skeleton = {
     }
 
 
+@mgtrace.traced()
 def locate_nodes(nodeinfo, exp_name, project='rnlab'):
     for n in nodeinfo.keys():
         print("locating node ",n, file=sys.stderr)
         node_located = False
         nslookup_cmd = "nslookup "+n+"."+exp_name+"."+project+".filab.uni-hannover.de"
-        ns_out =  subprocess.run(f"nslookup "+n+"."+exp_name+"."+project+".filab.uni-hannover.de",
-                                 shell=True, stdout=subprocess.PIPE)
+        with mgtrace.span("dns", n):
+            ns_out =  subprocess.run(f"nslookup "+n+"."+exp_name+"."+project+".filab.uni-hannover.de",
+                                     shell=True, stdout=subprocess.PIPE)
         for line in ns_out.stdout.decode().split("\n"):
             #print("\tprocessing line: ",line, file=sys.stderr)
             cname = re.search(r"canonical\s+name\s+=\s+(\S+.uni-hannover.de)", line)
@@ -86,6 +98,7 @@ def locate_nodes(nodeinfo, exp_name, project='rnlab'):
             sys.exit(-1)
 
 
+@mgtrace.traced()
 def query_endpoint(nodeinfo):
     # given the pc name, and the skeleton of the node info that is common to all
     # dumbells, fill in the interface names and (for routers) the links
@@ -104,6 +117,7 @@ def query_endpoint(nodeinfo):
                 nodeinfo['if']['ifname'] = ifname
 
 
+@mgtrace.traced()
 def query_router(nodeinfo):
     # given the pc name, and the skeleton of the node info that is common to all
     # dumbells, fill in the interface names and (for routers) the links
@@ -129,6 +143,7 @@ def query_router(nodeinfo):
                 nodeinfo['if-r-r']['ifname'] = ifname
 
 
+@mgtrace.traced()
 def query_moongen(nodeinfo):
     # given the pc name, and the skeleton of the node info that is common to all
     # dumbells, fill in the interface names and (for routers) the links
@@ -175,6 +190,7 @@ def query_moongen(nodeinfo):
         print("\tlinks: ", nodeinfo['links'], file=sys.stderr)
 
 
+@mgtrace.traced()
 def setup_endpoint(nodeinfo, routerip):
     # on the tx/rx nodes, the only thing to set up is the routing table
     # first we have to clear out the junk entries that emulab put
@@ -204,6 +220,7 @@ def setup_endpoint(nodeinfo, routerip):
     print("response: ", response, file=sys.stderr)
     
 
+@mgtrace.traced()
 def setup_router(nodeinfo, routerip):
     # on the router we need to delete extraneous route junk,
     # and set up the default through the other router
@@ -238,10 +255,15 @@ def setup_router(nodeinfo, routerip):
     print("response: ", response, file=sys.stderr)
 
 
+@mgtrace.traced()
 def install_moongen_dependencies(nodeinfo):
     # to just run moongen we only need to add:
     # libtbb2 libtbb-dev
     deps = ["htop", "libtbb2", "libtbb-dev"]
+    if nodeinfo.get('bundle'):
+        # the .debs came with the MoonGen bundle (see mgdist.py)
+        print("dependencies installed from bundle "+nodeinfo['bundle'], file=sys.stderr)
+        return
     quagga_sed_cmd = "sudo sed -i \"/\b\(quagga\)\b/d\" /var/lib/dpkg/statoverride"
     print("quagga sed command: ", quagga_sed_cmd, file=sys.stderr)
     response = subprocess.Popen(f"ssh -o StrictHostKeyChecking=no "+nodeinfo['hostname']+" '"+quagga_sed_cmd+"'",
@@ -255,7 +277,8 @@ def install_moongen_dependencies(nodeinfo):
     print("response: ", response, file=sys.stderr)
 
     
-def setup_moongen(nodeinfo, rate, latency=0, queue=0):
+@mgtrace.traced()
+def setup_moongen(nodeinfo, rate, latency=0, queue=0, profile=None, profile_tasks=None):
     # this is the tough one!
     # assume thr nodeinfo already contains the info about which
     # interfaces to link together
@@ -268,53 +291,73 @@ def setup_moongen(nodeinfo, rate, latency=0, queue=0):
     for iface in nodeinfo['ifaces']:
         if_down_cmd += "sudo ifconfig "+iface['ifname']+" down; "
     print("ifdown command: ",if_down_cmd, file=sys.stderr)
-    response = subprocess.Popen(f"ssh -o StrictHostKeyChecking=no "+nodeinfo['hostname']+" '"+if_down_cmd+"'",
-                                shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+    with mgtrace.span("ifdown", nodeinfo):
+        response = subprocess.Popen(f"ssh -o StrictHostKeyChecking=no "+nodeinfo['hostname']+" '"+if_down_cmd+"'",
+                                    shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
     print("response: ", response, file=sys.stderr)
     
-    # setup hugepages
-    hugepage_cmd = "cd "+moongen_dir+"; sudo ./setup-hugetlbfs.sh"
-    #response = subprocess.Popen(f"ssh -o StrictHostKeyChecking=no "+nodeinfo['hostname']+" '"+hugepage_cmd+"'",
-    #                            shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-    print("hugepage_cmd: "+hugepage_cmd, file=sys.stderr)
-    response = subprocess.Popen(f"ssh -o StrictHostKeyChecking=no "+nodeinfo['hostname']+" '"+hugepage_cmd+"'",
-                                shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
-    print("response: ", response, file=sys.stderr)
+    # reserve hugepages for the rings and mempools of the forwarder (see mghuge.py)
+    if not mghuge.setup_hugepages(nodeinfo, rate, latency=latency, queue=queue):
+        print("ERROR: not enough hugepage memory on "+nodeinfo['hostname']+", not starting moongen", file=sys.stderr)
+        sys.exit(-1)
     
     # bind the interfaces
     bind_interfaces_cmd = "cd "+moongen_dir+"; sudo ./bind-interfaces.sh"
     #response = subprocess.Popen(f"ssh -o StrictHostKeyChecking=no "+nodeinfo['hostname']+" '"+bind_interfaces_cmd+"'",
     #                            shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
     print("bind_interfaces_cmd: "+bind_interfaces_cmd, file=sys.stderr)
-    response = subprocess.Popen(f"ssh -o StrictHostKeyChecking=no "+nodeinfo['hostname']+" '"+bind_interfaces_cmd+"'",
-                                shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+    with mgtrace.span("bind-interfaces", nodeinfo):
+        response = subprocess.Popen(f"ssh -o StrictHostKeyChecking=no "+nodeinfo['hostname']+" '"+bind_interfaces_cmd+"'",
+                                    shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
     print("response: ", response, file=sys.stderr)
 
+    start_moongen(nodeinfo, rate, latency=latency, queue=queue, profile=profile, profile_tasks=profile_tasks)
+
+
+@mgtrace.traced()
+def start_moongen(nodeinfo, rate, latency=0, queue=0, profile=None, profile_tasks=None):
+    # (re)start the forwarder on an already configured moongen node
     # cleanup old moongen processes
     mg_kill_cmd = "sudo killall MoonGen; sleep 5; sudo killall MoonGen"
-    response = subprocess.Popen(f"ssh -o StrictHostKeyChecking=no "+nodeinfo['hostname']+" '"+mg_kill_cmd+"'",
-                                shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+    with mgtrace.span("kill", nodeinfo):
+        response = subprocess.Popen(f"ssh -o StrictHostKeyChecking=no "+nodeinfo['hostname']+" '"+mg_kill_cmd+"'",
+                                    shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
     print("response: ", response, file=sys.stderr)
+
+    # remember what the link emulates, the workload results refer to it
+    nodeinfo['forwarder'] = {"rate": rate, "latency": latency, "queue": queue}
     
+    # optionally profile the forwarding tasks
+    extra_args = mgprofile.profile_args(profile, profile_tasks)
+    if profile:
+        response = mgprofile.clear_profiles(nodeinfo)
+        print("response: ", response, file=sys.stderr)
+
     # run moongen
     links = nodeinfo['links']
     moongen_cmd = ""
     if len(links) == 1:
         if latency==0:
-            moongen_cmd = "sudo nohup MoonGen/build/MoonGen MoonGen/examples/l2-forward-rate-crc.lua "+str(links[0][0])+" "+str(links[0][1])+" "+str(rate)+" "+str(rate)+" > /tmp/mglog-"+str(links[0][0])+".log 2>&1 &"
+            moongen_cmd = "sudo nohup MoonGen/build/MoonGen MoonGen/examples/l2-forward-rate-crc.lua "+str(links[0][0])+" "+str(links[0][1])+" "+str(rate)+" "+str(rate)+extra_args+" > /tmp/mglog-"+str(links[0][0])+".log 2>&1 &"
         else:
             if queue==0:
-                moongen_cmd = "sudo nohup MoonGen/build/MoonGen MoonGen/examples/l2-forward-bsring-lrl.lua -d "+str(links[0][0])+" "+str(links[0][1])+" -r "+str(rate)+" "+str(rate)+" -l "+str(latency)+" "+str(latency)+" -x 20000 20000 > /tmp/mglog-"+str(links[0][0])+".log 2>&1 &"
+                moongen_cmd = "sudo nohup MoonGen/build/MoonGen MoonGen/examples/l2-forward-bsring-lrl.lua -d "+str(links[0][0])+" "+str(links[0][1])+" -r "+str(rate)+" "+str(rate)+" -l "+str(latency)+" "+str(latency)+" -x 20000 20000"+extra_args+" > /tmp/mglog-"+str(links[0][0])+".log 2>&1 &"
             else:
-                moongen_cmd = "sudo nohup MoonGen/build/MoonGen MoonGen/examples/l2-forward-psring-lrl.lua -d "+str(links[0][0])+" "+str(links[0][1])+" -r "+str(rate)+" "+str(rate)+" -l "+str(latency)+" "+str(latency)+" -q "+str(queue)+" "+str(queue)+" > /tmp/mglog-"+str(links[0][0])+".log 2>&1 &"
-    elif len(links) == 2:
-        moongen_cmd = "sudo nohup MoonGen/build/MoonGen MoonGen/examples/l2-multi-forward-rate-crc.lua "+str(links[0][0])+" "+str(links[0][1])+" "+str(links[1][0])+" "+str(links[1][1])+" "+str(rate)+" "+str(rate)+" "+str(rate)+" "+str(rate)+" > /tmp/mglog-"+str(links[0][0])+".log 2>&1 &"
+                moongen_cmd = "sudo nohup MoonGen/build/MoonGen MoonGen/examples/l2-forward-psring-lrl.lua -d "+str(links[0][0])+" "+str(links[0][1])+" -r "+str(rate)+" "+str(rate)+" -l "+str(latency)+" "+str(latency)+" -q "+str(queue)+" "+str(queue)+extra_args+" > /tmp/mglog-"+str(links[0][0])+".log 2>&1 &"
+    elif len(links) > 1:
+        # every link with the same parameters, a core per direction (see mgnlink.py)
+        moongen_cmd = mgnlink.command(links, rate, latency=latency, queue=queue, extra_args=extra_args)
             
     print("moongen_cmd: "+moongen_cmd, file=sys.stderr)
-    response = subprocess.Popen(f"ssh -o StrictHostKeyChecking=no "+nodeinfo['hostname']+" '"+moongen_cmd+"'",
-                                shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+    with mgtrace.span("launch", nodeinfo):
+        response = subprocess.Popen(f"ssh -o StrictHostKeyChecking=no "+nodeinfo['hostname']+" '"+moongen_cmd+"'",
+                                    shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE).communicate()
+        launched = mgtrace.now_us()
     print("response: ", response, file=sys.stderr)
-    
+    if mgtrace.enabled():
+        # wait for the startup markers of the forwarder (lua/phase-trace.lua)
+        mgtrace.wait_forwarder(nodeinfo, "/tmp/mglog-"+str(links[0][0])+".log", launched)
+
 
 def gather_config(nodeinfo, exp_name, proj_name):
     # when the experiment is first created, this will gather all the
@@ -343,14 +386,14 @@ def print_config(nodeinfo):
 
 
 def load_config(filename):
-    # load the json format config file for this experiment
-    with open(filename, 'r') as f:
-        nodeinfo = json.load(f)
-        print("read file: \n", nodeinfo)
+    # load the json format config file for this experiment, with the state
+    # recorded by earlier runs (see mgutil.save_config)
+    nodeinfo = mgutil.load_config(filename)
+    print("read file: \n", nodeinfo)
     return nodeinfo
 
     
-def configure_nodes(nodeinfo, bottleneck_rate, tx_rate, rx_rate, bottleneck_latency, queue_depth):
+def configure_nodes(nodeinfo, bottleneck_rate, tx_rate, rx_rate, bottleneck_latency, queue_depth, profile=None, profile_tasks=None):
     setup_endpoint(nodeinfo['sender1'], nodeinfo['router1']['if-r-1']['ip'])
     setup_endpoint(nodeinfo['sender2'], nodeinfo['router1']['if-r-2']['ip'])
     setup_endpoint(nodeinfo['receiver1'], nodeinfo['router2']['if-r-1']['ip'])
@@ -359,9 +402,22 @@ def configure_nodes(nodeinfo, bottleneck_rate, tx_rate, rx_rate, bottleneck_late
     setup_router(nodeinfo['router1'], nodeinfo['router2']['if-r-r']['ip'])
     setup_router(nodeinfo['router2'], nodeinfo['router1']['if-r-r']['ip'])
     print("\n\n\n")
-    setup_moongen(nodeinfo['mg_sender'], tx_rate)
-    setup_moongen(nodeinfo['mg_receiver'], rx_rate)
-    setup_moongen(nodeinfo['mg_router'], bottleneck_rate, latency=bottleneck_latency, queue=queue_depth)
+    setup_moongen(nodeinfo['mg_sender'], tx_rate, profile=profile, profile_tasks=profile_tasks)
+    setup_moongen(nodeinfo['mg_receiver'], rx_rate, profile=profile, profile_tasks=profile_tasks)
+    # reuse the correction of an earlier calibration with the same targets
+    (rate, latency) = mgcalibrate.corrected_params(nodeinfo['mg_router'], bottleneck_rate, bottleneck_latency)
+    setup_moongen(nodeinfo['mg_router'], rate, latency=latency, queue=queue_depth, profile=profile, profile_tasks=profile_tasks)
+
+
+def calibrate_bottleneck(nodeinfo, probe_args, bottleneck_rate, bottleneck_latency, queue_depth, size, tolerance):
+    # probe the emulated bottleneck and correct the forwarder until it
+    # delivers the requested rate and latency
+    probe = {'nodeinfo': nodeinfo[probe_args[0]], 'txdev': probe_args[1], 'rxdev': probe_args[2]}
+    def launch(rate, latency):
+        start_moongen(nodeinfo['mg_router'], rate, latency=latency, queue=queue_depth)
+    cal = mgcalibrate.calibrate(nodeinfo['mg_router'], probe, bottleneck_rate, bottleneck_latency, launch,
+                                size=size, rate_tol=tolerance[0]/100.0, latency_tol=tolerance[1], queue=queue_depth)
+    print("calibration of mg_router: ", cal, file=sys.stderr)
 
 # ======================================
 # ======================================
@@ -376,8 +432,19 @@ def main():
     parser.add_argument("-s", dest='sender_rate', help='sender nodes\' link rate in Mbps', type=int, default=10)
     parser.add_argument("-r", dest='receiver_rate', help='receiver nodes\' link rate in Mbps', type=int, default=10)
     parser.add_argument("-l", dest='bottleneck_latency', help='bottleneck link latency in ms', type=int, default=0)
+    parser.add_argument("--profile", nargs=2, type=float, metavar=('DELAY', 'DURATION'), help='profile the forwarding tasks for DURATION s, starting DELAY s after launch')
+    parser.add_argument("--profile-tasks", nargs='+', help='only profile these forwarder tasks (e.g. forward receive)')
+    parser.add_argument("--calibrate", nargs=3, metavar=('PROBE_NODE', 'TXDEV', 'RXDEV'), help='calibrate the bottleneck with probes from these moongen ports on PROBE_NODE')
+    parser.add_argument("--calibrate-size", help='packet size of the calibration probes', type=int, default=1400)
+    parser.add_argument("--calibrate-tolerance", nargs=2, type=float, metavar=('RATE_PCT', 'LATENCY_MS'), help='calibration tolerance (default=2%% 0.05ms)', default=[2, 0.05])
+    parser.add_argument("--distribute", action='store_true', help='build MoonGen once and fan it out to the moongen nodes first (see mgdist.py)')
+    parser.add_argument("--skip-preflight", action='store_true', help='launch even if the preflight checks of the moongen nodes fail (see mgpreflight.py)')
+    parser.add_argument("--trace", metavar='FILE', help='write a timeline of the bring-up phases to FILE (see mgtrace.py)')
+    parser.add_argument("--tune", action='store_true', help='apply the default host tuning profiles to routers and end hosts (see mgtune.py)')
     parser.add_argument("-q", dest='queue', help='use the packet-sized ring, and manually set queue depth', type=int, default=0)
     args = parser.parse_args()
+    if args.trace:
+        mgtrace.start(args.trace)
 
     if args.exp_name:
         if args.nodeinfo:
@@ -396,7 +463,20 @@ def main():
         print_config(nodeinfo)
     elif args.nodeinfo:
         nodeinfo = load_config(args.nodeinfo)
-        configure_nodes(nodeinfo, args.bottleneck_rate, args.sender_rate, args.receiver_rate, args.bottleneck_latency, args.queue)
+        if args.distribute:
+            mgdist.distribute(nodeinfo)
+        if not args.skip_preflight and not mgpreflight.preflight(nodeinfo, {'mg_sender': (args.sender_rate, 0, 0),
+                                                                  'mg_receiver': (args.receiver_rate, 0, 0),
+                                                                  'mg_router': (args.bottleneck_rate, args.bottleneck_latency, args.queue)}):
+            print("ERROR: preflight checks failed, not starting (override with --skip-preflight)", file=sys.stderr)
+            mgutil.save_config(nodeinfo, args.nodeinfo)
+            sys.exit(-1)
+        configure_nodes(nodeinfo, args.bottleneck_rate, args.sender_rate, args.receiver_rate, args.bottleneck_latency, args.queue, profile=args.profile, profile_tasks=args.profile_tasks)
+        if args.tune:
+            mgtune.print_report(mgtune.tune_nodes(nodeinfo))
+        if args.calibrate:
+            calibrate_bottleneck(nodeinfo, args.calibrate, args.bottleneck_rate, args.bottleneck_latency, args.queue, args.calibrate_size, args.calibrate_tolerance)
+        mgutil.save_config(nodeinfo, args.nodeinfo)
 
         
 # ======================================
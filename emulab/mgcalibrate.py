@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+#
+# closed-loop calibration of an emulated link.
+#
+# software rate control drifts with packet size and cpu load, so the rate
+# and latency a forwarder delivers are not exactly the -b and -l values it
+# was started with.  After the forwarder is up, a probe node runs the
+# l2-cbr-load-latency.lua (or the hardware rate controlled l2-load-latency.lua)
+# generator through the emulated link:
+#   - a rate probe offers more than the target rate and measures what arrives
+#   - a latency probe runs at low load and collects the latency histogram
+# the forwarder parameters are then corrected and the forwarder restarted
+# until both are within tolerance.  The last measured parameters are recorded
+# in the nodeinfo of the moongen node under 'calibration', and reused by later
+# runs with the same targets if the calibration converged.  A probe that
+# receives nothing (link down) ends the calibration as not converged, and so
+# does a corrected latency whose delay line would not fit the hugepages
+# mghuge.py reserved for the forwarder (the setup scripts reserve for the
+# reused parameters on the next run).
+#
+# The probe node must run MoonGen on two DPDK ports that are cabled to both
+# ends of the emulated link, since the generators send raw ethernet frames
+# and timestamp them in hardware on the same host.
+
+import re
+import sys
+
+import mghuge
+import mgutil
+import mgtrace
+
+moongen_dir = "MoonGen"
+
+probe_scripts = {"cbr": "l2-cbr-load-latency.lua",
+                 "hw": "l2-load-latency.lua"}
+
+# offered load of the rate probe and the latency probe, relative to the target
+rate_overload = 1.2
+latency_load = 0.1
+
+stats_re = re.compile(r"\[Device: id=(\d+)\] RX: ([\d.]+)(?: \(StdDev [\d.]+\))? Mpps, ([\d.]+)(?: \(StdDev [\d.]+\))? Mbit/s \(([\d.]+) Mbit/s with framing\)")
+
+
+def probe_command(txdev, rxdev, rate, size, duration, mode="cbr"):
+    # the generators write histogram.csv into the working directory
+    mg = "~/"+moongen_dir+"/build/MoonGen ~/"+moongen_dir+"/examples/"+probe_scripts[mode]
+    cmd = "cd /tmp; sudo rm -f histogram.csv; "
+    if mode == "cbr":
+        # one timestamped packet per ms, the script stops by itself
+        cmd += "sudo timeout "+str(int(duration)+30)+" "+mg+" "+str(txdev)+" "+str(rxdev)+" -r "+str(rate)+" -s "+str(size)+" -n "+str(int(duration*1000))+" 2>&1; "
+    else:
+        cmd += "sudo timeout -s INT "+str(int(duration))+" "+mg+" "+str(txdev)+" "+str(rxdev)+" -r "+str(rate)+" -f histogram.csv 2>&1; "
+    cmd += "echo HISTOGRAM; cat histogram.csv"
+    return cmd
+
+
+def parse_probe_output(output, rxdev):
+    # returns the rx rate (Mbit/s with framing) and the latency histogram
+    rates = []
+    final_rate = None
+    hist = {}
+    in_hist = False
+    for line in output.split("\n"):
+        if line.strip() == "HISTOGRAM":
+            in_hist = True
+            continue
+        if in_hist:
+            fields = line.strip().split(',')
+            if len(fields) == 2:
+                hist[float(fields[0])] = hist.get(float(fields[0]), 0) + int(float(fields[1]))
+            continue
+        m = stats_re.search(line)
+        if m and int(m.group(1)) == int(rxdev):
+            if "StdDev" in line:
+                final_rate = float(m.group(4))
+            else:
+                rates.append(float(m.group(4)))
+    if final_rate is None and rates:
+        # skip the warmup and the cut-off last interval
+        steady = rates[1:-1] if len(rates) > 2 else rates
+        final_rate = sum(steady)/len(steady)
+    return final_rate, hist
+
+
+def hist_quantile(hist, q):
+    total = sum(hist.values())
+    if total == 0:
+        return None
+    running = 0
+    for value in sorted(hist):
+        running += hist[value]
+        if running >= q*total:
+            return value
+    return max(hist)
+
+
+def run_probe(probe, rate, size, duration, mode="cbr"):
+    cmd = probe_command(probe['txdev'], probe['rxdev'], rate, size, duration, mode)
+    print("probe command: "+cmd, file=sys.stderr)
+    out, err, rc = mgutil.remote_command(probe['nodeinfo'], cmd)
+    return parse_probe_output(out, probe['rxdev'])
+
+
+def corrected_params(nodeinfo, rate, latency):
+    # forwarder parameters from an earlier converged calibration with the same targets
+    cal = nodeinfo.get('calibration')
+    if cal and cal['target_rate'] == rate and cal['target_latency'] == latency:
+        if not cal.get('converged'):
+            print("WARNING: the calibration for these targets did not converge, not reusing it", file=sys.stderr)
+            return rate, latency
+        print("using calibrated parameters rate="+str(cal['rate_param'])+" latency="+str(cal['latency_param']), file=sys.stderr)
+        return cal['rate_param'], cal['latency_param']
+    return rate, latency
+
+
+def fits_hugepages(nodeinfo, rate, latency, queue=0):
+    # whether the pages mghuge.setup_hugepages reserved on the node hold the
+    # forwarder with these parameters (True if nothing was reserved through it)
+    reserved = nodeinfo.get('hugepages')
+    if not reserved:
+        return True
+    p = mghuge.plan(nodeinfo, rate, latency, queue, page_size=reserved['page_size'])
+    return all(pages <= reserved['pages'].get(str(node), 0) for node, pages in p['pages'].items())
+
+
+@mgtrace.traced()
+def calibrate(nodeinfo, probe, target_rate, target_latency, launch, size=1400,
+              duration=5, rate_tol=0.02, latency_tol=0.05, max_iter=5, mode="cbr", queue=0):
+    # nodeinfo: the moongen node running the emulated link
+    # probe: {'nodeinfo': ..., 'txdev': .., 'rxdev': ..} of the probe node
+    # target_rate in Mbps, target_latency in ms
+    # launch(rate, latency) restarts the forwarder with the given parameters
+    # rate_tol is relative, latency_tol is in ms, queue the -q of the forwarder
+    rate_param, latency_param = corrected_params(nodeinfo, target_rate, target_latency)
+    history = []
+    for it in range(max_iter):
+        rate_ok = latency_ok = True
+        measured_rate, hist = run_probe(probe, target_rate*rate_overload, size, duration, mode)
+        if measured_rate is not None and measured_rate > 0:
+            rate_err = (measured_rate - target_rate)/target_rate
+            rate_ok = abs(rate_err) <= rate_tol
+        else:
+            rate_ok = False
+        measured_latency = None
+        if target_latency > 0:
+            measured_rate_lo, hist = run_probe(probe, target_rate*latency_load, size, duration, mode)
+            median = hist_quantile(hist, 0.5)
+            if median is not None:
+                # the histograms are in ns
+                measured_latency = median/1e6
+                latency_ok = abs(measured_latency - target_latency) <= latency_tol
+            else:
+                latency_ok = False
+        print("calibration iteration "+str(it)+": rate "+str(measured_rate)+" Mbps (param "+str(rate_param)
+              +"), latency "+str(measured_latency)+" ms (param "+str(latency_param)+")", file=sys.stderr)
+        history.append({"rate_param": rate_param, "latency_param": latency_param,
+                        "measured_rate": measured_rate, "measured_latency": measured_latency})
+        if measured_rate is None or measured_rate <= 0:
+            # no statistics or nothing arrived: the link is down, there is nothing to correct
+            print("ERROR: rate probe measured no traffic ("+str(measured_rate)+"), giving up", file=sys.stderr)
+            break
+        if rate_ok and latency_ok:
+            break
+        if it == max_iter - 1:
+            # the recorded parameters are the last measured ones, not an untested correction
+            break
+        if not rate_ok:
+            rate_param = rate_param*target_rate/measured_rate
+        if not latency_ok and measured_latency is not None:
+            latency_param = max(0, latency_param + target_latency - measured_latency)
+        if not fits_hugepages(nodeinfo, rate_param, latency_param, queue):
+            # the forwarder would not start: stop at the last launched parameters
+            print("ERROR: the forwarder with rate "+str(rate_param)+" latency "+str(latency_param)
+                  +" needs more hugepages than reserved, giving up", file=sys.stderr)
+            (rate_param, latency_param) = (history[-1]['rate_param'], history[-1]['latency_param'])
+            rate_ok = False
+            break
+        launch(rate_param, latency_param)
+
+    nodeinfo['calibration'] = {"target_rate": target_rate,
+                               "target_latency": target_latency,
+                               "rate_param": rate_param,
+                               "latency_param": latency_param,
+                               "converged": bool(history) and rate_ok and latency_ok,
+                               "history": history}
+    return nodeinfo['calibration']
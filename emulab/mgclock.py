@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+#
+# put hardware timestamps taken on different moongen nodes onto one timebase.
+#
+# Two kinds of clock samples are collected while the captures run:
+#   - NIC clock against the host clock of every capture node, by the sniffer
+#     (examples/moonsniff/sniffer.lua --clock-log), every NIC read bracketed by
+#     two host clock reads
+#   - host clock of every node against the clock of this host, by NTP style
+#     exchanges over ssh (exchange command), every interval the one with the
+#     lowest round trip time out of a short burst is kept
+#
+# For every clock an offset and a drift are fitted to its samples.  All clocks
+# are fitted at once, as one batch of weighted least squares problems that are
+# iteratively reweighted with Tukey's biweight, so outliers (preempted reads,
+# queued ssh messages) get no weight.  The NIC and host fits of a port are
+# chained into one map from the NIC clock to the clock of this host, and the
+# timestamps of .mscap or pcap files are rewritten with it in one streaming
+# pass.  Afterwards pre and post captures from different nodes can be matched
+# (e.g. with scripts/mgsketch.py build -t mscap) to get one-way delays.
+#
+#   ./mgclock.py exchange -j exp.json -n mg_sender mg_receiver -d 120 -o hosts.csv &
+#   (run sniffer.lua ... --clock-log clock.csv on both nodes, fetch the files)
+#   ./mgclock.py fit -s hosts.csv -c mg_sender=snd-clock.csv mg_receiver=rcv-clock.csv -o clock.json
+#   ./mgclock.py rewrite -m clock.json -k mg_sender:0 snd-pre.mscap aligned-pre.mscap
+#   ./mgclock.py rewrite -m clock.json -k mg_receiver:1 rcv-post.mscap aligned-post.mscap
+#
+# Without host samples the host clocks are taken as synchronized (e.g. by PTP).
+# The exchanges can not see an asymmetry of the control network, it ends up
+# in the offsets.
+
+import sys
+import json
+import time
+import struct
+import argparse
+import subprocess
+
+import numpy
+
+import mgutil
+
+responder = "python3 -u -c \"import sys,time; [print(time.time_ns(), flush=True) for l in sys.stdin]\""
+mscap_dtype = numpy.dtype([("ts", "<u8"), ("id", "<u4")])  # records of lua/moonsniff-io.lua
+pcap_magics = {0xa1b2c3d4: ("<", 1000), 0xd4c3b2a1: (">", 1000),
+               0xa1b23c4d: ("<", 1), 0x4d3cb2a1: (">", 1)}
+
+
+# ---- sample collection ---------------------------------------------------------
+
+def exchange_node(nodeinfo, duration, interval, burst=8):
+    # [(t1, t2, t4)]: sent here, time on the node, answer received here
+    p = subprocess.Popen(mgutil.ssh_cmd+mgutil.node_hostname(nodeinfo)+" '"+responder+"'", shell=True,
+                         stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    samples = []
+    end = time.time() + duration
+    try:
+        while time.time() < end:
+            best = None
+            for i in range(burst):
+                t1 = time.time_ns()
+                p.stdin.write(b"\n")
+                p.stdin.flush()
+                line = p.stdout.readline()
+                t4 = time.time_ns()
+                if not line:
+                    return samples
+                if best is None or t4 - t1 < best[2] - best[0]:
+                    best = (t1, int(line), t4)
+            samples.append(best)
+            time.sleep(interval)
+    finally:
+        p.stdin.close()
+        p.wait()
+    return samples
+
+
+def exchange(nodeinfo, nodes, duration, interval, filename):
+    results = mgutil.run_parallel({name: nodeinfo[name] for name in nodes},
+                                  lambda name, n: exchange_node(n, duration, interval))
+    with open(filename, 'w') as f:
+        f.write("node,t1_ns,t2_ns,t4_ns\n")
+        for name, samples in sorted(results.items()):
+            print(name+": "+str(len(samples))+" samples", file=sys.stderr)
+            for (t1, t2, t4) in samples:
+                f.write(name+","+str(t1)+","+str(t2)+","+str(t4)+"\n")
+
+
+def read_csv(filename):
+    with open(filename, 'r') as f:
+        next(f, None)
+        for line in f:
+            fields = line.strip().split(',')
+            if len(fields) == 4:
+                yield fields
+
+
+def best_half(x, y, quality):
+    # the samples with the lower half of the read spread / round trip time
+    keep = quality <= numpy.median(quality)
+    return x[keep], y[keep]
+
+
+def host_samples(filename):
+    # {node: (ref time, host - ref)}, both int64 ns
+    rows = {}
+    for (node, t1, t2, t4) in read_csv(filename):
+        rows.setdefault(node, []).append((int(t1), int(t2), int(t4)))
+    groups = {}
+    for node, r in rows.items():
+        a = numpy.array(r, dtype=numpy.int64)
+        mid = a[:, 0] + (a[:, 2] - a[:, 0])//2
+        groups[node] = best_half(mid, a[:, 1] - mid, a[:, 2] - a[:, 0])
+    return groups
+
+
+def nic_samples(node, filename):
+    # {node:port: (host time, nic - host)}, both int64 ns
+    rows = {}
+    for (port, before, nic, after) in read_csv(filename):
+        rows.setdefault(node+":"+port, []).append((int(before), int(nic), int(after)))
+    groups = {}
+    for key, r in rows.items():
+        a = numpy.array(r, dtype=numpy.int64)
+        mid = a[:, 0] + (a[:, 2] - a[:, 0])//2
+        groups[key] = best_half(mid, a[:, 1] - mid, a[:, 2] - a[:, 0])
+    return groups
+
+
+# ---- fitting -------------------------------------------------------------------
+
+def robust_fit(groups, iterations=10, c=4.685):
+    # fits y = offset + drift*(x - t0) for all groups at once.
+    # returns {key: {"t0", "offset", "drift", "mad", "samples"}}, offsets in ns
+    keys = sorted(groups)
+    n = max(len(x) for x, y in groups.values())
+    k = len(keys)
+    X = numpy.zeros((k, n))
+    Y = numpy.zeros((k, n))
+    mask = numpy.zeros((k, n), dtype=bool)
+    t0 = []
+    y0 = []
+    for i, key in enumerate(keys):
+        (x, y) = groups[key]
+        # take out the large parts exactly (int64), so the floats keep ns precision
+        t0.append(int(numpy.median(x)))
+        y0.append(int(numpy.median(y)))
+        X[i, :len(x)] = x - t0[-1]
+        Y[i, :len(y)] = y - y0[-1]
+        mask[i, :len(x)] = True
+
+    w = mask.astype(float)
+    for it in range(iterations):
+        sw = numpy.maximum(w.sum(axis=1, keepdims=True), 1e-12)
+        mx = (w*X).sum(axis=1, keepdims=True)/sw
+        my = (w*Y).sum(axis=1, keepdims=True)/sw
+        sxx = (w*(X - mx)**2).sum(axis=1, keepdims=True)
+        sxy = (w*(X - mx)*(Y - my)).sum(axis=1, keepdims=True)
+        slope = numpy.where(sxx > 0, sxy/numpy.where(sxx > 0, sxx, 1), 0)
+        intercept = my - slope*mx
+        r = Y - intercept - slope*X
+        mad = 1.4826*numpy.nanmedian(numpy.where(mask, numpy.abs(r), numpy.nan), axis=1, keepdims=True)
+        u = r/numpy.maximum(c*mad, 1e-9)
+        w = numpy.where(mask & (numpy.abs(u) < 1), (1 - u**2)**2, 0)
+
+    return {key: {"t0": t0[i], "offset": y0[i] + int(round(intercept[i, 0])), "drift": float(slope[i, 0]),
+                  "mad": float(mad[i, 0]), "samples": int(mask[i].sum())}
+            for i, key in enumerate(keys)}
+
+
+def chain(nic, host):
+    # map of a NIC clock to the reference clock: first NIC -> host, then
+    # host -> reference.  A map m takes ts to t0 + (ts - offset - t0)/(1 + drift)
+    if host is None:
+        return dict(nic)
+    a = nic["offset"] + host["offset"] - int(round(nic["drift"]*(nic["t0"] - host["offset"] - host["t0"])))
+    return {"t0": host["t0"], "offset": a, "drift": (1 + nic["drift"])*(1 + host["drift"]) - 1,
+            "mad": (nic["mad"]**2 + host["mad"]**2)**0.5, "samples": min(nic["samples"], host["samples"])}
+
+
+def to_reference(ts, m):
+    # int64 ns array on the source clock -> reference clock
+    d = ts.astype(numpy.int64) - numpy.int64(m["offset"] + m["t0"])
+    return numpy.int64(m["t0"]) + numpy.rint(d/(1 + m["drift"])).astype(numpy.int64)
+
+
+# ---- rewriting -----------------------------------------------------------------
+
+def rewrite_mscap(src, dst, m, chunk=1 << 20):
+    n = 0
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        while True:
+            rec = numpy.fromfile(fin, dtype=mscap_dtype, count=chunk)
+            if not len(rec):
+                break
+            rec["ts"] = to_reference(rec["ts"], m).astype(numpy.uint64)
+            rec.tofile(fout)
+            n += len(rec)
+    return n
+
+
+def rewrite_pcap(src, dst, m, chunk=65536):
+    n = 0
+    with open(src, 'rb') as fin, open(dst, 'wb') as fout:
+        header = fin.read(24)
+        magic = struct.unpack_from("<I", header)[0]
+        if magic not in pcap_magics:
+            raise ValueError(src+" is neither .mscap nor pcap")
+        (order, scale) = pcap_magics[magic]
+        rec = struct.Struct(order+"IIII")
+        fout.write(header)
+        while True:
+            # a batch of records, the timestamps are converted together
+            batch = []
+            for i in range(chunk):
+                h = fin.read(16)
+                if len(h) < 16:
+                    break
+                (sec, frac, caplen, origlen) = rec.unpack(h)
+                batch.append((sec*10**9 + frac*scale, caplen, origlen, fin.read(caplen)))
+            if not batch:
+                break
+            ts = to_reference(numpy.array([b[0] for b in batch], dtype=numpy.int64), m)
+            for t, (_, caplen, origlen, data) in zip(ts.tolist(), batch):
+                fout.write(rec.pack(t//10**9, (t % 10**9)//scale, caplen, origlen))
+                fout.write(data)
+            n += len(batch)
+            if len(batch) < chunk:
+                break
+    return n
+
+
+def rewrite(src, dst, m):
+    with open(src, 'rb') as f:
+        head = f.read(4)
+    if len(head) == 4 and struct.unpack("<I", head)[0] in pcap_magics:
+        return rewrite_pcap(src, dst, m)
+    return rewrite_mscap(src, dst, m)
+
+
+# ---- command line ------------------------------------------------------------
+
+def cmd_exchange(args):
+    nodeinfo = mgutil.load_config(args.nodeinfo)
+    nodes = args.nodes or sorted(mgutil.moongen_nodes(nodeinfo))
+    exchange(nodeinfo, nodes, args.duration, args.interval, args.output)
+
+
+def cmd_fit(args):
+    groups = {}
+    for spec in args.clock_logs:
+        (node, filename) = spec.split("=", 1)
+        groups.update(nic_samples(node, filename))
+    hosts = host_samples(args.host_samples) if args.host_samples else {}
+    fits = robust_fit(dict(groups, **{"host:"+k: v for k, v in hosts.items()}))
+    maps = {}
+    for key in groups:
+        node = key.split(":")[0]
+        if hosts and node not in hosts:
+            print("WARNING: no host samples of "+node+", taking its host clock as the reference", file=sys.stderr)
+        maps[key] = chain(fits[key], fits.get("host:"+node))
+    for key, f in sorted(fits.items()):
+        print("%-24s offset %+d ns  drift %+.3f ppm  mad %.0f ns  (%d samples)" % (key, f["offset"], f["drift"]*1e6, f["mad"], f["samples"]), file=sys.stderr)
+    with open(args.output, 'w') as f:
+        json.dump({"maps": maps, "fits": fits}, f, sort_keys=True, indent=4)
+
+
+def cmd_rewrite(args):
+    with open(args.map, 'r') as f:
+        maps = json.load(f)["maps"]
+    if args.key not in maps:
+        print("ERROR: no clock map for "+args.key+", known: "+", ".join(sorted(maps)), file=sys.stderr)
+        sys.exit(-1)
+    try:
+        n = rewrite(args.input, args.output, maps[args.key])
+    except ValueError as e:
+        print("ERROR: "+str(e), file=sys.stderr)
+        sys.exit(-1)
+    print("rewrote "+str(n)+" timestamps of "+args.input+" to "+args.output, file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="align the NIC clocks of several capture nodes")
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+
+    p = sub.add_parser("exchange", help='sample the host clocks of the nodes against this host')
+    p.add_argument("-j", '--nodeinfo', help='json config file for the experiment', required=True)
+    p.add_argument("-n", '--nodes', nargs='+', help='nodes to sample (default: all moongen nodes)')
+    p.add_argument("-d", '--duration', help='seconds to sample, as long as the captures run', type=float, required=True)
+    p.add_argument("-i", '--interval', help='seconds between samples (default=1)', type=float, default=1.0)
+    p.add_argument("-o", '--output', help='csv file for the samples', required=True)
+    p.set_defaults(func=cmd_exchange)
+
+    p = sub.add_parser("fit", help='fit offset and drift of all clocks')
+    p.add_argument("-c", '--clock-logs', nargs='+', metavar='NODE=FILE', required=True, help='--clock-log files of the sniffers')
+    p.add_argument("-s", '--host-samples', help='output of the exchange command')
+    p.add_argument("-o", '--output', help='json file for the clock maps', required=True)
+    p.set_defaults(func=cmd_fit)
+
+    p = sub.add_parser("rewrite", help='rewrite the timestamps of a .mscap or pcap file')
+    p.add_argument("-m", '--map', help='output of the fit command', required=True)
+    p.add_argument("-k", '--key', help='clock of the capture, NODE:PORT', required=True)
+    p.add_argument("input")
+    p.add_argument("output")
+    p.set_defaults(func=cmd_rewrite)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
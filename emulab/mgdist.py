@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+#
+# build MoonGen once and fan it out to all moongen nodes of an experiment.
+#
+# The bundle is identified by a hash of its inputs, computed on the build node
+# before anything is built: the content of the source files (the files git
+# tracks, including the submodules, or every file outside build/ without git)
+# and the versions of the run time dependencies in the apt lists the build
+# node has (the lists are not updated, so the hash only changes with the
+# sources or an update made on purpose).  The build output and the downloaded
+# .debs are not byte reproducible, so they are not hashed.  Nodes whose MoonGen/.bundle-hash
+# already matches are skipped, and if no node is left nothing is built.
+# Otherwise the tree is built on the build node, which also downloads the
+# .debs, and both are packed into a tarball.  The stale nodes get the bundle
+# in rounds: every node that has it copies it to one that does not, so n
+# nodes are done in log2(n)+1 rounds.  If a node cannot reach its peer, the
+# copy is relayed through this host.
+# Finally all nodes unpack the bundle and install the .debs at the same time.
+# Only MoonGen's own dependencies are shipped: apt on every node resolves
+# what they need in turn from the node's own packages (and its mirror for
+# anything missing), so no base system packages are replaced.
+#
+#   ./mgdist.py -j exp.json                     # build on the first moongen node
+#   ./mgdist.py -j exp.json -b mg_router -s ~/src/MoonGen
+#
+# The setup scripts skip their apt step on nodes that got a bundle.
+
+import sys
+import subprocess
+import argparse
+
+import mgutil
+import mgtrace
+
+deps = ["htop", "libtbb2", "libtbb-dev"]
+bundle_tmp = "/tmp/moongen-bundle.tar.gz"
+hash_file = ".bundle-hash"
+
+
+def hash_script(dest, tree):
+    # prints the hash of the bundle inputs as the last line
+    return "\n".join([
+        "set -e -o pipefail",
+        "cd "+dest+"/"+tree,
+        "{",
+        "  if git rev-parse --git-dir > /dev/null 2>&1; then",
+        # dangling symlinks hash as their (constant) error message
+        "    git ls-files -z --recurse-submodules | grep -zv '^"+hash_file+"$' | xargs -0 sha256sum 2>&1 || true",
+        "  else",
+        "    find . -type f -not -path './build/*' -not -name "+hash_file+" -print0 | sort -z | xargs -0 sha256sum",
+        "  fi",
+        "  apt-cache show --no-all-versions "+" ".join(deps)+" | grep -E '^(Package|Version|Architecture):'",
+        "} | sha256sum | cut -c1-16",
+    ])+"\n"
+
+
+def build_script(dest, tree):
+    # build, collect the .debs and pack
+    return "\n".join([
+        "set -e",
+        "cd "+dest,
+        "(cd "+tree+" && ./build.sh) > /tmp/mgdist-build.log 2>&1",
+        "rm -rf moongen-debs; mkdir moongen-debs",
+        "sudo sed -i \"/\\b\\(quagga\\)\\b/d\" /var/lib/dpkg/statoverride",
+        "(cd moongen-debs && apt-get download -q "+" ".join(deps)+") > /dev/null",
+        "tar --exclude=.git --exclude="+tree+"/"+hash_file+" -cf - "+tree+" moongen-debs | gzip > "+bundle_tmp,
+    ])+"\n"
+
+
+def install_script(dest, tree, bundle_hash):
+    return "\n".join([
+        "set -e",
+        "mkdir -p "+dest,
+        "tar xzf "+bundle_tmp+" -C "+dest,
+        "sudo sed -i \"/\\b\\(quagga\\)\\b/d\" /var/lib/dpkg/statoverride",
+        # apt installs the shipped .debs and whatever they need that the node lacks
+        "sudo DEBIAN_FRONTEND=noninteractive apt-get install -y -q --no-install-recommends "+dest+"/moongen-debs/*.deb > /dev/null",
+        "echo "+bundle_hash+" > "+dest+"/"+tree+"/"+hash_file,
+        "rm -f "+bundle_tmp,
+    ])+"\n"
+
+
+def installed_hashes(nodes, dest, tree):
+    results = mgutil.remote_command_all(nodes, "cat "+dest+"/"+tree+"/"+hash_file+" 2> /dev/null")
+    return {name: out.strip() for name, (out, err, rc) in results.items()}
+
+
+def sync_source(nodeinfo, src, dest, tree):
+    # put a local source tree on the build node
+    cmd = "rsync -a --delete --exclude build -e \"ssh -o StrictHostKeyChecking=no\" "+src.rstrip('/')+"/ "+mgutil.node_hostname(nodeinfo)+":"+dest+"/"+tree+"/"
+    print("sync command: "+cmd, file=sys.stderr)
+    if subprocess.call(cmd, shell=True) != 0:
+        print("ERROR: could not sync "+src+" to the build node", file=sys.stderr)
+        sys.exit(-1)
+
+
+def copy_bundle(src, dst):
+    # peer copy from src to dst, relayed through this host if that fails
+    cmd = "scp -q -o StrictHostKeyChecking=no "+bundle_tmp+" "+mgutil.node_hostname(dst)+":"+bundle_tmp
+    out, err, rc = mgutil.remote_command(src, cmd)
+    if rc == 0:
+        return True
+    print("peer copy "+mgutil.node_hostname(src)+" -> "+mgutil.node_hostname(dst)+" failed, relaying: "+err.strip(), file=sys.stderr)
+    return mgutil.relay_copy(src, dst, bundle_tmp)
+
+
+def fan_out(nodeinfo, seed, targets):
+    # tree distribution, the number of sources doubles every round.
+    # returns the names of the nodes that received the bundle
+    have = [seed]
+    todo = list(targets)
+    failed = []
+    rnd = 0
+    while todo:
+        rnd += 1
+        pairs = {dst: src for src, dst in zip(have, todo)}
+        todo = todo[len(pairs):]
+        print("round "+str(rnd)+": "+", ".join(src+" -> "+dst for dst, src in pairs.items()), file=sys.stderr)
+        results = mgutil.run_parallel({dst: nodeinfo[dst] for dst in pairs},
+                                      lambda dst, n: copy_bundle(nodeinfo[pairs[dst]], n))
+        for dst, ok in results.items():
+            if ok:
+                have.append(dst)
+            else:
+                failed.append(dst)
+    for name in failed:
+        print("ERROR: could not copy the bundle to "+name, file=sys.stderr)
+    return have[1:]
+
+
+@mgtrace.traced()
+def distribute(nodeinfo, build_node=None, src=None, dest="~", tree="MoonGen", nodes=None):
+    # returns the bundle hash, and records it in nodeinfo[node]['bundle']
+    if nodes is None:
+        nodes = mgutil.moongen_nodes(nodeinfo)
+    if build_node is None:
+        build_node = sorted(nodes)[0]
+    if src:
+        sync_source(nodeinfo[build_node], src, dest, tree)
+
+    out, err, rc = mgutil.remote_script(nodeinfo[build_node], hash_script(dest, tree))
+    if rc != 0 or not out.strip():
+        print("ERROR: hashing the sources and dependencies on "+build_node+" failed: "+err, file=sys.stderr)
+        sys.exit(-1)
+    bundle_hash = out.strip().split("\n")[-1]
+    print("bundle "+bundle_hash, file=sys.stderr)
+
+    current = installed_hashes(nodes, dest, tree)
+    stale = sorted(name for name in nodes if current.get(name) != bundle_hash)
+    for name in sorted(nodes):
+        if name not in stale:
+            print(name+" already has bundle "+bundle_hash+", skipping", file=sys.stderr)
+            nodeinfo[name]['bundle'] = bundle_hash
+    if not stale:
+        return bundle_hash
+
+    print("building on "+build_node, file=sys.stderr)
+    out, err, rc = mgutil.remote_script(nodeinfo[build_node], build_script(dest, tree))
+    if rc != 0:
+        print("ERROR: building the bundle on "+build_node+" failed (see /tmp/mgdist-build.log there): "+err, file=sys.stderr)
+        sys.exit(-1)
+
+    received = fan_out(nodeinfo, build_node, [name for name in stale if name != build_node])
+    if build_node in stale:
+        received.append(build_node)
+    script = install_script(dest, tree, bundle_hash)
+    results = mgutil.run_parallel({name: nodeinfo[name] for name in received},
+                                  lambda name, n: mgutil.remote_script(n, script))
+    for name, (out, err, rc) in sorted(results.items()):
+        if rc != 0:
+            print("ERROR: installing the bundle on "+name+" failed: "+err, file=sys.stderr)
+            continue
+        nodeinfo[name]['bundle'] = bundle_hash
+        print(name+": installed bundle "+bundle_hash, file=sys.stderr)
+    return bundle_hash
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", '--nodeinfo', help='json config file for the experiment', required=True)
+    parser.add_argument("-b", '--build-node', help='node to build on (default: the first moongen node)')
+    parser.add_argument("-s", '--src', help='local MoonGen tree to sync to the build node first')
+    parser.add_argument("-d", '--dest', help='directory of the MoonGen tree on the nodes (default=~)', default="~")
+    parser.add_argument("-n", '--nodes', nargs='+', help='nodes to distribute to (default: all moongen nodes)')
+    args = parser.parse_args()
+
+    nodeinfo = mgutil.load_config(args.nodeinfo)
+    nodes = {name: nodeinfo[name] for name in args.nodes} if args.nodes else None
+    distribute(nodeinfo, args.build_node, args.src, args.dest, nodes=nodes)
+    mgutil.save_config(nodeinfo, args.nodeinfo)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+#
+# hugepage budget of the forwarders on the moongen nodes.
+#
+# The delay line of l2-forward-bsring-lrl.lua holds latency*rate bytes (plus
+# the -x extra bytes), the one of l2-forward-psring-lrl.lua a number of
+# packets.  Every queued packet sits in an mbuf of the rx mempool of its
+# port, so at high BDP the pools, not the ring slots, are most of the memory.
+# The forwarders size these pools (numBufs) for their delay line full of
+# minimum size frames plus a fixed slack for the descriptors, and this is
+# what is budgeted per port, plus the ring slots and the EAL base memory,
+# summed up per NUMA node of the ports.  (The pool is per rx queue, the setup
+# scripts run the forwarders with one queue per port.)  Large budgets get 1 GB pages (if the
+# cpu has them), the rest 2 MB pages.  The plan is checked against the free
+# memory of every NUMA node, then the pages are reserved per node, hugetlbfs is
+# mounted with that page size and the result is read back.
+#
+#   ./mghuge.py -j exp.json                 # print the plans for the recorded forwarders
+#   ./mghuge.py -j exp.json --apply -n mg_router --page-size 1G
+#
+# The setup scripts do this instead of the fixed 2 MB setup-hugetlbfs.sh.
+# Nodes with several links run l2-nlink-forward-lrl.lua, which has the same
+# delay lines per direction of every link with latency.
+
+import sys
+import math
+import argparse
+
+import mgutil
+import mgtrace
+
+MB = 1 << 20
+GB = 1 << 30
+page_sizes = {"2M": 2*MB, "1G": GB}
+hugetlbfs = "/mnt/huge"
+
+# sizes of the libmoon/DPDK objects
+mbuf_size = 2176 + 128 + 64   # data room with headroom, struct rte_mbuf, mempool object header
+min_frame = 60                # smallest packet the rings account for (without CRC)
+rx_descs = 4096               # POOL_SLACK of the forwarders: mbufs of an rx mempool
+tx_descs = 1024               # besides the delay line
+base_memory = 256*MB          # EAL, per NUMA node that is used
+os_reserve = GB               # memory left to the kernel on every NUMA node
+headroom = 1.2
+one_gb_threshold = 4*GB       # use 1 GB pages from this budget on
+multi_link_script = "l2-nlink-forward-lrl.lua"
+
+
+def delay_line(rate, latency, queue):
+    # (forwarder script, packets one direction of the delay line can hold),
+    # the same queue sizing as the forwarder scripts
+    if latency == 0:
+        return ("l2-forward-rate-crc.lua", 0)
+    if queue == 0:
+        qbytes = max(math.floor(latency*rate*1000/8) + 20000, 3000)
+        return ("l2-forward-bsring-lrl.lua", math.ceil(qbytes/min_frame))
+    return ("l2-forward-psring-lrl.lua", queue)
+
+
+def as_list(v, n):
+    v = v if isinstance(v, list) else [v]
+    return [v[i] if i < len(v) else v[-1] for i in range(n)]
+
+
+def port_budget(rate, latency, queue):
+    # bytes of hugepage memory one port of a link needs: the rx mempool
+    # holding its direction of the delay line, and the ring slots
+    (script, packets) = delay_line(rate, latency, queue)
+    mbufs = packets + rx_descs + tx_descs
+    slots = 8*(1 << max(packets, 1).bit_length())
+    return (script, packets, mbufs*mbuf_size + slots)
+
+
+def query_script(ifaces):
+    lines = ["grep -qw pdpe1gb /proc/cpuinfo && echo pdpe1gb=1 || echo pdpe1gb=0"]
+    for dev in ifaces:
+        lines.append("echo numa:"+dev+"=$(cat /sys/class/net/"+dev+"/device/numa_node 2> /dev/null)")
+    lines += [
+        "for n in /sys/devices/system/node/node[0-9]*; do",
+        "  i=${n##*node}",
+        "  echo free:$i=$(awk '/MemFree/ {print $4*1024}' $n/meminfo)",
+        "  for p in $n/hugepages/hugepages-*; do",
+        "    echo pages:$i:$(basename $p)=$(cat $p/nr_hugepages)",
+        "  done",
+        "done",
+    ]
+    return "\n".join(lines)+"\n"
+
+
+def parse_query(out):
+    state = {"pdpe1gb": False, "numa": {}, "free": {}, "pages": {}}
+    for line in out.split("\n"):
+        if "=" not in line:
+            continue
+        (key, val) = line.split("=", 1)
+        if key == "pdpe1gb":
+            state["pdpe1gb"] = val == "1"
+        elif key.startswith("numa:"):
+            state["numa"][key[5:]] = max(int(val), 0) if val.strip().lstrip('-').isdigit() else 0
+        elif key.startswith("free:"):
+            state["free"][int(key[5:])] = int(val or 0)
+        elif key.startswith("pages:"):
+            (_, node, size) = key.split(":")
+            kb = int(size[len("hugepages-"):-2])
+            state["pages"].setdefault(int(node), {})[kb*1024] = int(val or 0)
+    return state
+
+
+def plan(nodeinfo, rate, latency=0, queue=0, state=None, page_size="auto"):
+    # returns the plan: page size, pages and bytes per NUMA node and the ports
+    links = nodeinfo['links']
+    rates = as_list(rate, len(links))
+    latencies = as_list(latency, len(links))
+    queues = as_list(queue, len(links))
+    numa_of_idx = {}
+    for iface in nodeinfo.get('ifaces', []):
+        dev = iface.get('dev') or iface.get('ifname')
+        if state and dev in state["numa"]:
+            iface['numa'] = state["numa"][dev]
+        numa_of_idx[iface.get('idx')] = iface.get('numa', 0)
+
+    need = {}
+    ports = []
+    for link, r, l, q in zip(links, rates, latencies, queues):
+        for idx in link:
+            (script, packets, size) = port_budget(r, l, q)
+            if len(links) > 1:
+                script = multi_link_script
+            node = numa_of_idx.get(idx, 0)
+            need[node] = need.get(node, 0) + size
+            ports.append({"port": idx, "numa": node, "script": script, "packets": packets, "bytes": size})
+    if not need:
+        need[0] = 0
+    for node in need:
+        need[node] = int((need[node] + base_memory)*headroom)
+
+    if page_size == "auto":
+        use_1g = (state is None or state["pdpe1gb"]) and max(need.values()) >= one_gb_threshold
+        page_size = "1G" if use_1g else "2M"
+    size = page_sizes[page_size]
+    return {"page_size": page_size, "page_bytes": size, "ports": ports,
+            "need": need, "pages": {node: math.ceil(b/size) for node, b in need.items()}}
+
+
+def check(p, state):
+    # problems that would make the launch fail, [] if the plan fits
+    problems = []
+    if p["page_size"] == "1G" and not state["pdpe1gb"]:
+        problems.append("the cpu does not support 1 GB pages")
+    for node, pages in p["pages"].items():
+        if node not in state["free"]:
+            problems.append("NUMA node "+str(node)+" does not exist")
+            continue
+        # pages that are already reserved with this size can be reused
+        have = state["pages"].get(node, {}).get(p["page_bytes"], 0)*p["page_bytes"]
+        avail = state["free"][node] + have - os_reserve
+        if pages*p["page_bytes"] > avail:
+            problems.append("NUMA node %d needs %d MB, only %d MB available" % (node, pages*p["page_bytes"]//MB, max(avail, 0)//MB))
+    return problems
+
+
+def apply_script(p):
+    size_kb = p["page_bytes"]//1024
+    lines = ["sync; echo 3 | sudo tee /proc/sys/vm/drop_caches > /dev/null",
+             "echo 1 | sudo tee /proc/sys/vm/compact_memory > /dev/null"]
+    for node, pages in sorted(p["pages"].items()):
+        base = "/sys/devices/system/node/node"+str(node)+"/hugepages/"
+        # give back unused pages of the other size first, then reserve
+        for other in page_sizes.values():
+            if other != p["page_bytes"]:
+                lines.append("echo 0 | sudo tee "+base+"hugepages-"+str(other//1024)+"kB/nr_hugepages > /dev/null 2>&1")
+        lines.append("echo "+str(pages)+" | sudo tee "+base+"hugepages-"+str(size_kb)+"kB/nr_hugepages > /dev/null")
+    lines += [
+        "sudo mkdir -p "+hugetlbfs,
+        "mountpoint -q "+hugetlbfs+" && sudo umount "+hugetlbfs,
+        "sudo mount -t hugetlbfs -o pagesize="+p["page_size"]+" nodev "+hugetlbfs,
+    ]
+    for node in sorted(p["pages"]):
+        lines.append("echo got:"+str(node)+"=$(cat /sys/devices/system/node/node"+str(node)+"/hugepages/hugepages-"+str(size_kb)+"kB/nr_hugepages)")
+    return "\n".join(lines)+"\n"
+
+
+def print_plan(name, p):
+    print(name+": "+p["page_size"]+" pages", file=sys.stderr)
+    for port in p["ports"]:
+        print("  port %d (NUMA %d) %s: %d packets in flight, %d MB" % (port["port"], port["numa"], port["script"], port["packets"], port["bytes"]//MB), file=sys.stderr)
+    for node, pages in sorted(p["pages"].items()):
+        print("  NUMA %d: %d MB -> %d pages" % (node, p["need"][node]//MB, pages), file=sys.stderr)
+
+
+@mgtrace.traced()
+def setup_hugepages(nodeinfo, rate, latency=0, queue=0, page_size="auto"):
+    # plan, check and reserve the hugepages on one moongen node before the
+    # forwarder starts. Returns the plan, or None if it does not fit
+    ifaces = [iface.get('dev') or iface.get('ifname') for iface in nodeinfo.get('ifaces', [])]
+    out, err, rc = mgutil.remote_script(nodeinfo, query_script([i for i in ifaces if i]))
+    state = parse_query(out)
+    p = plan(nodeinfo, rate, latency, queue, state, page_size)
+    print_plan(mgutil.node_hostname(nodeinfo), p)
+    problems = check(p, state)
+    for problem in problems:
+        print("ERROR: "+mgutil.node_hostname(nodeinfo)+": "+problem, file=sys.stderr)
+    if problems:
+        return None
+
+    out, err, rc = mgutil.remote_script(nodeinfo, apply_script(p))
+    got = {int(k[4:]): int(v or 0) for k, v in (line.split("=", 1) for line in out.split("\n") if line.startswith("got:"))}
+    for node, pages in p["pages"].items():
+        if got.get(node, 0) < pages:
+            print("ERROR: "+mgutil.node_hostname(nodeinfo)+": only %d of %d %s pages on NUMA node %d (fragmented memory?)"
+                  % (got.get(node, 0), pages, p["page_size"], node), file=sys.stderr)
+            return None
+    nodeinfo['hugepages'] = {"page_size": p["page_size"], "pages": {str(k): v for k, v in p["pages"].items()},
+                             "need_mb": {str(k): v//MB for k, v in p["need"].items()}}
+    return p
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", '--nodeinfo', help='json config file for the experiment', required=True)
+    parser.add_argument("-n", '--nodes', nargs='+', help='moongen nodes (default: all)')
+    parser.add_argument("-p", '--page-size', choices=["auto", "2M", "1G"], default="auto", help='hugepage size (default: 1G for large budgets)')
+    parser.add_argument('--apply', action='store_true', help='reserve the pages on the nodes (default: only print the plans)')
+    args = parser.parse_args()
+
+    nodeinfo = mgutil.load_config(args.nodeinfo)
+    nodes = {name: nodeinfo[name] for name in args.nodes} if args.nodes else mgutil.moongen_nodes(nodeinfo)
+    failed = False
+    for name, n in sorted(nodes.items()):
+        fwd = n.get('forwarder')
+        if not fwd:
+            print(name+": no forwarder recorded, skipping", file=sys.stderr)
+            continue
+        if args.apply:
+            failed |= setup_hugepages(n, fwd['rate'], fwd['latency'], fwd['queue'], args.page_size) is None
+        else:
+            print_plan(name, plan(n, fwd['rate'], fwd['latency'], fwd['queue'], page_size=args.page_size))
+    if args.apply:
+        mgutil.save_config(nodeinfo, args.nodeinfo)
+    if failed:
+        sys.exit(-1)
+
+
+if __name__ == "__main__":
+    main()
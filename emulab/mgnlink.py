@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+#
+# launch logic of l2-nlink-forward-lrl.lua, the forwarder of moongen nodes
+# with more than one link (or a single link with loss).
+#
+# Every link gets its own rate, latency, queue and loss, a single value is
+# used for all links.  Every one of the 2N directions gets its own worker
+# task and core: the CRC rate control sends filler frames at line rate and
+# blocks its core whatever the link rate, so directions can not share one.
+# The workers can be pinned to given cores, one per direction in the order
+# a>b, b>a of every link.
+#
+#   ./mgnlink.py -j exp.json -n mgnode1 -b 1000 500 100 -l 10 0 50 -q 0 0 500
+#   ./mgnlink.py -j exp.json -n mgnode1 -b 1000 -w 2 3 10 11
+#
+# prints the command the setup scripts would run on the node.
+
+import sys
+import argparse
+
+import mgutil
+import mghuge
+
+forwarder = mghuge.multi_link_script
+reserved_cores = 2   # master and stats task
+
+
+def workers(links):
+    # worker tasks (and cores) of the links, one per direction
+    return 2*len(links)
+
+
+def node_cores(nodeinfo):
+    out, err, rc = mgutil.remote_command(nodeinfo, "nproc")
+    return int(out.strip()) if out.strip().isdigit() else None
+
+
+def command(links, rate, latency=0, queue=0, loss=0, worker_cores=None, extra_args=""):
+    # worker_cores: the cores of the workers, one per direction (default: the next free ones)
+    n = len(links)
+    if worker_cores and len(worker_cores) != workers(links):
+        raise ValueError("need "+str(workers(links))+" worker cores, one per direction, got "+str(len(worker_cores)))
+    args = " -d "+" ".join(str(port) for link in links for port in link)
+    for (opt, values) in (("-r", rate), ("-l", latency), ("-q", queue), ("-o", loss)):
+        args += " "+opt+" "+" ".join(str(v) for v in mghuge.as_list(values, n))
+    if worker_cores:
+        args += " -c "+" ".join(str(c) for c in worker_cores)
+    return ("sudo nohup MoonGen/build/MoonGen MoonGen/examples/"+forwarder+args+extra_args
+            + " > /tmp/mglog-"+str(links[0][0])+".log 2>&1 &")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", '--nodeinfo', help='json config file for the experiment', required=True)
+    parser.add_argument("-n", '--node', help='moongen node', required=True)
+    parser.add_argument("-b", '--rate', nargs='+', type=float, help='link rates in Mbit/s, one per link', required=True)
+    parser.add_argument("-l", '--latency', nargs='+', type=float, default=[0], help='link latencies in ms')
+    parser.add_argument("-q", '--queue', nargs='+', type=int, default=[0], help='packet-sized ring depths (0: byte-sized from rate and latency)')
+    parser.add_argument("-o", '--loss', nargs='+', type=float, default=[0], help='link loss rates')
+    parser.add_argument("-w", '--worker-cores', nargs='+', type=int, help='cores of the workers, one per direction (default: the next free ones)')
+    parser.add_argument("-c", '--cores', type=int, help='cores of the node (default: ask the node)')
+    args = parser.parse_args()
+
+    nodeinfo = mgutil.load_config(args.nodeinfo)
+    n = nodeinfo[args.node]
+    links = n['links']
+    nproc = args.cores or node_cores(n)
+    need = reserved_cores + workers(links)
+    print(str(len(links))+" links, "+str(workers(links))+" workers, "+str(need)+" cores needed ("+str(nproc)+" present)", file=sys.stderr)
+    if nproc and nproc < need:
+        print("ERROR: "+args.node+" has "+str(nproc)+" cores, the forwarder needs "+str(need), file=sys.stderr)
+        sys.exit(-1)
+    try:
+        print(command(links, args.rate, args.latency, args.queue, args.loss, args.worker_cores))
+    except ValueError as e:
+        print("ERROR: "+str(e), file=sys.stderr)
+        sys.exit(-1)
+
+
+if __name__ == "__main__":
+    main()
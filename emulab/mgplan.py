@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+#
+# capacity plan of the moongen nodes for an emulated topology.
+#
+# From the links of the topology (rate, latency, loss, queue and the frame
+# size to plan for) and the measured throughput of the forwarders on the
+# testbed hardware, the links are packed onto as few moongen nodes as
+# possible (biggest load first, first node it fits on).  A node with one link
+# runs the dedicated forwarder with its fixed tasks, a node with several links
+# runs l2-nlink-forward-lrl.lua with a worker core per direction (its CRC
+# rate control keeps a core busy whatever the rate, see mgnlink.py).  Per
+# node the plan lists the ports, cores and hugepage memory (as mghuge.py
+# would reserve it), with the headroom applied to the load and the memory.
+#
+# Links that can not be emulated at the requested rate are reported and
+# left out of the plan: a rate above the port speed, or a direction that
+# needs more packets per second than one core of the forwarder makes (the
+# forwarders handle a direction on a single core).
+#
+#   ./mgplan.py topology.json -p testbed.json
+#   ./mgplan.py topology.json -p testbed.json -f 64 -o plan.json
+#
+# topology.json  {"links": [{"name": "bottleneck", "rate": 1000, "latency": 20,
+#                            "loss": 0.01, "queue": 0, "frame": 1518}, ...]}
+#                rate in Mbit/s, latency in ms, frame in bytes with CRC
+#                (default -f), the rest optional
+# testbed.json   {"node": {"cores": 16, "ports": 4, "port_speed": 10000,
+#                          "memory_gb": 64, "numa_nodes": 2},
+#                 "mpps_per_core": {"l2-forward-bsring-lrl.lua": {"64": 4.1, "1518": 0.81}, ...},
+#                 "ring_bytes_per_bdp": 24}
+#                Mpps per core measured per forwarder and frame size (linear
+#                in between), ring_bytes_per_bdp is the hugepage memory a
+#                port needs per byte of bandwidth-delay product (default: the
+#                worst case model of mghuge.py).  nlink and a dedicated
+#                forwarder without figures are assumed as fast as each other.
+#
+# NUMA placement of the ports is not planned, mgpreflight.py checks it on
+# the booked nodes.
+
+import sys
+import json
+import argparse
+
+import mghuge
+import mgnlink
+import mgpreflight
+
+MB = mghuge.MB
+GB = mghuge.GB
+framing = 20   # preamble and inter-frame gap, on top of the frame with CRC
+
+
+def link_pps(link):
+    # packets per second of one direction at full rate
+    return link["rate"]*1e6/((link["frame"] + framing)*8)
+
+
+def mpps_per_core(profile, script, frame):
+    # measured Mpps of one core of the forwarder, linear between the frame sizes, None without figures
+    points = profile.get("mpps_per_core", {}).get(script)
+    if not points:
+        return None
+    sizes = sorted((int(size), float(mpps)) for size, mpps in points.items())
+    if frame <= sizes[0][0]:
+        return sizes[0][1]
+    for (s0, m0), (s1, m1) in zip(sizes, sizes[1:]):
+        if frame <= s1:
+            return m0 + (m1 - m0)*(frame - s0)/(s1 - s0)
+    return sizes[-1][1]
+
+
+def port_memory(link, profile):
+    # hugepage bytes of one port of the link
+    (script, packets, size) = mghuge.port_budget(link["rate"], link["latency"], link["queue"])
+    if "ring_bytes_per_bdp" not in profile:
+        return size
+    bdp = link["latency"]*link["rate"]*1000/8
+    return (mghuge.rx_descs + mghuge.tx_descs)*mghuge.mbuf_size + int(bdp*profile["ring_bytes_per_bdp"])
+
+
+def analyze(link, profile, headroom):
+    # fills in the load of the link, returns the reasons it can't be emulated
+    hw = profile["node"]
+    script = mghuge.delay_line(link["rate"], link["latency"], link["queue"])[0]
+    if link["loss"] and script == "l2-forward-rate-crc.lua":
+        # only the delay-line forwarders and nlink drop packets
+        script = mghuge.multi_link_script
+    pps = link_pps(link)
+    nlink = mpps_per_core(profile, mghuge.multi_link_script, link["frame"])
+    dedicated = mpps_per_core(profile, script, link["frame"]) or nlink
+    if dedicated is None:
+        raise ValueError("no throughput figures for "+script+" in the testbed profile")
+    nlink = nlink or dedicated
+    link.update({"script": script, "mpps": pps/1e6,
+                 "load": pps*headroom/(dedicated*1e6), "nlink_load": pps*headroom/(nlink*1e6),
+                 "port_bytes": port_memory(link, profile)})
+    problems = []
+    if link["rate"] > hw.get("port_speed", float("inf")):
+        problems.append("%g Mbit/s is more than the %g Mbit/s of a port" % (link["rate"], hw["port_speed"]))
+    if link["load"] > 1:
+        problems.append("a direction needs %.2f Mpps (with headroom %.2f), one core forwards %.2f Mpps with %s"
+                        % (link["mpps"], link["mpps"]*headroom, dedicated, script))
+    return problems
+
+
+def node_needs(links, headroom):
+    # (ports, cores, hugepage bytes) of a node running these links, None if a direction overloads its worker
+    if len(links) == 1:
+        link = links[0]
+        cores = mgpreflight.required_cores([[0, 1]], link["latency"])
+        if link["script"] == mghuge.multi_link_script:
+            cores = mgnlink.reserved_cores + mgnlink.workers(links)
+    else:
+        if any(link["nlink_load"] > 1 for link in links):
+            return None
+        # the workers can not share cores, however light the links
+        cores = mgnlink.reserved_cores + mgnlink.workers(links)
+    memory = int((sum(2*link["port_bytes"] for link in links) + mghuge.base_memory)*headroom)
+    return (2*len(links), cores, memory)
+
+
+def fits(needs, hw):
+    if needs is None:
+        return False
+    (ports, cores, memory) = needs
+    usable = hw.get("memory_gb", float("inf"))*GB - mghuge.os_reserve*hw.get("numa_nodes", 1)
+    return ports <= hw.get("ports", 2) and cores <= hw.get("cores", 1) and memory <= usable
+
+
+def plan(topology, profile, frame=64, headroom=mghuge.headroom):
+    # returns {"nodes": [...], "infeasible": [...], totals}
+    hw = profile["node"]
+    links = []
+    infeasible = []
+    for i, l in enumerate(topology["links"]):
+        link = {"name": l.get("name", "link"+str(i)), "rate": float(l["rate"]), "latency": float(l.get("latency", 0)),
+                "loss": float(l.get("loss", 0)), "queue": int(l.get("queue", 0)), "frame": int(l.get("frame", frame))}
+        problems = analyze(link, profile, headroom)
+        alone = node_needs([link], headroom)
+        if not problems and not fits(alone, hw):
+            problems.append("does not fit on a node even alone (%d ports, %d cores, %d MB hugepages)"
+                            % (alone[0], alone[1], alone[2]//MB))
+        if problems:
+            infeasible.append({"link": link["name"], "problems": problems})
+        else:
+            links.append(link)
+
+    nodes = []
+    for link in sorted(links, key=lambda l: (-l["load"], -l["port_bytes"])):
+        for node in nodes:
+            needs = node_needs(node["links"] + [link], headroom)
+            if fits(needs, hw):
+                node["links"].append(link)
+                break
+        else:
+            nodes.append({"links": [link]})
+    for i, node in enumerate(nodes):
+        (ports, cores, memory) = node_needs(node["links"], headroom)
+        node.update({"name": "mgnode"+str(i + 1), "ports": ports, "cores": cores, "hugepage_mb": memory//MB,
+                     "script": node["links"][0]["script"] if len(node["links"]) == 1 else mghuge.multi_link_script,
+                     "page_size": "1G" if memory >= mghuge.one_gb_threshold else "2M"})
+    return {"nodes": nodes, "infeasible": infeasible,
+            "total": {"nodes": len(nodes), "ports": sum(n["ports"] for n in nodes), "cores": sum(n["cores"] for n in nodes),
+                      "hugepage_mb": sum(n["hugepage_mb"] for n in nodes)}}
+
+
+def print_plan(p):
+    for node in p["nodes"]:
+        print("%s: %s, %d ports, %d cores, %d MB hugepages (%s pages)"
+              % (node["name"], node["script"], node["ports"], node["cores"], node["hugepage_mb"], node["page_size"]))
+        for link in node["links"]:
+            print("  %-16s %8g Mbit/s %6g ms loss %g: %.3f Mpps per direction, %.0f%% of a core, %d MB per port"
+                  % (link["name"], link["rate"], link["latency"], link["loss"], link["mpps"],
+                     100*(link["load"] if len(node["links"]) == 1 else link["nlink_load"]), link["port_bytes"]//MB))
+    t = p["total"]
+    print("total: %d nodes, %d ports, %d cores, %d MB hugepages" % (t["nodes"], t["ports"], t["cores"], t["hugepage_mb"]))
+    for bad in p["infeasible"]:
+        print("ERROR: link "+bad["link"]+" can not be emulated: "+"; ".join(bad["problems"]), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("topology", help='json file with the links to emulate')
+    parser.add_argument("-p", '--profile', help='json file with the node hardware and measured forwarder throughput', required=True)
+    parser.add_argument("-f", '--frame', help='frame size in bytes to plan for, for links without one (default=64, the worst case)', type=int, default=64)
+    parser.add_argument('--headroom', help='factor on the load and memory (default=%g)' % mghuge.headroom, type=float, default=mghuge.headroom)
+    parser.add_argument("-o", '--output', help='also write the plan as json to this file')
+    args = parser.parse_args()
+
+    with open(args.topology, 'r') as f:
+        topology = json.load(f)
+    with open(args.profile, 'r') as f:
+        profile = json.load(f)
+    try:
+        p = plan(topology, profile, args.frame, args.headroom)
+    except ValueError as e:
+        print("ERROR: "+str(e), file=sys.stderr)
+        sys.exit(-1)
+    print_plan(p)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(p, f, indent=1)
+    if p["infeasible"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
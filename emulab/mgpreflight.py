@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+#
+# preflight checks of the moongen nodes against the planned forwarders.
+#
+# Before anything is launched, every moongen node is inspected at once (one
+# ssh script per node, all nodes in parallel) and checked against what the
+# setup script is about to start on it:
+#
+#   interfaces  all interfaces of the skeleton were discovered (name and port
+#               index) and still exist, or are already bound to DPDK
+#   links       every link pairs two different ports of the same subnet, no
+#               port is in two links, one rate per link
+#   speed       no link is asked for more than the slower of its two ports
+#   hugepages   the hugepage plan of mghuge.py fits into the NUMA nodes
+#   cores       enough cores for the forwarding tasks, and they are idle
+#   moongen     MoonGen is built, bind-interfaces.sh and a DPDK driver exist
+#   processes   no other MoonGen process is running (it will be killed)
+#
+# FAIL stops the setup, WARN is only reported.  The report is stored in
+# nodeinfo[node]['preflight'].
+#
+#   ./mgpreflight.py -j exp.json -n mg_router -b 1000 -l 20
+#   ./mgpreflight.py -j exp.json -n mg_router -b 1000 2000 -l 20 20
+
+import sys
+import argparse
+
+import mgutil
+import mgtrace
+import mghuge
+import mgnlink
+
+moongen_dir = "MoonGen"
+dpdk_drivers = ["igb_uio", "vfio-pci", "uio_pci_generic"]
+
+
+def iface_dev(iface):
+    return iface.get('dev') or iface.get('ifname')
+
+
+def query_script(ifaces):
+    lines = [mghuge.query_script(ifaces),
+             "echo pf:nproc=$(nproc)",
+             "echo pf:load=$(cut -d' ' -f1 /proc/loadavg)",
+             "echo pf:moongen=$(test -x "+moongen_dir+"/build/MoonGen && echo 1 || echo 0)",
+             "echo pf:bind=$(test -x "+moongen_dir+"/bind-interfaces.sh && echo 1 || echo 0)",
+             "echo pf:module=$( (lsmod | grep -qE \"^(igb_uio|vfio_pci|uio_pci_generic) \" || "
+             "find "+moongen_dir+"/libmoon -name igb_uio.ko 2> /dev/null | grep -q .) && echo 1 || echo 0)",
+             "echo pf:bound=$(ls "+" ".join("/sys/bus/pci/drivers/"+d for d in dpdk_drivers)+" 2> /dev/null | grep -c :)",
+             "echo pf:running=$(pgrep -c MoonGen)"]
+    for dev in ifaces:
+        lines.append("echo pf:exists:"+dev+"=$(test -e /sys/class/net/"+dev+" && echo 1 || echo 0)")
+        lines.append("echo pf:speed:"+dev+"=$(cat /sys/class/net/"+dev+"/speed 2> /dev/null)")
+        # the link may be down, then the best supported mode tells the speed
+        lines.append("echo pf:maxspeed:"+dev+"=$(sudo ethtool "+dev+" 2> /dev/null | "
+                     "sed -n '/Supported link modes/,/Supported pause/p' | grep -oE '[0-9]+base' | tr -d base | sort -n | tail -1)")
+    return "\n".join(lines)+"\n"
+
+
+def parse_query(out):
+    facts = {"exists": {}, "speed": {}, "maxspeed": {}}
+    for line in out.split("\n"):
+        if not line.startswith("pf:") or "=" not in line:
+            continue
+        (key, val) = line[3:].split("=", 1)
+        val = val.strip()
+        if ":" in key:
+            (kind, dev) = key.split(":", 1)
+            if kind == "exists":
+                facts["exists"][dev] = val == "1"
+            elif val.isdigit() and 0 < int(val) < 10**6:
+                facts[kind][dev] = int(val)
+        else:
+            facts[key] = float(val) if val.replace('.', '', 1).isdigit() else val
+    return facts
+
+
+def required_cores(links, latency):
+    # forwarding tasks of the forwarders the setup scripts start, plus master and stats
+    if len(links) > 1:
+        # l2-nlink-forward-lrl.lua, a core per direction
+        return mgnlink.reserved_cores + mgnlink.workers(links)
+    per_link = 4 if len(links) == 1 and mghuge.as_list(latency, 1)[0] != 0 else 2
+    return 2 + per_link*len(links)
+
+
+def check_node(nodeinfo, rate, latency, queue, facts, state):
+    # [(check, status, detail)]
+    results = []
+    def add(check, ok, detail, warn=False):
+        results.append((check, "OK" if ok else ("WARN" if warn else "FAIL"), detail))
+
+    ifaces = nodeinfo.get('ifaces', [])
+    by_idx = {iface.get('idx'): iface for iface in ifaces}
+    missing = [iface['ip'] for iface in ifaces if iface_dev(iface) is None or iface.get('idx') is None]
+    add("interfaces", not missing, "not discovered: "+", ".join(missing) if missing else str(len(ifaces))+" discovered")
+    gone = [iface_dev(iface) for iface in ifaces if iface_dev(iface) and not facts["exists"].get(iface_dev(iface))]
+    if gone:
+        add("interfaces", facts.get("bound", 0) >= len(gone), ", ".join(gone)+" not in the kernel, "
+            + str(int(facts.get("bound", 0)))+" devices bound to DPDK")
+
+    links = nodeinfo.get('links', [])
+    problems = []
+    used = set()
+    for link in links:
+        if len(link) != 2 or link[0] == link[1]:
+            problems.append("link "+str(link)+" does not pair two ports")
+            continue
+        for idx in link:
+            if idx not in by_idx:
+                problems.append("port "+str(idx)+" has no interface")
+            if idx in used:
+                problems.append("port "+str(idx)+" is in two links")
+            used.add(idx)
+        nets = set(by_idx[idx]['net'] for idx in link if idx in by_idx)
+        if len(nets) > 1:
+            problems.append("link "+str(link)+" spans "+", ".join(sorted(nets)))
+    if not links:
+        problems.append("no links")
+    rates = rate if isinstance(rate, list) else [rate]
+    if isinstance(rate, list) and len(rates) != len(links):
+        problems.append(str(len(rates))+" rates for "+str(len(links))+" links")
+    add("links", not problems, "; ".join(problems) if problems else str(len(links))+" links")
+
+    for link, r in zip(links, mghuge.as_list(rate, len(links))):
+        speeds = []
+        for idx in link:
+            dev = iface_dev(by_idx.get(idx, {}))
+            # negotiated speed, else the best supported mode, else what was seen before binding
+            speed = facts["speed"].get(dev) or facts["maxspeed"].get(dev) or by_idx.get(idx, {}).get('speed')
+            if speed:
+                by_idx[idx]['speed'] = speed
+                speeds.append(speed)
+        if len(speeds) < len(link):
+            add("speed", False, "link "+str(link)+": port speed unknown, "+str(r)+" Mbit/s requested", warn=True)
+        else:
+            add("speed", r <= min(speeds), "link "+str(link)+": "+str(r)+" Mbit/s requested, ports run at "+str(min(speeds))+" Mbit/s")
+
+    if state is not None:
+        p = mghuge.plan(nodeinfo, rate, latency, queue, state)
+        huge = mghuge.check(p, state)
+        add("hugepages", not huge, "; ".join(huge) if huge else
+            ", ".join("NUMA %d: %d x %s" % (node, pages, p["page_size"]) for node, pages in sorted(p["pages"].items())))
+
+    nproc = int(facts.get("nproc", 0))
+    need = required_cores(links, latency)
+    # the n-link forwarder can not put two directions on one core either, see mgnlink.py
+    add("cores", nproc >= need, str(need)+" needed, "+str(nproc)+" present")
+    if nproc >= need:
+        load = facts.get("load", 0)
+        add("cores", load <= nproc - need, "load %.1f leaves %.1f idle cores" % (load, nproc - load), warn=True)
+
+    add("moongen", facts.get("moongen") == 1, moongen_dir+"/build/MoonGen "+("exists" if facts.get("moongen") == 1 else "is missing"))
+    add("moongen", facts.get("bind") == 1, "bind-interfaces.sh "+("exists" if facts.get("bind") == 1 else "is missing"))
+    add("moongen", facts.get("module") == 1, "DPDK kernel driver "+("available" if facts.get("module") == 1 else "not found"), warn=True)
+    running = int(facts.get("running", 0))
+    add("processes", running == 0, str(running)+" MoonGen processes running, they will be killed", warn=True)
+    return results
+
+
+@mgtrace.traced()
+def preflight(nodeinfo, plans):
+    # plans: {node name: (rate, latency, queue)}. Checks all nodes at once,
+    # prints the report and returns True if nothing failed
+    def run(name, n):
+        ifaces = [iface_dev(iface) for iface in n.get('ifaces', []) if iface_dev(iface)]
+        out, err, rc = mgutil.remote_script(n, query_script(ifaces))
+        if rc != 0 and not out:
+            return [("ssh", "FAIL", err.strip() or "node not reachable")]
+        (rate, latency, queue) = plans[name]
+        return check_node(n, rate, latency, queue, parse_query(out), mghuge.parse_query(out))
+    results = mgutil.run_parallel({name: nodeinfo[name] for name in plans}, run)
+    print_report(results)
+    for name, res in results.items():
+        nodeinfo[name]['preflight'] = [list(r) for r in res]
+    return all(status != "FAIL" for res in results.values() for (check, status, detail) in res)
+
+
+def print_report(results):
+    for name, res in sorted(results.items()):
+        worst = "FAIL" if any(r[1] == "FAIL" for r in res) else ("WARN" if any(r[1] == "WARN" for r in res) else "OK")
+        print("preflight "+name+": "+worst, file=sys.stderr)
+        for (check, status, detail) in res:
+            print("  %-4s %-10s %s" % (status, check, detail), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", '--nodeinfo', help='json config file for the experiment', required=True)
+    parser.add_argument("-n", '--nodes', nargs='+', help='moongen nodes to check (default: all)')
+    parser.add_argument("-b", '--rate', nargs='+', type=float, help='link rates in Mbit/s, one per link (default: the recorded forwarder)')
+    parser.add_argument("-l", '--latency', nargs='+', type=float, default=[0], help='link latencies in ms')
+    parser.add_argument("-q", '--queue', nargs='+', type=int, default=[0], help='packet-sized ring depths')
+    args = parser.parse_args()
+
+    nodeinfo = mgutil.load_config(args.nodeinfo)
+    nodes = args.nodes or sorted(mgutil.moongen_nodes(nodeinfo))
+    plans = {}
+    for name in nodes:
+        fwd = nodeinfo[name].get('forwarder')
+        if args.rate:
+            plans[name] = (args.rate if len(args.rate) > 1 else args.rate[0], args.latency, args.queue)
+        elif fwd:
+            plans[name] = (fwd['rate'], fwd['latency'], fwd['queue'])
+        else:
+            print("ERROR: no rate given and no forwarder recorded for "+name, file=sys.stderr)
+            sys.exit(-1)
+    ok = preflight(nodeinfo, plans)
+    mgutil.save_config(nodeinfo, args.nodeinfo)
+    if not ok:
+        sys.exit(-1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+#
+# collect and merge the profiles written by the forwarders on the moongen
+# nodes (see lua/task-profile.lua).
+#
+# profiling is enabled when the forwarders are launched, e.g.
+#   ./mg-dumbell-setup.py -j exp.json -b 100 -l 10 --profile 30 20
+# profiles the forwarding tasks for 20 seconds, starting 30 seconds after
+# they come up.  Once the window has passed
+#   ./mgprofile.py -j exp.json -o profiles
+# pulls the profiles back from all moongen nodes and writes
+#   profiles/profile.folded  folded stacks of all tasks, for flamegraph.pl
+#   profiles/cycles.csv      per-task cycle counters (ring, busy-wait, send, ...)
+
+import os
+import re
+import sys
+import time
+import argparse
+
+import mgutil
+
+remote_prefix = "/tmp/mgprof-"
+
+
+def profile_args(window, tasks=None):
+    # extra forwarder arguments that enable profiling for the given
+    # (delay, duration) window in seconds
+    if not window:
+        return ""
+    args = " --profile "+str(window[0])+" "+str(window[1])
+    if tasks:
+        args += " --profile-tasks "+" ".join(tasks)
+    return args
+
+
+def clear_profiles(nodeinfo):
+    # remove the profiles of earlier runs so they are not collected again
+    return mgutil.remote_command(nodeinfo, "sudo rm -f "+remote_prefix+"*")
+
+
+def collect_profiles(nodes, outdir):
+    # pull the profile files of all nodes in parallel into outdir/<node>/
+    def fetch(name, n):
+        ok = mgutil.fetch_files(n, remote_prefix+"*", os.path.join(outdir, name))
+        if not ok:
+            print("WARNING: no profiles found on node "+name, file=sys.stderr)
+        return ok
+    return mgutil.run_parallel(nodes, fetch)
+
+
+def read_folded(filename):
+    # parse a file with one "frame;frame;... count" line per stack
+    stacks = {}
+    with open(filename, 'r') as f:
+        for line in f:
+            line = line.rstrip()
+            m = re.match(r"^(.*\S)\s+(\d+)$", line)
+            if not m:
+                continue
+            stacks[m.group(1)] = stacks.get(m.group(1), 0) + int(m.group(2))
+    return stacks
+
+
+def merge_folded(outdir, nodes):
+    # merge the stacks of all nodes and tasks into one folded file,
+    # every stack is prefixed with the node and the task it came from
+    merged = {}
+    for name in nodes:
+        nodedir = os.path.join(outdir, name)
+        if not os.path.isdir(nodedir):
+            continue
+        for fname in sorted(os.listdir(nodedir)):
+            m = re.match(r"^mgprof-(.*)\.folded$", fname)
+            if not m:
+                continue
+            for stack, count in read_folded(os.path.join(nodedir, fname)).items():
+                key = name+";"+m.group(1)+";"+stack
+                merged[key] = merged.get(key, 0) + count
+    with open(os.path.join(outdir, "profile.folded"), 'w') as f:
+        for stack in sorted(merged):
+            f.write(stack+" "+str(merged[stack])+"\n")
+    return merged
+
+
+def merge_cycles(outdir, nodes):
+    # combine the cycle counters of all tasks into one csv file
+    rows = []
+    for name in nodes:
+        nodedir = os.path.join(outdir, name)
+        if not os.path.isdir(nodedir):
+            continue
+        for fname in sorted(os.listdir(nodedir)):
+            m = re.match(r"^mgprof-(.*)-cycles\.csv$", fname)
+            if not m:
+                continue
+            with open(os.path.join(nodedir, fname), 'r') as f:
+                next(f, None)
+                for line in f:
+                    fields = line.rstrip().split(',')
+                    if len(fields) == 4:
+                        rows.append([name, m.group(1)]+fields)
+    with open(os.path.join(outdir, "cycles.csv"), 'w') as f:
+        f.write("node,task,counter,cycles,calls,share\n")
+        for r in rows:
+            f.write(",".join(r)+"\n")
+    return rows
+
+
+def print_cycles(rows):
+    for (node, task, counter, cycles, calls, share) in rows:
+        if counter != "window":
+            print("%-12s %-20s %-20s %6.2f%% %12s calls" % (node, task, counter, float(share)*100, calls))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", '--nodeinfo', help='json config file for the experiment', required=True)
+    parser.add_argument("-m", '--mgnode', nargs='+', help='only collect from these moongen nodes')
+    parser.add_argument("-o", '--outdir', help='directory for the collected profiles (default=profiles)', default='profiles')
+    parser.add_argument("-w", '--wait', help='wait this many seconds before collecting', type=float, default=0)
+    args = parser.parse_args()
+
+    nodeinfo = mgutil.load_config(args.nodeinfo)
+    nodes = mgutil.moongen_nodes(nodeinfo)
+    if args.mgnode:
+        nodes = {name: nodeinfo[name] for name in args.mgnode}
+
+    if args.wait > 0:
+        print("waiting "+str(args.wait)+"s for the profiling window to close", file=sys.stderr)
+        time.sleep(args.wait)
+
+    collect_profiles(nodes, args.outdir)
+    merged = merge_folded(args.outdir, nodes)
+    rows = merge_cycles(args.outdir, nodes)
+    print("merged "+str(len(merged))+" stacks into "+os.path.join(args.outdir, "profile.folded"), file=sys.stderr)
+    print_cycles(rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+#
+# static routing over the discovered link graph of an experiment.
+#
+# The hosts are the nodes without 'links' (the moongen nodes only bridge on
+# layer 2, their interfaces sit inside the subnets they emulate).  Two hosts
+# are neighbors if they have an interface in the same 'net'.  For every
+# subnet a host is not attached to, all shortest paths are found, and every
+# neighbor on one of them becomes a nexthop.  The nexthops are weighted by the
+# narrowest emulated link rate along their paths (nodeinfo['forwarder'] of
+# the moongen nodes), so e.g. node2 spreads its flows over if-r2 and if-r3 in
+# proportion to the two emulated bottlenecks.  The kernel hashes the flows onto
+# the nexthops (fib_multipath_hash_policy=1, L4 hash), so every flow stays on
+# one path and there is no reordering.
+#
+#   ./mgroute.py -j exp.json            # print the routes
+#   ./mgroute.py -j exp.json --install  # and install them on all hosts
+
+import sys
+import argparse
+
+import mgutil
+import mgtrace
+
+MAX_WEIGHT = 256
+
+
+def host_nodes(nodeinfo):
+    return {name: n for name, n in nodeinfo.items() if not n.get('links') and n.get('ifaces')}
+
+
+def iface_dev(iface):
+    return iface.get('dev') or iface.get('ifname')
+
+
+def link_rates(nodeinfo):
+    # emulated rate of every subnet, from the moongen nodes that were set up
+    rates = {}
+    for n in nodeinfo.values():
+        fwd = n.get('forwarder')
+        if not n.get('links') or not fwd:
+            continue
+        net_of_idx = {iface.get('idx'): iface['net'] for iface in n.get('ifaces', [])}
+        for link, rate in zip(n['links'], fwd.get('rate', [])):
+            for idx in link:
+                if idx in net_of_idx:
+                    net = net_of_idx[idx]
+                    rates[net] = min(rate, rates.get(net, rate))
+    return rates
+
+
+def compute_routes(nodeinfo):
+    # returns {host: [{"net": net, "nexthops": [{"via": ip, "dev": dev, "weight": w}]}]}
+    hosts = host_nodes(nodeinfo)
+    rates = link_rates(nodeinfo)
+    members = {}
+    for name, n in hosts.items():
+        for iface in n['ifaces']:
+            members.setdefault(iface['net'], []).append((name, iface))
+
+    routes = {name: [] for name in hosts}
+    for dst in sorted(members):
+        # breadth first from the hosts attached to dst, width is the narrowest
+        # emulated rate on the widest of the shortest paths
+        dist = {name: 0 for name, iface in members[dst]}
+        width = {name: float('inf') for name in dist}
+        frontier = sorted(dist)
+        while frontier:
+            candidates = {}
+            for v in frontier:
+                for iface_v in hosts[v]['ifaces']:
+                    for (u, iface_u) in members[iface_v['net']]:
+                        if u in dist:
+                            continue
+                        w = min(rates.get(iface_v['net'], float('inf')), width[v])
+                        candidates.setdefault(u, []).append({"via": iface_v['ip'], "dev": iface_dev(iface_u), "width": w})
+            for u, nexthops in candidates.items():
+                dist[u] = dist[frontier[0]] + 1
+                width[u] = max(nh['width'] for nh in nexthops)
+                routes[u].append({"net": dst, "nexthops": nexthops})
+            frontier = sorted(candidates)
+
+    for name in routes:
+        for route in routes[name]:
+            set_weights(route['nexthops'])
+    return routes
+
+
+def set_weights(nexthops):
+    # integer weights (1..256) proportional to the path widths,
+    # equal weights when no rates are known
+    finite = [nh['width'] for nh in nexthops if nh['width'] != float('inf')]
+    top = max(finite) if finite else None
+    for nh in nexthops:
+        w = nh.pop('width')
+        if top is None or w == float('inf'):
+            nh['weight'] = 1 if top is None else MAX_WEIGHT
+        else:
+            nh['weight'] = max(1, int(round(MAX_WEIGHT*w/top)))
+    if top is not None:
+        # keep the ratios but use the smallest weights that express them
+        g = 0
+        for nh in nexthops:
+            g = gcd(g, nh['weight'])
+        for nh in nexthops:
+            nh['weight'] //= g
+
+
+def gcd(a, b):
+    while b:
+        (a, b) = (b, a % b)
+    return a
+
+
+def route_command(route):
+    hops = route['nexthops']
+    if len(hops) == 1:
+        return "sudo ip route replace "+route['net']+" via "+hops[0]['via']+" dev "+hops[0]['dev']
+    cmd = "sudo ip route replace "+route['net']
+    for nh in hops:
+        cmd += " nexthop via "+nh['via']+" dev "+nh['dev']+" weight "+str(nh['weight'])
+    return cmd
+
+
+def route_script(n, routes):
+    # replaces the 10.10.x.x routes emulab installed (all but the connected
+    # subnets), enables forwarding on multi-homed hosts, and installs the routes
+    lines = ["for r in $(ip route show | grep '^10\\.10\\.' | grep -v 'proto kernel' | cut -d' ' -f1); do sudo ip route del $r; done"]
+    if len(set(iface['net'] for iface in n['ifaces'])) > 1:
+        lines.append("sudo sysctl -qw net.ipv4.ip_forward=1")
+    if any(len(r['nexthops']) > 1 for r in routes):
+        lines.append("sudo sysctl -qw net.ipv4.fib_multipath_hash_policy=1")
+    for r in routes:
+        lines.append(route_command(r))
+    lines.append("ip route show")
+    return "\n".join(lines)+"\n"
+
+
+@mgtrace.traced()
+def install_routes(nodeinfo, routes=None):
+    # install the routes on all hosts at once, they are also recorded in nodeinfo
+    if routes is None:
+        routes = compute_routes(nodeinfo)
+    hosts = host_nodes(nodeinfo)
+
+    def run(name, n):
+        script = route_script(n, routes[name])
+        print("["+name+"] routes:\n"+script, file=sys.stderr)
+        return mgutil.remote_script(n, script)
+
+    results = mgutil.run_parallel(hosts, run)
+    for name, (out, err, rc) in results.items():
+        if rc != 0:
+            print("ERROR: installing the routes on "+name+" failed: "+err, file=sys.stderr)
+        nodeinfo[name]['routes'] = routes[name]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", '--nodeinfo', help='json config file for the experiment', required=True)
+    parser.add_argument('--install', help='install the routes on the hosts', action='store_true')
+    args = parser.parse_args()
+
+    nodeinfo = mgutil.load_config(args.nodeinfo)
+    routes = compute_routes(nodeinfo)
+    for name in sorted(routes):
+        print(name)
+        for r in routes[name]:
+            print("    "+route_command(r))
+    if args.install:
+        install_routes(nodeinfo, routes)
+        mgutil.save_config(nodeinfo, args.nodeinfo)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+#
+# pack the emulated links of several experiments onto a shared pool of
+# moongen nodes.
+#
+# Every pool node runs one l2-nlink-forward-lrl.lua with the links of all the
+# experiments placed on it.  A link takes two free ports of the same NUMA node,
+# two worker cores of that NUMA node (nlink runs every direction on its own
+# core, see mgnlink.py) and its delay lines in the hugepage memory of that
+# NUMA node.  A direction must not need more packets per second than one
+# core of nlink makes (the measured Mpps per core, with headroom).  The links
+# are placed biggest first, each onto the NUMA node of a pool node that is
+# already in use and has the least room left that still fits it (best fit),
+# so small links fill up shared nodes and big ones get fresh nodes.  The
+# master and stats task of a node take the first two cores of NUMA node 0,
+# and the command pins every worker to a core of the NUMA node of its ports.
+#
+# Experiments are mgplan.py topologies ({"links": [...]}) or the nodeinfo of
+# an experiment set up before, whose moongen nodes have a 'forwarder' record.
+# The pool is a testbed profile of mgplan.py with "nodes" instead of "node":
+#
+#   {"nodes": {"pc701": {"hostname": "pc701.emulab.net", "port_speed": 10000, "memory_gb": 64,
+#                        "numa": {"0": {"cores": [0, 2, 4, 6, 8, 10, 12, 14], "ports": [0, 1, 2, 3]},
+#                                 "1": {"cores": [1, 3, 5, 7, 9, 11, 13, 15], "ports": [4, 5, 6, 7]}}}, ...},
+#    "mpps_per_core": {"l2-nlink-forward-lrl.lua": {"64": 3.2, "1518": 0.8}}}
+#
+# "cores" lists the core ids of a NUMA node, a count stands for consecutive
+# ids in the order of the NUMA nodes.  A node without "numa" has "cores" and
+# "ports" (a count) on NUMA node 0.  Experiments are named after their file,
+# so two files with the same name are rejected.
+#
+#   ./mgsched.py exp1.json exp2-nodeinfo.json -p pool.json -o schedule.json
+#
+# prints the links of every pool node with their ports and the command that
+# launches the forwarder for all of them.  Links that fit nowhere are listed
+# and make the exit status non-zero.
+
+import os
+import sys
+import json
+import argparse
+
+import mgutil
+import mghuge
+import mgnlink
+import mgplan
+
+MB = mghuge.MB
+GB = mghuge.GB
+
+
+def load_experiment(filename):
+    # [link dict as in a mgplan.py topology]
+    with open(filename, 'r') as f:
+        data = json.load(f)
+    if isinstance(data.get("links"), list):
+        return data["links"]
+    links = []
+    for name, n in sorted(mgutil.moongen_nodes(data).items()):
+        fwd = n.get('forwarder')
+        if not fwd:
+            raise ValueError(filename+": moongen node "+name+" has no forwarder record")
+        k = len(n['links'])
+        for i, (r, l, q, o) in enumerate(zip(mghuge.as_list(fwd['rate'], k), mghuge.as_list(fwd['latency'], k),
+                                              mghuge.as_list(fwd['queue'], k), mghuge.as_list(fwd.get('loss', 0), k))):
+            links.append({"name": name if k == 1 else name+"/"+str(i), "rate": r, "latency": l, "queue": q, "loss": o})
+    return links
+
+
+def core_ids(numa):
+    # {numa: [core ids]}, consecutive ids in NUMA order where only a count is given
+    ids = {}
+    first = 0
+    for numa_id, v in sorted(numa.items()):
+        cores = v["cores"]
+        ids[numa_id] = list(cores) if isinstance(cores, list) else list(range(first, first + cores))
+        first = max([first] + [c + 1 for c in ids[numa_id]])
+    return ids
+
+
+def pool_nodes(pool):
+    # {node: {"hw": ..., "numa": {numa: {"cores" (ids), "ports" (free), "directions", "bytes", "links"}}}}
+    nodes = {}
+    for name, hw in sorted(pool["nodes"].items()):
+        numa = hw.get("numa") or {"0": {"cores": hw.get("cores", 1), "ports": list(range(hw.get("ports", 2)))}}
+        numa = {int(k): v for k, v in numa.items()}
+        ids = core_ids(numa)
+        memory = hw.get("memory_gb", float("inf"))*GB/len(numa) - mghuge.os_reserve
+        nodes[name] = {"hw": hw, "numa": {k: {"cores": ids[k], "ports": sorted(v["ports"]), "memory": memory,
+                                               "directions": 0, "bytes": 0, "links": []} for k, v in numa.items()}}
+    return nodes
+
+
+def numa_cores(numa_id, directions):
+    # cores a NUMA node needs for the workers of these directions
+    return directions + (mgnlink.reserved_cores if numa_id == 0 else 0)
+
+
+def room(numa, numa_id, link, headroom, port_speed):
+    # cores left on the NUMA node after adding the link, None if it does not fit
+    if len(numa["ports"]) < 2 or link["rate"] > port_speed:
+        return None
+    need = numa_cores(numa_id, numa["directions"] + 2)
+    if need > len(numa["cores"]):
+        return None
+    if (numa["bytes"] + 2*link["port_bytes"] + mghuge.base_memory)*headroom > numa["memory"]:
+        return None
+    return len(numa["cores"]) - need
+
+
+def place(links, nodes, headroom):
+    # assigns every link a (node, numa, ports), returns the links that fit nowhere
+    unplaced = []
+    for link in sorted(links, key=lambda l: (-l["nlink_load"], -l["port_bytes"])):
+        best = None
+        for name, node in nodes.items():
+            used = any(numa["links"] for numa in node["numa"].values())
+            for numa_id, numa in node["numa"].items():
+                left = room(numa, numa_id, link, headroom, node["hw"].get("port_speed", float("inf")))
+                if left is None:
+                    continue
+                # nodes in use first, then the tightest fit
+                score = (not used, left, len(numa["ports"]))
+                if best is None or score < best[0]:
+                    best = (score, name, numa_id)
+        if best is None:
+            unplaced.append({"experiment": link["experiment"], "link": link["name"],
+                             "problems": ["no NUMA node of the pool has two free ports, the cores and the memory for it"]})
+            continue
+        numa = nodes[best[1]]["numa"][best[2]]
+        link.update({"node": best[1], "numa": best[2], "ports": numa["ports"][:2]})
+        numa["ports"] = numa["ports"][2:]
+        numa["directions"] += 2
+        numa["bytes"] += 2*link["port_bytes"]
+        numa["links"].append(link)
+    return unplaced
+
+
+def launch_plan(nodes, headroom):
+    # per used pool node: links, cores, hugepages and the forwarder command
+    out = {}
+    for name, node in nodes.items():
+        links = [link for numa in node["numa"].values() for link in numa["links"]]
+        if not links:
+            continue
+        links.sort(key=lambda l: l["ports"][0])
+        # the workers of both directions of a link on the NUMA node of its ports, after master and stats
+        free = {i: n["cores"][mgnlink.reserved_cores if i == 0 else 0:] for i, n in node["numa"].items()}
+        for l in links:
+            l["cores"] = free[l["numa"]][:2]
+            free[l["numa"]] = free[l["numa"]][2:]
+        worker_cores = [c for l in links for c in l["cores"]]
+        cmd = mgnlink.command([l["ports"] for l in links], [l["rate"] for l in links], latency=[l["latency"] for l in links],
+                              queue=[l["queue"] for l in links], loss=[l["loss"] for l in links], worker_cores=worker_cores)
+        out[name] = {"hostname": node["hw"].get("hostname", name), "workers": len(worker_cores),
+                     "cores": sum(numa_cores(i, n["directions"]) for i, n in node["numa"].items()),
+                     "worker_cores": {str(i): [c for l in links if l["numa"] == i for c in l["cores"]]
+                                      for i, n in node["numa"].items() if n["links"]},
+                     "hugepage_mb": {str(i): int((n["bytes"] + mghuge.base_memory)*headroom)//MB
+                                     for i, n in node["numa"].items() if n["links"]},
+                     "links": [{k: l[k] for k in ("experiment", "name", "ports", "numa", "cores", "rate", "latency", "queue", "loss")}
+                               for l in links],
+                     "command": cmd}
+    return out
+
+
+def schedule(experiments, pool, frame=64, headroom=mghuge.headroom):
+    # experiments: {name: [links]}, returns {"nodes": launch plan, "unplaced": [...]}
+    speeds = [hw.get("port_speed", float("inf")) for hw in pool["nodes"].values()]
+    profile = dict(pool, node={"port_speed": max(speeds) if speeds else 0})
+    links = []
+    unplaced = []
+    for exp, topology in sorted(experiments.items()):
+        for i, l in enumerate(topology):
+            link = {"experiment": exp, "name": l.get("name", "link"+str(i)), "rate": float(l["rate"]),
+                    "latency": float(l.get("latency", 0)), "loss": float(l.get("loss", 0)),
+                    "queue": int(l.get("queue", 0)), "frame": int(l.get("frame", frame))}
+            # only the load figures, a shared node runs every link in nlink
+            mgplan.analyze(link, profile, headroom)
+            problems = []
+            if link["rate"] > profile["node"]["port_speed"]:
+                problems.append("%g Mbit/s is more than the ports of the pool" % link["rate"])
+            if link["nlink_load"] > 1:
+                problems.append("a direction needs %.2f Mpps (with headroom), more than one nlink worker core"
+                                % (link["mpps"]*headroom))
+            if problems:
+                unplaced.append({"experiment": exp, "link": link["name"], "problems": problems})
+            else:
+                links.append(link)
+    nodes = pool_nodes(pool)
+    unplaced += place(links, nodes, headroom)
+    return {"nodes": launch_plan(nodes, headroom), "unplaced": unplaced}
+
+
+def print_schedule(s, pool_size):
+    for name, node in sorted(s["nodes"].items()):
+        print("%s (%s): %d links, %d cores, %d workers, hugepages %s MB"
+              % (name, node["hostname"], len(node["links"]), node["cores"], node["workers"],
+                 " + ".join("%s (NUMA %s)" % (mb, numa) for numa, mb in sorted(node["hugepage_mb"].items()))))
+        for l in node["links"]:
+            print("  %-12s %-16s ports %d %d (NUMA %d, cores %d %d) %g Mbit/s %g ms"
+                  % (l["experiment"], l["name"], l["ports"][0], l["ports"][1], l["numa"], l["cores"][0], l["cores"][1],
+                     l["rate"], l["latency"]))
+        print("  "+node["command"])
+    print("%d of %d pool nodes used" % (len(s["nodes"]), pool_size))
+    for bad in s["unplaced"]:
+        print("ERROR: "+bad["experiment"]+" link "+bad["link"]+" not placed: "+"; ".join(bad["problems"]), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("experiments", nargs='+', help='topology or nodeinfo json files, one per experiment')
+    parser.add_argument("-p", '--pool', help='json file with the pool nodes and the measured forwarder throughput', required=True)
+    parser.add_argument("-f", '--frame', help='frame size in bytes to plan for, for links without one (default=64, the worst case)', type=int, default=64)
+    parser.add_argument('--headroom', help='factor on the load and memory (default=%g)' % mghuge.headroom, type=float, default=mghuge.headroom)
+    parser.add_argument("-o", '--output', help='also write the schedule as json to this file')
+    args = parser.parse_args()
+
+    with open(args.pool, 'r') as f:
+        pool = json.load(f)
+    try:
+        experiments = {}
+        for e in args.experiments:
+            name = os.path.splitext(os.path.basename(e))[0]
+            if name in experiments:
+                raise ValueError("two experiments are named "+name+", rename one of the files")
+            experiments[name] = load_experiment(e)
+        s = schedule(experiments, pool, args.frame, args.headroom)
+    except ValueError as e:
+        print("ERROR: "+str(e), file=sys.stderr)
+        sys.exit(-1)
+    print_schedule(s, len(pool["nodes"]))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(s, f, indent=1)
+    if s["unplaced"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+#
+# reader for the shared-memory stats ring written by MoonGen tasks
+# (see lua/stats-shm.lua for the layout, keep both in sync).
+#
+# The file is mapped read-only and records are unpacked straight out of the
+# mapping, nothing is parsed from the logs and the writers are never blocked.
+# Locally:
+#   ./mgshm.py /dev/shm/moongen-stats -i 0.1
+# prints the newest record of every source ten times a second.  The emulab
+# scripts use remote_snapshot(), which runs this script with --json on the
+# moongen node.
+
+import sys
+import json
+import mmap
+import time
+import struct
+import argparse
+
+import mgutil
+
+MAGIC = b"MGSTATS1"
+VERSION = 1
+
+header_struct = struct.Struct("=8sIIIII36x")
+source_struct = struct.Struct("=48sQII")
+record_struct = struct.Struct("=QdII5d")
+
+HEADER_SIZE = header_struct.size
+SOURCE_HEADER_SIZE = source_struct.size
+SEQ_STRUCT = struct.Struct("=Q")
+
+COUNTERS = 1
+LATENCY = 2
+MS_STATS = 3
+
+kinds = {COUNTERS: ("counters", ["rx_packets", "rx_bytes", "tx_packets", "tx_bytes", "dropped"]),
+         LATENCY: ("latency", ["count", "mean", "variance", "min", "max"]),
+         MS_STATS: ("ms_stats", ["average_latency", "variance_latency", "hits", "misses", "inval_ts"])}
+
+remote_script = "~/MoonGen/emulab/mgshm.py"
+
+
+class StatsRing:
+
+    def __init__(self, path, wait=0):
+        # wait up to this many seconds for the writer to initialize the file
+        deadline = time.time() + wait
+        while True:
+            try:
+                self.open(path)
+                return
+            except (OSError, ValueError):
+                if time.time() >= deadline:
+                    raise
+                time.sleep(0.1)
+
+    def open(self, path):
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.num_sources, self.num_records, self.record_size, self.source_size) = header_struct.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            self.mm.close()
+            raise ValueError(path+" is not an initialized stats ring")
+        if version != VERSION or self.record_size != record_struct.size:
+            self.mm.close()
+            raise ValueError(path+" has an unsupported stats ring version")
+        self.path = path
+
+    def close(self):
+        self.mm.close()
+
+    def source_offset(self, src):
+        return HEADER_SIZE + src*self.source_size
+
+    def source_name(self, src):
+        (name, write_idx, pid, pad) = source_struct.unpack_from(self.mm, self.source_offset(src))
+        return name.split(b"\0", 1)[0].decode()
+
+    def sources(self):
+        return [self.source_name(i) for i in range(self.num_sources)]
+
+    def write_index(self, src):
+        return source_struct.unpack_from(self.mm, self.source_offset(src))[1]
+
+    def read_record(self, src, idx):
+        # the record with write index idx, None if it is being written or was overwritten
+        off = self.source_offset(src) + SOURCE_HEADER_SIZE + (idx % self.num_records)*self.record_size
+        rec = record_struct.unpack_from(self.mm, off)
+        if rec[0] != idx + 1 or SEQ_STRUCT.unpack_from(self.mm, off)[0] != idx + 1:
+            return None
+        (seq, t, kind, pad) = rec[:4]
+        return (t, kind, rec[4:])
+
+    def read(self, src, since=0):
+        # all records written since write index `since` that are still in the ring,
+        # returns (records, next since)
+        end = self.write_index(src)
+        start = max(since, end - self.num_records)
+        records = []
+        for idx in range(start, end):
+            rec = self.read_record(src, idx)
+            if rec:
+                records.append(rec)
+        return records, end
+
+    def latest(self, src, kind=None):
+        # newest record of the source (of the given kind) as a dict, or None
+        end = self.write_index(src)
+        for idx in range(end - 1, max(end - self.num_records, 0) - 1, -1):
+            rec = self.read_record(src, idx)
+            if rec and (kind is None or rec[1] == kind):
+                return record_dict(rec)
+        return None
+
+    def snapshot(self):
+        # newest record of every kind for all sources
+        snap = {}
+        for src in range(self.num_sources):
+            entry = {}
+            for kind in kinds:
+                rec = self.latest(src, kind)
+                if rec:
+                    entry[rec['kind']] = rec
+            snap[self.source_name(src) or str(src)] = entry
+        return snap
+
+    def numpy_view(self, src):
+        # zero-copy structured array over the records of one source
+        import numpy
+        dtype = numpy.dtype([('seq', '<u8'), ('time', '<f8'), ('kind', '<u4'), ('pad', '<u4'), ('values', '<f8', (5,))])
+        return numpy.frombuffer(self.mm, dtype=dtype, count=self.num_records,
+                                offset=self.source_offset(src) + SOURCE_HEADER_SIZE)
+
+
+def record_dict(rec):
+    (t, kind, values) = rec
+    (name, fields) = kinds.get(kind, (str(kind), ["v"+str(i) for i in range(5)]))
+    d = dict(zip(fields, values))
+    d['time'] = t
+    d['kind'] = name
+    return d
+
+
+def remote_snapshot(nodeinfo, path):
+    # sample the stats ring of a moongen node from the experiment controller
+    out, err, rc = mgutil.remote_command(nodeinfo, "python3 "+remote_script+" --json "+path)
+    if rc != 0:
+        print("ERROR: reading "+path+" on "+mgutil.node_hostname(nodeinfo)+" failed: "+err, file=sys.stderr)
+        return None
+    return json.loads(out)
+
+
+def print_snapshot(snap):
+    for name in sorted(snap):
+        entry = snap[name]
+        if not entry:
+            continue
+        line = "%-20s" % name
+        c = entry.get('counters')
+        if c:
+            line += " rx %12d pkts %14d bytes  tx %12d pkts %14d bytes" % (c['rx_packets'], c['rx_bytes'], c['tx_packets'], c['tx_bytes'])
+        l = entry.get('latency')
+        if l:
+            line += "  latency %.0f ns (sd %.0f, max %.0f)" % (l['mean'], max(l['variance'], 0)**0.5, l['max'])
+        m = entry.get('ms_stats')
+        if m:
+            line += "  hits %d misses %d latency %.0f ns" % (m['hits'], m['misses'], m['average_latency'])
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path", help='stats ring file, e.g. /dev/shm/moongen-stats')
+    parser.add_argument("-i", '--interval', help='print the newest records every interval seconds', type=float, default=1.0)
+    parser.add_argument("-w", '--wait', help='wait this many seconds for the ring to be created', type=float, default=0)
+    parser.add_argument('--json', help='print one snapshot as json and exit', action='store_true')
+    args = parser.parse_args()
+
+    ring = StatsRing(args.path, args.wait)
+    if args.json:
+        print(json.dumps(ring.snapshot()))
+        return
+    try:
+        while True:
+            print_snapshot(ring.snapshot())
+            print()
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    ring.close()
+
+
+if __name__ == "__main__":
+    main()
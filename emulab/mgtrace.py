@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+#
+# span tracing of the experiment bring-up.
+#
+# The setup scripts wrap their phases (DNS lookups, ssh commands, apt,
+# hugepages, binding the interfaces, killing the old forwarder, launching the
+# new one) in spans.  The forwarders print timestamped markers into their log
+# (lua/phase-trace.lua): entering master(), configuring the devices, waiting
+# for the links and every task reaching its forwarding loop.  After the launch
+# the markers are read back from the node and merged into the same trace, the
+# time between the launch and master() is DPDK/EAL init.
+#
+# The trace is written in the chrome trace event format, one process per node,
+# and can be opened in https://ui.perfetto.dev or chrome://tracing.  All times
+# are wall clock, the markers of a node are only as good as its clock (see
+# mgclock.py to measure the offset).
+#
+#   ./mg-dumbell-setup.py -j exp.json -b 1000 -l 20 --trace bringup.json
+#   ./mgtrace.py summary bringup-*.json     # phase durations of several runs side by side
+
+import os
+import sys
+import json
+import time
+import atexit
+import argparse
+import threading
+import functools
+import contextlib
+
+marker_prefix = "mgtrace:"
+controller = "controller"
+
+_events = []
+_lock = threading.Lock()
+_filename = None
+_pids = {}
+_tids = {}
+
+
+def start(filename):
+    # enable tracing, the trace is written to filename when the script exits
+    global _filename
+    _filename = filename
+    atexit.register(save)
+
+
+def enabled():
+    return _filename is not None
+
+
+def now_us():
+    return time.time()*1e6
+
+
+def _node_name(node):
+    if isinstance(node, dict):
+        return node.get('cn-name') or node.get('hostname')
+    return node
+
+
+def _pid(process):
+    # one trace process per node, named by a metadata event
+    with _lock:
+        if process not in _pids:
+            _pids[process] = len(_pids) + 1
+            _events.append({"ph": "M", "name": "process_name", "pid": _pids[process], "tid": 0,
+                            "args": {"name": process}})
+        return _pids[process]
+
+
+def _tid(pid, thread):
+    with _lock:
+        if (pid, thread) not in _tids:
+            _tids[(pid, thread)] = len(_tids) + 1
+            _events.append({"ph": "M", "name": "thread_name", "pid": pid, "tid": _tids[(pid, thread)],
+                            "args": {"name": str(thread)}})
+        return _tids[(pid, thread)]
+
+
+def add_event(name, ts, dur=None, process=controller, thread=None, args=None):
+    # a complete span (dur in us) or an instant event (dur None)
+    if not enabled():
+        return
+    pid = _pid(process or controller)
+    tid = _tid(pid, thread if thread is not None else threading.current_thread().name)
+    ev = {"name": name, "ph": "X" if dur is not None else "i", "ts": ts, "pid": pid, "tid": tid}
+    if dur is not None:
+        ev["dur"] = dur
+    else:
+        ev["s"] = "t"
+    if args:
+        ev["args"] = args
+    with _lock:
+        _events.append(ev)
+
+
+@contextlib.contextmanager
+def span(name, node=None, **args):
+    # time the enclosed block, node is a nodeinfo or a node name
+    if not enabled():
+        yield
+        return
+    t0 = now_us()
+    try:
+        yield
+    finally:
+        add_event(name, t0, now_us() - t0, _node_name(node) or controller, args=args or None)
+
+
+def traced(name=None):
+    # decorator: the call is a span, on the node of the first argument if that is a nodeinfo
+    def wrap(fn):
+        @functools.wraps(fn)
+        def call(*a, **kw):
+            node = a[0] if a and isinstance(a[0], dict) and ('hostname' in a[0] or 'cn-name' in a[0]) else None
+            with span(name or fn.__name__, node):
+                return fn(*a, **kw)
+        return call
+    return wrap
+
+
+def save(filename=None):
+    filename = filename or _filename
+    if not filename:
+        return
+    with _lock:
+        trace = {"traceEvents": sorted(_events, key=lambda e: e.get("ts", 0)), "displayTimeUnit": "ms"}
+    with open(filename, 'w') as f:
+        json.dump(trace, f)
+    print("trace written to "+filename, file=sys.stderr)
+
+
+def parse_markers(text):
+    # marker lines of lua/phase-trace.lua: "mgtrace: <B|E|i> <name> <unix ns> <task>"
+    markers = []
+    for line in text.split("\n"):
+        fields = line.split()
+        if len(fields) == 5 and fields[0] == marker_prefix and fields[1] in ("B", "E", "i") and fields[3].isdigit():
+            markers.append((fields[1], fields[2], int(fields[3])/1000.0, fields[4]))
+    return markers
+
+
+def add_markers(markers, process, launched=None):
+    # turn begin/end pairs of every task into spans, launched is the
+    # time (us) the forwarder was started, up to master() it is in DPDK init
+    open_spans = {}
+    for (kind, name, ts, task) in sorted(markers, key=lambda m: m[2]):
+        if kind == "B":
+            open_spans[(task, name)] = ts
+        elif kind == "E" and (task, name) in open_spans:
+            t0 = open_spans.pop((task, name))
+            add_event(name, t0, ts - t0, process, task)
+        elif kind == "i":
+            add_event(name, ts, None, process, task)
+    masters = [ts for (kind, name, ts, task) in markers if name == "master"]
+    if launched is not None and masters:
+        add_event("dpdk-init", launched, max(min(masters) - launched, 0), process, "master")
+
+
+def wait_forwarder(nodeinfo, logfile, launched, timeout=120, poll=1.0):
+    # poll the forwarder log until a task reports its forwarding loop, then
+    # merge all markers into the trace. Returns the seconds from launch to
+    # forwarding, or None on timeout
+    import mgutil
+    process = mgutil.node_hostname(nodeinfo)+" MoonGen"
+    markers = []
+    with span("wait-forwarding", nodeinfo):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            out, err, rc = mgutil.remote_command(nodeinfo, "grep \""+marker_prefix+"\" "+logfile)
+            markers = parse_markers(out)
+            if any(name == "forwarding" for (kind, name, ts, task) in markers):
+                break
+            time.sleep(poll)
+    add_markers(markers, process, launched)
+    forwarding = [ts for (kind, name, ts, task) in markers if name == "forwarding"]
+    if not forwarding:
+        print("WARNING: "+mgutil.node_hostname(nodeinfo)+": forwarder did not reach its forwarding loop within "+str(timeout)+" s", file=sys.stderr)
+        return None
+    print(mgutil.node_hostname(nodeinfo)+": forwarding %.1f s after launch" % ((min(forwarding) - launched)/1e6), file=sys.stderr)
+    return (min(forwarding) - launched)/1e6
+
+
+def phase_totals(trace):
+    # total seconds per (process, span name), process names without the node
+    # so that runs on different nodes can be compared
+    names = {e["pid"]: e["args"]["name"] for e in trace["traceEvents"] if e.get("ph") == "M" and e["name"] == "process_name"}
+    totals = {}
+    for e in trace["traceEvents"]:
+        if e.get("ph") != "X":
+            continue
+        process = "MoonGen" if names.get(e["pid"], "").endswith("MoonGen") else ("controller" if names.get(e["pid"]) == controller else "node")
+        key = (process, e["name"])
+        totals[key] = totals.get(key, 0) + e["dur"]/1e6
+    return totals
+
+
+def summary(files):
+    runs = []
+    for filename in files:
+        with open(filename, 'r') as f:
+            runs.append(phase_totals(json.load(f)))
+    keys = sorted(set(k for run in runs for k in run))
+    width = max([len(p+"/"+n) for (p, n) in keys] + [5])
+    print("%-*s" % (width, "phase")+"".join(" %12s" % os.path.basename(f)[-12:] for f in files))
+    for (p, n) in keys:
+        print("%-*s" % (width, p+"/"+n)+"".join(" %12s" % ("%.2f" % run[(p, n)] if (p, n) in run else "-") for run in runs))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('summary', help='seconds spent per phase, one column per trace')
+    p.add_argument('traces', nargs='+', help='trace files written with --trace')
+    p = sub.add_parser('markers', help='merge the markers of a forwarder log into a trace')
+    p.add_argument('log', help='forwarder log (/tmp/mglog-*.log)')
+    p.add_argument('-o', '--output', help='trace file', required=True)
+    p.add_argument('-n', '--node', help='process name in the trace', default='MoonGen')
+    args = parser.parse_args()
+
+    if args.command == 'summary':
+        summary(args.traces)
+    else:
+        start(args.output)
+        with open(args.log, 'r') as f:
+            add_markers(parse_markers(f.read()), args.node)
+
+
+if __name__ == "__main__":
+    main()
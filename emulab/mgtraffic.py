@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+#
+# traffic matrix planner for the moongen generator nodes.
+#
+# Turns a traffic matrix into moongen-simple flow definitions and the
+# `moongen-simple start` command of every generator node.  A demand is
+#
+#   {"src": "10.10.1.0/24", "dst": "receiver1", "rate": 2000,
+#    "pattern": "poisson", "size": 1400, "flows": 64}
+#
+# src/dst are subnets or node names from nodeinfo, rate is in Mbit/s (like the
+# rate option of moongen-simple), pattern is cbr or poisson.  Every demand is
+# sent by a moongen node with a port in the src subnet, towards the router of
+# that subnet (ethDst is resolved by arp), from spoofed sources .200-.249.
+# Demands are cut into shards so no core has to send more than --core-mpps and
+# no port more than --port-rate, the shards are spread round robin over the
+# ports of the subnet, and every shard gets its own udpSrc range so the shards
+# carry different flows.  One shard is one tx core in moongen-simple.
+#
+#   ./mgtraffic.py -j exp.json -m matrix.json -o tm          # writes tm/tm-<node>.lua and prints the commands
+#   ./mgtraffic.py -j exp.json -d 10.10.1.0/24 receiver1 2000 poisson -o tm --deploy -t 60s
+#
+# DPDK ports can only be used by one process, the ports used here must not be
+# in use by a forwarder at the same time.
+
+import os
+import sys
+import json
+import math
+import argparse
+
+import mgutil
+
+flow_dir = "MoonGen/flows"
+moongen_simple = "MoonGen/moongen-simple"
+src_host_range = (200, 249)
+udp_dst_port = 5001
+udp_src_base = 10000
+framing = 24  # preamble, SFD, IFG and CRC bytes that are not part of pktLength
+
+
+def subnet_prefix(net):
+    return net.split('/')[0].rsplit('.', 1)[0]
+
+
+def node_addresses(n):
+    # (ip, net) of all interfaces of a node, in any nodeinfo layout
+    addrs = []
+    for key, val in n.items():
+        if (key == 'if' or key.startswith('if-')) and isinstance(val, dict) and val.get('ip'):
+            addrs.append((val['ip'], val['net']))
+    if not n.get('links'):
+        for iface in n.get('ifaces', []):
+            addrs.append((iface['ip'], iface['net']))
+    return addrs
+
+
+def resolve(nodeinfo, where):
+    # subnet and destination address of a node name or subnet
+    if where in nodeinfo:
+        addrs = node_addresses(nodeinfo[where])
+        if not addrs:
+            raise ValueError(where+" has no addresses")
+        (ip, net) = addrs[0]
+        return (net, ip)
+    if '/' not in where:
+        raise ValueError("unknown node or subnet: "+where)
+    return (where, subnet_prefix(where)+".1")
+
+
+def gateway(nodeinfo, net):
+    # the router address in a subnet
+    for name in sorted(nodeinfo):
+        if name.startswith("router"):
+            for (ip, n) in node_addresses(nodeinfo[name]):
+                if n == net:
+                    return ip
+    return None
+
+
+def generator_ports(nodeinfo, net, exclude_linked=False):
+    # [(node, port idx)] of all moongen ports in a subnet
+    ports = []
+    for name, n in sorted(mgutil.moongen_nodes(nodeinfo).items()):
+        linked = set(i for link in n['links'] for i in link)
+        for iface in n.get('ifaces', []):
+            if iface['net'] == net and iface.get('idx') is not None:
+                if exclude_linked and iface['idx'] in linked:
+                    continue
+                ports.append((name, iface['idx']))
+    return ports
+
+
+def plan(nodeinfo, demands, core_mpps=5.0, port_rate=10000, free_ports=False):
+    # returns {node: [shard]}, a shard is a dict with the flow name,
+    # port, rate and everything needed for its flow definition
+    shards = {}
+    port_load = {}
+    for i, d in enumerate(demands):
+        (src_net, _) = resolve(nodeinfo, d['src'])
+        (dst_net, dst_ip) = resolve(nodeinfo, d['dst'])
+        size = d.get('size', 60)
+        rate = float(d['rate'])
+        pattern = d.get('pattern', 'cbr')
+        nflows = d.get('flows', 1)
+        gw = gateway(nodeinfo, src_net)
+        ports = generator_ports(nodeinfo, src_net, free_ports)
+        if not ports:
+            raise ValueError("no moongen port in "+src_net+" for demand "+str(i))
+
+        pps = rate*1e6/((size + framing)*8)
+        n = max(math.ceil(pps/(core_mpps*1e6)), math.ceil(rate/port_rate), 1)
+        # whole rounds over the ports, so the load is even
+        n = math.ceil(n/len(ports))*len(ports) if n > 1 else 1
+        per_shard = rate/n
+        flows_per_shard = max(1, math.ceil(nflows/n))
+        for s in range(n):
+            (node, port) = ports[s % len(ports)]
+            port_load[(node, port)] = port_load.get((node, port), 0) + per_shard
+            shards.setdefault(node, []).append({
+                "name": "tm-"+str(i)+"-"+str(s), "demand": i, "port": port,
+                "rate": per_shard, "pattern": pattern, "size": size,
+                "src": (subnet_prefix(src_net)+"."+str(src_host_range[0]), subnet_prefix(src_net)+"."+str(src_host_range[1])),
+                "dst": dst_ip, "dst_net": dst_net, "gateway": gw,
+                "udp_src": (udp_src_base + s*flows_per_shard, udp_src_base + (s + 1)*flows_per_shard - 1)})
+    for (node, port), load in sorted(port_load.items()):
+        if load > port_rate:
+            print("WARNING: "+node+" port "+str(port)+" is planned with "+str(round(load))+" Mbit/s, more than "+str(port_rate), file=sys.stderr)
+    return shards
+
+
+def flow_file(shards):
+    # moongen-simple configuration with one flow per shard
+    out = ["-- generated by emulab/mgtraffic.py", ""]
+    for s in shards:
+        eth_dst = "arp(ip\""+s['gateway']+"\")" if s['gateway'] else "arp(ip\""+s['dst']+"\")"
+        (lo, hi) = s['udp_src']
+        udp_src = str(lo) if lo == hi else "range("+str(lo)+", "+str(hi)+")"
+        out.append("Flow{\""+s['name']+"\", Packet.Udp{")
+        out.append("\t\tethSrc = txQueue(),")
+        out.append("\t\tethDst = "+eth_dst+",")
+        out.append("\t\tip4Src = range(ip\""+s['src'][0]+"\", ip\""+s['src'][1]+"\"),")
+        out.append("\t\tip4Dst = ip\""+s['dst']+"\",")
+        out.append("\t\tudpSrc = "+udp_src+",")
+        out.append("\t\tudpDst = "+str(udp_dst_port)+",")
+        out.append("\t\tpktLength = "+str(s['size']))
+        out.append("\t},")
+        out.append("\trate = "+("%.3f" % s['rate'])+",")
+        out.append("\tratePattern = \""+s['pattern']+"\"")
+        out.append("}")
+        out.append("")
+    return "\n".join(out)
+
+
+def start_command(shards, time_limit=None):
+    args = []
+    for s in shards:
+        arg = s['name']+":"+str(s['port'])
+        if time_limit:
+            arg += "::timeLimit="+time_limit
+        args.append(arg)
+    return "sudo "+moongen_simple+" start "+" ".join(args)
+
+
+def deploy(nodeinfo, plans, outdir, time_limit=None):
+    # copy the flow files and start the generators on all nodes at once
+    def run(name, n):
+        filename = os.path.join(outdir, "tm-"+name+".lua")
+        mgutil.remote_command(n, "rm -f "+flow_dir+"/tm-*.lua")
+        if not mgutil.push_files(n, [filename], flow_dir):
+            print("ERROR: could not copy "+filename+" to "+name, file=sys.stderr)
+            return None
+        cmd = "nohup "+start_command(plans[name], time_limit)+" > /tmp/mgtraffic-"+name+".log 2>&1 &"
+        print("["+name+"] "+cmd, file=sys.stderr)
+        return mgutil.remote_command(n, cmd)
+    return mgutil.run_parallel({name: nodeinfo[name] for name in plans}, run)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", '--nodeinfo', help='json config file for the experiment', required=True)
+    parser.add_argument("-m", '--matrix', help='json file with the list of demands')
+    parser.add_argument("-d", '--demand', nargs=4, action='append', metavar=('SRC', 'DST', 'RATE', 'PATTERN'),
+                        help='a demand of RATE Mbit/s from SRC to DST (node or subnet), PATTERN is cbr or poisson')
+    parser.add_argument("-s", '--size', help='packet size for --demand (default=60)', type=int, default=60)
+    parser.add_argument("-f", '--flows', help='number of udp flows per --demand (default=1)', type=int, default=1)
+    parser.add_argument("-o", '--outdir', help='directory for the flow files (default=.)', default=".")
+    parser.add_argument("-t", '--time-limit', help='stop the generators after this time, e.g. 60s')
+    parser.add_argument('--core-mpps', help='packets per second one core can send, in Mpps (default=5)', type=float, default=5.0)
+    parser.add_argument('--port-rate', help='line rate of the generator ports in Mbit/s (default=10000)', type=float, default=10000)
+    parser.add_argument('--free-ports', help='only use ports that are not part of an emulated link', action='store_true')
+    parser.add_argument('--deploy', help='copy the flow files to the nodes and start moongen-simple', action='store_true')
+    args = parser.parse_args()
+
+    nodeinfo = mgutil.load_config(args.nodeinfo)
+    demands = []
+    if args.matrix:
+        with open(args.matrix, 'r') as f:
+            demands = json.load(f)
+    for (src, dst, rate, pattern) in args.demand or []:
+        demands.append({"src": src, "dst": dst, "rate": float(rate), "pattern": pattern, "size": args.size, "flows": args.flows})
+    if not demands:
+        print("ERROR: no demands, use -m or -d", file=sys.stderr)
+        sys.exit(-1)
+
+    try:
+        plans = plan(nodeinfo, demands, args.core_mpps, args.port_rate, args.free_ports)
+    except ValueError as e:
+        print("ERROR: "+str(e), file=sys.stderr)
+        sys.exit(-1)
+
+    os.makedirs(args.outdir, exist_ok=True)
+    for name, shards in sorted(plans.items()):
+        filename = os.path.join(args.outdir, "tm-"+name+".lua")
+        with open(filename, 'w') as f:
+            f.write(flow_file(shards))
+        total = sum(s['rate'] for s in shards)
+        print("# "+name+": "+str(len(shards))+" shards, "+str(round(total))+" Mbit/s, "+filename)
+        print(start_command(shards, args.time_limit))
+        nodeinfo[name]['traffic'] = shards
+    if args.deploy:
+        deploy(nodeinfo, plans, args.outdir, args.time_limit)
+        mgutil.save_config(nodeinfo, args.nodeinfo)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+#!/usr/bin/env python3
+#
+# named host tuning profiles for the end hosts and linux routers.
+#
+# A profile is applied to all nodes at once: one shell script per node is
+# generated, sent over ssh and run in parallel.  The same script reads back the
+# resulting state (sysctls, offloads, ring sizes, governor, C-states, IRQ
+# affinity, RPS/XPS), which is stored in nodeinfo[node]['tuning'] together
+# with the settings that did not stick.  Running the check again later
+# reports any drift from the recorded state.
+#
+#   ./mgtune.py -j exp.json apply                 # routers/endpoints get the default profiles
+#   ./mgtune.py -j exp.json apply -a router1=no-offload-router
+#   ./mgtune.py -j exp.json check
+#
+# The moongen nodes are skipped, their ports are bound to DPDK.
+
+import sys
+import time
+import argparse
+
+import mgutil
+import mgtrace
+
+profiles = {
+    "no-offload-router": {
+        "description": "linux forwarding without offloads, interrupts spread over the cores",
+        "sysctl": {"net.ipv4.ip_forward": "1",
+                   "net.core.netdev_max_backlog": "250000",
+                   "net.core.netdev_budget": "600"},
+        "offloads": {"gro": "off", "gso": "off", "tso": "off", "lro": "off"},
+        "rings": "max",
+        "governor": "performance",
+        "cstates": 1,
+        "irq": "spread",
+        "rps": "off",
+        "xps": False,
+    },
+    "high-bdp-endpoint": {
+        "description": "tcp end host for long fat pipes, large socket buffers and fq pacing",
+        "sysctl": {"net.core.rmem_max": "268435456",
+                   "net.core.wmem_max": "268435456",
+                   "net.ipv4.tcp_rmem": "4096 131072 268435456",
+                   "net.ipv4.tcp_wmem": "4096 65536 268435456",
+                   "net.core.default_qdisc": "fq",
+                   "net.ipv4.tcp_no_metrics_save": "1",
+                   "net.ipv4.tcp_mtu_probing": "1"},
+        "offloads": {"gro": "off", "gso": "off", "tso": "off", "lro": "off"},
+        "rings": "max",
+        "governor": "performance",
+        "cstates": 1,
+        "irq": "spread",
+        "rps": "all",
+        "xps": True,
+    },
+}
+
+offload_names = {"gro": "generic-receive-offload",
+                 "gso": "generic-segmentation-offload",
+                 "tso": "tcp-segmentation-offload",
+                 "lro": "large-receive-offload",
+                 "rx": "rx-checksumming",
+                 "tx": "tx-checksumming",
+                 "sg": "scatter-gather"}
+
+
+def node_interfaces(n):
+    # kernel interface names of a node in any of the nodeinfo layouts
+    ifaces = []
+    for key, val in n.items():
+        if (key == 'if' or key.startswith('if-')) and isinstance(val, dict) and val.get('ifname'):
+            ifaces.append(val['ifname'])
+    for iface in n.get('ifaces', []):
+        name = iface.get('dev') or iface.get('ifname')
+        if name:
+            ifaces.append(name)
+    return sorted(ifaces)
+
+
+def default_profile(name):
+    if name.startswith("router"):
+        return "no-offload-router"
+    if name.startswith("sender") or name.startswith("receiver"):
+        return "high-bdp-endpoint"
+    return None
+
+
+def apply_script(profile, ifaces):
+    p = profiles[profile]
+    lines = ["ncpu=$(nproc)",
+             # cpu masks as comma separated 32 bit hex words, the shell arithmetic overflows at 64 cpus
+             "allcpus() { local n=$ncpu m= b; while [ $n -gt 0 ]; do b=$(( n < 32 ? n : 32 )); m=$(printf %x $(( (1 << b) - 1 )))${m:+,$m}; n=$((n - b)); done; echo $m; }",
+             "onecpu() { local m=$(printf %x $(( 1 << ($1 % 32) ))) g; for ((g = 0; g < $1 / 32; g++)); do m=$m,00000000; done; echo $m; }"]
+    for k, v in p.get("sysctl", {}).items():
+        lines.append("sudo sysctl -qw \"%s=%s\"" % (k, v))
+    if p.get("governor"):
+        lines.append("for f in /sys/devices/system/cpu/cpu*/cpufreq/scaling_governor; do [ -e \"$f\" ] && echo %s | sudo tee \"$f\" > /dev/null; done" % p["governor"])
+    if p.get("cstates") is not None:
+        lines.append("for f in /sys/devices/system/cpu/cpu*/cpuidle/state*/disable; do i=${f%%/disable}; i=${i##*state}; "
+                     "if [ \"$i\" -gt %d ]; then echo 1; else echo 0; fi | sudo tee \"$f\" > /dev/null; done" % p["cstates"])
+    if p.get("irq") == "spread":
+        lines.append("sudo systemctl stop irqbalance 2> /dev/null")
+    for i in ifaces:
+        if p.get("offloads"):
+            lines.append("sudo ethtool -K %s %s 2> /dev/null" % (i, " ".join(k+" "+v for k, v in p["offloads"].items())))
+        if p.get("rings") == "max":
+            lines.append("read rxmax txmax <<< $(ethtool -g %s 2> /dev/null | awk '/maximums/{m=1} /Current/{m=0} m && /^RX:/{r=$2} m && /^TX:/{t=$2} END{print r, t}')" % i)
+            lines.append("[ -n \"$rxmax\" ] && sudo ethtool -G %s rx $rxmax tx $txmax 2> /dev/null" % i)
+        if p.get("irq") == "spread":
+            lines.append("c=0; for irq in $(grep -w '%s[^ ]*' /proc/interrupts | cut -d: -f1 | tr -d ' '); do "
+                         "echo $c | sudo tee /proc/irq/$irq/smp_affinity_list > /dev/null; c=$(( (c + 1) %% ncpu )); done" % i)
+        if p.get("rps"):
+            mask = "0" if p["rps"] == "off" else "$(allcpus)"
+            lines.append("for q in /sys/class/net/%s/queues/rx-*/rps_cpus; do echo %s | sudo tee $q > /dev/null; done" % (i, mask))
+        if p.get("xps"):
+            lines.append("c=0; for q in /sys/class/net/%s/queues/tx-*/xps_cpus; do onecpu $(( c %% ncpu )) | sudo tee $q > /dev/null; c=$((c + 1)); done" % i)
+    return "\n".join(lines)+"\n"
+
+
+def readback_script(sysctls, ifaces, cstates=None):
+    # prints the state as key=value lines, cstates.deep_enabled counts the
+    # enabled idle states deeper than the cstates the profile keeps
+    lines = []
+    for k in sysctls:
+        lines.append("echo \"sysctl.%s=$(sysctl -n %s 2> /dev/null | tr -s '[:space:]' ' ' | sed 's/ $//')\"" % (k, k))
+    lines.append("echo \"governor=$(cat /sys/devices/system/cpu/cpu*/cpufreq/scaling_governor 2> /dev/null | sort -u | paste -sd, -)\"")
+    lines.append("echo \"cstates.deep_enabled=$(for f in /sys/devices/system/cpu/cpu*/cpuidle/state*/disable; do i=${f%%/disable}; i=${i##*state}; "
+                 "[ \"$i\" -gt %d ] && cat $f; done 2> /dev/null | grep -cx 0)\"" % (cstates if cstates is not None else -1))
+    lines.append("echo \"cstates.names=$(cat /sys/devices/system/cpu/cpu0/cpuidle/state*/name 2> /dev/null | paste -sd, -)\"")
+    lines.append("echo \"irqbalance=$(systemctl is-active irqbalance 2> /dev/null)\"")
+    lines.append("echo \"kernel=$(uname -r)\"")
+    names = "|".join(offload_names.values())
+    for i in ifaces:
+        lines.append("ethtool -k %s 2> /dev/null | grep -E '^(%s):' | sed 's/ \\[fixed\\]//; s/: /=/; s/^/%s.offload./'" % (i, names, i))
+        lines.append("ethtool -g %s 2> /dev/null | awk -v i=%s '/maximums/{s=\"max\"} /Current/{s=\"cur\"} /^RX:/{print i\".ring.rx_\"s\"=\"$2} /^TX:/{print i\".ring.tx_\"s\"=\"$2}'" % (i, i))
+        lines.append("echo \"%s.irqs=$(for irq in $(grep -w '%s[^ ]*' /proc/interrupts | cut -d: -f1 | tr -d ' '); do cat /proc/irq/$irq/smp_affinity_list; done | paste -sd ';' -)\"" % (i, i))
+        lines.append("echo \"%s.rps=$(cat /sys/class/net/%s/queues/rx-*/rps_cpus 2> /dev/null | sort -u | paste -sd ';' -)\"" % (i, i))
+        lines.append("echo \"%s.xps=$(cat /sys/class/net/%s/queues/tx-*/xps_cpus 2> /dev/null | paste -sd ';' -)\"" % (i, i))
+    return "\n".join(lines)+"\n"
+
+
+def parse_state(output):
+    state = {}
+    for line in output.split("\n"):
+        if "=" in line:
+            (k, v) = line.split("=", 1)
+            state[k.strip()] = v.strip()
+    return state
+
+
+def mismatches(profile, ifaces, state):
+    # settings of the profile that are not in effect.
+    # settings the node does not support at all (empty readback) are not reported
+    p = profiles[profile]
+    bad = []
+    def check(key, ok, expected):
+        val = state.get(key, "")
+        if val != "" and not ok(val):
+            bad.append({"setting": key, "expected": expected, "actual": val})
+    for k, v in p.get("sysctl", {}).items():
+        check("sysctl."+k, lambda val, v=v: val == " ".join(v.split()), v)
+    if p.get("governor"):
+        check("governor", lambda val: val == p["governor"], p["governor"])
+    if p.get("cstates") is not None:
+        check("cstates.deep_enabled", lambda val: val == "0", "0")
+    if p.get("irq") == "spread":
+        check("irqbalance", lambda val: val != "active", "inactive")
+    for i in ifaces:
+        for short, v in p.get("offloads", {}).items():
+            check(i+".offload."+offload_names[short], lambda val, v=v: val == v, v)
+        if p.get("rings") == "max":
+            for d in ("rx", "tx"):
+                mx = state.get(i+".ring."+d+"_max")
+                check(i+".ring."+d+"_cur", lambda val, mx=mx: mx is None or val == mx, mx)
+        if p.get("rps"):
+            check(i+".rps", lambda val: all((int(m.replace(",", ""), 16) == 0) == (p["rps"] == "off") for m in val.split(";")), p["rps"])
+        if p.get("xps"):
+            # every tx queue has a cpu
+            check(i+".xps", lambda val: all(int(m.replace(",", ""), 16) != 0 for m in val.split(";")), "a cpu per tx queue")
+    return bad
+
+
+def drift(old_state, new_state):
+    # everything that changed since the state was recorded
+    keys = set(old_state) | set(new_state)
+    return [{"setting": k, "recorded": old_state.get(k), "actual": new_state.get(k)}
+            for k in sorted(keys) if old_state.get(k) != new_state.get(k)]
+
+
+@mgtrace.traced()
+def tune_nodes(nodeinfo, assignment=None, apply=True):
+    # apply (or only read back) the profiles of all assigned nodes in one
+    # parallel step, the state ends up in nodeinfo[node]['tuning']
+    if assignment is None:
+        assignment = {}
+        for name in nodeinfo:
+            if not nodeinfo[name].get('links') and default_profile(name):
+                assignment[name] = default_profile(name)
+    for name, profile in assignment.items():
+        if profile not in profiles:
+            print("ERROR: unknown tuning profile "+profile+" for node "+name, file=sys.stderr)
+            sys.exit(-1)
+
+    def run(name, n):
+        profile = assignment[name]
+        ifaces = node_interfaces(n)
+        script = apply_script(profile, ifaces) if apply else ""
+        script += readback_script(profiles[profile].get("sysctl", {}).keys(), ifaces, profiles[profile].get("cstates"))
+        out, err, rc = mgutil.remote_script(n, script)
+        return (profile, ifaces, parse_state(out))
+
+    results = mgutil.run_parallel({name: nodeinfo[name] for name in assignment}, run)
+    report = {}
+    for name, (profile, ifaces, state) in results.items():
+        previous = nodeinfo[name].get('tuning')
+        entry = {"profile": profile, "time": time.time(), "state": state,
+                 "mismatches": mismatches(profile, ifaces, state)}
+        if previous and previous.get("state"):
+            entry["drift"] = drift(previous["state"], state)
+        if apply or not previous:
+            nodeinfo[name]['tuning'] = entry
+        report[name] = entry
+    return report
+
+
+def print_report(report, show_drift=False):
+    for name in sorted(report):
+        e = report[name]
+        print("%-12s %-20s %d settings not in effect" % (name, e['profile'], len(e['mismatches'])))
+        for m in e['mismatches']:
+            print("    %s: expected %s, got %s" % (m['setting'], m['expected'], m['actual']))
+        if show_drift:
+            for d in e.get('drift', []):
+                print("    drift %s: recorded %s, now %s" % (d['setting'], d['recorded'], d['actual']))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", '--nodeinfo', help='json config file for the experiment', required=True)
+    parser.add_argument("command", choices=["apply", "check", "list"], help='apply the profiles, check for drift, or list the profiles')
+    parser.add_argument("-a", '--assign', nargs='+', help='node=profile assignments (default: routers and endpoints by name)')
+    args = parser.parse_args()
+
+    if args.command == "list":
+        for name, p in profiles.items():
+            print("%-20s %s" % (name, p['description']))
+        return
+
+    nodeinfo = mgutil.load_config(args.nodeinfo)
+    assignment = None
+    if args.assign:
+        assignment = dict(a.split('=', 1) for a in args.assign)
+    elif args.command == "check":
+        assignment = {name: n['tuning']['profile'] for name, n in nodeinfo.items() if n.get('tuning')}
+
+    report = tune_nodes(nodeinfo, assignment, apply=(args.command == "apply"))
+    print_report(report, show_drift=(args.command == "check"))
+    if args.command == "apply":
+        mgutil.save_config(nodeinfo, args.nodeinfo)
+
+
+if __name__ == "__main__":
+    main()
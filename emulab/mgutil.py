@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+#
+# helpers shared by the emulab scripts for talking to the experiment nodes.
+# everything goes through ssh/scp like in the setup scripts, but commands
+# for many nodes can be run concurrently.  Every ssh/scp is a span of the
+# bring-up trace when tracing is on (see mgtrace.py).
+
+import os
+import json
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import mgtrace
+
+ssh_cmd = "ssh -o StrictHostKeyChecking=no "
+scp_cmd = "scp -o StrictHostKeyChecking=no "
+
+
+def node_hostname(nodeinfo):
+    # the dumbell scripts keep the control net name in 'hostname',
+    # the multipath script keeps it in 'cn-name'
+    return nodeinfo.get('cn-name') or nodeinfo['hostname']
+
+
+def moongen_nodes(nodeinfo):
+    # the moongen nodes are the ones that have links to emulate
+    return {name: n for name, n in nodeinfo.items() if n.get('links')}
+
+
+def remote_command(nodeinfo, cmd):
+    # run a command on one node, returns (stdout, stderr, returncode)
+    with mgtrace.span("ssh", nodeinfo, cmd=cmd[:200]):
+        p = subprocess.Popen(ssh_cmd+node_hostname(nodeinfo)+" '"+cmd+"'",
+                             shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+    return out.decode(), err.decode(), p.returncode
+
+
+def remote_script(nodeinfo, script):
+    # run a multi-line shell script on one node, it is passed on stdin so
+    # it needs no quoting, returns (stdout, stderr, returncode)
+    with mgtrace.span("ssh script", nodeinfo, script=script[:200]):
+        p = subprocess.Popen(ssh_cmd+node_hostname(nodeinfo)+" 'bash -s'",
+                             shell=True, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate(script.encode())
+    return out.decode(), err.decode(), p.returncode
+
+
+def remote_stream(nodeinfo, cmd, callback):
+    # run a command on one node and call callback(line) for every line of
+    # output as soon as it arrives, returns the returncode
+    p = subprocess.Popen(ssh_cmd+node_hostname(nodeinfo)+" '"+cmd+"'",
+                         shell=True, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    for line in p.stdout:
+        callback(line.decode().rstrip("\n"))
+    return p.wait()
+
+
+def run_parallel(nodes, fn, max_workers=16):
+    # call fn(name, nodeinfo) for all nodes concurrently
+    # returns a dict mapping the node names to the results
+    if not nodes:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(nodes))) as pool:
+        futures = {name: pool.submit(fn, name, n) for name, n in nodes.items()}
+    return {name: f.result() for name, f in futures.items()}
+
+
+def remote_command_all(nodes, cmd, max_workers=16):
+    # run a command on many nodes at once.
+    # cmd is either a string, or a function(name, nodeinfo) that returns
+    # the command for that node
+    def run(name, n):
+        c = cmd(name, n) if callable(cmd) else cmd
+        print("["+name+"] command: "+c, file=sys.stderr)
+        return remote_command(n, c)
+    return run_parallel(nodes, run, max_workers)
+
+
+def fetch_files(nodeinfo, remote_glob, local_dir):
+    # copy files matching remote_glob from the node into local_dir
+    os.makedirs(local_dir, exist_ok=True)
+    with mgtrace.span("scp fetch", nodeinfo, files=remote_glob):
+        p = subprocess.Popen(scp_cmd+node_hostname(nodeinfo)+":'"+remote_glob+"' "+local_dir+"/",
+                             shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+    return p.returncode == 0
+
+
+def push_files(nodeinfo, local_files, remote_dir):
+    # copy local files into remote_dir on the node
+    with mgtrace.span("scp push", nodeinfo, files=" ".join(local_files)):
+        p = subprocess.Popen(scp_cmd+" ".join(local_files)+" "+node_hostname(nodeinfo)+":"+remote_dir+"/",
+                             shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+    return p.returncode == 0
+
+
+def relay_copy(src, dst, path):
+    # copy a file from one node to the same path on another, through this host
+    with mgtrace.span("scp relay", dst, src=node_hostname(src), path=path):
+        p = subprocess.Popen(scp_cmd+"-3 "+node_hostname(src)+":"+path+" "+node_hostname(dst)+":"+path,
+                             shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = p.communicate()
+    return p.returncode == 0
+
+
+def state_file(filename):
+    # the runtime state of an experiment is kept next to its json file:
+    # exp.json -> exp.state.json
+    (base, ext) = os.path.splitext(filename)
+    return base+".state"+(ext or ".json")
+
+
+def state_diff(nodeinfo, config):
+    # what the tools added to or changed in the nodeinfo, per key
+    diff = {}
+    for key, val in nodeinfo.items():
+        if isinstance(val, dict) and isinstance(config.get(key), dict):
+            sub = state_diff(val, config[key])
+            if sub:
+                diff[key] = sub
+        elif key not in config or config[key] != val:
+            diff[key] = val
+    return diff
+
+
+def merge_state(nodeinfo, state):
+    for key, val in state.items():
+        if isinstance(val, dict) and isinstance(nodeinfo.get(key), dict):
+            merge_state(nodeinfo[key], val)
+        else:
+            nodeinfo[key] = val
+    return nodeinfo
+
+
+def load_config(filename):
+    # the experiment's json file with the recorded state on top
+    with open(filename, 'r') as f:
+        nodeinfo = json.load(f)
+    if os.path.exists(state_file(filename)):
+        with open(state_file(filename), 'r') as f:
+            merge_state(nodeinfo, json.load(f))
+    return nodeinfo
+
+
+def save_config(nodeinfo, filename):
+    # record the runtime state (calibration, preflight, tuning, forwarder,
+    # routes, ...) in the state file, the experiment's json file stays as written
+    with open(filename, 'r') as f:
+        config = json.load(f)
+    with open(state_file(filename), 'w') as f:
+        json.dump(state_diff(nodeinfo, config), f, sort_keys=True, indent=4)
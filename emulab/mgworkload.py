@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+#
+# run TCP/UDP workloads between the end hosts of an experiment.
+#
+# Uses the nodeinfo json of the setup scripts.  By default every senderN
+# sends to receiverN, e.g. after
+#   ./mg-dumbell-setup.py -j exp.json -b 100 -l 10
+# the command
+#   ./mgworkload.py -j exp.json -n 4 -t 60 -o results/run1
+# starts 4 iperf3 flows on each pair through the emulated bottleneck.
+#
+# One iperf3 server per flow is started on the receivers, then all clients of
+# a sender are launched with one ssh command and wait for a common start time,
+# so the flows of all senders start together (the clocks of the nodes are
+# assumed to be NTP synchronized).  The clients run with --json-stream, their
+# per-interval goodput, RTT and cwnd are streamed back while the test runs and
+# written to results/run1/flows.csv.  results/run1/summary.json holds the per
+# flow averages, the fairness index and the emulated link settings that the
+# setup scripts recorded in nodeinfo.
+
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import threading
+
+import mgutil
+
+base_port = 5201
+
+text_interval_re = re.compile(r"^\[\s*\d+\]\s+([\d.]+)-([\d.]+)\s+sec\s+[\d.]+ \w+\s+([\d.]+) (\w?)bits/sec")
+unit_scale = {"": 1e-6, "K": 1e-3, "M": 1, "G": 1e3}
+
+csv_fields = ["flow", "sender", "receiver", "start", "end", "goodput_mbps", "rtt_ms", "cwnd", "retransmits", "lost_percent"]
+
+
+def endpoint_ip(n):
+    # dumbell nodes have one 'if', multipath nodes a list of 'ifaces'
+    if 'if' in n:
+        return n['if']['ip']
+    return n['ifaces'][0]['ip']
+
+
+def endpoint_pairs(nodeinfo, pairs=None):
+    # default: senderN -> receiverN
+    if pairs:
+        return [tuple(p.split(':')) for p in pairs]
+    senders = sorted(n for n in nodeinfo if n.startswith("sender"))
+    receivers = sorted(n for n in nodeinfo if n.startswith("receiver"))
+    return list(zip(senders, receivers))
+
+
+def plan_flows(nodeinfo, pairs, flows_per_pair):
+    flows = []
+    for (sender, receiver) in pairs:
+        for i in range(flows_per_pair):
+            flows.append({"id": len(flows), "sender": sender, "receiver": receiver,
+                          "dst": endpoint_ip(nodeinfo[receiver]), "port": base_port + len(flows)})
+    return flows
+
+
+def emulated_links(nodeinfo):
+    # link settings recorded by the setup scripts on the moongen nodes
+    links = {}
+    for name, n in mgutil.moongen_nodes(nodeinfo).items():
+        if 'forwarder' in n:
+            links[name] = dict(n['forwarder'])
+            if 'calibration' in n:
+                links[name]['calibration'] = {k: n['calibration'][k] for k in ("target_rate", "target_latency", "converged")}
+    return links
+
+
+def start_servers(nodeinfo, flows):
+    # one single-test iperf3 daemon per flow
+    ports = {}
+    for f in flows:
+        ports.setdefault(f['receiver'], []).append(f['port'])
+    def cmd(name, n):
+        c = "pkill -x iperf3; sleep 0.5; "
+        c += "; ".join("iperf3 -s -1 -D -p "+str(p) for p in ports[name])
+        return c
+    return mgutil.remote_command_all({r: nodeinfo[r] for r in ports}, cmd)
+
+
+def client_command(flow, args):
+    c = "iperf3 -c "+flow['dst']+" -p "+str(flow['port'])+" -t "+str(args.time)+" -i "+str(args.interval)
+    if args.json_stream:
+        c += " --json-stream"
+    if args.udp:
+        c += " -u -b "+args.bandwidth
+    elif args.bandwidth:
+        c += " -b "+args.bandwidth
+    if args.congestion:
+        c += " -C "+args.congestion
+    if args.length:
+        c += " -l "+str(args.length)
+    # prefix every line with the flow id, the output of all flows is multiplexed on one ssh
+    return "("+c+" 2>&1 | sed -u \"s/^/FLOW"+str(flow['id'])+" /\") &"
+
+
+def sender_command(flows, start_at, args):
+    c = "python3 -c \"import time; time.sleep(max(0, "+repr(start_at)+" - time.time()))\"; "
+    c += " ".join(client_command(f, args) for f in flows)
+    c += " wait"
+    return c
+
+
+class FlowStats:
+
+    def __init__(self, flows, csvfile=None):
+        self.flows = {f['id']: f for f in flows}
+        self.lock = threading.Lock()
+        self.latest = {}
+        self.intervals = {f['id']: [] for f in flows}
+        self.final = {}
+        self.csv = csvfile
+        if self.csv:
+            self.csv.write(",".join(csv_fields)+"\n")
+
+    def record(self, fid, rec):
+        f = self.flows[fid]
+        rec = dict(rec, flow=fid, sender=f['sender'], receiver=f['receiver'])
+        with self.lock:
+            self.latest[fid] = rec
+            self.intervals[fid].append(rec)
+            if self.csv:
+                self.csv.write(",".join("" if rec.get(k) is None else str(rec[k]) for k in csv_fields)+"\n")
+
+    def parse(self, line):
+        m = re.match(r"^FLOW(\d+) (.*)$", line)
+        if not m:
+            return
+        fid = int(m.group(1))
+        if fid not in self.flows:
+            return
+        payload = m.group(2)
+        try:
+            ev = json.loads(payload)
+        except ValueError:
+            ev = None
+        if isinstance(ev, dict):
+            self.parse_event(fid, ev)
+            return
+        # plain text output of older iperf3 versions: goodput only
+        t = text_interval_re.match(payload)
+        if t and "sender" not in payload and "receiver" not in payload:
+            self.record(fid, {"start": float(t.group(1)), "end": float(t.group(2)),
+                              "goodput_mbps": float(t.group(3))*unit_scale.get(t.group(4), 1)})
+        elif "error" in payload:
+            print("flow "+str(fid)+": "+payload, file=sys.stderr)
+
+    def parse_event(self, fid, ev):
+        data = ev.get("data", {})
+        if ev.get("event") == "interval":
+            s = data.get("sum", {})
+            streams = data.get("streams", [{}])
+            st = streams[0] if streams else {}
+            self.record(fid, {"start": s.get("start"), "end": s.get("end"),
+                              "goodput_mbps": s.get("bits_per_second", 0)/1e6,
+                              "rtt_ms": st["rtt"]/1000.0 if "rtt" in st else None,
+                              "cwnd": st.get("snd_cwnd"),
+                              "retransmits": s.get("retransmits"),
+                              "lost_percent": s.get("lost_percent")})
+        elif ev.get("event") == "end":
+            # tcp: the receiver side is the goodput, udp: sum has the losses
+            s = data.get("sum_received") or data.get("sum") or {}
+            with self.lock:
+                self.final[fid] = {"goodput_mbps": s.get("bits_per_second", 0)/1e6,
+                                   "retransmits": data.get("sum_sent", {}).get("retransmits"),
+                                   "lost_percent": s.get("lost_percent")}
+        elif ev.get("event") == "error":
+            print("flow "+str(fid)+": "+str(ev.get("data")), file=sys.stderr)
+
+    def total_goodput(self):
+        with self.lock:
+            return sum(r.get("goodput_mbps") or 0 for r in self.latest.values())
+
+    def summary(self):
+        flows = {}
+        for fid, f in self.flows.items():
+            ivs = self.intervals[fid]
+            rtts = [r['rtt_ms'] for r in ivs if r.get('rtt_ms') is not None]
+            goodput = self.final.get(fid, {}).get("goodput_mbps")
+            if goodput is None and ivs:
+                goodput = sum(r['goodput_mbps'] for r in ivs)/len(ivs)
+            flows[fid] = {"sender": f['sender'], "receiver": f['receiver'], "port": f['port'],
+                          "goodput_mbps": goodput,
+                          "mean_rtt_ms": sum(rtts)/len(rtts) if rtts else None,
+                          "max_rtt_ms": max(rtts) if rtts else None}
+            flows[fid].update({k: v for k, v in self.final.get(fid, {}).items() if k != "goodput_mbps"})
+        rates = [f['goodput_mbps'] for f in flows.values() if f['goodput_mbps'] is not None]
+        total = sum(rates)
+        # Jain's fairness index
+        fairness = total**2/(len(rates)*sum(r*r for r in rates)) if rates and total > 0 else None
+        return {"flows": flows, "total_goodput_mbps": total, "fairness": fairness}
+
+
+def run_workload(nodeinfo, flows, args):
+    os.makedirs(args.outdir, exist_ok=True)
+    start_servers(nodeinfo, flows)
+    by_sender = {}
+    for f in flows:
+        by_sender.setdefault(f['sender'], []).append(f)
+
+    start_at = time.time() + args.lead
+    csvfile = open(os.path.join(args.outdir, "flows.csv"), 'w')
+    stats = FlowStats(flows, csvfile)
+
+    threads = []
+    for sender, sflows in by_sender.items():
+        cmd = sender_command(sflows, start_at, args)
+        print("["+sender+"] command: "+cmd, file=sys.stderr)
+        t = threading.Thread(target=mgutil.remote_stream, args=(nodeinfo[sender], cmd, stats.parse))
+        t.start()
+        threads.append(t)
+
+    # live view of the aggregate while the flows run
+    while any(t.is_alive() for t in threads):
+        time.sleep(args.interval)
+        if time.time() > start_at:
+            print("t=%6.1fs  %d flows  total goodput %.2f Mbps" % (time.time() - start_at, len(stats.latest), stats.total_goodput()), file=sys.stderr)
+    for t in threads:
+        t.join()
+    csvfile.close()
+
+    summary = stats.summary()
+    summary["start_time"] = start_at
+    summary["duration"] = args.time
+    summary["protocol"] = "udp" if args.udp else "tcp"
+    summary["links"] = emulated_links(nodeinfo)
+    with open(os.path.join(args.outdir, "summary.json"), 'w') as f:
+        json.dump(summary, f, sort_keys=True, indent=4)
+    return summary
+
+
+def print_summary(summary):
+    for fid in sorted(summary['flows']):
+        f = summary['flows'][fid]
+        print("flow %3d %-10s -> %-10s %10.2f Mbps  rtt %s ms" % (fid, f['sender'], f['receiver'], f['goodput_mbps'] or 0,
+              "%.2f" % f['mean_rtt_ms'] if f['mean_rtt_ms'] is not None else "-"))
+    line = "total %.2f Mbps" % summary['total_goodput_mbps']
+    if summary['fairness'] is not None:
+        line += ", fairness %.3f" % summary['fairness']
+    for name, link in summary['links'].items():
+        line += ", "+name+" emulates "+str(link['rate'])+" Mbps / "+str(link['latency'])+" ms"
+    print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-j", '--nodeinfo', help='json config file for the experiment', required=True)
+    parser.add_argument("-P", '--pairs', nargs='+', help='sender:receiver pairs (default: senderN:receiverN)')
+    parser.add_argument("-n", '--flows', help='flows per pair (default=1)', type=int, default=1)
+    parser.add_argument("-t", '--time', help='duration in seconds (default=30)', type=int, default=30)
+    parser.add_argument("-i", '--interval', help='reporting interval in seconds (default=1)', type=float, default=1)
+    parser.add_argument("-u", '--udp', help='udp instead of tcp flows', action='store_true')
+    parser.add_argument("-b", '--bandwidth', help='per flow target bitrate (iperf3 -b, required for udp)')
+    parser.add_argument("-C", '--congestion', help='tcp congestion control algorithm')
+    parser.add_argument("-l", '--length', help='buffer/datagram length', type=int)
+    parser.add_argument("-o", '--outdir', help='directory for the results (default=workload)', default='workload')
+    parser.add_argument('--lead', help='seconds between launching and the common start (default=5)', type=float, default=5)
+    parser.add_argument('--no-json-stream', dest='json_stream', help='for iperf3 < 3.17, reports goodput only', action='store_false')
+    args = parser.parse_args()
+
+    if args.udp and not args.bandwidth:
+        print("ERROR: udp flows need a target bitrate (-b)", file=sys.stderr)
+        sys.exit(-1)
+
+    nodeinfo = mgutil.load_config(args.nodeinfo)
+    pairs = endpoint_pairs(nodeinfo, args.pairs)
+    if not pairs:
+        print("ERROR: no sender/receiver pairs found in "+args.nodeinfo, file=sys.stderr)
+        sys.exit(-1)
+    flows = plan_flows(nodeinfo, pairs, args.flows)
+    print("running "+str(len(flows))+" flows on "+str(len(pairs))+" pairs", file=sys.stderr)
+    summary = run_workload(nodeinfo, flows, args)
+    print_summary(summary)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+# the tools are scripts, not a package: import them from the directory above
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,40 @@
+import mghuge
+import mgcalibrate
+
+links = {"links": [[0, 1]], "ifaces": [{"idx": 0, "numa": 0}, {"idx": 1, "numa": 0}]}
+
+
+def reserved(rate, latency):
+    # nodeinfo after mghuge.setup_hugepages reserved for these parameters
+    p = mghuge.plan(links, rate, latency, 0)
+    return dict(links, hugepages={"page_size": p["page_size"], "pages": {str(k): v for k, v in p["pages"].items()}})
+
+
+def test_only_converged_calibrations_are_reused():
+    cal = {"target_rate": 1000, "target_latency": 10, "rate_param": 1030, "latency_param": 9.6, "converged": True}
+    assert mgcalibrate.corrected_params({"calibration": cal}, 1000, 10) == (1030, 9.6)
+    assert mgcalibrate.corrected_params({"calibration": cal}, 1000, 20) == (1000, 20)
+    assert mgcalibrate.corrected_params({"calibration": dict(cal, converged=False)}, 1000, 10) == (1000, 10)
+
+
+def test_fits_hugepages():
+    nodeinfo = reserved(10000, 50)
+    assert mgcalibrate.fits_hugepages(nodeinfo, 10000, 50)
+    assert mgcalibrate.fits_hugepages(nodeinfo, 10000, 40)
+    assert not mgcalibrate.fits_hugepages(nodeinfo, 10000, 100)
+    assert mgcalibrate.fits_hugepages(links, 10000, 100)
+
+
+def test_calibration_stops_before_outgrowing_the_hugepages(monkeypatch):
+    nodeinfo = reserved(10000, 16)
+    launched = [(10000, 10)]
+
+    def run_probe(probe, rate, size, duration, mode):
+        # the link delivers the rate, but half the latency the forwarder is set to (histograms in ns)
+        return (10000.0, {launched[-1][1]/2*1e6: 1})
+    monkeypatch.setattr(mgcalibrate, "run_probe", run_probe)
+    cal = mgcalibrate.calibrate(nodeinfo, {}, 10000, 10, lambda r, l: launched.append((r, l)))
+    # 15 ms fits the pages reserved for 16 ms, the next correction to 17.5 ms would not: stop at the launched 15 ms
+    assert launched == [(10000, 10), (10000, 15)]
+    assert (cal["rate_param"], cal["latency_param"]) == (10000, 15)
+    assert not cal["converged"]
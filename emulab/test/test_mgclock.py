@@ -0,0 +1,63 @@
+import numpy
+
+import mgclock
+
+
+def samples(x, offset, drift, t0, noise, outliers, rng):
+    # (x, clock - x) of a clock running at offset + drift*(x - t0), with jitter and some delayed reads
+    y = offset + drift*(x - t0) + rng.normal(0, noise, len(x))
+    bad = rng.choice(len(x), outliers, replace=False)
+    y[bad] += rng.uniform(20000, 200000, outliers)
+    return x, numpy.rint(y).astype(numpy.int64)
+
+
+def test_robust_fit_ignores_outliers():
+    rng = numpy.random.default_rng(0)
+    x = 1_700_000_000*10**9 + numpy.sort(rng.integers(0, 60*10**9, 2000))
+    truth = {"a": (123456789, 20e-6, x[1000]), "b": (-5000, -3e-6, x[250])}
+    groups = {"a": samples(x, *truth["a"], 50, 100, rng),
+              "b": samples(x[:500], *truth["b"], 20, 10, rng)}
+    fits = mgclock.robust_fit(groups)
+    for key, (offset, drift, t0) in truth.items():
+        f = fits[key]
+        # the offset is reported at the fit's own t0, the median of the samples
+        expected = offset + drift*(f["t0"] - t0)
+        assert abs(f["offset"] - expected) < 10
+        assert abs(f["drift"] - drift) < 0.05e-6
+    assert fits["a"]["samples"] == 2000 and fits["b"]["samples"] == 500
+    assert fits["a"]["mad"] < 100
+
+
+def test_chained_maps_take_nic_time_to_the_reference():
+    rng = numpy.random.default_rng(1)
+    ref = 1_700_000_000*10**9 + numpy.sort(rng.integers(0, 30*10**9, 1000))
+    host = ref + 40_000_000 + numpy.rint(15e-6*(ref - ref[0])).astype(numpy.int64)
+    nic = host - 2_000_000_000 + numpy.rint(-8e-6*(host - host[0])).astype(numpy.int64)
+    fits = mgclock.robust_fit({"host": (ref, host - ref), "nic": (host, nic - host)})
+    m = mgclock.chain(fits["nic"], fits["host"])
+    assert numpy.max(numpy.abs(mgclock.to_reference(nic, m) - ref)) < 5
+    # without host samples the host clock is the reference
+    alone = mgclock.chain(fits["nic"], None)
+    assert numpy.max(numpy.abs(mgclock.to_reference(nic, alone) - host)) < 5
+
+
+def test_best_half_keeps_the_tight_reads():
+    x = numpy.arange(6)
+    y = x*10
+    quality = numpy.array([5, 1, 9, 2, 8, 3])
+    (bx, by) = mgclock.best_half(x, y, quality)
+    assert bx.tolist() == [1, 3, 5] and by.tolist() == [10, 30, 50]
+
+
+def test_rewrite_mscap(tmp_path):
+    rec = numpy.zeros(3, dtype=mgclock.mscap_dtype)
+    rec["ts"] = [10**12, 10**12 + 1000, 10**12 + 2000]
+    rec["id"] = [7, 8, 9]
+    src = str(tmp_path / "in.mscap")
+    dst = str(tmp_path / "out.mscap")
+    rec.tofile(src)
+    m = {"t0": 10**12, "offset": 500, "drift": 0.0}
+    assert mgclock.rewrite_mscap(src, dst, m) == 3
+    out = numpy.fromfile(dst, dtype=mgclock.mscap_dtype)
+    assert out["ts"].tolist() == [10**12 - 500, 10**12 + 500, 10**12 + 1500]
+    assert out["id"].tolist() == [7, 8, 9]
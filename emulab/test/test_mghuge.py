@@ -0,0 +1,61 @@
+import math
+
+import mghuge
+
+MB = mghuge.MB
+GB = mghuge.GB
+
+
+def test_delay_line_matches_the_forwarders():
+    assert mghuge.delay_line(1000, 0, 0) == ("l2-forward-rate-crc.lua", 0)
+    assert mghuge.delay_line(1000, 10, 500) == ("l2-forward-psring-lrl.lua", 500)
+    # byte-sized ring: bandwidth-delay product plus -x 20000, in smallest frames
+    (script, packets) = mghuge.delay_line(10000, 100, 0)
+    assert script == "l2-forward-bsring-lrl.lua"
+    assert packets == math.ceil((10000*100*1000//8 + 20000)/mghuge.min_frame)
+    # never below the 3000 byte minimum ring
+    assert mghuge.delay_line(1, 0.001, 0)[1] == math.ceil(20000/mghuge.min_frame)
+
+
+def test_port_budget_holds_the_delay_line_and_the_slack():
+    (script, packets, size) = mghuge.port_budget(10000, 100, 0)
+    assert size >= (packets + mghuge.rx_descs + mghuge.tx_descs)*mghuge.mbuf_size
+    # 10G with 100 ms keeps 125 MB in flight, in 60 byte frames a few GB of mbufs
+    assert 4*GB < size < 5*GB
+    # a rate controlled link only needs the descriptors
+    assert mghuge.port_budget(1000, 0, 0)[2] < 12*MB
+
+
+def test_as_list_repeats_the_last_value():
+    assert mghuge.as_list(5, 3) == [5, 5, 5]
+    assert mghuge.as_list([1, 2], 4) == [1, 2, 2, 2]
+
+
+def test_plan_per_numa_node():
+    nodeinfo = {"links": [[0, 1], [2, 3]],
+                "ifaces": [{"idx": 0, "numa": 0}, {"idx": 1, "numa": 0}, {"idx": 2, "numa": 1}, {"idx": 3, "numa": 1}]}
+    p = mghuge.plan(nodeinfo, [1000, 1000], [10, 0], 0)
+    port = {q["port"]: q for q in p["ports"]}
+    assert all(q["script"] == mghuge.multi_link_script for q in p["ports"])
+    for numa, ports in ((0, (0, 1)), (1, (2, 3))):
+        assert p["need"][numa] == int((sum(port[i]["bytes"] for i in ports) + mghuge.base_memory)*mghuge.headroom)
+        assert p["pages"][numa] == math.ceil(p["need"][numa]/p["page_bytes"])
+    assert p["page_size"] == "2M"
+
+
+def test_big_budgets_use_1g_pages_if_the_cpu_has_them():
+    nodeinfo = {"links": [[0, 1]]}
+    state = {"pdpe1gb": False, "numa": {}, "free": {0: 64*GB}, "pages": {}}
+    assert mghuge.plan(nodeinfo, 10000, 100, 0)["page_size"] == "1G"
+    assert mghuge.plan(nodeinfo, 10000, 100, 0, state)["page_size"] == "2M"
+
+
+def test_check_counts_reserved_pages():
+    p = mghuge.plan({"links": [[0, 1]]}, 1000, 10, 0)
+    need = p["pages"][0]*p["page_bytes"]
+    state = {"pdpe1gb": True, "numa": {}, "free": {0: mghuge.os_reserve + need//2},
+             "pages": {0: {p["page_bytes"]: p["pages"][0]}}}
+    assert mghuge.check(p, state) == []
+    state["pages"] = {}
+    assert mghuge.check(p, state)
+    assert mghuge.check(dict(p, pages={1: 1}), state) == ["NUMA node 1 does not exist"]
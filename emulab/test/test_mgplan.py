@@ -0,0 +1,72 @@
+import pytest
+
+import mghuge
+import mgnlink
+import mgplan
+
+profile = {"node": {"cores": 8, "ports": 8, "port_speed": 10000, "memory_gb": 64},
+           "mpps_per_core": {"l2-nlink-forward-lrl.lua": {"64": 3.0, "1518": 0.8},
+                             "l2-forward-rate-crc.lua": {"64": 4.0},
+                             "l2-forward-bsring-lrl.lua": {"64": 3.5}}}
+
+
+def test_mpps_per_core_is_linear_between_the_frame_sizes():
+    assert mgplan.mpps_per_core(profile, "l2-nlink-forward-lrl.lua", 64) == 3.0
+    assert mgplan.mpps_per_core(profile, "l2-nlink-forward-lrl.lua", 791) == pytest.approx(1.9)
+    assert mgplan.mpps_per_core(profile, "l2-nlink-forward-lrl.lua", 9000) == 0.8
+    assert mgplan.mpps_per_core(profile, "l2-forward-psring-lrl.lua", 64) is None
+
+
+def test_link_load():
+    link = {"rate": 1000, "latency": 0, "loss": 0, "queue": 0, "frame": 64}
+    assert mgplan.analyze(link, profile, 1.0) == []
+    # 1 Gbit/s of 64 byte frames is 1.488 Mpps
+    assert link["mpps"] == pytest.approx(1.488, abs=0.001)
+    assert link["load"] == pytest.approx(1.488/4.0, abs=0.001)
+    assert link["nlink_load"] == pytest.approx(1.488/3.0, abs=0.001)
+    # a lossy link needs a forwarder that drops
+    lossy = dict(link, loss=0.01)
+    mgplan.analyze(lossy, profile, 1.0)
+    assert lossy["script"] == mghuge.multi_link_script
+
+
+def test_overloaded_and_too_fast_links_are_reported():
+    fast = {"rate": 10000, "latency": 0, "loss": 0, "queue": 0, "frame": 64}
+    assert len(mgplan.analyze(fast, profile, 1.2)) == 1
+    faster = dict(fast, rate=40000)
+    assert len(mgplan.analyze(faster, profile, 1.2)) == 2
+
+
+def test_nlink_needs_a_core_per_direction():
+    links = []
+    for i in range(3):
+        link = {"rate": 10, "latency": 0, "loss": 0, "queue": 0, "frame": 1518}
+        mgplan.analyze(link, profile, 1.2)
+        links.append(link)
+    # however light the links, the workers do not share cores
+    (ports, cores, memory) = mgplan.node_needs(links, 1.2)
+    assert (ports, cores) == (6, mgnlink.reserved_cores + 6)
+    assert memory == int((sum(2*l["port_bytes"] for l in links) + mghuge.base_memory)*1.2)
+
+
+def test_plan_packs_onto_the_cores():
+    topology = {"links": [{"name": "l%d" % i, "rate": 100} for i in range(5)] + [{"name": "far", "rate": 100, "latency": 50}]}
+    p = mgplan.plan(topology, profile)
+    assert p["infeasible"] == []
+    # 8 cores: master, stats and the workers of three links
+    assert [len(n["links"]) for n in p["nodes"]] == [3, 3]
+    assert all(n["cores"] <= profile["node"]["cores"] for n in p["nodes"])
+    assert p["total"]["cores"] == 2*(mgnlink.reserved_cores + 6)
+    assert sorted(l["name"] for n in p["nodes"] for l in n["links"]) == sorted(l["name"] for l in topology["links"])
+
+
+def test_single_link_node_runs_the_dedicated_forwarder():
+    p = mgplan.plan({"links": [{"rate": 1000, "latency": 20}]}, profile)
+    (node,) = p["nodes"]
+    assert node["script"] == "l2-forward-bsring-lrl.lua"
+    assert node["ports"] == 2
+
+
+def test_plan_without_figures_fails():
+    with pytest.raises(ValueError):
+        mgplan.plan({"links": [{"rate": 1000, "latency": 20}]}, dict(profile, mpps_per_core={}))
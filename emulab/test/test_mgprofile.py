@@ -0,0 +1,27 @@
+import mgprofile
+
+# folded stacks as lua/task-profile.lua makes jit.p write them, outermost caller first
+FOLDED = """l2-nlink-forward-lrl:worker;crc-ratecontrol:sendWithDelayLoss;[C] 812
+l2-nlink-forward-lrl:worker;pipe:recvFromBytesizedRing 97
+l2-nlink-forward-lrl:worker;crc-ratecontrol:sendWithDelayLoss;[C] 8
+"""
+
+
+def test_read_folded_keeps_the_frames(tmp_path):
+    path = tmp_path / "mgprof-worker-1.folded"
+    path.write_text(FOLDED + "not a stack line\n")
+    stacks = mgprofile.read_folded(str(path))
+    assert stacks == {"l2-nlink-forward-lrl:worker;crc-ratecontrol:sendWithDelayLoss;[C]": 820,
+                      "l2-nlink-forward-lrl:worker;pipe:recvFromBytesizedRing": 97}
+    assert all(len(stack.split(";")) > 1 for stack in stacks)
+
+
+def test_merge_prefixes_node_and_task(tmp_path):
+    for node, task in (("mgnode1", "worker-1"), ("mgnode2", "worker-2")):
+        (tmp_path / node).mkdir()
+        (tmp_path / node / ("mgprof-"+task+".folded")).write_text(FOLDED)
+    merged = mgprofile.merge_folded(str(tmp_path), ["mgnode1", "mgnode2", "mgnode3"])
+    assert merged["mgnode2;worker-2;l2-nlink-forward-lrl:worker;pipe:recvFromBytesizedRing"] == 97
+    assert len(merged) == 4
+    lines = (tmp_path / "profile.folded").read_text().splitlines()
+    assert "mgnode1;worker-1;l2-nlink-forward-lrl:worker;crc-ratecontrol:sendWithDelayLoss;[C] 820" in lines
@@ -0,0 +1,67 @@
+import os
+import sys
+import json
+import subprocess
+
+import mgnlink
+import mgsched
+
+pool = {"nodes": {"pc1": {"port_speed": 10000, "memory_gb": 64,
+                          "numa": {"0": {"cores": [0, 2, 4, 6, 8, 10], "ports": [0, 1, 2, 3]},
+                                   "1": {"cores": [1, 3, 5, 7], "ports": [4, 5, 6, 7]}}},
+                  "pc2": {"port_speed": 10000, "memory_gb": 64, "cores": 8, "ports": 4}},
+        "mpps_per_core": {"l2-nlink-forward-lrl.lua": {"64": 3.0}}}
+
+
+def test_core_ids():
+    ids = mgsched.core_ids({0: {"cores": 4}, 1: {"cores": 4}})
+    assert ids == {0: [0, 1, 2, 3], 1: [4, 5, 6, 7]}
+    assert mgsched.core_ids({0: {"cores": [0, 2]}, 1: {"cores": [1, 3]}}) == {0: [0, 2], 1: [1, 3]}
+
+
+def test_links_fill_shared_nodes_first():
+    s = mgsched.schedule({"a": [{"rate": 100}, {"rate": 200}], "b": [{"rate": 300}]}, pool)
+    assert s["unplaced"] == []
+    assert list(s["nodes"]) == ["pc1"]
+    node = s["nodes"]["pc1"]
+    assert node["workers"] == 6
+    assert node["cores"] == mgnlink.reserved_cores + 6
+
+
+def test_workers_are_pinned_to_the_numa_node_of_their_ports():
+    s = mgsched.schedule({"a": [{"rate": 100 + i} for i in range(4)]}, pool)
+    node = s["nodes"]["pc1"]
+    numa_cores = {0: {0, 2, 4, 6, 8, 10}, 1: {1, 3, 5, 7}}
+    used = []
+    for link in node["links"]:
+        assert set(link["cores"]) <= numa_cores[link["numa"]]
+        assert {0: {0, 1, 2, 3}, 1: {4, 5, 6, 7}}[link["numa"]] >= set(link["ports"])
+        used += link["cores"]
+    # master and stats keep the first two cores of NUMA node 0, no core is used twice
+    assert 0 not in used and 2 not in used
+    assert len(used) == len(set(used)) == 8
+    assert node["worker_cores"] == {"0": [4, 6, 8, 10], "1": [1, 3, 5, 7]}
+    # the command pins the workers in the order of its ports
+    ordered = sorted(node["links"], key=lambda l: l["ports"][0])
+    assert " -c "+" ".join(str(c) for l in ordered for c in l["cores"])+" " in node["command"]
+
+
+def test_links_that_fit_nowhere_are_listed():
+    big = {"a": [{"rate": 100 + i} for i in range(5)], "b": [{"rate": 20000}]}
+    s = mgsched.schedule(big, dict(pool, nodes={"pc1": pool["nodes"]["pc1"]}))
+    assert sorted(u["experiment"] for u in s["unplaced"]) == ["a", "b"]
+    assert len(s["nodes"]["pc1"]["links"]) == 4
+
+
+def test_experiments_with_the_same_name_are_rejected(tmp_path):
+    for d in ("x", "y"):
+        (tmp_path / d).mkdir()
+        with open(tmp_path / d / "exp.json", 'w') as f:
+            json.dump({"links": [{"rate": 100}]}, f)
+    with open(tmp_path / "pool.json", 'w') as f:
+        json.dump(pool, f)
+    script = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mgsched.py")
+    r = subprocess.run([sys.executable, script, str(tmp_path / "x" / "exp.json"), str(tmp_path / "y" / "exp.json"),
+                        "-p", str(tmp_path / "pool.json")], capture_output=True, text=True)
+    assert r.returncode != 0
+    assert "two experiments are named exp" in r.stderr
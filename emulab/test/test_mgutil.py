@@ -0,0 +1,29 @@
+import json
+
+import mgutil
+
+
+def test_state_is_kept_out_of_the_experiment_file(tmp_path):
+    path = str(tmp_path / "exp.json")
+    config = {"mg_router": {"hostname": "pc1", "links": [[0, 1]], "ifaces": [{"idx": 0}]}, "sender1": {"hostname": "pc2"}}
+    with open(path, 'w') as f:
+        json.dump(config, f)
+    nodeinfo = mgutil.load_config(path)
+    nodeinfo["mg_router"]["calibration"] = {"converged": True, "rate_param": 1030}
+    nodeinfo["mg_router"]["forwarder"] = {"rate": 1000, "latency": 10, "queue": 0}
+    nodeinfo["sender1"]["routes"] = ["10.10.2.0/24 via 10.10.1.1"]
+    mgutil.save_config(nodeinfo, path)
+    with open(path) as f:
+        assert json.load(f) == config
+    assert mgutil.state_file(path) == str(tmp_path / "exp.state.json")
+    with open(mgutil.state_file(path)) as f:
+        assert json.load(f) == {"mg_router": {"calibration": nodeinfo["mg_router"]["calibration"],
+                                              "forwarder": nodeinfo["mg_router"]["forwarder"]},
+                                "sender1": {"routes": nodeinfo["sender1"]["routes"]}}
+    # the next run sees the state, and edits of the experiment file that the state does not cover
+    config["sender1"]["hostname"] = "pc3"
+    with open(path, 'w') as f:
+        json.dump(config, f)
+    again = mgutil.load_config(path)
+    assert again["mg_router"]["calibration"]["rate_param"] == 1030
+    assert again["sender1"] == {"hostname": "pc3", "routes": ["10.10.2.0/24 via 10.10.1.1"]}
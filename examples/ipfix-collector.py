@@ -0,0 +1,358 @@
+#!/usr/bin/env python3
+#
+# minimal high-rate IPFIX collector to benchmark ipfix-generation.lua
+# end-to-end on one box.
+#
+# The generator's tx port is cabled to a kernel-bound NIC of the same host
+# that holds IP_DST (10.0.10.10 by default), then e.g.
+#   ./ipfix-collector.py -w 4 -t 60 -f collector.csv &
+#   sudo ../build/MoonGen ipfix-generation.lua 0 100 10
+# The collector prints records/s, messages/s, lost records (from the IPFIX
+# sequence numbers) and the decode time per message once per interval.
+#
+# Packets are read in batches with recvmmsg() into preallocated buffers and
+# decoded in place.  Every worker process has its own SO_REUSEPORT socket, the
+# kernel hashes each exporter (udp 4-tuple) to one socket, so the templates and
+# sequence numbers of an exporter are always seen by the same worker.
+# Data records are decoded with a struct layout compiled once per template.
+
+import os
+import sys
+import time
+import errno
+import ctypes
+import select
+import signal
+import socket
+import struct
+import argparse
+import multiprocessing
+
+IPFIX_PORT = 4739
+MAX_MSG_SIZE = 65535
+
+msg_header = struct.Struct("!HHIII")     # version, length, export time, sequence, domain
+set_header = struct.Struct("!HH")        # set id, length
+tmpl_header = struct.Struct("!HH")       # template id, field count
+opts_tmpl_header = struct.Struct("!HHH") # template id, field count, scope field count
+field_spec = struct.Struct("!HH")        # information element id, field length
+enterprise_number = struct.Struct("!I")
+
+TEMPLATE_SET = 2
+OPTIONS_TEMPLATE_SET = 3
+VARIABLE_LENGTH = 65535
+
+field_formats = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+counter_names = ["messages", "records", "bytes", "lost", "gaps", "reordered",
+                 "malformed", "unknown", "templates", "empty_templates", "decode_ns"]
+
+
+# ---- recvmmsg ----------------------------------------------------------------
+
+class iovec(ctypes.Structure):
+    _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class msghdr(ctypes.Structure):
+    _fields_ = [("msg_name", ctypes.c_void_p), ("msg_namelen", ctypes.c_uint32),
+                ("msg_iov", ctypes.POINTER(iovec)), ("msg_iovlen", ctypes.c_size_t),
+                ("msg_control", ctypes.c_void_p), ("msg_controllen", ctypes.c_size_t),
+                ("msg_flags", ctypes.c_int)]
+
+
+class mmsghdr(ctypes.Structure):
+    _fields_ = [("msg_hdr", msghdr), ("msg_len", ctypes.c_uint)]
+
+
+MSG_DONTWAIT = 0x40
+SOCKADDR_SIZE = 128
+
+try:
+    libc = ctypes.CDLL(None, use_errno=True)
+    recvmmsg = libc.recvmmsg
+    recvmmsg.argtypes = [ctypes.c_int, ctypes.POINTER(mmsghdr), ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+    recvmmsg.restype = ctypes.c_int
+except (OSError, AttributeError):
+    recvmmsg = None
+
+
+class BatchReceiver:
+    # receives up to batch datagrams per call into one preallocated buffer,
+    # falls back to a recvfrom_into() loop where recvmmsg() is not available
+
+    def __init__(self, sock, batch, size=MAX_MSG_SIZE):
+        self.sock = sock
+        self.batch = batch
+        self.size = size
+        self.buf = bytearray(batch*size)
+        self.view = memoryview(self.buf)
+        self.names = bytearray(batch*SOCKADDR_SIZE)
+        self.peers = [None]*batch
+        self.lengths = [0]*batch
+        if recvmmsg:
+            base = ctypes.addressof(ctypes.c_char.from_buffer(self.buf))
+            namebase = ctypes.addressof(ctypes.c_char.from_buffer(self.names))
+            self.iovs = (iovec*batch)()
+            self.msgs = (mmsghdr*batch)()
+            for i in range(batch):
+                self.iovs[i].iov_base = base + i*size
+                self.iovs[i].iov_len = size
+                self.msgs[i].msg_hdr.msg_name = namebase + i*SOCKADDR_SIZE
+                self.msgs[i].msg_hdr.msg_iov = ctypes.pointer(self.iovs[i])
+                self.msgs[i].msg_hdr.msg_iovlen = 1
+
+    def receive(self):
+        # non-blocking, returns the number of datagrams received
+        if not recvmmsg:
+            return self.receive_fallback()
+        for i in range(self.batch):
+            self.msgs[i].msg_hdr.msg_namelen = SOCKADDR_SIZE
+        n = recvmmsg(self.sock.fileno(), self.msgs, self.batch, MSG_DONTWAIT, None)
+        if n < 0:
+            err = ctypes.get_errno()
+            if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+                return 0
+            raise OSError(err, os.strerror(err))
+        for i in range(n):
+            self.lengths[i] = self.msgs[i].msg_len
+            namelen = self.msgs[i].msg_hdr.msg_namelen
+            self.peers[i] = bytes(self.names[i*SOCKADDR_SIZE:i*SOCKADDR_SIZE+namelen])
+        return n
+
+    def receive_fallback(self):
+        n = 0
+        while n < self.batch:
+            try:
+                length, peer = self.sock.recvfrom_into(self.view[n*self.size:(n+1)*self.size], self.size, socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                break
+            self.lengths[n] = length
+            self.peers[n] = peer
+            n += 1
+        return n
+
+    def message(self, i):
+        return self.view[i*self.size:i*self.size+self.lengths[i]]
+
+
+# ---- decoding ----------------------------------------------------------------
+
+def compile_template(fields):
+    # one struct for the whole data record, None for variable length fields
+    fmt = "!"
+    for (ie, length) in fields:
+        if length == VARIABLE_LENGTH:
+            return None
+        fmt += field_formats.get(length, str(length)+"s")
+    return struct.Struct(fmt)
+
+
+class Collector:
+
+    def __init__(self):
+        self.templates = {}
+        self.next_seq = {}
+        self.counters = dict.fromkeys(counter_names, 0)
+
+    def parse_templates(self, msg, offset, end, key, options):
+        c = self.counters
+        header = opts_tmpl_header if options else tmpl_header
+        while offset + header.size <= end:
+            fields_hdr = header.unpack_from(msg, offset)
+            tid, count = fields_hdr[0], fields_hdr[1]
+            offset += header.size
+            if tid < 256:
+                # padding at the end of the set
+                break
+            fields = []
+            for _ in range(count):
+                if offset + field_spec.size > end:
+                    c["malformed"] += 1
+                    return
+                (ie, length) = field_spec.unpack_from(msg, offset)
+                offset += field_spec.size
+                if ie & 0x8000:
+                    offset += enterprise_number.size
+                fields.append((ie & 0x7fff, length))
+            layout = compile_template(fields)
+            if layout is not None and layout.size == 0:
+                # no fields (or only zero length ones): data sets can't be split into records
+                self.templates.pop(key+(tid,), None)
+                c["empty_templates"] += 1
+                continue
+            self.templates[key+(tid,)] = layout
+            c["templates"] += 1
+
+    def decode(self, msg, peer):
+        # decode one IPFIX message, returns the number of data records
+        c = self.counters
+        if len(msg) < msg_header.size:
+            c["malformed"] += 1
+            return 0
+        (version, length, export_time, seq, domain) = msg_header.unpack_from(msg, 0)
+        if version != 10 or length > len(msg):
+            c["malformed"] += 1
+            return 0
+        key = (peer, domain)
+        records = 0
+        known = True
+        offset = msg_header.size
+        while offset + set_header.size <= length:
+            (set_id, set_length) = set_header.unpack_from(msg, offset)
+            end = offset + set_length
+            if set_length < set_header.size or end > length:
+                c["malformed"] += 1
+                break
+            body = offset + set_header.size
+            if set_id == TEMPLATE_SET or set_id == OPTIONS_TEMPLATE_SET:
+                self.parse_templates(msg, body, end, key, set_id == OPTIONS_TEMPLATE_SET)
+            elif set_id >= 256:
+                layout = self.templates.get(key+(set_id,))
+                if layout is None:
+                    # no (usable) template yet, the record count is unknown
+                    c["unknown"] += 1
+                    known = False
+                else:
+                    n = (end - body)//layout.size
+                    for record in layout.iter_unpack(msg[body:body+n*layout.size]):
+                        pass
+                    records += n
+            offset = end
+
+        # the sequence number counts the data records exported before this message
+        expected = self.next_seq.get(key)
+        if expected is not None and seq != expected:
+            missing = (seq - expected) & 0xffffffff
+            if missing < 0x80000000:
+                c["lost"] += missing
+                c["gaps"] += 1
+            else:
+                c["reordered"] += 1
+        self.next_seq[key] = (seq + records) & 0xffffffff if known else None
+
+        c["messages"] += 1
+        c["records"] += records
+        c["bytes"] += length
+        return records
+
+
+# ---- workers -----------------------------------------------------------------
+
+def open_socket(addr, port, rcvbuf):
+    family = socket.AF_INET6 if ":" in addr else socket.AF_INET
+    sock = socket.socket(family, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    if rcvbuf:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, rcvbuf)
+    sock.bind((addr, port))
+    return sock
+
+
+def worker(wid, args, reports, stop):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    sock = open_socket(args.address, args.port, args.rcvbuf)
+    receiver = BatchReceiver(sock, args.batch)
+    collector = Collector()
+    c = collector.counters
+    poller = select.poll()
+    poller.register(sock, select.POLLIN)
+    last = time.time()
+    while not stop.is_set():
+        if poller.poll(100):
+            n = receiver.receive()
+            while n > 0:
+                start = time.perf_counter_ns()
+                for i in range(n):
+                    collector.decode(receiver.message(i), receiver.peers[i])
+                c["decode_ns"] += time.perf_counter_ns() - start
+                n = receiver.receive() if n == args.batch else 0
+        now = time.time()
+        if now - last >= args.interval:
+            reports.put((wid, now, dict(c)))
+            last = now
+    reports.put((wid, time.time(), dict(c)))
+    sock.close()
+
+
+# ---- reporting ---------------------------------------------------------------
+
+def print_stats(prefix, delta, seconds):
+    msgs = delta["messages"]
+    decode = delta["decode_ns"]/msgs if msgs else 0
+    print("[IPFIX Collector] %s: %.3f Krec/s, %.3f Kmsg/s, %.2f Mbit/s, lost %d records (%d gaps, %d reordered), %d malformed, decode %.0f ns/msg"
+          % (prefix, delta["records"]/seconds/1e3, msgs/seconds/1e3, delta["bytes"]*8/seconds/1e6,
+             delta["lost"], delta["gaps"], delta["reordered"], delta["malformed"], decode))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="IPFIX collector for benchmarking ipfix-generation.lua")
+    parser.add_argument("-a", '--address', help='address to listen on (default=0.0.0.0)', default="0.0.0.0")
+    parser.add_argument("-p", '--port', help='udp port (default=4739)', type=int, default=IPFIX_PORT)
+    parser.add_argument("-w", '--workers', help='number of receiving processes (default=1)', type=int, default=1)
+    parser.add_argument("-b", '--batch', help='datagrams per recvmmsg call (default=64)', type=int, default=64)
+    parser.add_argument("-r", '--rcvbuf', help='socket receive buffer in bytes', type=int, default=0)
+    parser.add_argument("-i", '--interval', help='report interval in seconds (default=1)', type=float, default=1.0)
+    parser.add_argument("-t", '--time', help='stop after this many seconds (default: run until ctrl-c)', type=float, default=0)
+    parser.add_argument("-f", '--file', help='also write the per-interval stats to this csv file')
+    args = parser.parse_args()
+
+    if not recvmmsg:
+        print("WARNING: recvmmsg() not available, falling back to single datagram reads", file=sys.stderr)
+
+    reports = multiprocessing.Queue()
+    stop = multiprocessing.Event()
+    workers = [multiprocessing.Process(target=worker, args=(i, args, reports, stop)) for i in range(args.workers)]
+    for w in workers:
+        w.start()
+    print("listening on "+args.address+":"+str(args.port)+" with "+str(args.workers)+" worker(s)", file=sys.stderr)
+
+    csv = None
+    if args.file:
+        csv = open(args.file, 'w')
+        csv.write("time,"+",".join(counter_names)+"\n")
+
+    start = time.time()
+    totals = {}
+    previous = dict.fromkeys(counter_names, 0)
+    last = start
+    finished = 0
+    try:
+        while finished < len(workers):
+            try:
+                (wid, ts, counters) = reports.get(timeout=args.interval)
+                totals[wid] = counters
+            except Exception:
+                pass
+            now = time.time()
+            if args.time and now - start >= args.time and not stop.is_set():
+                stop.set()
+            if stop.is_set():
+                finished = sum(not w.is_alive() for w in workers)
+            if now - last >= args.interval:
+                current = {k: sum(t[k] for t in totals.values()) for k in counter_names}
+                delta = {k: current[k] - previous[k] for k in counter_names}
+                print_stats("interval", delta, now - last)
+                if csv:
+                    csv.write(("%.3f," % (now - start))+",".join(str(delta[k]) for k in counter_names)+"\n")
+                    csv.flush()
+                previous = current
+                last = now
+    except KeyboardInterrupt:
+        stop.set()
+
+    for w in workers:
+        w.join()
+    while not reports.empty():
+        (wid, ts, counters) = reports.get()
+        totals[wid] = counters
+    current = {k: sum(t[k] for t in totals.values()) for k in counter_names}
+    print_stats("total", current, time.time() - start)
+    print("[IPFIX Collector] templates: %d, empty templates skipped: %d, data sets without template: %d"
+          % (current["templates"], current["empty_templates"], current["unknown"]))
+    if csv:
+        csv.close()
+
+
+if __name__ == "__main__":
+    main()
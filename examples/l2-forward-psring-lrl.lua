@@ -9,9 +9,15 @@ local pipe    = require "pipe"
 local ffi     = require "ffi"
 local libmoon = require "libmoon"
 local histogram = require "histogram"
+local profile = require "task-profile"
+local trace   = require "phase-trace"
+local statsShm = require "stats-shm"
+local sojournTrace = require "sojourn-trace"
 --local bit64   = require "bit64"
 
 local PKT_SIZE	= 60
+-- mbufs of an rx mempool besides the delay line: rx/tx descriptors and bufArrays in flight
+local POOL_SLACK = 4096 + 1024
 
 function configure(parser)
 	parser:description("Forward traffic between interfaces with moongen rate control")
@@ -21,29 +27,17 @@ function configure(parser)
 	parser:option("-l --latency", "Fixed emulated latency (in ms) on the link."):args(2):convert(tonumber):default({0,0})
 	parser:option("-q --queuedepth", "Maximum number of packets to hold in the delay line"):args(2):convert(tonumber):default({0,0})
 	parser:option("-o --loss", "Rate of packet drops"):args(2):convert(tonumber):default({0,0})
+	parser:option("--profile", "Profile the tasks with the LuaJIT sampler: start after <delay> s, stop after <duration> s."):args(2):convert(tonumber)
+	parser:option("--profile-tasks", "Only profile these tasks (forward, receive)."):args("*")
+	parser:option("--stats-shm", "Publish per-task counters and queueing latency into this shared-memory stats ring, e.g. /dev/shm/moongen-stats."):args(1)
+	parser:option("--sojourn-trace", "Write a per-packet sojourn trace (scripts/mgsojourn.py) to this file, recording one in <sample> packets (default 100)."):args("1-2")
 	return parser:parse()
 end
 
 
 function master(args)
-	-- configure devices
-	for i, dev in ipairs(args.dev) do
-		args.dev[i] = device.config{
-			port = dev,
-			txQueues = args.threads,
-			rxQueues = args.threads,
-			rssQueues = 0,
-			rssFunctions = {},
-			--rxDescs = 4096,
-			dropEnable = true,
-			disableOffloads = true
-		}
-	end
-	device.waitForLinks()
-
-	-- print stats
-	stats.startStatsTask{devices = args.dev}
-	
+	-- startup phases for the bring-up trace (emulab/mgtrace.py)
+	trace.instant("master")
 	-- create the ring buffers
 	-- should set the size here, based on the line speed and latency, and maybe desired queue depth
 	local qdepth1 = args.queuedepth[1]
@@ -65,19 +59,65 @@ function master(args)
 	local ring1 = pipe:newPktsizedRing(qdepth1)
 	local ring2 = pipe:newPktsizedRing(qdepth2)
 
+	-- the rx mempool of a port holds the delay line it feeds (dev 2 feeds ring1, dev 1 ring2),
+	-- every packet in the ring keeps its mbuf.  emulab/mghuge.py budgets the hugepages the same way
+	local poolBufs = {qdepth2 + POOL_SLACK, qdepth1 + POOL_SLACK}
+	if args.dev[1] == args.dev[2] then
+		poolBufs[1] = math.max(poolBufs[1], poolBufs[2])
+		poolBufs[2] = poolBufs[1]
+	end
+
+	-- configure devices
+	trace.begin("configure-devices")
+	for i, dev in ipairs(args.dev) do
+		args.dev[i] = device.config{
+			port = dev,
+			txQueues = args.threads,
+			rxQueues = args.threads,
+			rssQueues = 0,
+			rssFunctions = {},
+			--rxDescs = 4096,
+			numBufs = poolBufs[i],
+			dropEnable = true,
+			disableOffloads = true
+		}
+	end
+	trace.finish("configure-devices")
+	trace.begin("wait-links")
+	device.waitForLinks()
+	trace.finish("wait-links")
+
+	-- print stats
+	stats.startStatsTask{devices = args.dev}
+
+	-- one stats source per task
+	local statsIdx = 0
+	if args.stats_shm then
+		statsShm:create(args.stats_shm, args.threads * (args.dev[1] ~= args.dev[2] and 4 or 2))
+	end
+	-- the trace has one source per task too, with the same index
+	local tracePath = args.sojourn_trace and args.sojourn_trace[1]
+	if tracePath then
+		sojournTrace:create(tracePath, args.threads * (args.dev[1] ~= args.dev[2] and 4 or 2), tonumber(args.sojourn_trace[2]))
+	end
+
 	-- start the forwarding tasks
 	for i = 1, args.threads do
-		mg.startTask("forward", ring1, args.dev[1]:getTxQueue(i - 1), args.dev[1], args.rate[1], args.latency[1], args.loss[1])
+		mg.startTask("forward", ring1, args.dev[1]:getTxQueue(i - 1), args.dev[1], args.rate[1], args.latency[1], args.loss[1], args.profile, args.profile_tasks, args.stats_shm, statsIdx, tracePath, qdepth1)
+		statsIdx = statsIdx + 1
 		if args.dev[1] ~= args.dev[2] then
-			mg.startTask("forward", ring2, args.dev[2]:getTxQueue(i - 1), args.dev[2], args.rate[2], args.latency[2], args.loss[2])
+			mg.startTask("forward", ring2, args.dev[2]:getTxQueue(i - 1), args.dev[2], args.rate[2], args.latency[2], args.loss[2], args.profile, args.profile_tasks, args.stats_shm, statsIdx, tracePath, qdepth2)
+			statsIdx = statsIdx + 1
 		end
 	end
 
 	-- start the receiving/latency tasks
 	for i = 1, args.threads do
-		mg.startTask("receive", ring1, args.dev[2]:getRxQueue(i - 1), args.dev[2])
+		mg.startTask("receive", ring1, args.dev[2]:getRxQueue(i - 1), args.dev[2], args.profile, args.profile_tasks, args.stats_shm, statsIdx, tracePath, qdepth1, args.rate[1], args.latency[1])
+		statsIdx = statsIdx + 1
 		if args.dev[1] ~= args.dev[2] then
-			mg.startTask("receive", ring2, args.dev[1]:getRxQueue(i - 1), args.dev[1])
+			mg.startTask("receive", ring2, args.dev[1]:getRxQueue(i - 1), args.dev[1], args.profile, args.profile_tasks, args.stats_shm, statsIdx, tracePath, qdepth2, args.rate[2], args.latency[2])
+			statsIdx = statsIdx + 1
 		end
 	end
 
@@ -85,7 +125,7 @@ function master(args)
 end
 
 
-function receive(ring, rxQueue, rxDev)
+function receive(ring, rxQueue, rxDev, profWindow, profTasks, statsPath, statsIdx, tracePath, qdepth, rate, latency)
 	--print("receive thread...")
 
 	local bufs = memory.createBufArray()
@@ -93,7 +133,19 @@ function receive(ring, rxQueue, rxDev)
 	local count_hist = histogram:new()
 	local ringsize_hist = histogram:new()
 	local ringbytes_hist = histogram:new()
+	local prof = profile:new("receive-"..rxDev["id"].."-"..rxQueue.qid, profWindow, profTasks)
+	local profiling = prof.enabled
+	local PROF_ENQUEUE = prof:counter("ring-enqueue")
+	local shm = statsShm:source(statsPath, statsIdx, "receive-"..rxDev["id"].."-"..rxQueue.qid)
+	local publishing = shm.enabled
+	local rxPkts, rxBytes = 0, 0
+	-- sampled packets that don't fit into the delay line
+	local tr = sojournTrace:source(tracePath, statsIdx, "receive-"..rxDev["id"].."-"..rxQueue.qid,
+		{ latency = latency, rate = rate, capacity = qdepth, unit = sojournTrace.PACKETS })
+	local tracing = tr.enabled
+	trace.instant("receiving", prof.name)
 	while mg.running() do
+		if profiling then prof:poll() end
 		count = rxQueue:recv(bufs)
 		count_hist:update(count)
 		--print("receive thread count="..count)
@@ -102,20 +154,41 @@ function receive(ring, rxQueue, rxDev)
 			local ts = limiter:get_tsc_cycles()
 			buf.udata64 = ts
 			--print("RXRX arrival: ", bit64.tohex(buf.udata64))
+			if publishing then rxBytes = rxBytes + buf.pkt_len end
+		end
+		if publishing then
+			rxPkts = rxPkts + count
+			if shm:due() then shm:counters(rxPkts, rxBytes, 0, 0, 0) end
 		end
 		if count > 0 then
+			if tracing then
+				-- the ring drops what does not fit into its free space, inferred from the packets in it before the enqueue
+				local used = pipe:countPktsizedRing(ring.ring)
+				for iix=1,count do
+					local buf = bufs[iix]
+					local fits = used < qdepth
+					if fits then used = used + 1 end
+					if tr:sampled() and not fits then
+						tr:record(buf.udata64, 0, 0, used, buf.pkt_len, sojournTrace.OVERFLOW)
+					end
+				end
+			end
+			local enq_start = profiling and limiter:get_tsc_cycles()
 			pipe:sendToPktsizedRing(ring.ring, bufs, count)
+			if profiling then prof:add(PROF_ENQUEUE, limiter:get_tsc_cycles() - enq_start) end
 			--print("ring count: ",pipe:countPacketRing(ring.ring))
 			ringsize_hist:update(pipe:countPktsizedRing(ring.ring))
 		end
 	end
+	prof:stop()
+	tr:close()
 	count_hist:print()
 	count_hist:save("rxq-pkt-count-distribution-histogram-"..rxDev["id"]..".csv")
 	ringsize_hist:print()
 	ringsize_hist:save("rxq-ringsize-distribution-histogram-"..rxDev["id"]..".csv")
 end
 
-function forward(ring, txQueue, txDev, rate, latency, lossrate)
+function forward(ring, txQueue, txDev, rate, latency, lossrate, profWindow, profTasks, statsPath, statsIdx, tracePath, qdepth)
 	print("forward with rate "..rate.." and latency "..latency.." and loss rate "..lossrate)
 	local numThreads = 1
 	
@@ -130,9 +203,38 @@ function forward(ring, txQueue, txDev, rate, latency, lossrate)
 	local bufs = memory.createBufArray()  --memory:bufArray()  --(128)
 	local count = 0
 
+	local prof = profile:new("forward-"..txDev["id"].."-"..txQueue.qid, profWindow, profTasks)
+	local profiling = prof.enabled
+	local PROF_DEQUEUE = prof:counter("ring-dequeue")
+	local PROF_WAIT = prof:counter("latency-busy-wait")
+	local PROF_SEND = prof:counter("send")
+
+	-- counters and the queueing latency (arrival to send) of the current stats interval
+	local shm = statsShm:source(statsPath, statsIdx, "forward-"..txDev["id"].."-"..txQueue.qid)
+	local publishing = shm.enabled
+	local ns_per_cycle = 1e9 / tsc_hz
+	local txPkts, txBytes = 0, 0
+	local latN, latSum, latSumSq, latMin, latMax = 0, 0, 0, math.huge, 0
+
+	-- sampled packets with their arrival, dequeue and send time
+	local tr = sojournTrace:source(tracePath, statsIdx, "forward-"..txDev["id"].."-"..txQueue.qid,
+		{ latency = latency, rate = rate, capacity = qdepth, unit = sojournTrace.PACKETS })
+	local tracing = tr.enabled
+	local lost = tracing and ffi.new("uint8_t[?]", bufs.size) or nil
+	local trSampled, trEnqueue, trSend, trLen = {}, {}, {}, {}
+	local deq_time, occupancy = 0, 0
+
+	trace.instant("forwarding", prof.name)
 	while mg.running() do
+		local deq_start = profiling and limiter:get_tsc_cycles()
+		if profiling then prof:poll(deq_start) end
 		-- receive one or more packets from the queue
 		count = pipe:recvFromPktsizedRing(ring.ring, bufs, 1)
+		if profiling then prof:add(PROF_DEQUEUE, limiter:get_tsc_cycles() - deq_start) end
+		if tracing and count > 0 then
+			deq_time = limiter:get_tsc_cycles()
+			occupancy = pipe:countPktsizedRing(ring.ring)
+		end
 
 		for iix=1,count do
 			local buf = bufs[iix]
@@ -146,11 +248,32 @@ function forward(ring, txQueue, txDev, rate, latency, lossrate)
 
 			-- spin/wait until it is time to send this frame
 			-- this does not allow reordering of frames
+			local wait_start = profiling and limiter:get_tsc_cycles()
 			while limiter:get_tsc_cycles() < send_time do
 				if not mg.running() then
+					prof:stop()
+					tr:close()
 					return
 				end
 			end
+			if profiling then prof:add(PROF_WAIT, limiter:get_tsc_cycles() - wait_start) end
+			if tracing then
+				trSampled[iix] = tr:sampled()
+				if trSampled[iix] then
+					trEnqueue[iix] = arrival_timestamp
+					trSend[iix] = limiter:get_tsc_cycles()
+					trLen[iix] = buf.pkt_len
+				end
+			end
+			if publishing then
+				local sojourn = tonumber(limiter:get_tsc_cycles() - arrival_timestamp) * ns_per_cycle
+				latN = latN + 1
+				latSum = latSum + sojourn
+				latSumSq = latSumSq + sojourn * sojourn
+				if sojourn < latMin then latMin = sojourn end
+				if sojourn > latMax then latMax = sojourn end
+				txBytes = txBytes + buf.pkt_len
+			end
 			
 			local pktSize = buf.pkt_len + 24
 			--print("TXTX set delay: ", (pktSize) * (linkspeed/rate - 1))
@@ -158,9 +281,33 @@ function forward(ring, txQueue, txDev, rate, latency, lossrate)
 		end
 
 		if count > 0 then
+			local send_start = profiling and limiter:get_tsc_cycles()
 			-- the rate here doesn't affect the result afaict.  It's just to help decide the size of the bad pkts
-			txQueue:sendWithDelayLoss(bufs, rate * numThreads, lossrate, count)
+			txQueue:sendWithDelayLoss(bufs, rate * numThreads, lossrate, count, lost)
+			if profiling then prof:add(PROF_SEND, limiter:get_tsc_cycles() - send_start) end
+			if tracing then
+				for iix=1,count do
+					if trSampled[iix] then
+						tr:record(trEnqueue[iix], deq_time, trSend[iix], occupancy, trLen[iix],
+							lost[iix - 1] == 1 and sojournTrace.LOSS or sojournTrace.SENT)
+					end
+				end
+			end
+		end
+
+		if publishing then
+			txPkts = txPkts + count
+			if shm:due() then
+				shm:counters(0, 0, txPkts, txBytes, 0)
+				if latN > 0 then
+					local mean = latSum / latN
+					shm:latency(latN, mean, latSumSq / latN - mean * mean, latMin, latMax)
+				end
+				latN, latSum, latSumSq, latMin, latMax = 0, 0, 0, math.huge, 0
+			end
 		end
 	end
+	prof:stop()
+	tr:close()
 end
 
@@ -8,8 +8,9 @@ local histogram = require "histogram"
 local stats  = require "stats"
 local log    = require "log"
 local timer		= require "timer"
-
--- local limiter = require "software-ratecontrol"
+local limiter	= require "software-ratecontrol"
+local profile	= require "task-profile"
+local trace		= require "phase-trace"
 
 function configure(parser)
 	parser:description("Forward traffic between interfaces with moongen rate control")
@@ -17,11 +18,16 @@ function configure(parser)
 	--parser:option("-r --rate", "Transmit rate in Mpps."):args(1):default(2):convert(tonumber)
 	parser:argument("rate", "Forwarding rates in Mbps (two values for two links)"):args(2):convert(tonumber)
 	parser:option("-t --threads", "Number of threads per forwarding direction using RSS."):args(1):convert(tonumber):default(1)
+	parser:option("--profile", "Profile the tasks with the LuaJIT sampler: start after <delay> s, stop after <duration> s."):args(2):convert(tonumber)
+	parser:option("--profile-tasks", "Only profile these tasks (forward)."):args("*")
 	return parser:parse()
 end
 
 function master(args)
+	-- startup phases for the bring-up trace (emulab/mgtrace.py)
+	trace.instant("master")
 	-- configure devices
+	trace.begin("configure-devices")
 	for i, dev in ipairs(args.dev) do
 		args.dev[i] = device.config{
 			port = dev,
@@ -34,7 +40,10 @@ function master(args)
 			disableOffloads = true
 		}
 	end
+	trace.finish("configure-devices")
+	trace.begin("wait-links")
 	device.waitForLinks()
+	trace.finish("wait-links")
 
 	-- print stats
 	stats.startStatsTask{devices = args.dev}
@@ -43,16 +52,16 @@ function master(args)
 	for i = 1, args.threads do
 		print("dev is ",tonumber(args.dev[1]["id"]))
 		--rateLimiter1 = limiter:new(args.dev[2]:getTxQueue(i - 1), "cbr", 1 / args.rate[1] * 1000)
-		mg.startTask("forward", args.dev[1]:getRxQueue(i - 1), args.dev[2]:getTxQueue(i - 1), args.dev[2], args.rate[1])
+		mg.startTask("forward", args.dev[1]:getRxQueue(i - 1), args.dev[2]:getTxQueue(i - 1), args.dev[2], args.rate[1], args.profile, args.profile_tasks)
 		-- bidirectional fowarding only if two different devices where passed
 		if args.dev[1] ~= args.dev[2] then
-			mg.startTask("forward", args.dev[2]:getRxQueue(i - 1), args.dev[1]:getTxQueue(i - 1), args.dev[1], args.rate[2])
+			mg.startTask("forward", args.dev[2]:getRxQueue(i - 1), args.dev[1]:getTxQueue(i - 1), args.dev[1], args.rate[2], args.profile, args.profile_tasks)
 		end
 	end
 	mg.waitForTasks()
 end
 
-function forward(rxQueue, txQueue, txDev, rate)
+function forward(rxQueue, txQueue, txDev, rate, profWindow, profTasks)
 	print("forward with rate "..rate)
 	local ETH_DST	= "11:12:13:14:15:16"
 	local pattern = "cbr"
@@ -67,9 +76,21 @@ function forward(rxQueue, txQueue, txDev, rate)
 	-- larger batch size is useful when sending it through a rate limiter
 	local bufs = memory.createBufArray()  --memory:bufArray()  --(128)
 	local dist = pattern == "poisson" and poissonDelay or function(x) return x end
+
+	local prof = profile:new("forward-"..tonumber(txDev["id"]).."-"..txQueue.qid, profWindow, profTasks)
+	local profiling = prof.enabled
+	local PROF_RECV = prof:counter("recv")
+	local PROF_DELAY = prof:counter("set-delay")
+	local PROF_SEND = prof:counter("send")
+
+	trace.instant("forwarding", prof.name)
 	while mg.running() do
+		local recv_start = profiling and limiter:get_tsc_cycles()
+		if profiling then prof:poll(recv_start) end
 		-- receive one or more packets from the queue
 		local count = rxQueue:recv(bufs)
+		local delay_start = profiling and limiter:get_tsc_cycles()
+		if profiling then prof:add(PROF_RECV, delay_start - recv_start) end
 
 		count_hist:update(count)
 
@@ -109,10 +130,15 @@ function forward(rxQueue, txQueue, txDev, rate)
 			end
 		end
 
+		local send_start = profiling and limiter:get_tsc_cycles()
+		if profiling then prof:add(PROF_DELAY, send_start - delay_start) end
+
 		-- the rate here doesn't affect the result afaict.  It's just to help decide the size of the bad pkts
 		txQueue:sendWithDelay(bufs, rate * numThreads, count)
 		--txQueue:sendWithDelay(bufs)
+		if profiling then prof:add(PROF_SEND, limiter:get_tsc_cycles() - send_start) end
 	end
+	prof:stop()
 	
 	count_hist:print()
 	count_hist:save("pkt-count-distribution-histogram-"..tonumber(txDev["id"])..".csv")
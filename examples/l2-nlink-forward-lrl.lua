@@ -0,0 +1,280 @@
+--- Emulate N links between N pairs of ports on one node.
+--- Every link has its own rate, latency, loss rate and queue.  A link without
+--- latency is forwarded with CRC rate control like l2-forward-rate-crc.lua,
+--- a link with latency gets a delay line per direction like
+--- l2-forward-bsring-lrl.lua (byte-sized ring, -q 0) or
+--- l2-forward-psring-lrl.lua (packet-sized ring of -q packets).
+---
+--- Every one of the 2N directions gets its own worker task and core: the CRC
+--- rate control keeps a core busy sending filler frames at line rate whatever
+--- the link rate, so directions can not share one.  -c pins the workers to
+--- given cores (e.g. on the NUMA node of their ports), otherwise they take the
+--- next free ones.
+---
+---   l2-nlink-forward-lrl.lua -d 0 1 2 3 4 5 -r 1000 500 100 -l 10 0 50 -q 0 0 500
+---   l2-nlink-forward-lrl.lua -d 0 1 2 3 -r 1000 100 -c 2 3 10 11
+local mg      = require "moongen"
+local memory  = require "memory"
+local device  = require "device"
+local stats   = require "stats"
+local log     = require "log"
+local limiter = require "software-ratecontrol"
+local pipe    = require "pipe"
+local libmoon = require "libmoon"
+local profile = require "task-profile"
+local trace   = require "phase-trace"
+local statsShm = require "stats-shm"
+
+local RING_NONE, RING_BYTES, RING_PKTS = 0, 1, 2
+-- smallest frame the byte-sized rings account for, and the mbufs of an rx
+-- mempool besides the delay line (descriptors and bufArrays in flight)
+local PKT_SIZE = 60
+local POOL_SLACK = 4096 + 1024
+
+function configure(parser)
+	parser:description("Emulate links with rate control, latency and loss between N pairs of interfaces")
+	parser:option("-d --dev", "Devices to use, two per link."):args("+"):convert(tonumber)
+	parser:option("-r --rate", "Forwarding rate of every link in Mbps (one value for all links)."):args("+"):convert(tonumber)
+	parser:option("-l --latency", "Fixed emulated latency (in ms) of every link."):args("+"):convert(tonumber):default({0})
+	parser:option("-q --queuedepth", "Packets in the delay line of every link, 0 to size a byte-sized ring from rate and latency."):args("+"):convert(tonumber):default({0})
+	parser:option("-o --loss", "Rate of packet drops of every link."):args("+"):convert(tonumber):default({0})
+	parser:option("-x --extraqueue", "For automatic queue depth, allocate this number of extra bytes in the queue."):args("+"):convert(tonumber):default({20000})
+	parser:option("-c --worker-cores", "Cores of the workers, one per direction in the order of -d (a>b, b>a of every link), default the next free cores."):args("+"):convert(tonumber):target("worker_cores")
+	parser:option("--profile", "Profile the tasks with the LuaJIT sampler: start after <delay> s, stop after <duration> s."):args(2):convert(tonumber)
+	parser:option("--profile-tasks", "Only profile these tasks (worker)."):args("*")
+	parser:option("--stats-shm", "Publish per-task counters and queueing latency into this shared-memory stats ring, e.g. /dev/shm/moongen-stats."):args(1)
+	return parser:parse()
+end
+
+-- one value per link, the last value is repeated
+local function perLink(values, n)
+	local res = {}
+	for i = 1, n do
+		res[i] = values[math.min(i, #values)]
+	end
+	return res
+end
+
+-- bytes of a byte-sized delay line, the same sizing as l2-forward-bsring-lrl.lua
+local function ringBytes(rate, latency, extra)
+	return math.max(math.floor((latency * rate * 1000) / 8) + extra, 3000)
+end
+
+local function newRing(rate, latency, queue, extra)
+	if latency == 0 then
+		return false, RING_NONE
+	end
+	if queue > 0 then
+		return pipe:newPktsizedRing(queue), RING_PKTS
+	end
+	return pipe:newBytesizedRing(ringBytes(rate, latency, extra)), RING_BYTES
+end
+
+-- mbufs of the rx mempool of a port: every packet in the delay line it feeds keeps its mbuf
+-- (emulab/mghuge.py budgets the hugepages the same way)
+local function poolBufs(rate, latency, queue, extra)
+	if latency == 0 then
+		return POOL_SLACK
+	elseif queue > 0 then
+		return queue + POOL_SLACK
+	end
+	return math.ceil(ringBytes(rate, latency, extra) / PKT_SIZE) + POOL_SLACK
+end
+
+function master(args)
+	if not args.dev or #args.dev < 2 or #args.dev % 2 ~= 0 then
+		log:fatal("Need an even number of devices, two per link")
+	end
+	if not args.rate then
+		log:fatal("Need the rate of the links (-r)")
+	end
+	local numLinks = #args.dev / 2
+	local rate = perLink(args.rate, numLinks)
+	local latency = perLink(args.latency, numLinks)
+	local queue = perLink(args.queuedepth, numLinks)
+	local loss = perLink(args.loss, numLinks)
+	local extra = perLink(args.extraqueue, numLinks)
+
+	-- startup phases for the bring-up trace (emulab/mgtrace.py)
+	trace.instant("master")
+	-- configure devices, one queue per port: every port is the ingress of one direction and the egress of the other
+	trace.begin("configure-devices")
+	for i, dev in ipairs(args.dev) do
+		local k = math.ceil(i / 2)
+		args.dev[i] = device.config{
+			port = dev,
+			txQueues = 1,
+			rxQueues = 1,
+			rssQueues = 0,
+			rssFunctions = {},
+			numBufs = poolBufs(rate[k], latency[k], queue[k], extra[k]),
+			dropEnable = true,
+			disableOffloads = true
+		}
+	end
+	trace.finish("configure-devices")
+	trace.begin("wait-links")
+	device.waitForLinks()
+	trace.finish("wait-links")
+
+	-- print stats
+	stats.startStatsTask{devices = args.dev}
+
+	-- both directions of every link, each with its own delay line
+	local dirs = {}
+	for k = 1, numLinks do
+		local a, b = args.dev[2 * k - 1], args.dev[2 * k]
+		for _, pair in ipairs({{a, b}, {b, a}}) do
+			local ring, kind = newRing(rate[k], latency[k], queue[k], extra[k])
+			table.insert(dirs, {
+				rx = pair[1], tx = pair[2], ring = ring, kind = kind,
+				rate = rate[k], latency = latency[k], loss = loss[k],
+			})
+		end
+	end
+
+	-- a worker per direction, on the given cores or the next free ones
+	if args.worker_cores and #args.worker_cores ~= #dirs then
+		log:fatal("Need one core per direction (%d), got %d", #dirs, #args.worker_cores)
+	end
+	if args.stats_shm then
+		statsShm:create(args.stats_shm, #dirs)
+	end
+	for w, d in ipairs(dirs) do
+		local dirArgs = {w, args.profile, args.profile_tasks, args.stats_shm, w - 1,
+			d.rx:getRxQueue(0), d.tx:getTxQueue(0), d.tx, d.ring, d.kind, d.rate, d.latency, d.loss}
+		if args.worker_cores then
+			log:info("Worker %d: %s>%s on core %d", w, d.rx["id"], d.tx["id"], args.worker_cores[w])
+			mg.startTaskOnCore(args.worker_cores[w], "worker", unpack(dirArgs))
+		else
+			log:info("Worker %d: %s>%s", w, d.rx["id"], d.tx["id"])
+			mg.startTask("worker", unpack(dirArgs))
+		end
+	end
+
+	mg.waitForTasks()
+end
+
+--- Forward one direction.
+--- A direction without latency is received and sent in bursts, one with
+--- latency is timestamped into its delay line, taken off the line a burst at
+--- a time and every packet whose latency has passed is sent in one burst.  The sends block until the filler frames of
+--- the CRC rate control are on the wire, and the filler delay left over from
+--- one send is kept per thread, so a worker must not serve a second queue.
+function worker(id, profWindow, profTasks, statsPath, statsIdx, rxQueue, txQueue, txDev, ring, kind, rate, latency, loss)
+	local tsc_hz = libmoon:getCyclesFrequency()
+	local tsc_hz_ms = tsc_hz / 1000
+
+	local d = {
+		rxQueue = rxQueue, txQueue = txQueue, txDev = txDev, ring = ring,
+		kind = kind, rate = rate, latency = latency, loss = loss,
+	}
+	d.linkspeed = d.txDev:getLinkStatus().speed
+	d.bufs = memory.createBufArray()
+	-- packets taken off the delay line, d.line[d.next] to d.line[d.held] are not due yet
+	d.line = memory.createBufArray()
+	d.held = 0
+	d.next = 1
+	d.delay = d.latency * tsc_hz_ms
+	print("worker "..id.." forwards "..tostring(d.rxQueue.id).." > "..tostring(d.txDev["id"]).." with rate "..d.rate.." and latency "..d.latency.." and loss rate "..d.loss)
+
+	local prof = profile:new("worker-"..id, profWindow, profTasks)
+	local profiling = prof.enabled
+	local PROF_RECV = prof:counter("recv")
+	local PROF_RING = prof:counter("ring")
+	local PROF_SEND = prof:counter("send")
+
+	local shm = statsShm:source(statsPath, statsIdx, "worker-"..id)
+	local publishing = shm.enabled
+	local ns_per_cycle = 1e9 / tsc_hz
+	local rxPkts, rxBytes, txPkts, txBytes = 0, 0, 0, 0
+	local latN, latSum, latSumSq, latMin, latMax = 0, 0, 0, math.huge, 0
+
+	trace.instant("forwarding", prof.name)
+	while mg.running() do
+		local recv_start = profiling and limiter:get_tsc_cycles()
+		if profiling then prof:poll(recv_start) end
+		local count = d.rxQueue:tryRecv(d.bufs, 0)
+		local recv_end = profiling and limiter:get_tsc_cycles()
+		if profiling then prof:add(PROF_RECV, recv_end - recv_start) end
+		if publishing and count > 0 then
+			rxPkts = rxPkts + count
+			for iix = 1, count do rxBytes = rxBytes + d.bufs[iix].pkt_len end
+		end
+
+		if d.kind == RING_NONE then
+			if count > 0 then
+				for iix = 1, count do
+					local buf = d.bufs[iix]
+					buf:setDelay((buf.pkt_len + 24) * (d.linkspeed / d.rate - 1))
+					if publishing then txBytes = txBytes + buf.pkt_len end
+				end
+				-- the rate here only decides the size of the bad pkts
+				d.txQueue:sendWithDelayLoss(d.bufs, d.rate, d.loss, count)
+				if profiling then prof:add(PROF_SEND, limiter:get_tsc_cycles() - recv_end) end
+				if publishing then txPkts = txPkts + count end
+			end
+		else
+			if count > 0 then
+				local now = limiter:get_tsc_cycles()
+				for iix = 1, count do
+					d.bufs[iix].udata64 = now
+				end
+				if d.kind == RING_BYTES then
+					pipe:sendToBytesizedRing(d.ring.ring, d.bufs, count)
+				else
+					pipe:sendToPktsizedRing(d.ring.ring, d.bufs, count)
+				end
+			end
+			if d.next > d.held then
+				if d.kind == RING_BYTES then
+					d.held = pipe:recvFromBytesizedRing(d.ring.ring, d.line, d.line.size)
+				else
+					d.held = pipe:recvFromPktsizedRing(d.ring.ring, d.line, d.line.size)
+				end
+				d.next = 1
+			end
+			local ring_end = profiling and limiter:get_tsc_cycles()
+			if profiling then prof:add(PROF_RING, ring_end - recv_end) end
+			-- send everything whose latency has passed in one burst, the rest stays held
+			-- (the line is in arrival order, so the first packet not due ends the burst)
+			local now = limiter:get_tsc_cycles()
+			local n = 0
+			while d.next <= d.held do
+				local buf = d.line[d.next]
+				if now < buf.udata64 + d.delay then
+					break
+				end
+				if publishing then
+					local sojourn = tonumber(now - buf.udata64) * ns_per_cycle
+					latN = latN + 1
+					latSum = latSum + sojourn
+					latSumSq = latSumSq + sojourn * sojourn
+					if sojourn < latMin then latMin = sojourn end
+					if sojourn > latMax then latMax = sojourn end
+					txBytes = txBytes + buf.pkt_len
+				end
+				buf:setDelay((buf.pkt_len + 24) * (d.linkspeed / d.rate - 1))
+				-- the received packets are in the ring already, reuse their array for the burst
+				d.bufs.array[n] = d.line.array[d.next - 1]
+				n = n + 1
+				d.next = d.next + 1
+			end
+			if n > 0 then
+				d.txQueue:sendWithDelayLoss(d.bufs, d.rate, d.loss, n)
+				if profiling then prof:add(PROF_SEND, limiter:get_tsc_cycles() - now) end
+				if publishing then txPkts = txPkts + n end
+			end
+		end
+
+		if publishing and shm:due() then
+			shm:counters(rxPkts, rxBytes, txPkts, txBytes, 0)
+			if latN > 0 then
+				local mean = latSum / latN
+				shm:latency(latN, mean, latSumSq / latN - mean * mean, latMin, latMax)
+			end
+			latN, latSum, latSumSq, latMin, latMax = 0, 0, 0, math.huge, 0
+		end
+	end
+	prof:stop()
+end
@@ -57,8 +57,8 @@ function mod.match(PRE, POST, args)
 
 	C.hs_initialize(args.nrbuckets)
 
-	prereader = ms:newReader(PRE)
-	postreader = ms:newReader(POST)
+	prereader = ms:newReader(PRE, args.window)
+	postreader = ms:newReader(POST, args.window)
 
 	local precap = readSingle(prereader)
 	local postcap = readSingle(postreader)
@@ -3,6 +3,7 @@
 --- In order for pcap files to be processed correctly they must feature a 64 bit timestamp at the end
 ---
 --- Valid files can be generated by sniffer.lua with no flags (mscap) or with the flag --capture (pcap)
+--- .mscap files compressed with scripts/mgarchive.py (.mscz) are read directly
 
 require "utils"
 local log       = require "log"
@@ -21,8 +22,9 @@ dpdk.skipInit()
 
 function configure(parser)
 	parser:description("Demonstrate and test hardware latency induced by a device under test.\nThe ideal test setup is to use 2 taps, one should be connected to the ingress cable, the other one to the egress one.\n\nThe type of the input is automatically detected based on the file extension. Make sure input files are either .pcap or .mscap files.\n\nTo determine which is the pre and which is the post file, files must adhere to the following naming conventions:\n\t<name>-pre.pcap and <name>-post.pcap\n\tor\n\t<name>-pre.mscap and <name>-post.mscap\n\nNote that <name> need not be the same name.")
-	parser:option("-i --input", "Path to input file. Supports .mscap or .pcap files."):args(1)
-	parser:option("-s --second-input", "Path to second input file. Supports .mscap or .pcap files."):args(1):target("second")
+	parser:option("-i --input", "Path to input file. Supports .mscap, .mscz or .pcap files."):args(1)
+	parser:option("-s --second-input", "Path to second input file. Supports .mscap, .mscz or .pcap files."):args(1):target("second")
+	parser:option("-w --window", "Only match packets with pre/post timestamps in [start, stop] (ns). .mscz archives only decode the blocks of this window."):args(2):convert(tonumber)
 	parser:option("-o --output", "Name of the histogram which is generated."):args(1):default("hist")
 	parser:option("-n --nrbuckets", "Size of a bucket for the resulting histogram."):args(1):convert(tonumber):default(1)
 	parser:flag("-d --debug", "Create debug information. Instead of processing the input files normally, they are translated into human readable csv files.")
@@ -38,10 +40,10 @@ function master(args)
 	-- determine the input type
 	if string.match(args.input, ".*%.pcap") then
 		MODE = MODE_PCAP
-	elseif string.match(args.input, ".*%.mscap") then
+	elseif isMscap(args.input, "") then
 		MODE = MODE_MSCAP
 	else
-		log:err("Input with unknown file extension. Can only process .pcap or .mscap files.")
+		log:err("Input with unknown file extension. Can only process .pcap, .mscap or .mscz files.")
 	end
 
 	print(MODE)
@@ -53,11 +55,11 @@ function master(args)
 	if MODE == MODE_MSCAP then
 		if not args.second then log:fatal("Detected .mscap file but there was no second file. Single .mscap files cannot be processed.") end
 
-		if string.match(args.input, ".*%-pre%.mscap") and string.match(args.second, ".*%-post%.mscap") then
+		if isMscap(args.input, "%-pre") and isMscap(args.second, "%-post") then
 			PRE = args.input
 			POST = args.second
 
-		elseif string.match(args.second, ".*%-pre%.mscap") and string.match(args.input, ".*%-post%.mscap") then
+		elseif isMscap(args.second, "%-pre") and isMscap(args.input, "%-post") then
 			POST = args.input
 			PRE = args.second
 		else
@@ -116,6 +118,11 @@ function master(args)
 	log:info("Processing speed:\n\t" .. (size / 1e6) / elapsed .. " [MB/s]\n\t" .. (packets / 1e6) / elapsed .. " [mpps]")
 end
 
+--- True if path is an .mscap file or an .mscz archive of one, whose name ends with suffix
+function isMscap(path, suffix)
+	return string.match(path, ".*" .. suffix .. "%.mscap") or string.match(path, ".*" .. suffix .. "%.mscz")
+end
+
 --- Compute the size of a file
 function fsize(file)
 	local current = file:seek()
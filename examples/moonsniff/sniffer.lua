@@ -11,6 +11,8 @@ local stats  	= require "stats"
 local barrier 	= require "barrier"
 local pcap	= require "pcap"
 local ms	= require "moonsniff-io"
+local statsShm	= require "stats-shm"
+local S		= require "syscall"
 
 local ffi    = require "ffi"
 local C = ffi.C
@@ -28,6 +30,9 @@ function configure(parser)
 	parser:flag("-l --live", "Do some live processing during packet capture. Lower performance than standard mode.")
 	parser:flag("-f --fast", "Set fast flag to reduce the amount of live processing for higher performance. Only has effect if live flag is also set")
 	parser:flag("-c --capture", "If set, all incoming packets are captured as a whole.")
+	parser:option("--shm", "Live mode only: publish the live statistics into this shared-memory stats ring, e.g. /dev/shm/moonsniff-stats."):args(1)
+	parser:option("--clock-log", "Write samples of both NIC clocks against the host clock to this csv file, to align captures from several nodes (see emulab/mgclock.py)."):args(1)
+	parser:option("--clock-interval", "Interval of the clock samples in ms."):args(1):convert(tonumber):default(100)
 	parser:flag("-d --debug", "Insted of reading real input, some fake input is generated and written to the output files.")
 	return parser:parse()
 end
@@ -47,6 +52,9 @@ function master(args)
 
 		if args.live then
 			stats.startStatsTask{rxDevices = {args.dev[1], args.dev[2]}}
+			if args.shm then
+				statsShm:create(args.shm, 2)
+			end
 		else
 			-- if we are not live we want to print the stats to a seperate file so they are easily
 			-- available for post-processing
@@ -66,10 +74,12 @@ function master(args)
 		-- correct mesurement requires a packet to arrive at Pre before Post
 		local receiver0 = lm.startTask("timestamp", dev0rx, args.dev[2], bar, true, args)
 		local receiver1 = lm.startTask("timestamp", dev1rx, args.dev[1], bar, false, args)
+		local sampler = args.clock_log and lm.startTask("clockSamples", args.dev[1], args.dev[2], args)
 
 
 		receiver0:wait()
 		receiver1:wait()
+		if sampler then sampler:wait() end
 		lm.stop()
 
 		log:info("Finished all capturing/writing operations")
@@ -134,8 +144,20 @@ function core_online(queue, bufs, pre, hist, args)
 	local runtime = timer:new(args.time + 0.5)
 	local lastTimestamp
 
+	-- the post task publishes the matching statistics, both publish their rx counters
+	local shm = statsShm:source(args.shm, pre and 0 or 1, pre and "pre" or "post")
+	local publishing = shm.enabled
+	local rxPkts = 0
+
 	while lm.running() and runtime:running() do
 		local rx = queue:tryRecv(bufs, 1000)
+		if publishing then
+			rxPkts = rxPkts + rx
+			if shm:due() then
+				shm:counters(rxPkts, 0, 0, 0, 0)
+				if not pre then shm:msStats(C.ms_peek_stats()) end
+			end
+		end
 		for i = 1, rx do
 			local timestamp = bufs[i]:getTimestamp(queue.dev)
 			if not args.fast and timestamp then
@@ -195,6 +217,37 @@ function core_capture(queue, bufs, writer, args)
 	end
 end
 
+local function hostTime()
+	local t = S.clock_gettime("realtime")
+	return ffi.cast("uint64_t", t.tv_sec) * 1000000000ULL + t.tv_nsec
+end
+
+local function nsString(v)
+	if type(v) == "number" then
+		return string.format("%.0f", v)
+	end
+	return (tostring(v):gsub("U?LL$", ""))
+end
+
+--- Sample the NIC clocks against the host clock for the whole capture.
+--- Every NIC read is bracketed by two host clock reads, the spread of the
+--- two tells how good the sample is.
+function clockSamples(dev1, dev2, args)
+	local f = io.open(args.clock_log, "w")
+	f:write("port,host_before_ns,nic_ns,host_after_ns\n")
+	local runtime = timer:new(args.time + 1)
+	while lm.running() and runtime:running() do
+		for _, dev in ipairs({dev1, dev2}) do
+			local before = hostTime()
+			local nic = dev:readTime()
+			local after = hostTime()
+			f:write(dev.id, ",", nsString(before), ",", nsString(nic), ",", nsString(after), "\n")
+		end
+		lm.sleepMillis(args.clock_interval)
+	end
+	f:close()
+end
+
 function printStats(args)
 	lm.sleepMillis(500)
 	print()
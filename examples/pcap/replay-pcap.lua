@@ -1,4 +1,8 @@
---- Replay a pcap file.
+--- Replay a pcap file, or the shards of one (scripts/mgshard.py) in parallel.
+--- Every file gets its own tx queue and task.  All tasks start at the same
+--- time, with -r every shard waits for its first timestamp relative to the
+--- earliest one and never sends a batch before its time in the capture, so
+--- the shards keep the global timing of the original file.
 
 local mg      = require "moongen"
 local device  = require "device"
@@ -7,41 +11,93 @@ local stats   = require "stats"
 local log     = require "log"
 local pcap    = require "pcap"
 local limiter = require "software-ratecontrol"
+local libmoon = require "libmoon"
+
+-- time the tasks get to start up before the coordinated start
+local START_DELAY = 0.5
 
 function configure(parser)
 	parser:argument("dev", "Device to use."):args(1):convert(tonumber)
-	parser:argument("file", "File to replay."):args(1)
+	parser:argument("file", "File to replay, or the shards of a file written by scripts/mgshard.py."):args("+")
 	parser:option("-r --rate-multiplier", "Speed up or slow down replay, 1 = use intervals from file, default = replay as fast as possible"):default(0):convert(tonumber):target("rateMultiplier")
-	parser:flag("-l --loop", "Repeat pcap file.")
+	parser:flag("-l --loop", "Repeat pcap file (every shard on its own, only the first pass is coordinated).")
 	local args = parser:parse()
 	return args
 end
 
+--- Timestamp of the first packet in us (as the pcap reader puts it into udata64), nil for an empty file.
+local function firstTimestamp(file)
+	local f = io.open(file, "rb")
+	if not f then
+		log:fatal("Could not open %s", file)
+	end
+	local hdr = f:read(40)
+	f:close()
+	if not hdr or #hdr < 40 then
+		return nil
+	end
+	local bigEndian = hdr:byte(1) == 0xa1
+	local function u32(pos)
+		local a, b, c, d = hdr:byte(pos, pos + 3)
+		if bigEndian then
+			a, b, c, d = d, c, b, a
+		end
+		return a + b * 2^8 + c * 2^16 + d * 2^24
+	end
+	return u32(25) * 10^6 + u32(29)
+end
+
 function master(args)
-	local dev = device.config{port = args.dev}
+	local dev = device.config{port = args.dev, txQueues = #args.file}
 	device.waitForLinks()
-	local rateLimiter
-	if args.rateMultiplier > 0 then
-		rateLimiter = limiter:new(dev:getTxQueue(0), "custom")
+	-- the shards are offset against the earliest first packet
+	local first = {}
+	local traceStart
+	for i, file in ipairs(args.file) do
+		first[i] = firstTimestamp(file)
+		if first[i] and (not traceStart or first[i] < traceStart) then
+			traceStart = first[i]
+		end
+	end
+	local startAt = tonumber(limiter:get_tsc_cycles()) + START_DELAY * libmoon:getCyclesFrequency()
+	for i, file in ipairs(args.file) do
+		local queue = dev:getTxQueue(i - 1)
+		local rateLimiter
+		if args.rateMultiplier > 0 then
+			rateLimiter = limiter:new(queue, "custom")
+		end
+		local offset = (args.rateMultiplier > 0 and first[i]) and (first[i] - traceStart) or 0
+		mg.startTask("replay", queue, file, args.loop, rateLimiter, args.rateMultiplier, startAt, offset)
 	end
-	mg.startTask("replay", dev:getTxQueue(0), args.file, args.loop, rateLimiter, args.rateMultiplier)
 	stats.startStatsTask{txDevices = {dev}}
 	mg.waitForTasks()
 end
 
-function replay(queue, file, loop, rateLimiter, multiplier)
+function replay(queue, file, loop, rateLimiter, multiplier, startAt, offset)
 	local mempool = memory:createMemPool(4096)
 	local bufs = mempool:bufArray()
 	local pcapFile = pcap:newReader(file)
 	local prev = 0
 	local linkSpeed = queue.dev:getLinkStatus().speed
+	local cyclesPerUs = libmoon:getCyclesFrequency() / 10^6
+	-- the tsc at which the first packet of this file is due, nil once the first pass is over
+	local anchor = startAt + (multiplier > 0 and offset * cyclesPerUs / multiplier or 0)
+	local fileStart
+	while limiter:get_tsc_cycles() < startAt do
+		if not mg.running() then
+			return
+		end
+	end
 	while mg.running() do
 		local n = pcapFile:read(bufs)
 		if n > 0 then
+			-- setDelay() below overwrites the timestamps
+			local batchTs = bufs.array[0].udata64
 			if rateLimiter ~= nil then
 				if prev == 0 then
-					prev = bufs.array[0].udata64
+					prev = batchTs
 				end
+				fileStart = fileStart or batchTs
 				for i, buf in ipairs(bufs) do
 					-- ts is in microseconds
 					local ts = buf.udata64
@@ -55,9 +111,19 @@ function replay(queue, file, loop, rateLimiter, multiplier)
 					prev = ts
 				end
 			end
+			-- don't hand a batch to the rate limiter before its time, the shards would drift apart
+			if anchor then
+				local due = anchor + (fileStart and tonumber(batchTs - fileStart) * cyclesPerUs / multiplier or 0)
+				while limiter:get_tsc_cycles() < due do
+					if not mg.running() then
+						return
+					end
+				end
+			end
 		else
 			if loop then
 				pcapFile:reset()
+				anchor = nil
 			else
 				break
 			end
@@ -69,4 +135,3 @@ function replay(queue, file, loop, rateLimiter, multiplier)
 		end
 	end
 end
-
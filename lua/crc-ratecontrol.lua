@@ -11,7 +11,7 @@ local C = ffi.C
 
 ffi.cdef[[
 	void moongen_send_all_packets_with_delay_bad_crc(uint8_t port_id, uint16_t queue_id, struct rte_mbuf** load_pkts, uint16_t num_pkts, struct mempool* pool, uint32_t min_pkt_size);
-	void moongen_send_all_packets_with_delay_bad_crc_loss(uint8_t port_id, uint16_t queue_id, struct rte_mbuf** load_pkts, uint16_t num_pkts, struct mempool* pool, uint32_t min_pkt_size, double loss_rate);
+	void moongen_send_all_packets_with_delay_bad_crc_loss(uint8_t port_id, uint16_t queue_id, struct rte_mbuf** load_pkts, uint16_t num_pkts, struct mempool* pool, uint32_t min_pkt_size, double loss_rate, uint8_t* lost);
 ]]
 
 local mempool
@@ -55,7 +55,8 @@ end
 --   increases precision at low non-cbr rates
 -- @param lossRate bernoulli probability of dropping any particular frame
 -- @param n optional, number of packets to send (defaults to full bufs)
-function txQueue:sendWithDelayLoss(bufs, targetRate, lossRate, n)
+-- @param lost optional uint8_t array, set to 1 for every packet dropped by the random loss
+function txQueue:sendWithDelayLoss(bufs, targetRate, lossRate, n, lost)
 	if not self.dev.crcPatch then
 		log:fatal("Driver does not support disabling the CRC flag. This feature requires a patched driver.")
 	end
@@ -82,7 +83,7 @@ function txQueue:sendWithDelayLoss(bufs, targetRate, lossRate, n)
 	end
 	local tsc_hz_us = 2666
 	local presend_time = limiter:get_tsc_cycles()
-	C.moongen_send_all_packets_with_delay_bad_crc_loss(self.id, self.qid, bufs.array, n, mempool, minPktSize, lossRate)
+	C.moongen_send_all_packets_with_delay_bad_crc_loss(self.id, self.qid, bufs.array, n, mempool, minPktSize, lossRate, lost)
 	local postsend_time = limiter:get_tsc_cycles()
 	return bufs.size
 end
@@ -25,6 +25,7 @@ ffi.cdef [[
         void ms_add_entry(uint32_t identification, uint64_t timestamp);
         void ms_test_for(uint32_t identification, uint64_t timestamp);
         struct ms_stats ms_fetch_stats();
+        struct ms_stats ms_peek_stats();
 
 	//---------------MSCAP Writer/Reader-------------------------
         struct mscap {
@@ -32,6 +33,17 @@ ffi.cdef [[
                 uint32_t identification;   /* identifies a received packet */
         };
 
+	//---------------MSCZ archive (scripts/mgarchive.py)---------
+	struct mscz_block {
+		char magic[4];
+		uint32_t count;
+		uint32_t nbytes;
+		uint64_t ts0;
+		uint64_t ts_min;
+		uint64_t ts_max;
+		uint32_t id0;
+	} __attribute__((__packed__));
+
 	//--------------CPP Histogram--------------------------------
 	void hs_initialize(uint32_t bucket_size);
 	void hs_destroy();
@@ -122,9 +134,27 @@ end
 local reader = {}
 reader.__index = reader
 
+local function inWindow(window, timestamp)
+	local ts = tonumber(timestamp)
+	return ts >= window[1] and ts <= window[2]
+end
+
+local archiveReader = {}
+archiveReader.__index = archiveReader
+
+local ARCHIVE_MAGIC = "MSCZ"
+local ARCHIVE_HEADER_SIZE = 12
+local BLOCK_MAGIC = "MSZB"
+local mscz_block_p = ffi.typeof("struct mscz_block*")
+local BLOCK_HEADER_SIZE = ffi.sizeof("struct mscz_block")
+
 --- Create a new fast pcap reader for the given file name.
+--- .mscz archives (scripts/mgarchive.py) are detected by their magic and
+--- decoded on the fly, the records are returned the same way.
 --- Call :close() on the reader when you are done to avoid fd leakage.
-function mod:newReader(filename)
+--- @param window optional {start, stop} in ns, only records in this time window are
+--- returned. Archives only decode the blocks that overlap it.
+function mod:newReader(filename, window)
 	local fd = S.open(filename, "rdonly")
 	if not fd then
 		log:fatal("could not open pcap file: %s", strError(S.errno()))
@@ -137,20 +167,30 @@ function mod:newReader(filename)
 	end
 	local offset = 0
 	ptr = cast("uint8_t*", ptr)
-	return setmetatable({ fd = fd, ptr = ptr, size = size, offset = offset }, reader)
+	if size >= ARCHIVE_HEADER_SIZE and ffi.string(ptr, 4) == ARCHIVE_MAGIC then
+		return setmetatable({
+			fd = fd, ptr = ptr, size = size, offset = ARCHIVE_HEADER_SIZE, left = 0,
+			window = window, out = ffi.new("struct mscap"),
+		}, archiveReader)
+	end
+	return setmetatable({ fd = fd, ptr = ptr, size = size, offset = offset, window = window }, reader)
 end
 
 --- Read the next packet into a buf, the timestamp is stored in the udata64 field as microseconds.
 --- The buffer's packet size corresponds to the original packet size, cut off bytes are zero-filled.
 function reader:readSingle()
-	local fileRemaining = self.size - self.offset
-	if fileRemaining < MSCAP_SIZE then -- header size
-		return nil
-	end
+	while true do
+		local fileRemaining = self.size - self.offset
+		if fileRemaining < MSCAP_SIZE then -- header size
+			return nil
+		end
 
-	local mscap = cast(mscap_p, self.ptr + self.offset)
-	self.offset = self.offset + MSCAP_SIZE
-	return mscap
+		local mscap = cast(mscap_p, self.ptr + self.offset)
+		self.offset = self.offset + MSCAP_SIZE
+		if not self.window or inWindow(self.window, mscap.timestamp) then
+			return mscap
+		end
+	end
 end
 
 function reader:close()
@@ -160,6 +200,89 @@ function reader:close()
 	self.ptr = nil
 end
 
+-- unsigned LEB128, values stay below 2^53 (the encoder keeps the ts span of a block below 2^52)
+local function varint(ptr, pos)
+	local b = ptr[pos]
+	if b < 128 then
+		return b, pos + 1
+	end
+	local v, mul = b - 128, 128
+	repeat
+		pos = pos + 1
+		b = ptr[pos]
+		v = v + (b % 128) * mul
+		mul = mul * 128
+	until b < 128
+	return v, pos + 1
+end
+
+local function unzigzag(z)
+	if z % 2 == 0 then
+		return z / 2
+	end
+	return -(z + 1) / 2
+end
+
+--- Move to the next block that overlaps the window, false at the end of the archive.
+--- Only the block headers are touched for the skipped blocks.
+function archiveReader:nextBlock()
+	while self.offset + BLOCK_HEADER_SIZE <= self.size do
+		local block = cast(mscz_block_p, self.ptr + self.offset)
+		if ffi.string(block.magic, 4) ~= BLOCK_MAGIC then
+			-- the index at the end of the archive
+			return false
+		end
+		local payload = self.offset + BLOCK_HEADER_SIZE
+		self.offset = payload + block.nbytes
+		if self.offset > self.size then
+			log:warn("Truncated block at the end of the archive, ignoring it")
+			return false
+		end
+		local window = self.window
+		if not window or (tonumber(block.ts_max) >= window[1] and tonumber(block.ts_min) <= window[2]) then
+			-- timestamps are decoded relative to the smallest one of the block
+			self.base = block.ts_min
+			self.rel = tonumber(block.ts0 - block.ts_min)
+			self.id = block.id0
+			self.pos = payload
+			self.left = block.count
+			self.first = true
+			return true
+		end
+	end
+	return false
+end
+
+--- Decode the next record of the window, nil at the end.
+--- The returned struct is reused by the next call.
+function archiveReader:readSingle()
+	while true do
+		if self.left == 0 and not self:nextBlock() then
+			return nil
+		end
+		if self.first then
+			self.first = false
+		else
+			local dts, did
+			dts, self.pos = varint(self.ptr, self.pos)
+			did, self.pos = varint(self.ptr, self.pos)
+			self.rel = self.rel + unzigzag(dts)
+			self.id = (self.id + unzigzag(did)) % 4294967296
+		end
+		self.left = self.left - 1
+		local out = self.out
+		out.timestamp = self.base + self.rel
+		out.identification = self.id
+		if not self.window or inWindow(self.window, out.timestamp) then
+			return out
+		end
+	end
+end
+
+function archiveReader:close()
+	reader.close(self)
+end
+
 return mod
 
 
@@ -0,0 +1,43 @@
+--- Startup phase markers for the forwarders.
+--- Every marker is one line on stdout with the wall clock time, the setup
+--- scripts read them back from the forwarder log and merge them into the
+--- bring-up trace (emulab/mgtrace.py):
+---   mgtrace: <B|E|i> <phase> <unix time in ns> <task>
+--- B/E begin and end a phase of a task, i is a point in time (e.g. a task
+--- reaching its forwarding loop).  Only a handful of lines per run, the hot
+--- loops are not touched.
+
+local mod = {}
+
+local ffi = require "ffi"
+local S   = require "syscall"
+
+local PREFIX = "mgtrace:"
+
+local function now()
+	local t = S.clock_gettime("realtime")
+	return (tostring(ffi.cast("uint64_t", t.tv_sec) * 1000000000ULL + t.tv_nsec):gsub("U?LL$", ""))
+end
+
+local function mark(kind, phase, task)
+	print(("%s %s %s %s %s"):format(PREFIX, kind, phase, now(), task or "master"))
+	-- the log is a file, don't let the markers sit in the stdio buffer
+	io.stdout:flush()
+end
+
+--- Begin a phase of a task (default task: master).
+function mod.begin(phase, task)
+	mark("B", phase, task)
+end
+
+--- End a phase started with begin().
+function mod.finish(phase, task)
+	mark("E", phase, task)
+end
+
+--- A point in time, e.g. mod.instant("forwarding", "forward-0-0").
+function mod.instant(phase, task)
+	mark("i", phase, task)
+end
+
+return mod
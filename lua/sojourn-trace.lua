@@ -0,0 +1,197 @@
+--- Sampled per-packet sojourn trace of the delay-line forwarders.
+--- The master creates the file with one region per task, every task opens its
+--- own source and writes one fixed-size record per sampled packet straight into
+--- the mapping.  Records are not a ring: once a source is full it stops
+--- recording (the header keeps counting the packets it has seen), so a trace
+--- always starts at the beginning of the run.
+--- The layout is read by scripts/mgsojourn.py, keep both in sync.
+---
+---   header   64 bytes   magic "MGSOJRN1", version, num_sources, num_records, record_size, source_size, sample
+---   source   96 bytes   name[48], write_idx, seen, tsc_hz, latency, rate, capacity, unit   } num_sources times
+---   record   32 bytes   enqueue tsc, dequeue tsc, send tsc, occupancy, pkt_len, reason    }   num_records times each
+---
+--- The forward task of a direction records dequeued packets: the arrival
+--- timestamp the receive task put into udata64, the dequeue and send time and
+--- the ring occupancy at the dequeue.  The receive task records packets that
+--- did not fit into the ring, with the occupancy seen before the enqueue.
+
+local mod = {}
+
+local S       = require "syscall"
+local ffi     = require "ffi"
+local log     = require "log"
+local memory  = require "memory"
+local libmoon = require "libmoon"
+
+ffi.cdef [[
+	struct mg_sojourn_header {
+		char magic[8];
+		uint32_t version;
+		uint32_t num_sources;
+		uint32_t num_records;
+		uint32_t record_size;
+		uint32_t source_size;
+		uint32_t sample;        /* one record per this many packets */
+		uint32_t pad[8];
+	};
+
+	struct mg_sojourn_source {
+		char name[48];
+		volatile uint64_t write_idx;
+		uint64_t seen;          /* packets the task has handled, sampled or not */
+		double tsc_hz;
+		double latency;         /* ms */
+		double rate;            /* Mbit/s */
+		uint32_t capacity;      /* of the ring, in units */
+		uint32_t unit;          /* 1: bytes, 2: packets */
+	};
+
+	struct mg_sojourn_record {
+		uint64_t enqueue;       /* tsc */
+		uint64_t dequeue;       /* tsc, 0 if the packet never made it into the ring */
+		uint64_t send;          /* tsc */
+		uint32_t occupancy;     /* ring occupancy in units */
+		uint16_t pkt_len;
+		uint8_t reason;
+		uint8_t pad;
+	};
+]]
+
+local MAGIC = "MGSOJRN1"
+local VERSION = 1
+local HEADER_SIZE = ffi.sizeof("struct mg_sojourn_header")
+local SOURCE_HEADER_SIZE = ffi.sizeof("struct mg_sojourn_source")
+local RECORD_SIZE = ffi.sizeof("struct mg_sojourn_record")
+local DEFAULT_RECORDS = 1048576
+local DEFAULT_SAMPLE = 100
+
+--- Record reasons.
+mod.SENT     = 0  -- forwarded
+mod.LOSS     = 1  -- dropped by the random loss of the link
+mod.OVERFLOW = 2  -- did not fit into the delay line
+
+--- Ring occupancy units.
+mod.BYTES   = 1
+mod.PACKETS = 2
+
+local function sourceSize(numRecords)
+	return SOURCE_HEADER_SIZE + numRecords * RECORD_SIZE
+end
+
+local function map(path, flags, size)
+	local fd = S.open(path, flags, "0666")
+	if not fd then
+		log:fatal("could not open sojourn trace %s: %s", path, strError(S.errno()))
+	end
+	if size and not S.ftruncate(fd, size) then
+		log:fatal("ftruncate of sojourn trace %s failed: %s", path, strError(S.errno()))
+	end
+	size = size or fd:stat().size
+	local ptr = S.mmap(nil, size, "read, write", "shared", fd, 0)
+	if not ptr then
+		log:fatal("mmap of sojourn trace %s failed: %s", path, strError(S.errno()))
+	end
+	fd:close()
+	return ffi.cast("uint8_t*", ptr), size
+end
+
+--- Create (or truncate) the trace file, call this in the master before starting tasks.
+--- @param path file name, e.g. /tmp/sojourn.trace
+--- @param numSources number of tracing tasks
+--- @param sample record one packet out of this many, default 100
+--- @param numRecords records kept per source, default 1M (32 MB)
+function mod:create(path, numSources, sample, numRecords)
+	sample = math.max(1, sample or DEFAULT_SAMPLE)
+	numRecords = numRecords or DEFAULT_RECORDS
+	local size = HEADER_SIZE + numSources * sourceSize(numRecords)
+	-- the file is sparse, only pages with records are ever touched
+	local ptr = map(path, "creat, rdwr, trunc", size)
+	local hdr = ffi.cast("struct mg_sojourn_header*", ptr)
+	hdr.version = VERSION
+	hdr.num_sources = numSources
+	hdr.num_records = numRecords
+	hdr.record_size = RECORD_SIZE
+	hdr.source_size = sourceSize(numRecords)
+	hdr.sample = sample
+	memory.fence()
+	ffi.copy(hdr.magic, MAGIC, #MAGIC)
+	S.munmap(ptr, size)
+	log:info("Tracing one in %d packets of %d tasks to %s", sample, numSources, path)
+end
+
+local source = {}
+source.__index = source
+
+--- Open one source of an existing trace file for writing, from inside a task.
+--- Returns a disabled source if path is nil, so callers can check source.enabled.
+--- @param path file name passed to create()
+--- @param idx source index, 0 .. numSources - 1
+--- @param name name of the source shown by the reader
+--- @param link table with the latency (ms), rate (Mbit/s), capacity and unit of the traced delay line
+function mod:source(path, idx, name, link)
+	if not path then
+		return setmetatable({ enabled = false }, source)
+	end
+	local ptr = map(path, "rdwr")
+	local hdr = ffi.cast("struct mg_sojourn_header*", ptr)
+	if idx >= hdr.num_sources then
+		log:fatal("sojourn trace %s has only %d sources, can't open source %d", path, hdr.num_sources, idx)
+	end
+	local base = ptr + HEADER_SIZE + idx * hdr.source_size
+	local src = ffi.cast("struct mg_sojourn_source*", base)
+	ffi.fill(src.name, ffi.sizeof(src.name))
+	ffi.copy(src.name, name, math.min(#name, ffi.sizeof(src.name) - 1))
+	src.tsc_hz = libmoon:getCyclesFrequency()
+	src.latency = link.latency or 0
+	src.rate = link.rate or 0
+	src.capacity = link.capacity or 0
+	src.unit = link.unit or mod.BYTES
+	return setmetatable({
+		enabled = true,
+		src = src,
+		records = ffi.cast("struct mg_sojourn_record*", base + SOURCE_HEADER_SIZE),
+		numRecords = hdr.num_records,
+		sample = hdr.sample,
+		idx = tonumber(src.write_idx),
+		seen = 0,
+		left = hdr.sample,
+	}, source)
+end
+
+--- Count one packet, true if it is sampled.  Cheap enough for the hot loop.
+function source:sampled()
+	self.seen = self.seen + 1
+	self.left = self.left - 1
+	if self.left > 0 then
+		return false
+	end
+	self.left = self.sample
+	return true
+end
+
+--- Write one record, ignored once the source is full.
+function source:record(enqueue, dequeue, send, occupancy, pktLen, reason)
+	if self.idx >= self.numRecords then
+		return
+	end
+	local rec = self.records[self.idx]
+	rec.enqueue = enqueue
+	rec.dequeue = dequeue
+	rec.send = send
+	rec.occupancy = occupancy
+	rec.pkt_len = pktLen
+	rec.reason = reason
+	self.idx = self.idx + 1
+	self.src.seen = self.seen
+	memory.fence()
+	self.src.write_idx = self.idx
+end
+
+--- Store the final packet count, call this when the task ends.
+function source:close()
+	if self.enabled then
+		self.src.seen = self.seen
+	end
+end
+
+return mod
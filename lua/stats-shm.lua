@@ -0,0 +1,189 @@
+--- Fixed-layout shared-memory ring for publishing task statistics.
+--- The master creates the file (usually in /dev/shm) with one ring per source,
+--- every task then opens its own source and periodically appends records.
+--- Each ring has a single writer, so no locking is needed, readers detect torn or
+--- overwritten records with the per-record sequence number.
+--- The layout is read by emulab/mgshm.py, keep both in sync.
+---
+---   header   64 bytes   magic "MGSTATS1", version, num_sources, num_records, record_size, source_size
+---   source   64 bytes   name[48], write_idx, pid          } num_sources times
+---   record   64 bytes   seq, time, kind, values[5]        }   num_records times each
+
+local mod = {}
+
+local S       = require "syscall"
+local ffi     = require "ffi"
+local log     = require "log"
+local memory  = require "memory"
+local libmoon = require "libmoon"
+local limiter = require "software-ratecontrol"
+
+ffi.cdef [[
+	struct mg_stats_shm_header {
+		char magic[8];
+		uint32_t version;
+		uint32_t num_sources;
+		uint32_t num_records;
+		uint32_t record_size;
+		uint32_t source_size;
+		uint32_t pad[9];
+	};
+
+	struct mg_stats_shm_source {
+		char name[48];
+		volatile uint64_t write_idx;
+		uint32_t pid;
+		uint32_t pad;
+	};
+
+	struct mg_stats_shm_record {
+		volatile uint64_t seq;  /* write index + 1, 0 while the record is written */
+		double time;            /* wall clock time in seconds */
+		uint32_t kind;
+		uint32_t pad;
+		double values[5];
+	};
+]]
+
+local MAGIC = "MGSTATS1"
+local VERSION = 1
+local HEADER_SIZE = ffi.sizeof("struct mg_stats_shm_header")
+local SOURCE_HEADER_SIZE = ffi.sizeof("struct mg_stats_shm_source")
+local RECORD_SIZE = ffi.sizeof("struct mg_stats_shm_record")
+local DEFAULT_RECORDS = 4096
+local DEFAULT_INTERVAL = 0.01
+
+--- Record kinds and the meaning of their values.
+mod.COUNTERS = 1  -- rx packets, rx bytes, tx packets, tx bytes, dropped packets
+mod.LATENCY  = 2  -- count, mean, variance, min, max (ns)
+mod.MS_STATS = 3  -- struct ms_stats: average latency, variance, hits, misses, invalid timestamps
+
+local function sourceSize(numRecords)
+	return SOURCE_HEADER_SIZE + numRecords * RECORD_SIZE
+end
+
+local function map(path, flags, size)
+	local fd = S.open(path, flags, "0666")
+	if not fd then
+		log:fatal("could not open stats ring %s: %s", path, strError(S.errno()))
+	end
+	if size and not S.ftruncate(fd, size) then
+		log:fatal("ftruncate of stats ring %s failed: %s", path, strError(S.errno()))
+	end
+	size = size or fd:stat().size
+	local ptr = S.mmap(nil, size, "read, write", "shared", fd, 0)
+	if not ptr then
+		log:fatal("mmap of stats ring %s failed: %s", path, strError(S.errno()))
+	end
+	fd:close()
+	return ffi.cast("uint8_t*", ptr), size
+end
+
+--- Create (or truncate) the stats ring file, call this in the master before starting tasks.
+--- @param path file name, e.g. /dev/shm/moongen-stats
+--- @param numSources number of publishing tasks
+--- @param numRecords records kept per source, default 4096
+function mod:create(path, numSources, numRecords)
+	numRecords = numRecords or DEFAULT_RECORDS
+	local size = HEADER_SIZE + numSources * sourceSize(numRecords)
+	-- truncate to 0 first so no stale records survive
+	local ptr = map(path, "creat, rdwr, trunc", size)
+	local hdr = ffi.cast("struct mg_stats_shm_header*", ptr)
+	hdr.version = VERSION
+	hdr.num_sources = numSources
+	hdr.num_records = numRecords
+	hdr.record_size = RECORD_SIZE
+	hdr.source_size = sourceSize(numRecords)
+	memory.fence()
+	-- the magic goes last, readers wait for it
+	ffi.copy(hdr.magic, MAGIC, #MAGIC)
+	S.munmap(ptr, size)
+	log:info("Publishing statistics of %d sources to %s", numSources, path)
+end
+
+local source = {}
+source.__index = source
+
+--- Open one source of an existing stats ring for writing, from inside a task.
+--- Returns a disabled source if path is nil, so callers can check source.enabled.
+--- @param path file name passed to create()
+--- @param idx source index, 0 .. numSources - 1
+--- @param name name of the source shown by the readers
+--- @param interval optional minimum time between records in seconds (see source:due()), default 10 ms
+function mod:source(path, idx, name, interval)
+	if not path then
+		return setmetatable({ enabled = false }, source)
+	end
+	local ptr = map(path, "rdwr")
+	local hdr = ffi.cast("struct mg_stats_shm_header*", ptr)
+	if idx >= hdr.num_sources then
+		log:fatal("stats ring %s has only %d sources, can't open source %d", path, hdr.num_sources, idx)
+	end
+	local base = ptr + HEADER_SIZE + idx * hdr.source_size
+	local src = ffi.cast("struct mg_stats_shm_source*", base)
+	ffi.fill(src.name, ffi.sizeof(src.name))
+	ffi.copy(src.name, name, math.min(#name, ffi.sizeof(src.name) - 1))
+	src.pid = S.getpid()
+	return setmetatable({
+		enabled = true,
+		src = src,
+		records = ffi.cast("struct mg_stats_shm_record*", base + SOURCE_HEADER_SIZE),
+		numRecords = hdr.num_records,
+		idx = tonumber(src.write_idx),
+		period = (interval or DEFAULT_INTERVAL) * libmoon:getCyclesFrequency(),
+		nextAt = 0,
+	}, source)
+end
+
+--- Check whether the next record is due, cheap enough for the hot loop.
+--- @param now optional current TSC value if the caller already has it
+function source:due(now)
+	if not self.enabled then
+		return false
+	end
+	now = now or limiter:get_tsc_cycles()
+	if now < self.nextAt then
+		return false
+	end
+	self.nextAt = now + self.period
+	return true
+end
+
+--- Append one record.
+function source:publish(kind, v1, v2, v3, v4, v5)
+	if not self.enabled then
+		return
+	end
+	local rec = self.records[self.idx % self.numRecords]
+	rec.seq = 0
+	memory.fence()
+	rec.time = wallTime()
+	rec.kind = kind
+	rec.values[0] = v1 or 0
+	rec.values[1] = v2 or 0
+	rec.values[2] = v3 or 0
+	rec.values[3] = v4 or 0
+	rec.values[4] = v5 or 0
+	memory.fence()
+	self.idx = self.idx + 1
+	rec.seq = self.idx
+	self.src.write_idx = self.idx
+end
+
+--- Publish packet and byte counters (totals since the task started).
+function source:counters(rxPkts, rxBytes, txPkts, txBytes, dropped)
+	self:publish(mod.COUNTERS, rxPkts, rxBytes, txPkts, txBytes, dropped)
+end
+
+--- Publish a latency summary in ns.
+function source:latency(count, mean, variance, min, max)
+	self:publish(mod.LATENCY, count, mean, variance, min, max)
+end
+
+--- Publish a struct ms_stats of the moonsniff live mode.
+function source:msStats(stats)
+	self:publish(mod.MS_STATS, tonumber(stats.average_latency), tonumber(stats.variance_latency),
+		stats.hits, stats.misses, stats.inval_ts)
+end
+
+return mod
@@ -0,0 +1,131 @@
+--- Sampling profiler and cycle counters for long-running tasks.
+--- The LuaJIT sampling profiler (jit.p) is started and stopped from inside the
+--- task once a time window (relative to the task start) is reached, so the hot
+--- loop of a forwarder can be profiled without touching it for the rest of the run.
+---
+--- Output files (one set per task, picked up by emulab/mgprofile.py):
+---   /tmp/mgprof-<name>.folded      folded stacks (flame graph input)
+---   /tmp/mgprof-<name>-cycles.csv  cycles spent in each counter during the window
+---
+--- Every line of the .folded file is one stack, outermost caller first, and
+--- its sample count, e.g.
+---   l2-nlink-forward-lrl:worker;crc-ratecontrol:sendWithDelayLoss;[C] 812
+---   l2-nlink-forward-lrl:worker;pipe:recvFromBytesizedRing 97
+
+local mod = {}
+
+local ffi     = require "ffi"
+local libmoon = require "libmoon"
+local limiter = require "software-ratecontrol"
+local log     = require "log"
+
+local MAX_COUNTERS = 16
+local OUTPUT_PREFIX = "/tmp/mgprof-"
+-- frames kept of every sampled stack
+local PROFILE_DEPTH = 64
+-- F: module:function names, G: raw folded stacks for flame graphs, i1: sample every ms,
+-- a negative depth dumps the stack from the outermost caller in, as flame graphs want it
+-- (without a depth jit.p keeps one frame and the profile is flat)
+local PROFILE_MODE = "FGi1-" .. PROFILE_DEPTH
+
+local profiler = {}
+profiler.__index = profiler
+
+--- Create the profiler for the calling task.
+--- @param name unique name of the task instance, used in the output file names
+--- @param window table {delay, duration} in seconds, nil disables profiling
+--- @param tasks optional list of task names (prefix of name up to the first '-') to profile
+function mod:new(name, window, tasks)
+	local enabled = window ~= nil
+	if enabled and tasks and #tasks > 0 then
+		enabled = false
+		local task = name:match("^[^%-]+")
+		for _, t in ipairs(tasks) do
+			if t == task then
+				enabled = true
+			end
+		end
+	end
+	local obj = setmetatable({
+		name = name,
+		enabled = enabled,
+		running = false,
+		done = not enabled,
+		names = {},
+		cycles = ffi.new("uint64_t[?]", MAX_COUNTERS),
+		calls = ffi.new("uint64_t[?]", MAX_COUNTERS),
+	}, profiler)
+	if enabled then
+		local hz = libmoon:getCyclesFrequency()
+		local now = limiter:get_tsc_cycles()
+		obj.startAt = now + window[1] * hz
+		obj.stopAt = obj.startAt + window[2] * hz
+		log:info("Profiling %s for %s s after %s s", name, window[2], window[1])
+	end
+	return obj
+end
+
+--- Register a named cycle counter.
+--- @return the counter index to pass to profiler:add()
+function profiler:counter(name)
+	if #self.names >= MAX_COUNTERS then
+		log:fatal("Too many profiling counters in task %s", self.name)
+	end
+	table.insert(self.names, name)
+	return #self.names - 1
+end
+
+--- Account cycles to a counter, only counts while the window is open.
+function profiler:add(idx, cycles)
+	if self.running then
+		self.cycles[idx] = self.cycles[idx] + cycles
+		self.calls[idx] = self.calls[idx] + 1
+	end
+end
+
+--- Open or close the profiling window, call this once per loop iteration.
+--- @param now optional current TSC value if the caller already has it
+function profiler:poll(now)
+	if self.done then
+		return
+	end
+	now = now or limiter:get_tsc_cycles()
+	if not self.running then
+		if now >= self.startAt then
+			require("jit.p").start(PROFILE_MODE, OUTPUT_PREFIX .. self.name .. ".folded")
+			self.running = true
+			self.windowStart = now
+		end
+	elseif now >= self.stopAt then
+		self:stop(now)
+	end
+end
+
+--- Close the window early (e.g. when the task exits) and write the results.
+function profiler:stop(now)
+	if not self.running then
+		self.done = true
+		return
+	end
+	now = now or limiter:get_tsc_cycles()
+	require("jit.p").stop()
+	self.running = false
+	self.done = true
+	local window = tonumber(now - self.windowStart)
+	local file = OUTPUT_PREFIX .. self.name .. "-cycles.csv"
+	local f, err = io.open(file, "w")
+	if not f then
+		log:warn("Could not write the cycle counters of %s to %s: %s", self.name, file, err)
+		return
+	end
+	f:write("counter,cycles,calls,share\n")
+	for i, name in ipairs(self.names) do
+		local cycles = tonumber(self.cycles[i - 1])
+		f:write(("%s,%d,%d,%f\n"):format(name, cycles, tonumber(self.calls[i - 1]), cycles / window))
+	end
+	f:write(("window,%d,1,1.0\n"):format(window))
+	f:close()
+	log:info("Profile of %s written to %s", self.name, OUTPUT_PREFIX .. self.name .. ".folded")
+end
+
+return mod
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+#
+# compressed, seekable archive of moonsniff captures (.mscz).
+#
+# A .mscap file of lua/moonsniff-io.lua is a flat array of 12-byte records
+# (timestamp in ns, identification).  Timestamps grow and identifications are
+# mostly sequential, so the archive stores blocks of records as the first
+# record followed by zigzag varints of the differences to the previous record,
+# usually 2-4 bytes per record instead of 12.  An index of all blocks with
+# their time range is appended, so a time window is read without decoding
+# (or even reading) the rest of the file.
+#
+#   file      header, block*, index, trailer
+#   header    "MSCZ", version u16, reserved u16, records per block u32
+#   block     "MSZB", count u32, payload bytes u32, first ts u64, min ts u64,
+#             max ts u64, first id u32, then (ts delta, id delta) varints for
+#             the other count-1 records
+#   index     (block offset u64, min ts u64, max ts u64, count u32) per block
+#   trailer   index offset u64, blocks u32, "MSZI"
+#
+# All integers are little endian.  The ts span of a block stays below 2^52 ns,
+# so the Lua reader (moonsniff-io.lua) can decode it with plain numbers.  A
+# file without trailer (interrupted encoder) is read by walking the block
+# headers.
+#
+#   ./mgarchive.py pack latencies-pre.mscap latencies-post.mscap
+#   ./mgarchive.py info latencies-pre.mscz
+#   ./mgarchive.py unpack latencies-pre.mscz -o window-pre.mscap -w 1000000000 2000000000
+#
+# post-processing.lua and mgsketch.py read .mscz files directly.
+
+import os
+import sys
+import struct
+import argparse
+
+import numpy
+
+MAGIC = b"MSCZ"
+VERSION = 1
+header_struct = struct.Struct("<4sHHI")
+block_struct = struct.Struct("<4sIIQQQI")
+index_struct = struct.Struct("<QQQI")
+trailer_struct = struct.Struct("<QI4s")
+BLOCK_MAGIC = b"MSZB"
+INDEX_MAGIC = b"MSZI"
+MAX_SPAN = 1 << 52
+
+mscap_dtype = numpy.dtype([("ts", "<u8"), ("id", "<u4")])  # records of lua/moonsniff-io.lua
+
+
+def is_archive(filename):
+    with open(filename, 'rb') as f:
+        return f.read(4) == MAGIC
+
+
+def zigzag(d):
+    d = d.astype(numpy.int64)
+    return ((d << 1) ^ (d >> 63)).view(numpy.uint64)
+
+
+def unzigzag(z):
+    return (z >> numpy.uint64(1)).view(numpy.int64) ^ -(z & numpy.uint64(1)).view(numpy.int64)
+
+
+def varint_encode(v):
+    # LEB128 of every value, 7 bits per byte, high bit set on all but the last
+    v = v.astype(numpy.uint64)
+    if not len(v):
+        return b""
+    n = numpy.ones(len(v), dtype=numpy.int64)
+    for k in range(1, 10):
+        n += v >= numpy.uint64(1 << (7*k))
+    starts = numpy.cumsum(n) - n
+    out = numpy.empty(int(n.sum()), dtype=numpy.uint8)
+    for k in range(int(n.max())):
+        m = n > k
+        low = ((v[m] >> numpy.uint64(7*k)) & numpy.uint64(0x7f)).astype(numpy.uint8)
+        out[starts[m] + k] = low | ((n[m] > k + 1).astype(numpy.uint8) << 7)
+    return out.tobytes()
+
+
+def varint_decode(buf, count):
+    b = numpy.frombuffer(buf, dtype=numpy.uint8)
+    ends = numpy.flatnonzero(b < 0x80)
+    if len(ends) != count:
+        raise ValueError("corrupt block: %d varints, %d expected" % (len(ends), count))
+    if not count:
+        return numpy.zeros(0, dtype=numpy.uint64)
+    starts = numpy.concatenate(([0], ends[:-1] + 1))
+    shift = (numpy.arange(len(b)) - numpy.repeat(starts, ends - starts + 1))*7
+    parts = (b & 0x7f).astype(numpy.uint64) << shift.astype(numpy.uint64)
+    return numpy.bitwise_or.reduceat(parts, starts)
+
+
+def encode_block(rec):
+    ts = rec["ts"].astype(numpy.int64)
+    ids = rec["id"].astype(numpy.int64)
+    vals = numpy.empty(2*(len(rec) - 1), dtype=numpy.uint64)
+    vals[0::2] = zigzag(numpy.diff(ts))
+    # identifications wrap at 32 bit, a small step back or forward stays small
+    vals[1::2] = zigzag((numpy.diff(ids) + (1 << 31)) % (1 << 32) - (1 << 31))
+    payload = varint_encode(vals)
+    return block_struct.pack(BLOCK_MAGIC, len(rec), len(payload), int(rec["ts"][0]), int(rec["ts"].min()),
+                             int(rec["ts"].max()), int(ids[0])) + payload
+
+
+def decode_block(header, payload):
+    (magic, count, nbytes, ts0, ts_min, ts_max, id0) = header
+    vals = varint_decode(payload, 2*(count - 1))
+    rec = numpy.empty(count, dtype=mscap_dtype)
+    # the deltas are added modulo 2^64
+    ts = numpy.empty(count, dtype=numpy.uint64)
+    ts[0] = ts0
+    ts[1:] = unzigzag(vals[0::2]).view(numpy.uint64)
+    rec["ts"] = numpy.cumsum(ts, dtype=numpy.uint64)
+    ids = numpy.empty(count, dtype=numpy.int64)
+    ids[0] = id0
+    ids[1:] = unzigzag(vals[1::2])
+    rec["id"] = numpy.cumsum(ids) % (1 << 32)
+    return rec
+
+
+class Encoder:
+    # streaming encoder: write() any number of record arrays, close() adds the index
+
+    def __init__(self, f, block_records=65536):
+        self.f = f
+        self.block_records = block_records
+        self.pending = numpy.zeros(0, dtype=mscap_dtype)
+        self.index = []
+        self.records = 0
+        f.write(header_struct.pack(MAGIC, VERSION, 0, block_records))
+
+    def write(self, rec):
+        self.pending = numpy.concatenate((self.pending, rec)) if len(self.pending) else rec
+        while len(self.pending) >= self.block_records:
+            self._emit(self.pending[:self.block_records])
+            self.pending = self.pending[self.block_records:]
+
+    def _emit(self, rec):
+        if not len(rec):
+            return
+        ts = rec["ts"]
+        if len(rec) > 1 and int(ts.max()) - int(ts.min()) >= MAX_SPAN:
+            # not a capture clock (or a wrapped one), keep the deltas exact for the lua reader
+            half = len(rec)//2
+            self._emit(rec[:half])
+            self._emit(rec[half:])
+            return
+        self.index.append((self.f.tell(), int(ts.min()), int(ts.max()), len(rec)))
+        self.f.write(encode_block(rec))
+        self.records += len(rec)
+
+    def close(self):
+        self._emit(self.pending)
+        self.pending = numpy.zeros(0, dtype=mscap_dtype)
+        offset = self.f.tell()
+        for entry in self.index:
+            self.f.write(index_struct.pack(*entry))
+        self.f.write(trailer_struct.pack(offset, len(self.index), INDEX_MAGIC))
+
+
+def read_mscap_chunks(filename, chunk=1 << 20):
+    with open(filename, 'rb') as f:
+        while True:
+            rec = numpy.fromfile(f, dtype=mscap_dtype, count=chunk)
+            if not len(rec):
+                return
+            yield rec
+
+
+def pack(src, dst, block_records=65536):
+    with open(dst, 'wb') as f:
+        enc = Encoder(f, block_records)
+        for rec in read_mscap_chunks(src):
+            enc.write(rec)
+        enc.close()
+    return enc.records
+
+
+def read_index(f):
+    # [(offset, min ts, max ts, count)], from the index or by walking the blocks
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    if size >= header_struct.size + trailer_struct.size:
+        f.seek(size - trailer_struct.size)
+        (offset, blocks, magic) = trailer_struct.unpack(f.read(trailer_struct.size))
+        if magic == INDEX_MAGIC and offset + blocks*index_struct.size + trailer_struct.size == size:
+            f.seek(offset)
+            data = f.read(blocks*index_struct.size)
+            return list(index_struct.iter_unpack(data))
+    index = []
+    offset = header_struct.size
+    while offset + block_struct.size <= size:
+        f.seek(offset)
+        header = block_struct.unpack(f.read(block_struct.size))
+        if header[0] != BLOCK_MAGIC or offset + block_struct.size + header[2] > size:
+            break
+        index.append((offset, header[4], header[5], header[1]))
+        offset += block_struct.size + header[2]
+    return index
+
+
+def read_archive(filename, window=None):
+    # record arrays of the blocks overlapping window (min ts, max ts), in file order
+    with open(filename, 'rb') as f:
+        (magic, version, _, block_records) = header_struct.unpack(f.read(header_struct.size))
+        if magic != MAGIC or version > VERSION:
+            raise ValueError(filename+" is not a .mscz archive (version %d)" % VERSION)
+        for (offset, lo, hi, count) in read_index(f):
+            if window and (hi < window[0] or lo > window[1]):
+                continue
+            f.seek(offset)
+            header = block_struct.unpack(f.read(block_struct.size))
+            rec = decode_block(header, f.read(header[2]))
+            if window and (lo < window[0] or hi > window[1]):
+                rec = rec[(rec["ts"] >= window[0]) & (rec["ts"] <= window[1])]
+            if len(rec):
+                yield rec
+
+
+def read_records(filename, window=None):
+    # record arrays of a .mscz or .mscap file, optionally only the time window
+    if is_archive(filename):
+        yield from read_archive(filename, window)
+        return
+    for rec in read_mscap_chunks(filename):
+        if window:
+            rec = rec[(rec["ts"] >= window[0]) & (rec["ts"] <= window[1])]
+        if len(rec):
+            yield rec
+
+
+def info(filename):
+    with open(filename, 'rb') as f:
+        (magic, version, _, block_records) = header_struct.unpack(f.read(header_struct.size))
+        index = read_index(f)
+        size = f.seek(0, os.SEEK_END)
+    records = sum(e[3] for e in index)
+    print(filename+": version %d, %d blocks of up to %d records" % (version, len(index), block_records))
+    print("  records   %d" % records)
+    if index:
+        print("  ts        %d .. %d ns (%.3f s)" % (min(e[1] for e in index), max(e[2] for e in index),
+                                                  (max(e[2] for e in index) - min(e[1] for e in index))/1e9))
+    print("  size      %d bytes, %.2f bytes/record, %.1fx smaller than .mscap"
+          % (size, size/max(records, 1), records*mscap_dtype.itemsize/max(size, 1)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('pack', help='compress .mscap files, each into <name>.mscz next to it')
+    p.add_argument('inputs', nargs='+', help='.mscap files')
+    p.add_argument("-b", '--block-records', type=int, default=65536, help='records per block (default=65536)')
+    p.add_argument('--verify', action='store_true', help='decode the archive again and compare')
+    p = sub.add_parser('unpack', help='write (a time window of) an archive as .mscap')
+    p.add_argument('input', help='.mscz file')
+    p.add_argument("-o", '--output', help='.mscap file', required=True)
+    p.add_argument("-w", '--window', nargs=2, type=int, metavar=('START', 'STOP'), help='only records with START <= ts <= STOP (ns)')
+    p = sub.add_parser('info', help='blocks, records, time range and compression of archives')
+    p.add_argument('inputs', nargs='+', help='.mscz files')
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        for src in args.inputs:
+            dst = os.path.splitext(src)[0]+".mscz"
+            records = pack(src, dst, args.block_records)
+            print("%s: %d records, %d -> %d bytes (%.1fx)" % (dst, records, os.path.getsize(src), os.path.getsize(dst),
+                                                               os.path.getsize(src)/max(os.path.getsize(dst), 1)), file=sys.stderr)
+            if args.verify:
+                a = numpy.concatenate(list(read_mscap_chunks(src)) or [numpy.zeros(0, dtype=mscap_dtype)])
+                b = numpy.concatenate(list(read_archive(dst)) or [numpy.zeros(0, dtype=mscap_dtype)])
+                if not numpy.array_equal(a, b):
+                    print("ERROR: "+dst+" does not decode to "+src, file=sys.stderr)
+                    sys.exit(-1)
+    elif args.command == 'unpack':
+        with open(args.output, 'wb') as f:
+            for rec in read_archive(args.input, args.window):
+                rec.tofile(f)
+    else:
+        for filename in args.inputs:
+            info(filename)
+
+
+if __name__ == "__main__":
+    main()
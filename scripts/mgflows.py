@@ -0,0 +1,344 @@
+#!/usr/bin/env python3
+#
+# per-flow analysis of pcap captures (e.g. from examples/pcap/dump-pkts.lua).
+#
+# The files are mmapped and cut into chunks that are parsed by worker
+# processes.  A worker walks the record headers of its chunk (resyncing on the
+# first valid record after the chunk start) and then decodes Ethernet (with
+# one VLAN tag), IPv4, UDP and TCP headers of all its packets at once into
+# numpy columns.  The columns of all chunks are put together in capture order
+# and every metric is computed per 5-tuple without a loop over packets:
+#
+#   flows.csv       5-tuple, packets, bytes, duration, mean rate, sequence
+#                   gaps (lost) and out of order packets
+#   throughput.csv  Mbit/s of every flow per interval (the intervals with packets)
+#   iat.csv         histogram of the inter-arrival times of every flow, log2 buckets in ns
+#
+# Sequence numbers are the TCP sequence numbers, and for UDP a 32 bit big
+# endian counter at --udp-seq bytes into the payload if given.  Lost are the
+# bytes (TCP) or counter values (UDP) in the sequence range of a flow that no
+# packet carried, out of order are packets below the highest sequence number
+# seen so far (reordered or retransmitted).
+#
+#   ./mgflows.py capture.pcap -o flows/
+#   ./mgflows.py rx-*.pcap -o flows/ -i 0.1 -j 16 --udp-seq 0
+#
+# Memory use is about 40 bytes per packet.
+
+import os
+import sys
+import mmap
+import struct
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+# magic -> (byte order, ns per timestamp fraction)
+magics = {0xa1b2c3d4: ("<", 1000), 0xd4c3b2a1: (">", 1000),
+          0xa1b23c4d: ("<", 1), 0x4d3cb2a1: (">", 1)}
+LINKTYPE_ETHERNET = 1
+sync_records = 8  # consecutive valid headers needed to resync inside a chunk
+
+columns = ["ts", "wirelen", "src", "dst", "sport", "dport", "proto", "seq", "has_seq", "seqlen"]
+
+
+def read_header(mm):
+    if len(mm) < 24:
+        raise ValueError("not a pcap file")
+    magic = struct.unpack_from("<I", mm, 0)[0]
+    if magic not in magics:
+        raise ValueError("not a pcap file (magic %08x)" % magic)
+    (order, scale) = magics[magic]
+    (_, _, _, _, _, snaplen, linktype) = struct.unpack_from(order+"IHHiIII", mm, 0)
+    if linktype != LINKTYPE_ETHERNET:
+        raise ValueError("unsupported link type "+str(linktype))
+    first_sec = struct.unpack_from(order+"I", mm, 24)[0] if len(mm) >= 40 else 0
+    return (order, scale, snaplen, first_sec)
+
+
+def valid_record(mm, pos, rec, snaplen, first_sec, scale):
+    if pos + 16 > len(mm):
+        return False
+    (sec, frac, caplen, origlen) = rec.unpack_from(mm, pos)
+    # zero padding in packet data looks like a chain of empty records, a frame has at least its ethernet header
+    return (14 <= caplen <= snaplen and caplen <= origlen and origlen <= 65535 + 18
+            and frac < 10**9//scale and abs(sec - first_sec) < 7*86400
+            and pos + 16 + caplen <= len(mm))
+
+
+def resync(mm, pos, end, rec, snaplen, first_sec, scale):
+    # first offset >= pos that starts a chain of valid record headers
+    while pos < end:
+        p = pos
+        for i in range(sync_records):
+            if p == len(mm):
+                return pos
+            if not valid_record(mm, p, rec, snaplen, first_sec, scale):
+                break
+            p += 16 + rec.unpack_from(mm, p)[2]
+        else:
+            return pos
+        pos += 1
+    return end
+
+
+def u16(buf, pos):
+    return (buf[pos].astype(numpy.uint32) << 8) | buf[pos + 1]
+
+
+def u32(buf, pos):
+    return (u16(buf, pos) << 16) | u16(buf, pos + 2)
+
+
+def parse_chunk(filename, start, end, udp_seq=None):
+    # worker: decode all records starting in [start, end) into columns
+    with open(filename, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        (order, scale, snaplen, first_sec) = read_header(mm)
+        rec = struct.Struct(order+"IIII")
+        pos = 24 if start <= 24 else resync(mm, start, end, rec, snaplen, first_sec, scale)
+        offsets = []
+        ts = []
+        caplens = []
+        wirelens = []
+        size = len(mm)
+        unpack = rec.unpack_from
+        while pos < end and pos + 16 <= size:
+            (sec, frac, caplen, origlen) = unpack(mm, pos)
+            if pos + 16 + caplen > size:
+                break
+            offsets.append(pos + 16)
+            ts.append(sec*10**9 + frac*scale)
+            caplens.append(caplen)
+            wirelens.append(origlen)
+            pos += 16 + caplen
+
+        n = len(offsets)
+        buf = numpy.frombuffer(mm, dtype=numpy.uint8)
+        off = numpy.array(offsets, dtype=numpy.int64)
+        cap = numpy.array(caplens, dtype=numpy.int64)
+        last = size - 1
+
+        def at(rel):
+            # absolute positions, clipped so short packets at the end of the file can be read (and masked)
+            return numpy.minimum(off + rel, last - 3)
+
+        ethertype = u16(buf, at(12))
+        vlan = (ethertype == 0x8100) | (ethertype == 0x88a8)
+        l3 = numpy.where(vlan, 18, 14)
+        ethertype = numpy.where(vlan, u16(buf, at(16)), ethertype)
+        ip = (ethertype == 0x0800) & (cap >= l3 + 20)
+        ip &= (buf[at(l3)] >> 4) == 4
+        ihl = (buf[at(l3)] & 0xf).astype(numpy.int64)*4
+        l4 = l3 + ihl
+        proto = numpy.where(ip, buf[at(l3 + 9)], 0).astype(numpy.uint8)
+        total = u16(buf, at(l3 + 2)).astype(numpy.int64)
+        first_frag = (u16(buf, at(l3 + 6)) & 0x1fff) == 0
+        ports = ip & first_frag & ((proto == 6) | (proto == 17)) & (cap >= l4 + 4)
+        tcp = ports & (proto == 6) & (cap >= l4 + 14)
+        seq = numpy.where(tcp, u32(buf, at(l4 + 4)), 0)
+        has_seq = tcp.copy()
+        # sequence space of a packet: TCP payload plus SYN and FIN, one counter value for UDP
+        seqlen = numpy.where(tcp, total - ihl - (buf[at(l4 + 12)] >> 4).astype(numpy.int64)*4 + (buf[at(l4 + 13)] & 0x3 != 0), 1)
+        if udp_seq is not None:
+            udp = ports & (proto == 17) & (cap >= l4 + 8 + udp_seq + 4)
+            seq = numpy.where(udp, u32(buf, at(l4 + 8 + udp_seq)), seq)
+            has_seq |= udp
+        out = {
+            "ts": numpy.array(ts, dtype=numpy.int64),
+            "wirelen": numpy.array(wirelens, dtype=numpy.uint32),
+            "src": numpy.where(ip, u32(buf, at(l3 + 12)), 0).astype(numpy.uint32),
+            "dst": numpy.where(ip, u32(buf, at(l3 + 16)), 0).astype(numpy.uint32),
+            "sport": numpy.where(ports, u16(buf, at(l4)), 0).astype(numpy.uint16),
+            "dport": numpy.where(ports, u16(buf, at(l4 + 2)), 0).astype(numpy.uint16),
+            "proto": proto,
+            "seq": seq.astype(numpy.uint32),
+            "has_seq": has_seq,
+            "seqlen": numpy.maximum(seqlen, 0).astype(numpy.uint32),
+            "ip": ip,
+            # where the record (header and data) is in the file, for tools that copy packets (mgshard.py)
+            "record": off - 16,
+            "caplen": cap,
+        }
+        del buf
+        return n, out
+    finally:
+        mm.close()
+
+
+def read_captures(filenames, jobs, chunk_size, udp_seq=None):
+    # columns of all IPv4 packets of all files, in capture order
+    tasks = []
+    for filename in filenames:
+        size = os.path.getsize(filename)
+        for start in range(0, size, chunk_size):
+            tasks.append((filename, start, min(start + chunk_size, size)))
+    parts = []
+    total = 0
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for n, cols in pool.map(parse_chunk, *zip(*tasks), [udp_seq]*len(tasks)):
+            total += n
+            keep = cols.pop("ip")
+            parts.append({k: v[keep] for k, v in cols.items()})
+    cols = {k: numpy.concatenate([p[k] for p in parts]) if parts else numpy.zeros(0) for k in columns}
+    print("%d packets, %d IPv4 in %d chunks" % (total, len(cols["ts"]), len(tasks)), file=sys.stderr)
+    return cols
+
+
+def group_flows(cols):
+    # flow index of every packet and the 5-tuples, flows sorted by 5-tuple
+    a = (cols["src"].astype(numpy.uint64) << 32) | cols["dst"]
+    b = (cols["sport"].astype(numpy.uint64) << 24) | (cols["dport"].astype(numpy.uint64) << 8) | cols["proto"]
+    keys, flow = numpy.unique(numpy.stack([a, b], axis=1), axis=0, return_inverse=True)
+    return flow.reshape(-1), keys
+
+
+def flow_metrics(cols, flow, nflows):
+    # per flow totals plus lost/out of order from the sequence numbers
+    order = numpy.argsort(flow, kind='stable')   # per flow, in capture order
+    f = flow[order]
+    ts = cols["ts"][order]
+    starts = numpy.flatnonzero(numpy.r_[True, f[1:] != f[:-1]]) if len(f) else numpy.zeros(0, dtype=numpy.int64)
+    first = numpy.zeros(len(f), dtype=bool)
+    first[starts] = True
+
+    m = {
+        "packets": numpy.bincount(flow, minlength=nflows),
+        "bytes": numpy.bincount(flow, weights=cols["wirelen"], minlength=nflows),
+        "first": numpy.full(nflows, -1, dtype=numpy.int64),
+        "last": numpy.full(nflows, -1, dtype=numpy.int64),
+        "lost": numpy.zeros(nflows),
+        "out_of_order": numpy.zeros(nflows, dtype=numpy.int64),
+    }
+    if len(f):
+        m["first"][f[starts]] = numpy.minimum.reduceat(ts, starts)
+        m["last"][f[starts]] = numpy.maximum.reduceat(ts, starts)
+
+    # sequence numbers, only over the packets that have one
+    has = cols["has_seq"][order]
+    sf = f[has]
+    seq = cols["seq"][order][has].astype(numpy.int64)
+    seqlen = cols["seqlen"][order][has].astype(numpy.int64)
+    if len(sf):
+        sstarts = numpy.flatnonzero(numpy.r_[True, sf[1:] != sf[:-1]])
+        lengths = numpy.diff(numpy.r_[sstarts, len(sf)])
+        sfirst = numpy.zeros(len(sf), dtype=bool)
+        sfirst[sstarts] = True
+        # unwrap the 32 bit numbers per flow: signed differences, restarted at every flow
+        d = numpy.diff(seq, prepend=0)
+        d = (d + 2**31) % 2**32 - 2**31
+        d[sfirst] = 0
+        csum = numpy.cumsum(d)
+        pos = seq[sstarts].repeat(lengths) + csum - csum[sstarts].repeat(lengths)
+        # every flow gets its own range, so one running maximum over the whole array never crosses flows
+        pos += numpy.arange(len(sstarts), dtype=numpy.int64).repeat(lengths)*2**48
+        high = numpy.maximum.accumulate(pos + seqlen)
+        prev_high = numpy.r_[numpy.int64(0), high[:-1]]
+        behind = ~sfirst & (pos < prev_high)
+        m["out_of_order"] = numpy.bincount(sf[behind], minlength=nflows)
+        # lost: the part of the sequence range of a flow no packet covered
+        span = numpy.maximum.reduceat(pos + seqlen, sstarts) - numpy.minimum.reduceat(pos, sstarts)
+        _, once = numpy.unique(pos, return_index=True)
+        covered = numpy.bincount(sf[once], weights=seqlen[once], minlength=nflows)
+        m["lost"][sf[sstarts]] = numpy.maximum(span - covered[sf[sstarts]], 0)
+    m["sequenced"] = numpy.bincount(sf, minlength=nflows) > 0
+    m["iat"] = (f[~first], numpy.diff(ts, prepend=0)[~first])
+    return m
+
+
+def throughput(cols, flow, interval):
+    # (flow, interval, Mbit/s) of the intervals since the first packet in which
+    # a flow has packets, sorted by flow and interval.  Sparse: long captures
+    # with many flows have mostly empty (flow, interval) cells
+    t0 = cols["ts"].min()
+    bins = ((cols["ts"] - t0)//max(int(interval*1e9), 1)).astype(numpy.int64)
+    nbins = int(bins.max()) + 1
+    cells, cell = numpy.unique(flow.astype(numpy.int64)*nbins + bins, return_inverse=True)
+    bits = numpy.bincount(cell.ravel(), weights=cols["wirelen"].astype(numpy.float64)*8)
+    return cells//nbins, cells % nbins, bits/interval/1e6
+
+
+def iat_histogram(flow_iat, nflows):
+    # counts per log2 bucket of the inter-arrival time in ns, bucket 0 is < 1 ns
+    (f, iat) = flow_iat
+    bucket = numpy.zeros(len(iat), dtype=numpy.int64)
+    pos = iat > 0
+    bucket[pos] = numpy.floor(numpy.log2(iat[pos])).astype(numpy.int64) + 1
+    nb = int(bucket.max()) + 1 if len(bucket) else 1
+    return numpy.bincount(f*nb + bucket, minlength=nflows*nb).reshape(nflows, nb)
+
+
+def ip_str(a):
+    return ".".join(str((int(a) >> s) & 0xff) for s in (24, 16, 8, 0))
+
+
+def write_results(outdir, keys, m, tput, hist, interval, min_packets):
+    os.makedirs(outdir, exist_ok=True)
+    names = []
+    for (a, b) in keys:
+        proto = int(b) & 0xff
+        names.append((ip_str(a >> 32), ip_str(a & 0xffffffff), (int(b) >> 24) & 0xffff, (int(b) >> 8) & 0xffff,
+                      {6: "tcp", 17: "udp"}.get(proto, str(proto))))
+    selected = numpy.flatnonzero(m["packets"] >= min_packets)
+    with open(os.path.join(outdir, "flows.csv"), 'w') as f:
+        f.write("flow,src,dst,sport,dport,proto,packets,bytes,start_s,duration_s,mbps,lost,out_of_order\n")
+        for i in selected:
+            duration = (m["last"][i] - m["first"][i])/1e9
+            rate = m["bytes"][i]*8/duration/1e6 if duration > 0 else 0
+            lost = str(int(m["lost"][i])) if m["sequenced"][i] else ""
+            ooo = str(m["out_of_order"][i]) if m["sequenced"][i] else ""
+            f.write("%d,%s,%s,%d,%d,%s,%d,%d,%.9f,%.9f,%.3f,%s,%s\n" % ((i,) + names[i] + (
+                m["packets"][i], m["bytes"][i], m["first"][i]/1e9, duration, rate, lost, ooo)))
+    with open(os.path.join(outdir, "throughput.csv"), 'w') as f:
+        f.write("flow,time_s,mbps\n")
+        (tf, tb, mbps) = tput
+        for j in numpy.flatnonzero(numpy.isin(tf, selected)):
+            f.write("%d,%g,%.3f\n" % (tf[j], tb[j]*interval, mbps[j]))
+    with open(os.path.join(outdir, "iat.csv"), 'w') as f:
+        f.write("flow,iat_min_ns,iat_max_ns,packets\n")
+        for i in selected:
+            for b in numpy.flatnonzero(hist[i]):
+                lo = 0 if b == 0 else 2**(b - 1)
+                f.write("%d,%d,%d,%d\n" % (i, lo, 2**b if b else 1, hist[i][b]))
+    return names, selected
+
+
+def main():
+    parser = argparse.ArgumentParser(description="per-flow throughput, inter-arrival times and loss from pcap files")
+    parser.add_argument("inputs", nargs='+', help='pcap files, analyzed as one capture in the given order')
+    parser.add_argument("-o", '--outdir', help='output directory (default=.)', default=".")
+    parser.add_argument("-i", '--interval', help='throughput interval in s (default=1)', type=float, default=1.0)
+    parser.add_argument("-j", '--jobs', help='worker processes (default: all cores)', type=int, default=os.cpu_count())
+    parser.add_argument("-c", '--chunk-size', help='bytes per chunk in MB (default=64)', type=int, default=64)
+    parser.add_argument("-m", '--min-packets', help='only write flows with at least this many packets (default=1)', type=int, default=1)
+    parser.add_argument('--udp-seq', help='offset of a 32 bit sequence number in the UDP payload', type=int)
+    args = parser.parse_args()
+    if args.chunk_size <= 0 or args.interval <= 0 or args.jobs <= 0:
+        parser.error("the chunk size, interval and jobs must be positive")
+
+    try:
+        cols = read_captures(args.inputs, args.jobs, args.chunk_size << 20, args.udp_seq)
+    except ValueError as e:
+        print("ERROR: "+str(e), file=sys.stderr)
+        sys.exit(-1)
+    if not len(cols["ts"]):
+        print("ERROR: no IPv4 packets", file=sys.stderr)
+        sys.exit(-1)
+    flow, keys = group_flows(cols)
+    m = flow_metrics(cols, flow, len(keys))
+    tput = throughput(cols, flow, args.interval)
+    hist = iat_histogram(m["iat"], len(keys))
+    names, selected = write_results(args.outdir, keys, m, tput, hist, args.interval, args.min_packets)
+
+    top = sorted(selected, key=lambda i: -m["bytes"][i])[:10]
+    print("%d flows, %d written to %s" % (len(keys), len(selected), args.outdir), file=sys.stderr)
+    for i in top:
+        print("  %s:%d -> %s:%d %s  %d pkts  %.1f MB  lost %s  ooo %s" % (
+            names[i][0], names[i][2], names[i][1], names[i][3], names[i][4], m["packets"][i], m["bytes"][i]/1e6,
+            int(m["lost"][i]) if m["sequenced"][i] else "-", m["out_of_order"][i] if m["sequenced"][i] else "-"), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
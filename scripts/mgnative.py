@@ -0,0 +1,205 @@
+#!/usr/bin/env python3
+#
+# ctypes bindings for the native histogram (src/histogram.cpp) and the TBB
+# hashmap (src/hashmap.cpp), so offline analysis buckets and matches exactly
+# like the on-line path of MoonGen/MoonSniff.
+#
+# The library is built together with MoonGen as build/libmgnative.so, set
+# MGNATIVE_LIB to use another location.  The bulk entry points take numpy
+# arrays and never loop in Python.
+#
+#   import numpy, mgnative
+#   h = mgnative.Histogram(bucket_size=10)
+#   h.update(numpy.fromfile("latencies.bin", dtype=numpy.int64))
+#   h.finalize()
+#   values, counts = h.buckets()
+
+import os
+import ctypes
+
+import numpy
+
+lib_name = "libmgnative.so"
+
+key_sizes = [8, 16, 32, 64]
+value_sizes = [8, 16, 32, 64, 128]
+
+
+def load_library():
+    path = os.environ.get("MGNATIVE_LIB")
+    if not path:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "build", lib_name)
+    return ctypes.CDLL(path)
+
+
+lib = load_library()
+
+c_hist = ctypes.c_void_p
+c_int64_p = ctypes.POINTER(ctypes.c_int64)
+c_uint64_p = ctypes.POINTER(ctypes.c_uint64)
+
+for (name, restype, argtypes) in [
+        ("hist_create", c_hist, [ctypes.c_uint32]),
+        ("hist_destroy", None, [c_hist]),
+        ("hist_update_bulk", ctypes.c_uint64, [c_hist, c_int64_p, ctypes.c_size_t]),
+        ("hist_merge", ctypes.c_bool, [c_hist, c_hist]),
+        ("hist_finalize", None, [c_hist]),
+        ("hist_write", None, [c_hist, ctypes.c_char_p]),
+        ("hist_count", ctypes.c_uint64, [c_hist]),
+        ("hist_mean", ctypes.c_double, [c_hist]),
+        ("hist_variance", ctypes.c_double, [c_hist]),
+        ("hist_bucket_size", ctypes.c_int64, [c_hist]),
+        ("hist_num_buckets", ctypes.c_size_t, [c_hist]),
+        ("hist_export", ctypes.c_size_t, [c_hist, c_int64_p, c_uint64_p, ctypes.c_size_t])]:
+    fn = getattr(lib, name)
+    fn.restype = restype
+    fn.argtypes = argtypes
+
+
+class Histogram:
+    # same bucketing as the hs_* histogram: values are rounded to the nearest
+    # multiple of bucket_size (half bucket offset, away from zero)
+
+    def __init__(self, bucket_size=1):
+        self.h = None
+        # hist_create() exits the process on a bucket size it can't use
+        if int(bucket_size) != bucket_size or not 1 <= bucket_size <= 0xffffffff:
+            raise ValueError("bucket_size must be an integer between 1 and 2^32-1, not "+str(bucket_size))
+        self.h = lib.hist_create(int(bucket_size))
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.h:
+            lib.hist_destroy(self.h)
+            self.h = None
+
+    def update(self, values):
+        # add all values of an array, returns the number of negative values
+        # (which are counted, like in hs_update)
+        a = numpy.ascontiguousarray(values, dtype=numpy.int64)
+        return lib.hist_update_bulk(self.h, a.ctypes.data_as(c_int64_p), a.size)
+
+    def merge(self, other):
+        if not lib.hist_merge(self.h, other.h):
+            raise ValueError("can only merge histograms with the same bucket size")
+        return self
+
+    def finalize(self):
+        lib.hist_finalize(self.h)
+
+    def write(self, filename):
+        lib.hist_write(self.h, filename.encode())
+
+    @property
+    def count(self):
+        return lib.hist_count(self.h)
+
+    @property
+    def mean(self):
+        return lib.hist_mean(self.h)
+
+    @property
+    def variance(self):
+        # only set by finalize(), like hs_getVariance()
+        return lib.hist_variance(self.h)
+
+    @property
+    def bucket_size(self):
+        return lib.hist_bucket_size(self.h)
+
+    def buckets(self):
+        # (values, counts) arrays in ascending order of the bucket values
+        n = lib.hist_num_buckets(self.h)
+        values = numpy.empty(n, dtype=numpy.int64)
+        counts = numpy.empty(n, dtype=numpy.uint64)
+        lib.hist_export(self.h, values.ctypes.data_as(c_int64_p), counts.ctypes.data_as(c_uint64_p), n)
+        return values, counts
+
+
+def fitting_size(size, sizes, what):
+    for s in sizes:
+        if size <= s:
+            return s
+    raise ValueError("HashMap: "+what+" of size "+str(size)+" are not supported")
+
+
+def packed(a, size):
+    # pack an array into rows of exactly size bytes, zero padded like the
+    # scratchpads used on the Lua side
+    a = numpy.ascontiguousarray(a)
+    if a.ndim == 1 and a.dtype != numpy.uint8:
+        a = a.reshape(-1, 1)
+    rows = a.view(numpy.uint8).reshape(a.shape[0], -1)
+    if rows.shape[1] > size:
+        raise ValueError("elements of "+str(rows.shape[1])+" bytes do not fit into "+str(size))
+    if rows.shape[1] == size:
+        return rows
+    out = numpy.zeros((rows.shape[0], size), dtype=numpy.uint8)
+    out[:, :rows.shape[1]] = rows
+    return out
+
+
+class HashMap:
+    # TBB concurrent_hash_map with the same sip hash and key/value sizes as lua/hmap.lua
+    # keys and values are arrays with one element (or one row of bytes) per entry
+
+    def __init__(self, key_size=8, value_size=8):
+        self.map = None
+        self.key_size = fitting_size(key_size, key_sizes, "Keys")
+        self.value_size = fitting_size(value_size, value_sizes, "Values")
+        prefix = "hmapk"+str(self.key_size)+"v"+str(self.value_size)
+        self.fn = {}
+        for (name, restype, argtypes) in [
+                ("create", ctypes.c_void_p, []),
+                ("delete", None, [ctypes.c_void_p]),
+                ("clear", None, [ctypes.c_void_p]),
+                ("size", ctypes.c_size_t, [ctypes.c_void_p]),
+                ("clean", ctypes.c_uint32, [ctypes.c_void_p, ctypes.c_uint64]),
+                ("put_bulk", ctypes.c_uint64, [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t]),
+                ("get_bulk", ctypes.c_uint64, [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t, ctypes.c_bool])]:
+            fn = getattr(lib, prefix+"_"+name)
+            fn.restype = restype
+            fn.argtypes = argtypes
+            self.fn[name] = fn
+        self.map = self.fn["create"]()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        if self.map:
+            self.fn["delete"](self.map)
+            self.map = None
+
+    def __len__(self):
+        return self.fn["size"](self.map)
+
+    def clear(self):
+        self.fn["clear"](self.map)
+
+    def clean(self, thresh):
+        # remove all entries whose value starts with a uint64 timestamp below thresh
+        return self.fn["clean"](self.map, thresh)
+
+    def put(self, keys, values):
+        # insert or overwrite, returns the number of new keys
+        k = packed(keys, self.key_size)
+        v = packed(values, self.value_size)
+        if len(k) != len(v):
+            raise ValueError("need one value per key")
+        return self.fn["put_bulk"](self.map, k.ctypes.data, v.ctypes.data, len(k))
+
+    def get(self, keys, erase=False, dtype=numpy.uint64):
+        # returns (values, found), values are zero where the key was not found.
+        # values are returned as dtype if it fits the value size, else as rows of bytes
+        k = packed(keys, self.key_size)
+        values = numpy.zeros((len(k), self.value_size), dtype=numpy.uint8)
+        found = numpy.zeros(len(k), dtype=numpy.uint8)
+        self.fn["get_bulk"](self.map, k.ctypes.data, values.ctypes.data, found.ctypes.data, len(k), erase)
+        if dtype is not None and self.value_size % numpy.dtype(dtype).itemsize == 0:
+            values = values.view(dtype)
+            if values.shape[1] == 1:
+                values = values.reshape(-1)
+        return values, found.astype(bool)
@@ -0,0 +1,440 @@
+#!/usr/bin/env python3
+#
+# incremental report builder for campaigns of rfc2544 and emulab runs.
+#
+# All run directories below the given roots are picked up:
+#   - rfc2544 results (testresults_*/ with throughput.csv, latency.csv,
+#     frameloss.csv, backtoback.csv from rfc2544/master.lua)
+#   - emulab workload results (flows.csv and summary.json from emulab/mgworkload.py)
+#
+# Every run is parsed into a small summary, and every figure is a standalone
+# pgfplots document (like rfc2544/utils/tikz.lua) compiled with pdflatex.
+# Summaries and figures are cached under <out>/cache by a hash of everything
+# they are made from (input file contents, parameters, RENDER_VERSION), so a
+# rebuild only parses new or changed runs and only compiles figures whose
+# inputs changed.  Parsing and compiling run in parallel worker processes.
+# File contents are only rehashed when size or mtime changed.
+#
+#   ./mgreport.py campaign/ -o report            # report/report.tex, report/*.csv
+#   ./mgreport.py campaign/ -o report -j 32 --no-runs
+#
+# Without pdflatex only the figure sources are written.
+
+import os
+import re
+import sys
+import json
+import shutil
+import hashlib
+import argparse
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+# bump when the parsers or the figure code change, this invalidates the cache
+RENDER_VERSION = 1
+
+rfc2544_files = ["throughput.csv", "latency.csv", "frameloss.csv", "backtoback.csv"]
+workload_files = ["summary.json", "flows.csv"]
+
+tikz_start = r"""\documentclass{standalone}
+\usepackage{pgfplots}
+\pgfplotsset{compat=newest}
+
+\begin{document}
+\begin{tikzpicture}
+\begin{axis}"""
+tikz_end = r"""\end{axis}
+\end{tikzpicture}
+\end{document}
+"""
+
+tex_header = r"""\documentclass{article}
+\usepackage{graphicx}
+\usepackage{longtable}
+\usepackage[margin=1in]{geometry}
+\begin{document}
+"""
+
+
+def digest(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:24]
+
+
+class Cache:
+    # content hashes of the input files and the cached summaries and figures
+
+    def __init__(self, directory):
+        self.dir = directory
+        for d in ("sum", "fig"):
+            os.makedirs(os.path.join(directory, d), exist_ok=True)
+        self.index_file = os.path.join(directory, "index.json")
+        try:
+            with open(self.index_file, 'r') as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def file_hash(self, path):
+        st = os.stat(path)
+        entry = self.index.get(path)
+        if entry and entry[0] == st.st_size and entry[1] == st.st_mtime_ns:
+            return entry[2]
+        h = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+        self.index[path] = [st.st_size, st.st_mtime_ns, h.hexdigest()]
+        return self.index[path][2]
+
+    def save(self):
+        tmp = self.index_file+".tmp"
+        with open(tmp, 'w') as f:
+            json.dump(self.index, f)
+        os.replace(tmp, self.index_file)
+
+    def summary_path(self, key):
+        return os.path.join(self.dir, "sum", key+".json")
+
+    def figure_path(self, key, ext):
+        return os.path.join(self.dir, "fig", key+ext)
+
+
+# ---- run discovery and parsing -----------------------------------------------
+
+def discover(roots):
+    # [(run id, kind, directory, files)]
+    runs = []
+    for root in roots:
+        for dirpath, dirnames, filenames in os.walk(root):
+            dirnames.sort()
+            rel = os.path.relpath(dirpath, root)
+            run_id = os.path.join(os.path.basename(os.path.abspath(root)), rel) if rel != "." else os.path.basename(os.path.abspath(root))
+            found = [f for f in rfc2544_files if f in filenames]
+            if found:
+                runs.append((run_id, "rfc2544", dirpath, found))
+            elif all(f in filenames for f in workload_files):
+                runs.append((run_id, "workload", dirpath, workload_files))
+    return runs
+
+
+def csv_rows(filename):
+    with open(filename, 'r') as f:
+        next(f, None)
+        for line in f:
+            fields = line.strip().split(',')
+            if len(fields) > 1:
+                yield fields
+
+
+def num(s):
+    return float(s.rstrip("s"))
+
+
+def summarize_rfc2544(directory):
+    s = {}
+    path = os.path.join(directory, "throughput.csv")
+    if os.path.exists(path):
+        th = {}
+        for r in csv_rows(path):
+            th.setdefault(int(num(r[0])), []).append(num(r[4]))
+        s["throughput"] = {fs: {"mpps": sum(v)/len(v), "mbps": sum(v)/len(v)*8*(fs + 20), "iterations": len(v)}
+                           for fs, v in th.items()}
+    path = os.path.join(directory, "latency.csv")
+    if os.path.exists(path):
+        hist = {}
+        for r in csv_rows(path):
+            hist.setdefault(int(num(r[2])), []).append((num(r[0]), num(r[1])))
+        lat = {}
+        for fs, h in hist.items():
+            h.sort()
+            total = sum(c for _, c in h)
+            cdf = []
+            acc = 0
+            step = max(1, len(h)//200)
+            quantiles = {}
+            for i, (v, c) in enumerate(h):
+                acc += c
+                for q in (0.5, 0.99, 0.999):
+                    if q not in quantiles and acc >= q*total:
+                        quantiles[q] = v
+                if i % step == 0 or i == len(h) - 1:
+                    cdf.append((v, acc/total))
+            lat[fs] = {"min": h[0][0], "max": h[-1][0], "avg": sum(v*c for v, c in h)/total,
+                       "p50": quantiles.get(0.5), "p99": quantiles.get(0.99), "p999": quantiles.get(0.999),
+                       "samples": total, "cdf": cdf}
+        s["latency"] = lat
+    path = os.path.join(directory, "frameloss.csv")
+    if os.path.exists(path):
+        fl = {}
+        for r in csv_rows(path):
+            fl.setdefault(int(num(r[1])), []).append((num(r[0])*100, num(r[5])))
+        s["frameloss"] = {fs: sorted(v) for fs, v in fl.items()}
+    path = os.path.join(directory, "backtoback.csv")
+    if os.path.exists(path):
+        btb = {}
+        for r in csv_rows(path):
+            bursts = [num(x) for x in r[4:] if x]
+            if bursts:
+                btb[int(num(r[0]))] = {"min": min(bursts), "avg": sum(bursts)/len(bursts), "max": max(bursts)}
+        s["backtoback"] = btb
+    return s
+
+
+def summarize_workload(directory):
+    with open(os.path.join(directory, "summary.json"), 'r') as f:
+        summary = json.load(f)
+    series = {}
+    for r in csv_rows(os.path.join(directory, "flows.csv")):
+        # flow,sender,receiver,start,end,goodput_mbps,...
+        if r[4] and r[5]:
+            series.setdefault(r[0], []).append((num(r[4]), num(r[5])))
+    rates = []
+    latencies = []
+    for link in summary.get("links", {}).values():
+        rates += [x for x in link.get("rate", []) if x]
+        latencies += [x for x in link.get("latency", []) if x is not None]
+    rtts = [f["mean_rtt_ms"] for f in summary["flows"].values() if f.get("mean_rtt_ms") is not None]
+    return {"flows": len(summary["flows"]), "total_goodput_mbps": summary["total_goodput_mbps"],
+            "fairness": summary.get("fairness"), "protocol": summary.get("protocol"),
+            "bottleneck_mbps": min(rates) if rates else None, "latency_ms": max(latencies) if latencies else None,
+            "mean_rtt_ms": sum(rtts)/len(rtts) if rtts else None,
+            "series": {fid: v[::max(1, len(v)//300)] for fid, v in series.items()}}
+
+
+def summarize(kind, directory, out):
+    # worker: parse one run and store the summary
+    s = summarize_rfc2544(directory) if kind == "rfc2544" else summarize_workload(directory)
+    tmp = out+".tmp"
+    with open(tmp, 'w') as f:
+        json.dump(s, f)
+    os.replace(tmp, out)
+    return out
+
+
+# ---- figures -------------------------------------------------------------------
+
+def tikz(options, plots):
+    # plots: [(legend, [(x, y)], plot options)]
+    out = [tikz_start+"["+options+"]"]
+    for (legend, points, popts) in plots:
+        out.append("    \\addplot"+("["+popts+"]" if popts else "")+" coordinates {")
+        out += ["        (%g, %g)" % (x, y) for (x, y) in points if x is not None and y is not None]
+        out.append("    };"+("\\addlegendentry {"+legend+"}" if legend else ""))
+    out.append(tikz_end)
+    return "\n".join(out)
+
+
+axis = "grid=both, scaled ticks=false, width=9cm, height=4cm, cycle list name=exotic, legend style={at={(1.04,1)},anchor=north west}"
+
+
+def run_figures(kind, s):
+    # [(name, tikz source)] of one run
+    figs = []
+    if kind == "rfc2544":
+        if s.get("throughput"):
+            pts = sorted((int(fs), v["mpps"]) for fs, v in s["throughput"].items())
+            figs.append(("throughput", tikz("xlabel={frame size [byte]}, ylabel={throughput [mpps]}, ymin=0, "+axis, [(None, pts, "mark=*")])))
+        if s.get("latency"):
+            plots = [(str(fs)+" byte", v["cdf"], "no markers") for fs, v in sorted(s["latency"].items(), key=lambda e: int(e[0]))]
+            figs.append(("latency_cdf", tikz("xlabel={latency [$\\mu$s]}, ylabel={CDF}, ymin=0, ymax=1, "+axis, plots)))
+        if s.get("frameloss"):
+            plots = [(str(fs)+" byte", [tuple(p) for p in v], "mark=*") for fs, v in sorted(s["frameloss"].items(), key=lambda e: int(e[0]))]
+            figs.append(("frameloss", tikz("xlabel={link rate [\\%]}, ylabel={frameloss [\\%]}, ymin=0, xmin=0, xmax=100, "+axis, plots)))
+        if s.get("backtoback"):
+            pts = sorted((int(fs), v["avg"]) for fs, v in s["backtoback"].items())
+            figs.append(("backtoback", tikz("xlabel={frame size [byte]}, ylabel={burst size [packets]}, ymin=0, "+axis, [(None, pts, "mark=*")])))
+    elif s.get("series"):
+        plots = [("flow "+fid, [tuple(p) for p in v], "no markers") for fid, v in sorted(s["series"].items(), key=lambda e: int(e[0]))]
+        figs.append(("goodput", tikz("xlabel={time [s]}, ylabel={goodput [Mbit/s]}, ymin=0, "+axis, plots)))
+    return figs
+
+
+def campaign_figures(summaries):
+    # [(name, tikz source)] over all runs
+    figs = []
+    th = {}
+    lat = {}
+    for (run_id, kind), s in summaries.items():
+        if kind != "rfc2544":
+            continue
+        for fs, v in s.get("throughput", {}).items():
+            th.setdefault(int(fs), []).append(v["mpps"])
+        for fs, v in s.get("latency", {}).items():
+            if v.get("p99") is not None:
+                lat.setdefault(int(fs), []).append(v["p99"])
+    def spread(d):
+        pts = sorted(d.items())
+        return [("min", [(fs, min(v)) for fs, v in pts], "mark=*"),
+                ("median", [(fs, sorted(v)[len(v)//2]) for fs, v in pts], "mark=*"),
+                ("max", [(fs, max(v)) for fs, v in pts], "mark=*")]
+    if th:
+        figs.append(("throughput", tikz("xlabel={frame size [byte]}, ylabel={throughput [mpps]}, ymin=0, "+axis, spread(th))))
+    if lat:
+        figs.append(("latency_p99", tikz("xlabel={frame size [byte]}, ylabel={p99 latency [$\\mu$s]}, ymin=0, "+axis, spread(lat))))
+    wl = [s for (run_id, kind), s in summaries.items() if kind == "workload" and s.get("bottleneck_mbps")]
+    if wl:
+        figs.append(("goodput", tikz("xlabel={bottleneck [Mbit/s]}, ylabel={total goodput [Mbit/s]}, ymin=0, "+axis,
+                                     [(None, [(s["bottleneck_mbps"], s["total_goodput_mbps"]) for s in wl], "only marks")])))
+        figs.append(("fairness", tikz("xlabel={bottleneck [Mbit/s]}, ylabel={Jain's fairness}, ymin=0, ymax=1, "+axis,
+                                      [(None, [(s["bottleneck_mbps"], s["fairness"]) for s in wl if s["fairness"] is not None], "only marks")])))
+    return figs
+
+
+def render(source, tex_path, compile_pdf):
+    # worker: write the standalone document and compile it
+    with open(tex_path, 'w') as f:
+        f.write(source)
+    if not compile_pdf:
+        return tex_path, True
+    d = os.path.dirname(tex_path)
+    p = subprocess.run(["pdflatex", "-interaction=batchmode", "-halt-on-error", "-output-directory", d, tex_path],
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base = tex_path[:-4]
+    for ext in (".aux", ".log"):
+        if p.returncode == 0 and os.path.exists(base+ext):
+            os.remove(base+ext)
+    return tex_path, p.returncode == 0
+
+
+# ---- report --------------------------------------------------------------------
+
+def tex_escape(s):
+    return re.sub(r"([_%&#$])", r"\\\1", s)
+
+
+def write_tables(outdir, summaries):
+    with open(os.path.join(outdir, "rfc2544.csv"), 'w') as f:
+        f.write("run,frame_size,throughput_mpps,throughput_mbps,latency_min,latency_avg,latency_p99,latency_max,btb_avg\n")
+        for (run_id, kind), s in sorted(summaries.items()):
+            if kind != "rfc2544":
+                continue
+            sizes = sorted(set(int(fs) for part in ("throughput", "latency", "backtoback") for fs in s.get(part, {})))
+            for fs in sizes:
+                th = s.get("throughput", {}).get(str(fs), {})
+                lat = s.get("latency", {}).get(str(fs), {})
+                btb = s.get("backtoback", {}).get(str(fs), {})
+                row = [run_id, fs, th.get("mpps"), th.get("mbps"), lat.get("min"), lat.get("avg"), lat.get("p99"), lat.get("max"), btb.get("avg")]
+                f.write(",".join("" if v is None else str(v) for v in row)+"\n")
+    with open(os.path.join(outdir, "workload.csv"), 'w') as f:
+        fields = ["flows", "protocol", "bottleneck_mbps", "latency_ms", "total_goodput_mbps", "fairness", "mean_rtt_ms"]
+        f.write("run,"+",".join(fields)+"\n")
+        for (run_id, kind), s in sorted(summaries.items()):
+            if kind == "workload":
+                f.write(run_id+","+",".join("" if s.get(k) is None else str(s[k]) for k in fields)+"\n")
+
+
+def fmt(v, f="%.3f"):
+    return "--" if v is None else f % v
+
+
+def run_section(run_id, kind, s, figures):
+    out = ["\\subsection*{"+tex_escape(run_id)+"}"]
+    if kind == "rfc2544":
+        out.append("\\begin{longtable}{rrrrrr} \\hline")
+        out.append("Frame Size (bytes) & Throughput (Mpps) & Latency Min & Avg & p99 & Max ($\\mu$s) \\\\ \\hline")
+        sizes = sorted(set(int(fs) for part in ("throughput", "latency") for fs in s.get(part, {})))
+        for fs in sizes:
+            th = s.get("throughput", {}).get(str(fs), {})
+            lat = s.get("latency", {}).get(str(fs), {})
+            out.append("%d & %s & %s & %s & %s & %s \\\\" % (fs, fmt(th.get("mpps")), fmt(lat.get("min"), "%.1f"),
+                                                          fmt(lat.get("avg"), "%.1f"), fmt(lat.get("p99"), "%.1f"), fmt(lat.get("max"), "%.1f")))
+        out.append("\\hline\n\\end{longtable}")
+    else:
+        out.append("%d %s flows, bottleneck %s Mbit/s, total goodput %s Mbit/s, fairness %s\n" %
+                   (s["flows"], s.get("protocol") or "", fmt(s.get("bottleneck_mbps"), "%g"),
+                    fmt(s.get("total_goodput_mbps"), "%.1f"), fmt(s.get("fairness"))))
+    for path in figures:
+        out.append("\\begin{center}\n\\includegraphics{"+path+"}\n\\end{center}")
+    return "\n".join(out)
+
+
+def build(args):
+    os.makedirs(args.outdir, exist_ok=True)
+    cache = Cache(os.path.join(args.outdir, "cache"))
+    compile_pdf = not args.no_compile and shutil.which("pdflatex") is not None
+    if not compile_pdf and not args.no_compile:
+        print("pdflatex not found, only writing the figure sources", file=sys.stderr)
+
+    runs = discover(args.roots)
+    keys = {}
+    for (run_id, kind, directory, files) in runs:
+        hashes = [(f, cache.file_hash(os.path.join(directory, f))) for f in files]
+        keys[(run_id, kind)] = (digest(RENDER_VERSION, kind, hashes), directory)
+    cache.save()
+
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        todo = {rk: (k, d) for rk, (k, d) in keys.items() if not os.path.exists(cache.summary_path(k))}
+        futures = [pool.submit(summarize, rk[1], d, cache.summary_path(k)) for rk, (k, d) in todo.items()]
+        for f in futures:
+            f.result()
+        print("%d runs, %d parsed" % (len(keys), len(todo)), file=sys.stderr)
+
+        summaries = {}
+        for rk, (k, d) in keys.items():
+            with open(cache.summary_path(k), 'r') as f:
+                summaries[rk] = json.load(f)
+
+        # every figure is cached by the hash of its own source
+        figures = {}
+        pending = {}
+        def add(owner, name, source):
+            key = digest(RENDER_VERSION, source)
+            tex = cache.figure_path(key, ".tex")
+            done = cache.figure_path(key, ".pdf" if compile_pdf else ".tex")
+            figures.setdefault(owner, []).append(os.path.relpath(tex[:-4], args.outdir))
+            if key not in pending and not os.path.exists(done):
+                pending[key] = pool.submit(render, source, tex, compile_pdf)
+        for name, source in campaign_figures(summaries):
+            add(None, name, source)
+        if not args.no_runs:
+            for (run_id, kind), s in sorted(summaries.items()):
+                for name, source in run_figures(kind, s):
+                    add((run_id, kind), name, source)
+        failed = 0
+        for f in pending.values():
+            tex_path, ok = f.result()
+            if not ok:
+                failed += 1
+                print("ERROR: compiling "+tex_path+" failed", file=sys.stderr)
+        print("%d figures, %d rendered, %d failed" % (sum(len(v) for v in figures.values()), len(pending), failed), file=sys.stderr)
+
+    write_tables(args.outdir, summaries)
+    with open(os.path.join(args.outdir, "report.tex"), 'w') as f:
+        f.write(tex_header)
+        f.write("\\section*{"+tex_escape(args.title)+"}\n")
+        f.write("%d rfc2544 runs, %d workload runs\n\n" % (sum(1 for rk in summaries if rk[1] == "rfc2544"),
+                                                          sum(1 for rk in summaries if rk[1] == "workload")))
+        for path in figures.get(None, []):
+            f.write("\\begin{center}\n\\includegraphics{"+path+"}\n\\end{center}\n")
+        if not args.no_runs:
+            f.write("\\newpage\n\\section*{Runs}\n")
+            for (run_id, kind), s in sorted(summaries.items()):
+                f.write(run_section(run_id, kind, s, figures.get((run_id, kind), []))+"\n\n")
+        f.write("\\end{document}\n")
+
+    if args.prune:
+        used = set(k for k, d in keys.values())
+        used_figs = set(os.path.basename(p) for v in figures.values() for p in v)
+        for name in os.listdir(os.path.join(cache.dir, "sum")):
+            if name[:-5] not in used:
+                os.remove(os.path.join(cache.dir, "sum", name))
+        for name in os.listdir(os.path.join(cache.dir, "fig")):
+            if os.path.splitext(name)[0] not in used_figs:
+                os.remove(os.path.join(cache.dir, "fig", name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="incremental report for rfc2544 and emulab runs")
+    parser.add_argument("roots", nargs='+', help='directories with run results')
+    parser.add_argument("-o", '--outdir', help='output directory (default=report)', default="report")
+    parser.add_argument("-j", '--jobs', help='worker processes (default: all cores)', type=int, default=os.cpu_count())
+    parser.add_argument("-t", '--title', help='report title', default="Test Report")
+    parser.add_argument('--no-runs', help='only the campaign figures and tables, no section per run', action='store_true')
+    parser.add_argument('--no-compile', help='do not run pdflatex on the figures', action='store_true')
+    parser.add_argument('--prune', help='remove cache entries that are no longer used', action='store_true')
+    args = parser.parse_args()
+    build(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+#
+# split a pcap file into shards by flow for parallel replay
+# (examples/pcap/replay-pcap.lua with one tx queue and task per shard).
+#
+# Every packet of a flow (IPv4 5-tuple, non-IP packets count as one flow)
+# goes to the same shard, in capture order, so the replay keeps the order
+# within every flow.  The shards keep the original timestamps: the replay
+# starts all of them at the same time and offsets each shard by its first
+# timestamp, so the global timing of the capture is kept too.
+#
+#   hash     shard = hash of the 5-tuple modulo the number of shards
+#   balance  flows are assigned biggest first to the shard with the fewest
+#            bytes, for captures with a few elephant flows
+#
+#   ./mgshard.py trace.pcap -n 4 -o shards/
+#   ./build/MoonGen examples/pcap/replay-pcap.lua 0 shards/trace-0.pcap shards/trace-1.pcap ... -r 1
+#
+# Next to the shards <name>-shards.json lists packets, bytes, flows and the
+# time range of every shard.
+
+import os
+import sys
+import mmap
+import json
+import heapq
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy
+
+import mgflows
+
+copy_bytes = 8 << 20  # packet data gathered per write
+
+
+def read_records(filename, jobs, chunk_size):
+    # flow columns plus the position of every record, in capture order
+    size = os.path.getsize(filename)
+    starts = list(range(0, size, chunk_size))
+    parts = []
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        for n, cols in pool.map(mgflows.parse_chunk, [filename]*len(starts), starts,
+                                [min(s + chunk_size, size) for s in starts]):
+            parts.append(cols)
+    keys = ["ts", "src", "dst", "sport", "dport", "proto", "record", "caplen"]
+    return {k: numpy.concatenate([p[k] for p in parts]) if parts else numpy.zeros(0, dtype=numpy.int64) for k in keys}
+
+
+def flow_hash(cols):
+    # 64 bit mix of the 5-tuple, the same for every packet of a flow
+    a = (cols["src"].astype(numpy.uint64) << numpy.uint64(32)) | cols["dst"].astype(numpy.uint64)
+    b = ((cols["sport"].astype(numpy.uint64) << numpy.uint64(24)) | (cols["dport"].astype(numpy.uint64) << numpy.uint64(8))
+         | cols["proto"].astype(numpy.uint64))
+    h = a*numpy.uint64(0x9e3779b97f4a7c15) ^ b*numpy.uint64(0xc2b2ae3d27d4eb4f)
+    h ^= h >> numpy.uint64(31)
+    h *= numpy.uint64(0xbf58476d1ce4e5b9)
+    h ^= h >> numpy.uint64(29)
+    return h
+
+
+def assign(cols, shards, mode="hash"):
+    # shard of every packet
+    if mode == "hash":
+        return (flow_hash(cols) % numpy.uint64(shards)).astype(numpy.int64)
+    flow, keys = mgflows.group_flows(cols)
+    nbytes = numpy.bincount(flow, weights=cols["caplen"] + 16, minlength=len(keys))
+    load = [(0, s) for s in range(shards)]
+    flow_shard = numpy.zeros(len(keys), dtype=numpy.int64)
+    for f in numpy.argsort(-nbytes, kind='stable'):
+        (b, s) = heapq.heappop(load)
+        flow_shard[f] = s
+        heapq.heappush(load, (b + nbytes[f], s))
+    return flow_shard[flow]
+
+
+def write_shard(mm, header, filename, starts, lengths):
+    # copy the records (starts, lengths) into a new pcap file
+    buf = numpy.frombuffer(mm, dtype=numpy.uint8)
+    ends = numpy.cumsum(lengths)
+    with open(filename, 'wb') as f:
+        f.write(header)
+        i = 0
+        while i < len(starts):
+            # as many records as fit into copy_bytes, at least one
+            j = max(int(numpy.searchsorted(ends, (ends[i - 1] if i else 0) + copy_bytes, side='right')), i + 1)
+            s = starts[i:j]
+            n = lengths[i:j]
+            rel = numpy.arange(int(n.sum())) - numpy.repeat(numpy.cumsum(n) - n, n)
+            f.write(buf[numpy.repeat(s, n) + rel].tobytes())
+            i = j
+    del buf
+
+
+def shard(filename, shards, outdir, mode="hash", jobs=None, chunk_size=64 << 20):
+    cols = read_records(filename, jobs, chunk_size)
+    which = assign(cols, shards, mode)
+    base = os.path.splitext(os.path.basename(filename))[0]
+    os.makedirs(outdir, exist_ok=True)
+    flow, keys = mgflows.group_flows(cols) if len(cols["ts"]) else (numpy.zeros(0, dtype=numpy.int64), [])
+    meta = {"source": filename, "mode": mode, "packets": int(len(cols["ts"])),
+            "first_ts": int(cols["ts"].min()) if len(cols["ts"]) else 0,
+            "last_ts": int(cols["ts"].max()) if len(cols["ts"]) else 0, "shards": []}
+    with open(filename, 'rb') as f:
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        header = mm[:24]
+        for s in range(shards):
+            sel = which == s
+            out = os.path.join(outdir, "%s-%d.pcap" % (base, s))
+            lengths = cols["caplen"][sel] + 16
+            write_shard(mm, header, out, cols["record"][sel], lengths)
+            ts = cols["ts"][sel]
+            meta["shards"].append({"file": out, "packets": int(sel.sum()), "bytes": int(lengths.sum()),
+                                   "flows": int(len(numpy.unique(flow[sel]))),
+                                   "first_ts": int(ts.min()) if len(ts) else None,
+                                   "last_ts": int(ts.max()) if len(ts) else None})
+    finally:
+        mm.close()
+    with open(os.path.join(outdir, base+"-shards.json"), 'w') as f:
+        json.dump(meta, f, indent=1)
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description="split a pcap file into per-queue shards by flow")
+    parser.add_argument("input", help='pcap file')
+    parser.add_argument("-n", '--shards', help='number of shards (tx queues of the replay)', type=int, required=True)
+    parser.add_argument("-o", '--outdir', help='output directory (default=.)', default=".")
+    parser.add_argument("-m", '--mode', help='hash: 5-tuple hash, balance: spread the bytes of the flows evenly (default=hash)',
+                        choices=["hash", "balance"], default="hash")
+    parser.add_argument("-j", '--jobs', help='worker processes (default: all cores)', type=int, default=os.cpu_count())
+    parser.add_argument("-c", '--chunk-size', help='bytes per chunk in MB (default=64)', type=int, default=64)
+    args = parser.parse_args()
+    if args.shards <= 0 or args.chunk_size <= 0 or args.jobs <= 0:
+        parser.error("the number of shards, chunk size and jobs must be positive")
+
+    try:
+        meta = shard(args.input, args.shards, args.outdir, args.mode, args.jobs, args.chunk_size << 20)
+    except ValueError as e:
+        print("ERROR: "+str(e), file=sys.stderr)
+        sys.exit(-1)
+    for s in meta["shards"]:
+        print("%s: %d packets, %d flows, %.1f MB" % (s["file"], s["packets"], s["flows"], s["bytes"]/1e6), file=sys.stderr)
+    print(" ".join(s["file"] for s in meta["shards"]))
+
+
+if __name__ == "__main__":
+    main()
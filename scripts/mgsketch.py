@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+#
+# mergeable quantile sketches for latency data from many vantage points.
+#
+# Every node/thread/tap builds a t-digest from its own data, only the compact
+# sketches (a few KB) are moved and merged, and the tail quantiles are read
+# from the merged sketch.  The digest keeps at most O(compression) centroids,
+# with small centroids at both tails, so p99.9/p99.99 stay accurate.
+#
+#   ./mgsketch.py build -t hist hist.csv -o node1.td
+#   ./mgsketch.py build -t mscap latencies-pre.mscap latencies-post.mscap -o tap2.td
+#   ./mgsketch.py build -t mscap tap-pre.mscz tap-post.mscz -w 1000000000 2000000000 -o tap2-1s.td
+#   ./mgsketch.py build -t stats mglog-0.log -o node1-rates.td
+#   ./mgsketch.py merge node1.td tap2.td -o all.td
+#   ./mgsketch.py quantiles all.td -q 0.5 0.99 0.999 0.9999
+#
+# The inputs are read incrementally, nothing is loaded into memory as a whole.
+# Every sketch is labelled with the metric it holds: latency_ns for the
+# histograms and captures, rate_mpps/rate_mbit/rate_framing for the stats
+# logs.  Sketches of different metrics are never merged.
+
+import re
+import sys
+import math
+import base64
+import struct
+import argparse
+from collections import deque
+
+MAGIC = b"MGTD"
+VERSION = 2
+header_struct = struct.Struct("<4sHdQddI16s")  # magic, version, compression, count, min, max, centroids, metric
+header_v1_struct = struct.Struct("<4sHdQddI")  # without the metric, always latency_ns
+centroid_struct = struct.Struct("<dd")      # mean, weight
+
+# .mscap records written by lua/moonsniff-io.lua: timestamp (ns), identification
+mscap_struct = struct.Struct("<QI")
+TIME_THRESH = -50  # like arrmatch.lua, latencies below this are dropped
+
+
+class TDigest:
+    # merging t-digest (Dunning, "Computing extremely accurate quantiles using
+    # t-digests") with the k1 scale function
+
+    def __init__(self, compression=500, metric="latency_ns"):
+        self.compression = compression
+        self.metric = metric
+        self.means = []
+        self.weights = []
+        self.buffer = []
+        self.buffer_limit = 5*compression
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def __len__(self):
+        return self.count
+
+    def add(self, value, weight=1):
+        if weight <= 0:
+            return
+        self.buffer.append((value, weight))
+        self.count += weight
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if len(self.buffer) >= self.buffer_limit:
+            self.compress()
+
+    def add_many(self, values, weights=None):
+        if weights is None:
+            for v in values:
+                self.add(v)
+        else:
+            for v, w in zip(values, weights):
+                self.add(v, w)
+
+    def merge(self, other):
+        # add all centroids of another digest of the same metric
+        if other.metric != self.metric:
+            raise ValueError("cannot merge a sketch of "+other.metric+" into one of "+self.metric)
+        other.compress()
+        self.buffer.extend(zip(other.means, other.weights))
+        self.count += other.count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.compress()
+        return self
+
+    def k(self, q):
+        return self.compression/(2*math.pi)*math.asin(2*q - 1)
+
+    def k_inverse(self, k):
+        return (math.sin(k*2*math.pi/self.compression) + 1)/2
+
+    def compress(self):
+        if not self.buffer:
+            return
+        items = sorted(list(zip(self.means, self.weights)) + self.buffer)
+        self.buffer = []
+        total = float(sum(w for _, w in items))
+        means = []
+        weights = []
+        (cur_mean, cur_weight) = items[0]
+        weight_so_far = 0.0
+        q_limit = self.k_inverse(self.k(0) + 1)
+        for (mean, w) in items[1:]:
+            if (weight_so_far + cur_weight + w)/total <= q_limit:
+                cur_weight += w
+                cur_mean += (mean - cur_mean)*w/cur_weight
+            else:
+                means.append(cur_mean)
+                weights.append(cur_weight)
+                weight_so_far += cur_weight
+                q_limit = self.k_inverse(self.k(weight_so_far/total) + 1)
+                (cur_mean, cur_weight) = (mean, w)
+        means.append(cur_mean)
+        weights.append(cur_weight)
+        self.means = means
+        self.weights = weights
+
+    def quantile(self, q):
+        self.compress()
+        if not self.means:
+            return None
+        n = len(self.means)
+        if n == 1:
+            return self.means[0]
+        index = q*self.count
+        if index < 1:
+            return self.min
+        if index > self.count - 1:
+            return self.max
+        # between min and the center of the first centroid
+        w0 = self.weights[0]
+        if w0 > 1 and index < w0/2:
+            return self.min + (index - 1)/(w0/2 - 1)*(self.means[0] - self.min)
+        # between the center of the last centroid and max
+        wn = self.weights[-1]
+        if wn > 1 and self.count - index <= wn/2:
+            return self.max - (self.count - index - 1)/(wn/2 - 1)*(self.max - self.means[-1])
+        weight_so_far = w0/2
+        for i in range(n - 1):
+            dw = (self.weights[i] + self.weights[i + 1])/2
+            if weight_so_far + dw > index:
+                z1 = index - weight_so_far
+                z2 = weight_so_far + dw - index
+                return (self.means[i]*z2 + self.means[i + 1]*z1)/dw
+            weight_so_far += dw
+        return self.means[-1]
+
+    def to_bytes(self):
+        self.compress()
+        data = header_struct.pack(MAGIC, VERSION, self.compression, int(self.count), self.min, self.max, len(self.means),
+                                  self.metric.encode())
+        return data + b"".join(centroid_struct.pack(m, w) for m, w in zip(self.means, self.weights))
+
+    @classmethod
+    def from_bytes(cls, data):
+        (magic, version) = struct.unpack_from("<4sH", data, 0)
+        if magic != MAGIC or version not in (1, VERSION):
+            raise ValueError("not a t-digest of version "+str(VERSION))
+        if version == 1:
+            (magic, version, compression, count, mn, mx, n) = header_v1_struct.unpack_from(data, 0)
+            (metric, size) = ("latency_ns", header_v1_struct.size)
+        else:
+            (magic, version, compression, count, mn, mx, n, metric) = header_struct.unpack_from(data, 0)
+            (metric, size) = (metric.rstrip(b"\0").decode(), header_struct.size)
+        td = cls(compression, metric)
+        td.count = count
+        td.min = mn
+        td.max = mx
+        for (m, w) in centroid_struct.iter_unpack(data[size:size + n*centroid_struct.size]):
+            td.means.append(m)
+            td.weights.append(w)
+        return td
+
+    def to_base64(self):
+        # for embedding in json (e.g. nodeinfo or results files)
+        return base64.b64encode(self.to_bytes()).decode()
+
+    @classmethod
+    def from_base64(cls, s):
+        return cls.from_bytes(base64.b64decode(s))
+
+    def save(self, filename):
+        with open(filename, 'wb') as f:
+            f.write(self.to_bytes())
+
+    @classmethod
+    def load(cls, filename):
+        with open(filename, 'rb') as f:
+            return cls.from_bytes(f.read())
+
+
+# ---- input parsers -----------------------------------------------------------
+
+def read_histogram_csv(filename):
+    # (value, count) pairs of a histogram.csv written by hs_write or histogram:save()
+    with open(filename, 'r') as f:
+        for line in f:
+            fields = line.strip().split(',')
+            if len(fields) < 2:
+                continue
+            try:
+                yield (float(fields[0]), float(fields[1]))
+            except ValueError:
+                # header line
+                continue
+
+
+def read_mscap(filename, chunk=65536, window=None):
+    # lists of (timestamp, identification), chunk records at a time.
+    # .mscz archives (mgarchive.py, needs numpy) only decode the blocks of the window
+    with open(filename, 'rb') as f:
+        archive = f.read(4) == b"MSCZ"
+    if archive:
+        import mgarchive
+        for rec in mgarchive.read_archive(filename, window):
+            yield list(zip(rec["ts"].tolist(), rec["id"].tolist()))
+        return
+    with open(filename, 'rb') as f:
+        while True:
+            data = f.read(chunk*mscap_struct.size)
+            if len(data) < mscap_struct.size:
+                return
+            usable = len(data) - len(data) % mscap_struct.size
+            records = list(mscap_struct.iter_unpack(data[:usable]))
+            if window:
+                records = [r for r in records if window[0] <= r[0] <= window[1]]
+                if not records:
+                    continue
+            yield records
+
+
+def match_mscap(pre, post, max_age=10**9, window=None):
+    # yields the latencies of packets seen in both .mscap files.
+    # Pre entries that were not matched once both captures are max_age ns
+    # past them are dropped after every chunk (like mgtail.py), so memory is
+    # bounded by the packets in flight.
+    pending = {}
+    arrivals = deque()  # (ts, ident) of the pre entries in capture order
+    stats = {"pre": 0, "post": 0, "misses": 0, "dropped": 0}
+    pre_chunks = read_mscap(pre, window=window)
+    newest = 0
+    for post_chunk in read_mscap(post, window=window):
+        # keep the pre side ahead of the post side
+        last_post = post_chunk[-1][0]
+        while newest <= last_post:
+            pre_chunk = next(pre_chunks, None)
+            if pre_chunk is None:
+                break
+            for (ts, ident) in pre_chunk:
+                pending[ident] = ts
+            arrivals.extend(pre_chunk)
+            stats["pre"] += len(pre_chunk)
+            newest = pre_chunk[-1][0]
+        for (ts, ident) in post_chunk:
+            pre_ts = pending.pop(ident, None)
+            if pre_ts is None:
+                stats["misses"] += 1
+                continue
+            diff = ts - pre_ts
+            if diff >= TIME_THRESH:
+                yield diff
+        stats["post"] += len(post_chunk)
+        horizon = min(newest, last_post) - max_age
+        while arrivals and arrivals[0][0] < horizon:
+            (ts, ident) = arrivals.popleft()
+            # matched entries are gone, a reused identification is newer
+            if pending.get(ident) == ts:
+                del pending[ident]
+                stats["dropped"] += 1
+    print("mscap: %d pre, %d post, %d misses, %d dropped" % (stats["pre"], stats["post"], stats["misses"], stats["dropped"]), file=sys.stderr)
+
+
+stats_line_re = re.compile(r"\[Device: id=(\d+)\] (RX|TX): ([\d.]+) Mpps, ([\d.]+) Mbit/s \(([\d.]+) Mbit/s with framing\)")
+
+
+def read_stats_log(filename, direction="RX", field="mbit"):
+    # per-interval rates of the libmoon stats task, from the plain text output
+    # (MoonGen logs) or from the csv format.  The final summary lines are skipped.
+    index = {"mpps": 3, "mbit": 4, "framing": 5}[field]
+    csv_columns = None
+    with open(filename, 'r') as f:
+        for line in f:
+            if csv_columns is None and line.startswith("Time,"):
+                csv_columns = line.strip().split(',')
+                continue
+            if csv_columns:
+                row = dict(zip(csv_columns, line.strip().split(',')))
+                if row.get("Direction", direction).upper() != direction:
+                    continue
+                key = {"mpps": "PacketRate", "mbit": "Mbit", "framing": "MbitWithFraming"}[field]
+                try:
+                    yield float(row[key])
+                except (KeyError, ValueError):
+                    continue
+                continue
+            m = stats_line_re.search(line)
+            if m and m.group(2) == direction:
+                yield float(m.group(index))
+
+
+# ---- command line ------------------------------------------------------------
+
+def build(args):
+    td = TDigest(args.compression, "rate_"+args.field if args.type == "stats" else "latency_ns")
+    if args.type == "hist":
+        for filename in args.inputs:
+            for (value, count) in read_histogram_csv(filename):
+                td.add(value, count)
+    elif args.type == "mscap":
+        if len(args.inputs) != 2:
+            print("ERROR: mscap input needs the pre and the post file", file=sys.stderr)
+            sys.exit(1)
+        td.add_many(match_mscap(args.inputs[0], args.inputs[1], window=args.window))
+    elif args.type == "stats":
+        for filename in args.inputs:
+            td.add_many(read_stats_log(filename, args.direction, args.field))
+    td.save(args.output)
+    print("wrote sketch of "+str(int(td.count))+" "+td.metric+" values ("+str(len(td.means))+" centroids) to "+args.output, file=sys.stderr)
+
+
+def load_merged(filenames):
+    td = None
+    for filename in filenames:
+        other = TDigest.load(filename)
+        try:
+            td = other if td is None else td.merge(other)
+        except ValueError as e:
+            print("ERROR: "+filename+": "+str(e), file=sys.stderr)
+            sys.exit(1)
+    return td
+
+
+def merge(args):
+    td = load_merged(args.inputs)
+    td.save(args.output)
+    print("merged "+str(len(args.inputs))+" sketches, "+str(int(td.count))+" values", file=sys.stderr)
+
+
+def quantiles(args):
+    td = load_merged(args.inputs)
+    print("metric,"+td.metric)
+    print("count,"+str(int(td.count)))
+    print("min,"+str(td.min))
+    for q in args.quantiles:
+        print("p"+str(q*100)+","+str(td.quantile(q)))
+    print("max,"+str(td.max))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="mergeable t-digest latency sketches")
+    sub = parser.add_subparsers(dest="command")
+    sub.required = True
+
+    p = sub.add_parser("build", help='build a sketch from measurement files')
+    p.add_argument("inputs", nargs='+')
+    p.add_argument("-t", '--type', choices=["hist", "mscap", "stats"], default="hist",
+                   help='histogram.csv files, a pre and post .mscap/.mscz pair, or stats logs (default=hist)')
+    p.add_argument("-w", '--window', nargs=2, type=int, metavar=('START', 'STOP'), help='mscap: only packets with START <= ts <= STOP (ns)')
+    p.add_argument("-o", '--output', required=True)
+    p.add_argument("-c", '--compression', type=float, default=500, help='t-digest compression (default=500)')
+    p.add_argument('--direction', choices=["RX", "TX"], default="RX", help='stats logs: direction (default=RX)')
+    p.add_argument('--field', choices=["mpps", "mbit", "framing"], default="mbit", help='stats logs: rate to sketch (default=mbit)')
+    p.set_defaults(func=build)
+
+    p = sub.add_parser("merge", help='merge sketches')
+    p.add_argument("inputs", nargs='+')
+    p.add_argument("-o", '--output', required=True)
+    p.set_defaults(func=merge)
+
+    p = sub.add_parser("quantiles", help='print quantiles of (the merge of) sketches')
+    p.add_argument("inputs", nargs='+')
+    p.add_argument("-q", '--quantiles', nargs='+', type=float, default=[0.5, 0.9, 0.99, 0.999, 0.9999])
+    p.set_defaults(func=quantiles)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
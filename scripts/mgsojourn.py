@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+#
+# reader for the sampled per-packet sojourn traces of the delay-line
+# forwarders (l2-forward-bsring-lrl.lua and l2-forward-psring-lrl.lua with
+# --sojourn-trace, see lua/sojourn-trace.lua for the layout, keep both in sync).
+#
+# Every source is one task of the forwarder.  The forward tasks record the
+# packets they dequeue, the receive tasks the packets that did not fit into
+# the delay line.  packets() turns a source into numpy columns:
+#
+#   time        s since the first record of the trace
+#   sojourn     ns from the arrival to the send
+#   ring        ns the packet spent in the ring before it was dequeued
+#   hold        ns from the dequeue to the send (waiting for the fixed latency)
+#   queueing    sojourn minus the fixed latency: the delay added by the
+#               backlog in front of the rate limiter
+#   occupancy   bytes or packets in the ring at the dequeue (forward) or
+#               before the enqueue (receive)
+#   pkt_len, reason (sent, loss, overflow)
+#
+# Dropped packets have nan in the times they never reached.
+#
+#   ./mgsojourn.py /tmp/sojourn.trace
+#   ./mgsojourn.py /tmp/sojourn.trace -o sojourn.npz
+
+import sys
+import struct
+import argparse
+
+import numpy
+
+MAGIC = b"MGSOJRN1"
+VERSION = 1
+
+header_struct = struct.Struct("=8sIIIIII32x")
+source_struct = struct.Struct("=48sQQdddII")
+record_dtype = numpy.dtype([("enqueue", "<u8"), ("dequeue", "<u8"), ("send", "<u8"), ("occupancy", "<u4"),
+                            ("pkt_len", "<u2"), ("reason", "u1"), ("pad", "u1")])
+
+SENT = 0
+LOSS = 1
+OVERFLOW = 2
+reasons = {SENT: "sent", LOSS: "loss", OVERFLOW: "overflow"}
+units = {1: "bytes", 2: "packets"}
+
+
+def read_trace(path):
+    # [source dict with the header fields and the raw records written so far]
+    with open(path, 'rb') as f:
+        (magic, version, num_sources, num_records, record_size, source_size, sample) = header_struct.unpack(f.read(header_struct.size))
+        if magic != MAGIC:
+            raise ValueError(path+" is not an initialized sojourn trace")
+        if version != VERSION or record_size != record_dtype.itemsize:
+            raise ValueError(path+" has an unsupported sojourn trace version")
+        sources = []
+        for i in range(num_sources):
+            offset = header_struct.size + i*source_size
+            f.seek(offset)
+            (name, write_idx, seen, tsc_hz, latency, rate, capacity, unit) = source_struct.unpack(f.read(source_struct.size))
+            f.seek(offset + source_struct.size)
+            records = numpy.fromfile(f, dtype=record_dtype, count=min(write_idx, num_records))
+            sources.append({"name": name.split(b"\0", 1)[0].decode() or str(i), "seen": seen, "sample": sample,
+                            "tsc_hz": tsc_hz, "latency": latency, "rate": rate, "capacity": capacity,
+                            "unit": units.get(unit, str(unit)), "records": records})
+    return sources
+
+
+def trace_start(sources):
+    # first arrival tsc over all sources, the time origin of packets()
+    starts = [int(s["records"]["enqueue"].min()) for s in sources if len(s["records"]) and s["tsc_hz"]]
+    return min(starts) if starts else 0
+
+
+def packets(source, start=None):
+    # per-packet columns of one source (see the top of the file)
+    rec = source["records"]
+    ns = 1e9/source["tsc_hz"] if source["tsc_hz"] else 0.0
+    if start is None:
+        start = int(rec["enqueue"].min()) if len(rec) else 0
+    enqueue = (rec["enqueue"].astype(numpy.int64) - start).astype(numpy.float64)*ns
+    dequeued = rec["dequeue"] != 0
+    dequeue = numpy.where(dequeued, (rec["dequeue"].astype(numpy.int64) - start).astype(numpy.float64)*ns, numpy.nan)
+    send = numpy.where(dequeued, (rec["send"].astype(numpy.int64) - start).astype(numpy.float64)*ns, numpy.nan)
+    sojourn = send - enqueue
+    return {"time": enqueue/1e9,
+            "sojourn": sojourn,
+            "ring": dequeue - enqueue,
+            "hold": send - dequeue,
+            "queueing": sojourn - source["latency"]*1e6,
+            "occupancy": rec["occupancy"].astype(numpy.int64),
+            "pkt_len": rec["pkt_len"].astype(numpy.int64),
+            "reason": rec["reason"].astype(numpy.int64)}
+
+
+def summary(source, cols):
+    n = len(cols["reason"])
+    line = "%-20s %d/%d packets (1 in %d)" % (source["name"], n, source["seen"], source["sample"])
+    for code, name in reasons.items():
+        k = int((cols["reason"] == code).sum())
+        if k:
+            line += "  %s %d" % (name, k)
+    print(line)
+    sent = cols["reason"] != OVERFLOW
+    if sent.any():
+        s = cols["sojourn"][sent]
+        q = cols["queueing"][sent]
+        print("  sojourn    p50 %.0f p99 %.0f max %.0f ns (latency %.3f ms)"
+              % (numpy.percentile(s, 50), numpy.percentile(s, 99), s.max(), source["latency"]))
+        print("  queueing   mean %.0f p99 %.0f ns" % (q.mean(), numpy.percentile(q, 99)))
+    if n:
+        print("  occupancy  mean %.0f max %d of %d %s" % (cols["occupancy"].mean(), cols["occupancy"].max(),
+                                                          source["capacity"], source["unit"]))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("trace", help='trace file written with --sojourn-trace')
+    parser.add_argument("-o", '--npz', help='save the per-packet columns of all sources to this .npz file (<source>/<column>)')
+    args = parser.parse_args()
+
+    sources = read_trace(args.trace)
+    start = trace_start(sources)
+    arrays = {}
+    for source in sources:
+        cols = packets(source, start)
+        summary(source, cols)
+        for name, values in cols.items():
+            arrays[source["name"]+"/"+name] = values
+    if args.npz:
+        numpy.savez_compressed(args.npz, **arrays)
+        print("wrote "+args.npz, file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
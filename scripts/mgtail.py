@@ -0,0 +1,265 @@
+#!/usr/bin/env python3
+#
+# live latency and loss of a moonsniff capture while it is being written.
+#
+# The .mscap writer of lua/moonsniff-io.lua allocates the file ahead (512 MB,
+# then doubling) and fills it through a shared mapping, so the data ends at
+# the first record that is still zero, not at the end of the file.  Both
+# files are read with pread (never mapped: the writer's truncation at close
+# would fault a mapping that still spans the old size), a block at a time up
+# to that frontier on every poll.
+#
+# The new pre and post records are matched by identification against the
+# unmatched records of both sides, with numpy, a poll at a time.  A record is
+# evicted once both captures are more than --window ns past it: an unmatched
+# pre record is a lost packet, an unmatched post record a miss (post without
+# pre, like in post-processing.lua).  Memory is bounded by the packets in
+# flight within the window (and --max-pending).
+#
+# Every --interval seconds the quantiles of the latencies matched in the last
+# --rolling seconds and the loss rate over the same time are printed (and
+# appended as a json line to --json), at the end the quantiles of the whole
+# run from a t-digest (mgsketch.py, saved with --sketch).
+#
+#   ./mgtail.py latencies-pre.mscap latencies-post.mscap
+#   ./mgtail.py latencies-pre.mscap latencies-post.mscap -i 1 -r 10 --json live.jsonl --sketch run.td
+#
+# The tailer stops when both files are closed (truncated to their data), when
+# neither has grown for --idle seconds (0: never) or on ctrl-c, and prints the
+# totals: packets lost are pre records never matched, misses post records
+# never matched.
+
+import os
+import sys
+import json
+import time
+import argparse
+from collections import deque
+
+import numpy
+
+import mgsketch
+from mgarchive import mscap_dtype
+
+empty = numpy.zeros(0, dtype=mscap_dtype)
+digest_groups = 1000  # (mean, weight) pairs added to the t-digest per poll
+
+
+class MscapTail:
+    # the records a moonsniff writer has added to an .mscap file since the last poll
+
+    def __init__(self, filename, step=1 << 16):
+        self.filename = filename
+        self.step = step    # records read at a time
+        self.f = None
+        self.size = 0
+        self.pos = 0        # records read
+        self.at_end = False
+
+    def read(self, pos, count):
+        # copies the records, a truncation by the writer just gives a short read
+        data = os.pread(self.f.fileno(), count*mscap_dtype.itemsize, pos*mscap_dtype.itemsize)
+        return numpy.frombuffer(data, dtype=mscap_dtype, count=len(data)//mscap_dtype.itemsize)
+
+    def poll(self, limit=1 << 22):
+        if self.f is None:
+            if not os.path.exists(self.filename):
+                return empty
+            self.f = open(self.filename, 'rb')
+        self.size = os.fstat(self.f.fileno()).st_size
+        end = self.size//mscap_dtype.itemsize
+        parts = []
+        n = 0
+        # a step at a time, so the zeroed space ahead of the data is not read as a whole
+        while n < limit and self.pos + n < end:
+            rec = self.read(self.pos + n, min(self.step, limit - n, end - self.pos - n))
+            unwritten = numpy.flatnonzero(rec["ts"] == 0)
+            if len(unwritten):
+                rec = rec[:unwritten[0]]
+            parts.append(rec)
+            n += len(rec)
+            if len(unwritten) or len(rec) == 0:
+                break
+        self.pos += n
+        # closed by the writer: truncated to the data, nothing unwritten behind it
+        self.at_end = self.pos >= os.fstat(self.f.fileno()).st_size//mscap_dtype.itemsize
+        if not parts:
+            return empty
+        return parts[0] if len(parts) == 1 else numpy.concatenate(parts)
+
+    def close(self):
+        if self.f is not None:
+            self.f.close()
+
+
+class Matcher:
+    # incremental pre/post matching within a sliding window of capture time
+
+    def __init__(self, window=10**9, max_pending=1 << 22):
+        self.window = window
+        self.max_pending = max_pending
+        self.pre = empty
+        self.post = empty
+        self.newest_pre = 0
+        self.newest_post = 0
+        self.counts = {"pre": 0, "post": 0, "matched": 0, "lost": 0, "misses": 0, "invalid": 0}
+
+    def add(self, pre, post):
+        # returns the latencies (ns) of the packets matched by these records
+        self.counts["pre"] += len(pre)
+        self.counts["post"] += len(post)
+        if len(pre):
+            self.newest_pre = max(self.newest_pre, int(pre["ts"].max()))
+            self.pre = numpy.concatenate((self.pre, pre))
+        if len(post):
+            self.newest_post = max(self.newest_post, int(post["ts"].max()))
+            self.post = numpy.concatenate((self.post, post))
+        lat = numpy.zeros(0, dtype=numpy.int64)
+        if len(self.pre) and len(self.post):
+            order = numpy.argsort(self.pre["id"], kind='stable')
+            ids = self.pre["id"][order]
+            pos = numpy.minimum(numpy.searchsorted(ids, self.post["id"]), len(ids) - 1)
+            hit = ids[pos] == self.post["id"]
+            # one post record per pre record, the first one in capture order
+            pre_idx, first = numpy.unique(order[pos[hit]], return_index=True)
+            post_idx = numpy.flatnonzero(hit)[first]
+            lat = self.post["ts"][post_idx].astype(numpy.int64) - self.pre["ts"][pre_idx].astype(numpy.int64)
+            keep = numpy.ones(len(self.pre), dtype=bool)
+            keep[pre_idx] = False
+            self.pre = self.pre[keep]
+            keep = numpy.ones(len(self.post), dtype=bool)
+            keep[post_idx] = False
+            self.post = self.post[keep]
+            valid = lat >= mgsketch.TIME_THRESH
+            self.counts["invalid"] += int((~valid).sum())
+            lat = lat[valid]
+            self.counts["matched"] += len(lat)
+        self.evict(min(self.newest_pre, self.newest_post) - self.window)
+        return lat
+
+    def evict(self, horizon):
+        # records older than horizon will not be matched any more
+        old = self.pre["ts"] < horizon if horizon > 0 else numpy.zeros(len(self.pre), dtype=bool)
+        if len(self.pre) - old.sum() > self.max_pending:
+            old[:len(self.pre) - self.max_pending] = True
+        self.counts["lost"] += int(old.sum())
+        self.pre = self.pre[~old]
+        old = self.post["ts"] < horizon if horizon > 0 else numpy.zeros(len(self.post), dtype=bool)
+        if len(self.post) - old.sum() > self.max_pending:
+            old[:len(self.post) - self.max_pending] = True
+        self.counts["misses"] += int(old.sum())
+        self.post = self.post[~old]
+
+    def finish(self):
+        self.counts["lost"] += len(self.pre)
+        self.counts["misses"] += len(self.post)
+        self.pre = empty
+        self.post = empty
+
+
+def digest_add(td, lat):
+    # add many values to the t-digest as a bounded number of (mean, weight) groups
+    if not len(lat):
+        return
+    values = numpy.sort(lat).astype(numpy.float64)
+    groups = numpy.array_split(values, min(len(values), digest_groups))
+    td.add_many([g.mean() for g in groups], [len(g) for g in groups])
+
+
+def report(elapsed, rolling, counts, pending, quantiles):
+    lat = numpy.concatenate([r[1] for r in rolling]) if rolling else numpy.zeros(0)
+    matched = sum(len(r[1]) for r in rolling)
+    lost = sum(r[2] for r in rolling)
+    entry = {"time": round(elapsed, 3), "pre": counts["pre"], "post": counts["post"], "matched": counts["matched"],
+             "lost": counts["lost"], "misses": counts["misses"], "pending": pending,
+             "loss_rate": lost/(matched + lost) if matched + lost else None}
+    line = "%8.1f s  pre %d post %d  matched %d  lost %d  misses %d  pending %d" % (
+        elapsed, counts["pre"], counts["post"], counts["matched"], counts["lost"], counts["misses"], pending)
+    if entry["loss_rate"] is not None:
+        line += "  loss %.4f%%" % (100*entry["loss_rate"])
+    if len(lat):
+        qs = numpy.percentile(lat, [100*q for q in quantiles])
+        for q, v in zip(quantiles, qs):
+            entry["p%g" % (q*100)] = float(v)
+        line += "  " + " ".join("p%g %.0f" % (q*100, v) for q, v in zip(quantiles, qs)) + " ns"
+    print(line)
+    return entry
+
+
+def tail(pre_file, post_file, window=10**9, interval=1.0, rolling=10.0, idle=5.0,
+         quantiles=(0.5, 0.99, 0.999), json_file=None, max_pending=1 << 22):
+    # follow both files until they are closed, returns the matcher and the t-digest of the run
+    pre = MscapTail(pre_file)
+    post = MscapTail(post_file)
+    matcher = Matcher(window, max_pending)
+    td = mgsketch.TDigest()
+    recent = deque()   # (wall time, latencies, lost) per poll
+    start = time.time()
+    next_report = start + interval
+    last_data = start
+    out = open(json_file, 'a') if json_file else None
+    try:
+        while True:
+            a = pre.poll()
+            b = post.poll()
+            lost = matcher.counts["lost"]
+            lat = matcher.add(a, b)
+            now = time.time()
+            recent.append((now, lat, matcher.counts["lost"] - lost))
+            while recent and recent[0][0] < now - rolling:
+                recent.popleft()
+            digest_add(td, lat)
+            if len(a) or len(b):
+                last_data = now
+            # a closed file ends at its data, give the other one an interval to catch up
+            done = ((pre.at_end and post.at_end and now - last_data > min(interval, idle or interval))
+                    or (idle and now - last_data > idle))
+            if now >= next_report or done:
+                entry = report(now - start, recent, matcher.counts, len(matcher.pre) + len(matcher.post), quantiles)
+                if out:
+                    out.write(json.dumps(entry)+"\n")
+                    out.flush()
+                next_report += interval
+            if done:
+                break
+            if not len(a) and not len(b):
+                time.sleep(min(0.1, interval))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        pre.close()
+        post.close()
+        if out:
+            out.close()
+    matcher.finish()
+    return matcher, td
+
+
+def main():
+    parser = argparse.ArgumentParser(description="live latency quantiles and loss of growing moonsniff captures")
+    parser.add_argument("pre", help='pre-DUT .mscap file')
+    parser.add_argument("post", help='post-DUT .mscap file')
+    parser.add_argument("-w", '--window', help='ns after which unmatched records are evicted (default=1e9)', type=float, default=1e9)
+    parser.add_argument("-i", '--interval', help='seconds between reports (default=1)', type=float, default=1.0)
+    parser.add_argument("-r", '--rolling', help='seconds of matches the reported quantiles and loss rate cover (default=10)', type=float, default=10.0)
+    parser.add_argument('--idle', help='stop when neither file has grown for this many seconds, 0: never (default=5)', type=float, default=5.0)
+    parser.add_argument("-q", '--quantiles', nargs='+', type=float, default=[0.5, 0.99, 0.999])
+    parser.add_argument('--max-pending', help='unmatched records kept per side at most (default=4M)', type=int, default=1 << 22)
+    parser.add_argument('--json', help='append every report as a json line to this file')
+    parser.add_argument('--sketch', help='save the t-digest of all latencies of the run to this file (mgsketch.py)')
+    args = parser.parse_args()
+
+    matcher, td = tail(args.pre, args.post, int(args.window), args.interval, args.rolling, args.idle,
+                       args.quantiles, args.json, args.max_pending)
+    c = matcher.counts
+    print("total: %d pre, %d post, %d matched, %d lost (%.4f%%), %d misses, %d invalid"
+          % (c["pre"], c["post"], c["matched"], c["lost"], 100*c["lost"]/max(c["matched"] + c["lost"], 1),
+             c["misses"], c["invalid"]), file=sys.stderr)
+    if len(td):
+        print("  " + " ".join("p%g %.0f" % (q*100, td.quantile(q)) for q in args.quantiles) + " ns", file=sys.stderr)
+    if args.sketch:
+        td.save(args.sketch)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+# the tools are scripts, not a package: import them from the directory above
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pcaputil import write_pcap
+
+
+@pytest.fixture
+def make_pcap(tmp_path):
+    # writes [(ts ns, frame)] as a pcap in the test directory, returns its path
+    def make(packets, name="trace.pcap"):
+        path = str(tmp_path / name)
+        write_pcap(path, packets)
+        return path
+    return make
@@ -0,0 +1,20 @@
+# synthetic pcap captures for the tests
+import struct
+
+
+def udp_frame(src, dst, sport, dport, seq, size=64):
+    # ethernet/IPv4/UDP frame (without CRC) with a 32 bit big endian counter at the start of the payload
+    ip_len = size - 14
+    eth = b"\x02\x00\x00\x00\x00\x01\x02\x00\x00\x00\x00\x02\x08\x00"
+    ip = struct.pack(">BBHHHBBHII", 0x45, 0, ip_len, 0, 0, 64, 17, 0, src, dst)
+    udp = struct.pack(">HHHH", sport, dport, ip_len - 20, 0)
+    payload = struct.pack(">I", seq)
+    return (eth + ip + udp + payload).ljust(size, b"\0")
+
+
+def write_pcap(path, packets):
+    # [(ts ns, frame)] as a nanosecond pcap
+    with open(path, 'wb') as f:
+        f.write(struct.pack("<IHHiIII", 0xa1b23c4d, 2, 4, 0, 0, 65535, 1))
+        for (ts, frame) in packets:
+            f.write(struct.pack("<IIII", ts//10**9, ts % 10**9, len(frame), len(frame)) + frame)
@@ -0,0 +1,66 @@
+import os
+
+import numpy
+
+import mgflows
+from pcaputil import udp_frame
+
+
+def flow_columns(make_pcap, packets):
+    path = make_pcap(packets)
+    n, cols = mgflows.parse_chunk(path, 0, os.path.getsize(path), udp_seq=0)
+    keep = cols.pop("ip")
+    return {k: v[keep] for k, v in cols.items()}
+
+
+def test_parse_chunk_decodes_the_headers(make_pcap):
+    cols = flow_columns(make_pcap, [(5*10**9 + 7, udp_frame(0x0a000001, 0x0a000002, 1234, 80, 42, 100))])
+    assert cols["ts"].tolist() == [5*10**9 + 7]
+    assert cols["wirelen"].tolist() == [100]
+    assert (cols["src"][0], cols["dst"][0], cols["sport"][0], cols["dport"][0], cols["proto"][0]) == \
+        (0x0a000001, 0x0a000002, 1234, 80, 17)
+    assert cols["seq"].tolist() == [42] and cols["has_seq"].tolist() == [True]
+
+
+def test_lost_and_out_of_order_counters(make_pcap):
+    # flow a: 0..9 without 3 and 7, 5 arrives after 6; flow b: complete, wraps at 2^32
+    seq_a = [0, 1, 2, 4, 6, 5, 8, 9]
+    seq_b = [2**32 - 2, 2**32 - 1, 0, 1]
+    packets = [(10**9 + i*1000, udp_frame(1, 2, 10, 20, s)) for i, s in enumerate(seq_a)]
+    packets += [(10**9 + i*1000 + 500, udp_frame(3, 4, 30, 40, s)) for i, s in enumerate(seq_b)]
+    packets.sort(key=lambda p: p[0])
+    cols = flow_columns(make_pcap, packets)
+    flow, keys = mgflows.group_flows(cols)
+    m = mgflows.flow_metrics(cols, flow, len(keys))
+    a = int(numpy.flatnonzero(keys[:, 0] >> numpy.uint64(32) == 1)[0])
+    b = 1 - a
+    assert m["packets"][a] == 8 and m["packets"][b] == 4
+    assert m["lost"][a] == 2 and m["out_of_order"][a] == 1
+    assert m["lost"][b] == 0 and m["out_of_order"][b] == 0
+    assert m["first"][a] == 10**9 and m["last"][a] == 10**9 + 7000
+
+
+def test_sparse_throughput_matches_dense_bins():
+    rng = numpy.random.default_rng(0)
+    n = 5000
+    cols = {"ts": numpy.sort(rng.integers(0, 10*10**9, n)).astype(numpy.int64),
+            "wirelen": rng.integers(64, 1518, n).astype(numpy.uint32)}
+    flow = rng.integers(0, 40, n).astype(numpy.int64)
+    interval = 0.1
+    (tf, tb, mbps) = mgflows.throughput(cols, flow, interval)
+    bins = (cols["ts"] - cols["ts"].min())//int(interval*1e9)
+    dense = numpy.zeros((40, int(bins.max()) + 1))
+    numpy.add.at(dense, (flow, bins), cols["wirelen"]*8/interval/1e6)
+    assert numpy.allclose(dense[tf, tb], mbps)
+    # exactly the cells with packets, sorted by flow and interval
+    assert len(tf) == numpy.count_nonzero(dense)
+    assert numpy.all(numpy.diff(tf*dense.shape[1] + tb) > 0)
+
+
+def test_iat_histogram_buckets():
+    f = numpy.array([0, 0, 0, 1])
+    iat = numpy.array([0, 1, 1000, 3])
+    hist = mgflows.iat_histogram((f, iat), 2)
+    # bucket 0 is < 1 ns, bucket b holds [2^(b-1), 2^b)
+    assert hist[0, 0] == 1 and hist[0, 1] == 1 and hist[0, 10] == 1
+    assert hist[1, 2] == 1 and hist.sum() == 4
@@ -0,0 +1,68 @@
+import numpy
+import pytest
+
+try:
+    import mgnative
+except OSError:
+    pytest.skip("build/libmgnative.so is not built (or set MGNATIVE_LIB)", allow_module_level=True)
+
+
+def test_histogram_buckets_like_hs_update(tmp_path):
+    h = mgnative.Histogram(10)
+    # rounded to the nearest multiple of 10, half away from zero, negative values count
+    assert h.update([1, 4, 5, 14, 15, 26, -3]) == 1
+    h.finalize()
+    values, counts = h.buckets()
+    assert values.tolist() == [0, 10, 20, 30] and counts.tolist() == [3, 2, 1, 1]
+    assert h.count == 7 and h.bucket_size == 10
+    assert h.mean == pytest.approx(numpy.mean([1, 4, 5, 14, 15, 26, -3]))
+    h.write(str(tmp_path / "hist.csv"))
+    assert (tmp_path / "hist.csv").read_text().split() == ["0,3", "10,2", "20,1", "30,1"]
+
+
+def test_histogram_merge():
+    rng = numpy.random.default_rng(0)
+    data = rng.integers(0, 100000, 10000)
+    whole = mgnative.Histogram(100)
+    whole.update(data)
+    parts = [mgnative.Histogram(100) for _ in range(4)]
+    for p, chunk in zip(parts, numpy.array_split(data, 4)):
+        p.update(chunk)
+    for p in parts[1:]:
+        parts[0].merge(p)
+    (whole_values, whole_counts) = whole.buckets()
+    (values, counts) = parts[0].buckets()
+    assert numpy.array_equal(whole_values, values) and numpy.array_equal(whole_counts, counts)
+    assert parts[0].mean == pytest.approx(whole.mean)
+    with pytest.raises(ValueError):
+        whole.merge(mgnative.Histogram(10))
+    with pytest.raises(ValueError):
+        mgnative.Histogram(0)
+
+
+def test_hashmap_put_get_and_clean():
+    m = mgnative.HashMap(8, 16)
+    assert (m.key_size, m.value_size) == (8, 16)
+    keys = numpy.arange(1000, dtype=numpy.uint64)
+    # timestamp first, like the moonsniff entries clean() expects
+    values = numpy.stack([keys*10, keys], axis=1)
+    assert m.put(keys, values) == 1000 and len(m) == 1000
+    assert m.put(keys[:10], values[:10]) == 0
+    (got, found) = m.get(numpy.array([3, 5000], dtype=numpy.uint64))
+    assert got.tolist() == [[30, 3], [0, 0]] and found.tolist() == [True, False]
+    (got, found) = m.get(keys[:5], erase=True)
+    assert found.all() and len(m) == 995
+    # the entries with a timestamp below 5000: keys 5..499
+    assert m.clean(5000) == 495
+    assert len(m) == 500
+    assert m.get(keys[499:501])[1].tolist() == [False, True]
+
+
+def test_hashmap_byte_keys_are_padded():
+    m = mgnative.HashMap(13, 8)
+    assert m.key_size == 16
+    keys = numpy.frombuffer(b"flow-a-5-tuplflow-b-5-tupl", dtype=numpy.uint8).reshape(2, 13)
+    assert m.put(keys, numpy.array([1, 2], dtype=numpy.uint64)) == 2
+    assert m.get(keys[::-1])[0].tolist() == [2, 1]
+    with pytest.raises(ValueError):
+        mgnative.HashMap(65, 8)
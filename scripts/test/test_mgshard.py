@@ -0,0 +1,66 @@
+import json
+import os
+
+import numpy
+import pytest
+
+import mgflows
+import mgshard
+from pcaputil import udp_frame
+
+
+def interleaved(flows=12, packets=400, seed=0):
+    # (ts, frame) of several flows of different sizes, interleaved in time
+    rng = numpy.random.default_rng(seed)
+    which = rng.integers(0, flows, packets)
+    which[:flows] = numpy.arange(flows)
+    seq = numpy.zeros(flows, dtype=numpy.int64)
+    out = []
+    for i, f in enumerate(which):
+        out.append((10**9 + i*1000, udp_frame(0x0a000001 + int(f), 0x0a000100, 1000 + int(f), 5000, int(seq[f]),
+                                               64 + 8*int(f))))
+        seq[f] += 1
+    return out
+
+
+def read_shard(path):
+    n, cols = mgflows.parse_chunk(path, 0, os.path.getsize(path), udp_seq=0)
+    return cols
+
+
+@pytest.mark.parametrize("mode", ["hash", "balance"])
+def test_shards_keep_every_packet_and_the_flow_order(make_pcap, tmp_path, mode):
+    packets = interleaved()
+    src = make_pcap(packets)
+    meta = mgshard.shard(src, 3, str(tmp_path / "out"), mode=mode, jobs=1)
+    assert meta["packets"] == len(packets)
+    assert sum(s["packets"] for s in meta["shards"]) == len(packets)
+
+    seen = {}
+    for s in meta["shards"]:
+        cols = read_shard(s["file"])
+        assert len(cols["ts"]) == s["packets"]
+        # capture order within the shard, and every flow on this shard only
+        assert numpy.all(numpy.diff(cols["ts"]) > 0)
+        for sport, seq in zip(cols["sport"].tolist(), cols["seq"].tolist()):
+            assert seen.setdefault(sport, (s["file"], []))[0] == s["file"]
+            seen[sport][1].append(seq)
+    assert len(seen) == 12
+    for (_, seqs) in seen.values():
+        assert seqs == list(range(len(seqs)))
+    with open(tmp_path / "out" / "trace-shards.json") as f:
+        assert json.load(f)["mode"] == mode
+
+
+def test_balance_spreads_the_bytes(make_pcap, tmp_path):
+    meta = mgshard.shard(make_pcap(interleaved(flows=8, packets=800, seed=1)), 4, str(tmp_path), mode="balance", jobs=1)
+    nbytes = [s["bytes"] for s in meta["shards"]]
+    assert max(nbytes) - min(nbytes) <= max(nbytes)//4
+
+
+def test_small_chunks_give_the_same_records(make_pcap):
+    src = make_pcap(interleaved(packets=300, seed=2))
+    whole = mgshard.read_records(src, 1, 64 << 20)
+    chunked = mgshard.read_records(src, 2, 4096)
+    for k in whole:
+        assert numpy.array_equal(whole[k], chunked[k])
@@ -0,0 +1,92 @@
+import numpy
+import pytest
+
+import mgsketch
+
+
+def rank_error(data, value, q):
+    return abs(numpy.searchsorted(data, value, side='right')/len(data) - q)
+
+
+def test_quantiles_of_one_digest():
+    rng = numpy.random.default_rng(1)
+    data = numpy.sort(rng.lognormal(10, 1, 50000))
+    td = mgsketch.TDigest(200)
+    td.add_many(data.tolist())
+    assert len(td) == len(data)
+    for q in (0.01, 0.1, 0.5, 0.9, 0.99, 0.999):
+        assert rank_error(data, td.quantile(q), q) < 0.005
+    assert td.quantile(0) == data[0]
+    assert td.quantile(1) == data[-1]
+
+
+def test_merge_is_as_accurate_as_one_digest():
+    rng = numpy.random.default_rng(2)
+    parts = [rng.normal(1000*i, 300, 20000) for i in range(4)]
+    merged = mgsketch.TDigest(200)
+    for p in parts:
+        td = mgsketch.TDigest(200)
+        td.add_many(p.tolist())
+        merged.merge(td)
+    data = numpy.sort(numpy.concatenate(parts))
+    assert len(merged) == len(data)
+    assert merged.min == data[0] and merged.max == data[-1]
+    for q in (0.01, 0.25, 0.5, 0.75, 0.99):
+        assert rank_error(data, merged.quantile(q), q) < 0.005
+
+
+def test_weighted_values():
+    td = mgsketch.TDigest()
+    td.add_many([1.0, 2.0, 3.0], [1, 98, 1])
+    assert len(td) == 100
+    assert td.quantile(0.5) == 2.0
+
+
+def test_serialization_round_trip(tmp_path):
+    rng = numpy.random.default_rng(3)
+    td = mgsketch.TDigest(100)
+    td.add_many(rng.exponential(50, 10000).tolist())
+    back = mgsketch.TDigest.from_base64(td.to_base64())
+    path = str(tmp_path / "run.td")
+    td.save(path)
+    loaded = mgsketch.TDigest.load(path)
+    for other in (back, loaded):
+        assert len(other) == len(td)
+        assert (other.min, other.max) == (td.min, td.max)
+        for q in (0.1, 0.5, 0.99):
+            assert other.quantile(q) == td.quantile(q)
+
+
+def write_mscap(path, records):
+    with open(path, 'wb') as f:
+        for r in records:
+            f.write(mgsketch.mscap_struct.pack(*r))
+
+
+def test_unmatched_pre_records_are_dropped_every_chunk(tmp_path, monkeypatch, capsys):
+    # 1000 packets 1 us apart, every other one lost, read 100 records at a time
+    pre = [(10**6 + i*1000, i) for i in range(1000)]
+    post = [(ts + 500, i) for (ts, i) in pre if i % 2 == 0]
+    write_mscap(str(tmp_path / "pre.mscap"), pre)
+    write_mscap(str(tmp_path / "post.mscap"), post)
+    read = mgsketch.read_mscap
+    monkeypatch.setattr(mgsketch, "read_mscap", lambda f, window=None: read(f, chunk=100, window=window))
+    lat = list(mgsketch.match_mscap(str(tmp_path / "pre.mscap"), str(tmp_path / "post.mscap"), max_age=20000))
+    assert lat == [500]*500
+    # all lost packets but the ones within max_age of the end
+    dropped = int(capsys.readouterr().err.split(", ")[-1].split()[0])
+    assert 500 - 20 <= dropped < 500
+
+
+def test_sketches_are_labelled_with_their_metric(tmp_path):
+    td = mgsketch.TDigest(100, "rate_mbit")
+    td.add_many([900.0, 1000.0, 1100.0])
+    path = str(tmp_path / "rates.td")
+    td.save(path)
+    assert mgsketch.TDigest.load(path).metric == "rate_mbit"
+    with pytest.raises(ValueError):
+        mgsketch.TDigest(100).merge(mgsketch.TDigest.load(path))
+    # version 1 sketches held latencies
+    v1 = mgsketch.header_v1_struct.pack(mgsketch.MAGIC, 1, 100, 1, 5.0, 5.0, 1) + mgsketch.centroid_struct.pack(5.0, 1)
+    old = mgsketch.TDigest.from_bytes(v1)
+    assert old.metric == "latency_ns" and old.quantile(0.5) == 5.0
@@ -0,0 +1,82 @@
+import numpy
+
+import mgsketch
+import mgtail
+from mgarchive import mscap_dtype
+
+
+def records(ts, ids):
+    rec = numpy.zeros(len(ts), dtype=mscap_dtype)
+    rec["ts"] = ts
+    rec["id"] = ids
+    return rec
+
+
+def test_matcher_counts_latency_loss_and_misses():
+    n = 1000
+    pre = records(10**9 + numpy.arange(n)*1000, numpy.arange(n))
+    lost = {10, 500, 998}
+    ids = numpy.array([i for i in range(n) if i not in lost] + [n + 5])
+    post = records(10**9 + ids*1000 + 700, ids)
+    m = mgtail.Matcher(window=10**6)
+    lat = numpy.concatenate([m.add(pre[:400], post[:300]), m.add(pre[400:], post[300:])])
+    m.finish()
+    assert len(lat) == n - len(lost)
+    assert numpy.all(lat == 700)
+    assert m.counts == {"pre": n, "post": len(ids), "matched": n - len(lost),
+                        "lost": len(lost), "misses": 1, "invalid": 0}
+
+
+def test_matcher_evicts_outside_the_window():
+    m = mgtail.Matcher(window=10000)
+    m.add(records([1000, 2000], [1, 2]), records([1500], [1]))
+    assert len(m.pre) == 1
+    # both sides are now far past id 2: it is lost, a late post record is a miss
+    m.add(records([50000], [3]), records([50500], [3]))
+    assert len(m.pre) == 0 and m.counts["lost"] == 1
+    m.add(records([], []), records([60000], [2]))
+    m.finish()
+    assert m.counts["matched"] == 2 and m.counts["misses"] == 1
+
+
+def test_matcher_drops_negative_latencies():
+    m = mgtail.Matcher()
+    lat = m.add(records([1000, 1000], [1, 2]), records([1000 + mgsketch.TIME_THRESH - 1, 1010], [1, 2]))
+    assert lat.tolist() == [10]
+    assert m.counts["invalid"] == 1
+
+
+def test_tail_reads_up_to_the_unwritten_records(tmp_path):
+    path = str(tmp_path / "pre.mscap")
+    rec = records(numpy.arange(1, 11)*100, numpy.arange(10))
+    # allocated ahead by the writer, zero behind the data
+    numpy.concatenate((rec, numpy.zeros(6, dtype=mscap_dtype))).tofile(path)
+    t = mgtail.MscapTail(path)
+    assert numpy.array_equal(t.poll(), rec)
+    assert not t.at_end
+    # closed: truncated to the data
+    rec.tofile(path)
+    assert len(t.poll()) == 0 and t.at_end
+    t.close()
+
+
+def test_tail_reads_in_steps_and_survives_the_truncation(tmp_path):
+    path = str(tmp_path / "pre.mscap")
+    rec = records(numpy.arange(1, 101)*100, numpy.arange(100))
+    numpy.concatenate((rec[:40], numpy.zeros(60, dtype=mscap_dtype))).tofile(path)
+    t = mgtail.MscapTail(path, step=7)
+    assert numpy.array_equal(t.poll(limit=30), rec[:30])
+    assert numpy.array_equal(t.poll(), rec[30:40])
+    # the writer fills up and closes the file between two polls
+    rec[:90].tofile(path)
+    assert numpy.array_equal(t.poll(), rec[40:90]) and t.at_end
+    t.close()
+
+
+def test_digest_add_keeps_the_quantiles():
+    rng = numpy.random.default_rng(0)
+    lat = rng.integers(1000, 100000, 100000)
+    td = mgsketch.TDigest()
+    mgtail.digest_add(td, lat)
+    assert len(td) == len(lat)
+    assert abs(td.quantile(0.5) - numpy.median(lat)) < 0.01*numpy.median(lat)
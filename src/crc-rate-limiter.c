@@ -176,7 +176,8 @@ void moongen_send_all_packets_with_delay_bad_crc(uint8_t port_id, uint16_t queue
 	return;
 }
 
-void moongen_send_all_packets_with_delay_bad_crc_loss(uint8_t port_id, uint16_t queue_id, struct rte_mbuf** load_pkts, uint16_t num_pkts, struct rte_mempool* pool, uint32_t min_pkt_size, double loss_rate) {
+// lost (optional, num_pkts entries) is set to 1 for every packet dropped by the random loss
+void moongen_send_all_packets_with_delay_bad_crc_loss(uint8_t port_id, uint16_t queue_id, struct rte_mbuf** load_pkts, uint16_t num_pkts, struct rte_mempool* pool, uint32_t min_pkt_size, double loss_rate, uint8_t* lost) {
 	const int BUF_SIZE = 128;
 	struct rte_mbuf* pkts[BUF_SIZE];
 	int send_buf_idx = 0;
@@ -220,9 +221,11 @@ void moongen_send_all_packets_with_delay_bad_crc_loss(uint8_t port_id, uint16_t
 		// include random losses
 		if ((double)rand()/RAND_MAX >= loss_rate) {
 			pkts[send_buf_idx++] = pkt;
+			if (lost) lost[i] = 0;
 		} else {
 			// if the packet is not going to be sent, we have to free the mbuf.
 			rte_pktmbuf_free(pkt);
+			if (lost) lost[i] = 1;
 		}
 		if (send_buf_idx >= BUF_SIZE || i + 1 == num_pkts) { // don't forget to send the last batch
 			dpdk_send_all_packets(port_id, queue_id, pkts, send_buf_idx);
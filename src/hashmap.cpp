@@ -101,13 +101,45 @@ using namespace hash_map;
                 deque.push_front(it->first); \
             } \
             it++; \
-            for(auto it = deque.begin(); it != deque.end(); it++) { \
-                map->erase(*it); \
-        ++ctr; \
-            } \
+        } \
+        /* erasing invalidates the iterators, so only after the scan */ \
+        for(auto it = deque.begin(); it != deque.end(); it++) { \
+            ctr += map->erase(*it); \
         } \
         deque.clear(); \
     return ctr; \
+    } \
+    size_t hmapk##key_size##v##value_size##_size(hmapk##key_size##v##value_size* map) { \
+        return map->size(); \
+    } \
+    /* bulk entry points, keys and values are packed arrays of key_size/value_size bytes */ \
+    uint64_t hmapk##key_size##v##value_size##_put_bulk(hmapk##key_size##v##value_size* map, const void* keys, const void* values, size_t n) { \
+        const uint8_t* k = static_cast<const uint8_t*>(keys); \
+        const uint8_t* v = static_cast<const uint8_t*>(values); \
+        uint64_t inserted = 0; \
+        hmapk##key_size##v##value_size::accessor a; \
+        for (size_t i = 0; i < n; ++i) { \
+            if (map->insert(a, *reinterpret_cast<const K<key_size>*>(k + i * key_size))) ++inserted; \
+            std::memcpy(a->second.data(), v + i * value_size, value_size); \
+            a.release(); \
+        } \
+        return inserted; \
+    } \
+    uint64_t hmapk##key_size##v##value_size##_get_bulk(hmapk##key_size##v##value_size* map, const void* keys, void* values, uint8_t* found, size_t n, bool erase) { \
+        const uint8_t* k = static_cast<const uint8_t*>(keys); \
+        uint8_t* v = static_cast<uint8_t*>(values); \
+        uint64_t hits = 0; \
+        hmapk##key_size##v##value_size::accessor a; \
+        for (size_t i = 0; i < n; ++i) { \
+            found[i] = map->find(a, *reinterpret_cast<const K<key_size>*>(k + i * key_size)); \
+            if (found[i]) { \
+                ++hits; \
+                std::memcpy(v + i * value_size, a->second.data(), value_size); \
+                if (erase) map->erase(a); \
+            } \
+            a.release(); \
+        } \
+        return hits; \
     }
 
 #define MAP_VALUES(value_size) \
@@ -54,6 +54,48 @@ public:
 		return ret;
 	}
 
+	/**
+	 * Add all values of another histogram with the same bucket size.
+	 * Mean and m2 are combined with the parallel variant of the online algorithm.
+	 */
+	bool merge(const Histogram &other) {
+		if (other.bucket_size != bucket_size) {
+			return false;
+		}
+		if (other.count == 0) {
+			return true;
+		}
+		uint64_t total = count + other.count;
+		double delta = other.mean - mean;
+		mean = mean + delta * other.count / total;
+		m2 = m2 + other.m2 + delta * delta * ((double) count * other.count / total);
+		count = total;
+		for (auto &bucket : other.storage) {
+			storage[bucket.first] += bucket.second;
+		}
+		return true;
+	}
+
+	size_t numBuckets() const {
+		return storage.size();
+	}
+
+	int64_t getBucketSize() const {
+		return bucket_size;
+	}
+
+	/**
+	 * Copy up to n buckets (value, count) into the given arrays, in ascending order.
+	 */
+	size_t exportBuckets(int64_t *values, uint64_t *counts, size_t n) const {
+		size_t i = 0;
+		for (auto it = storage.begin(); it != storage.end() && i < n; ++it, ++i) {
+			values[i] = it->first;
+			counts[i] = it->second;
+		}
+		return i;
+	}
+
 	void finalize() {
 		if (count < 2) {
 			std::cerr << "Not enough members to calculate mean and variance\n";
@@ -130,5 +172,64 @@ double hs_getVariance() {
 	return hist->getVariance();
 }
 
+/*
+ * Handle based interface with bulk entry points, used by the Python bindings
+ * (scripts/mgnative.py). Bucketing is the same as for the hs_* functions above.
+ */
+Histogram* hist_create(uint32_t bucket_size) {
+	return new Histogram(bucket_size);
+}
+
+void hist_destroy(Histogram *h) {
+	delete h;
+}
+
+// returns the number of rejected (negative) values, which are still counted
+uint64_t hist_update_bulk(Histogram *h, const int64_t *values, size_t n) {
+	uint64_t rejected = 0;
+	for (size_t i = 0; i < n; ++i) {
+		if (!h->update(values[i])) {
+			++rejected;
+		}
+	}
+	return rejected;
+}
+
+bool hist_merge(Histogram *dst, const Histogram *src) {
+	return dst->merge(*src);
+}
+
+void hist_finalize(Histogram *h) {
+	h->finalize();
+}
+
+void hist_write(Histogram *h, const char *filename) {
+	h->write_to_file(filename);
+}
+
+uint64_t hist_count(Histogram *h) {
+	return h->getCount();
+}
+
+double hist_mean(Histogram *h) {
+	return h->getMean();
+}
+
+double hist_variance(Histogram *h) {
+	return h->getVariance();
+}
+
+int64_t hist_bucket_size(Histogram *h) {
+	return h->getBucketSize();
+}
+
+size_t hist_num_buckets(Histogram *h) {
+	return h->numBuckets();
+}
+
+size_t hist_export(Histogram *h, int64_t *values, uint64_t *counts, size_t n) {
+	return h->exportBuckets(values, counts, n);
+}
+
 }
 
@@ -0,0 +1,12 @@
+#include <cstdint>
+#include <highwayhash/sip_hash.h>
+
+/*
+ * SipHashC of highwayhash's c_bindings.cc for libmgnative.so (scripts/mgnative.py).
+ * The highwayhash archive MoonGen links is not built as position independent
+ * code, so the shared library compiles the header-only SipHash itself. The
+ * hash is the same as the one of the hashmaps in MoonGen.
+ */
+extern "C" uint64_t SipHashC(const uint64_t* key, const char* bytes, const uint64_t size) {
+	return highwayhash::SipHash(*reinterpret_cast<const highwayhash::SipHashState::Key*>(key), bytes, size);
+}
@@ -106,6 +106,16 @@ namespace moonsniff {
 		stats.variance_latency = variance;
 		return stats;
 	}
+
+	/**
+	 * Current statistics, does not print warnings so it can be polled while measuring.
+	 */
+	static ms_stats peek_stats() {
+		ms_stats current = stats;
+		current.average_latency = mean;
+		current.variance_latency = count < 2 ? 0 : m2 / (count - 1);
+		return current;
+	}
 }
 
 extern "C" {
@@ -125,4 +135,8 @@ void ms_test_for(uint32_t identification, uint64_t timestamp) {
 moonsniff::ms_stats ms_fetch_stats() {
 	return moonsniff::fetch_stats();
 }
+
+moonsniff::ms_stats ms_peek_stats() {
+	return moonsniff::peek_stats();
+}
 }
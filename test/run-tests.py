@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+#
+# parallel runner for the hardware test suite, an alternative to exec.sh.
+#
+# Every test is split into units that only need some of the ports:
+#   - tests using testlib:masterSingle() get one unit per card,
+#   - tests using testlib:masterPairSingle()/masterPairMulti() one per pair,
+#   - all other tests one unit with all cards.
+# Units with disjoint ports run at the same time as separate MoonGen
+# processes.  Each process gets a dpdk config (--dpdk-config) that whitelists
+# only its ports and gives it its own cores and hugepage file prefix, and a
+# tconfig.lua with only its cards and pairs (renumbered, DPDK numbers the
+# whitelisted ports from 0 in PCI order), found first through LUA_PATH.
+#
+#   cd test; sudo ./run-tests.py -j 4 -t 120
+#   sudo ./run-tests.py tests/01-send.lua --junit results.xml
+#
+# Every unit has a timeout, its output is kept in logs/, and the results are
+# written as JUnit XML.  config/tconfig.lua must exist (see config/autoconfig.sh).
+
+import os
+import re
+import sys
+import time
+import glob
+import signal
+import argparse
+import subprocess
+import xml.etree.ElementTree as ET
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+moongen = os.path.join(test_dir, "..", "build", "MoonGen")
+devbind = os.path.join(test_dir, "..", "libmoon", "deps", "dpdk", "usertools", "dpdk-devbind.py")
+
+result_re = re.compile(r"Ran (\d+) tests in ([\d.]+) seconds")
+failures_re = re.compile(r"failures=(\d+)")
+errors_re = re.compile(r"errors=(\d+)")
+
+
+def read_tconfig(filename):
+    # cards {port, mac, speed} and pairs {port, port} from the generated tconfig.lua
+    with open(filename, 'r') as f:
+        text = f.read()
+    cards = []
+    m = re.search(r"local cards = \{(.*)\}\s*$", text, re.M)
+    if m:
+        for (port, mac, speed) in re.findall(r"\{(\d+),\"([^\"]*)\"(?:,(\d+))?\}", m.group(1)):
+            cards.append((int(port), mac, int(speed) if speed else None))
+    pairs = []
+    m = re.search(r"local pairs = \{(.*)\}\s*$", text, re.M)
+    if m:
+        pairs = [(int(a), int(b)) for (a, b) in re.findall(r"\{(\d+),(\d+)\}", m.group(1))]
+    return cards, pairs
+
+
+def dpdk_ports():
+    # PCI addresses of the DPDK bound devices, in DPDK port order
+    out = subprocess.run([sys.executable, devbind, "--status-dev", "net"],
+                         stdout=subprocess.PIPE, stderr=subprocess.DEVNULL).stdout.decode()
+    section = out.split("Network devices using DPDK-compatible driver")[-1].split("Network devices using kernel driver")[0]
+    return sorted(re.findall(r"^([0-9a-f]{4}:[0-9a-f]{2}:[0-9a-f]{2}\.[0-9a-f])", section, re.M))
+
+
+def test_mode(filename):
+    with open(filename, 'r') as f:
+        text = f.read()
+    if "masterPairSingle" in text or "masterPairMulti" in text:
+        return "pair"
+    if "masterSingle" in text:
+        return "single"
+    return "all"
+
+
+def make_units(tests, cards, pairs):
+    units = []
+    for t in tests:
+        mode = test_mode(t)
+        if mode == "single":
+            for c in cards:
+                units.append({"test": t, "ports": [c[0]]})
+        elif mode == "pair":
+            for (a, b) in pairs:
+                units.append({"test": t, "ports": [a, b]})
+        else:
+            units.append({"test": t, "ports": [c[0] for c in cards]})
+    for u in units:
+        u["name"] = os.path.basename(u["test"])[:-4]+"["+",".join(str(p) for p in u["ports"])+"]"
+    return units
+
+
+def write_tconfig(dirname, unit, cards, pairs):
+    # the cards and pairs of the unit, renumbered like the whitelisted ports
+    new = {p: i for i, p in enumerate(sorted(unit["ports"]))}
+    c = [(new[p], mac, speed) for (p, mac, speed) in cards if p in new]
+    pr = [(new[a], new[b]) for (a, b) in pairs if a in new and b in new]
+    with open(os.path.join(dirname, "tconfig.lua"), 'w') as f:
+        f.write("local tconfig = {}\n\n")
+        f.write("local cards = {"+",".join("{%d,\"%s\"%s}" % (p, mac, ","+str(s) if s else "") for (p, mac, s) in sorted(c))+"}\n\n")
+        f.write("function tconfig.cards()\n\treturn cards\nend\n\n")
+        f.write("local pairs = {"+",".join("{%d,%d}" % pp for pp in pr)+"}\n\n")
+        f.write("function tconfig.pairs()\n\treturn pairs\nend\n\n")
+        f.write("return tconfig\n")
+
+
+def write_dpdk_config(dirname, unit, pci, cores, mem):
+    whitelist = [pci[p] for p in sorted(unit["ports"])]
+    filename = os.path.join(dirname, "dpdk-conf.lua")
+    with open(filename, 'w') as f:
+        f.write("DPDKConfig {\n")
+        f.write("\tcores = {"+", ".join(str(c) for c in cores)+"},\n")
+        f.write("\tpciWhitelist = {"+", ".join("\""+a+"\"" for a in whitelist)+"},\n")
+        f.write("\tcli = {\"--file-prefix\", \""+unit["prefix"]+"\", \"-m\", \""+str(mem)+"\"},\n")
+        f.write("}\n")
+    return filename
+
+
+def start_unit(unit, cards, pairs, pci, cores, args):
+    unit["prefix"] = "mgtest"+str(unit["index"])
+    dirname = os.path.join(args.workdir, unit["prefix"])
+    os.makedirs(dirname, exist_ok=True)
+    write_tconfig(dirname, unit, cards, pairs)
+    conf = write_dpdk_config(dirname, unit, pci, cores, args.mem)
+    env = dict(os.environ)
+    env["LUA_PATH"] = ";".join([dirname+"/?.lua", test_dir+"/?.lua", test_dir+"/config/?.lua", env.get("LUA_PATH", ";")])
+    unit["log"] = os.path.join(args.logdir, unit["name"]+".log")
+    unit["logfile"] = open(unit["log"], 'w')
+    unit["cores"] = cores
+    unit["start"] = time.time()
+    unit["proc"] = subprocess.Popen([moongen, unit["test"], "--dpdk-config="+conf], cwd=test_dir, env=env,
+                                    stdout=unit["logfile"], stderr=subprocess.STDOUT, start_new_session=True)
+    print("[INFO] started "+unit["name"]+" on cores "+",".join(str(c) for c in cores), file=sys.stderr)
+
+
+def stop(proc):
+    # every unit runs in its own session, stop the whole process group
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+        proc.wait(5)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+    except ProcessLookupError:
+        pass
+
+
+def finish_unit(unit, timed_out=False):
+    unit["time"] = time.time() - unit["start"]
+    unit["logfile"].close()
+    with open(unit["log"], 'r', errors='replace') as f:
+        output = f.read()
+    unit["output"] = output
+    m = result_re.search(output)
+    unit["tests"] = int(m.group(1)) if m else 0
+    tail = output[m.start():] if m else ""
+    f = failures_re.search(tail)
+    e = errors_re.search(tail)
+    unit["failures"] = int(f.group(1)) if f else 0
+    unit["errors"] = int(e.group(1)) if e else 0
+    rc = unit["proc"].returncode
+    if timed_out:
+        unit["status"] = "timeout"
+    elif not m:
+        unit["status"] = "error"
+    elif unit["failures"] or unit["errors"] or rc != 0:
+        unit["status"] = "failed"
+    else:
+        unit["status"] = "passed"
+    print("[INFO] "+unit["name"]+" "+unit["status"]+" in %.1fs" % unit["time"], file=sys.stderr)
+
+
+def run_units(units, cards, pairs, pci, args):
+    free_cores = list(args.cores)
+    busy_ports = set()
+    pending = list(units)
+    running = []
+    while pending or running:
+        # start everything that fits, in order
+        for u in list(pending):
+            if len(running) >= args.jobs or len(free_cores) < args.cores_per_job:
+                break
+            if busy_ports & set(u["ports"]):
+                continue
+            cores = free_cores[:args.cores_per_job]
+            del free_cores[:args.cores_per_job]
+            busy_ports |= set(u["ports"])
+            pending.remove(u)
+            start_unit(u, cards, pairs, pci, cores, args)
+            running.append(u)
+        if not running:
+            print("[FAIL] cannot schedule "+", ".join(u["name"] for u in pending)+" with the given cores", file=sys.stderr)
+            for u in pending:
+                u.update({"status": "error", "time": 0, "tests": 0, "failures": 0, "errors": 0, "output": "not scheduled"})
+            break
+        time.sleep(0.1)
+        for u in list(running):
+            timed_out = time.time() - u["start"] > args.timeout
+            if timed_out:
+                stop(u["proc"])
+            elif u["proc"].poll() is None:
+                continue
+            finish_unit(u, timed_out)
+            running.remove(u)
+            free_cores.extend(u["cores"])
+            busy_ports -= set(u["ports"])
+
+
+def write_junit(units, filename):
+    suites = ET.Element("testsuites")
+    for test in sorted(set(u["test"] for u in units)):
+        tu = [u for u in units if u["test"] == test]
+        suite = ET.SubElement(suites, "testsuite", name=os.path.basename(test), tests=str(len(tu)),
+                              failures=str(sum(1 for u in tu if u["status"] == "failed")),
+                              errors=str(sum(1 for u in tu if u["status"] in ("error", "timeout"))),
+                              time="%.3f" % sum(u["time"] for u in tu))
+        for u in tu:
+            case = ET.SubElement(suite, "testcase", classname=os.path.basename(test)[:-4], name=u["name"], time="%.3f" % u["time"])
+            if u["status"] == "failed":
+                ET.SubElement(case, "failure", message=str(u["failures"])+" of "+str(u["tests"])+" assertions failed").text = u["output"][-4000:]
+            elif u["status"] == "timeout":
+                ET.SubElement(case, "error", message="timeout").text = u["output"][-4000:]
+            elif u["status"] == "error":
+                ET.SubElement(case, "error", message="no test result").text = u["output"][-4000:]
+            ET.SubElement(case, "system-out").text = u["output"]
+    ET.ElementTree(suites).write(filename, encoding="utf-8", xml_declaration=True)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tests", nargs='*', help='test scripts (default: tests/*.lua)')
+    parser.add_argument("-j", '--jobs', help='maximum number of concurrent MoonGen processes (default=4)', type=int, default=4)
+    parser.add_argument("-t", '--timeout', help='timeout per unit in seconds (default=300)', type=float, default=300)
+    parser.add_argument("-c", '--cores', help='cores to use (default: all but core 0)', type=int, nargs='+')
+    parser.add_argument('--cores-per-job', help='cores per MoonGen process (default=3)', type=int, default=3)
+    parser.add_argument('--mem', help='hugepage memory per process in MB (default=1024)', type=int, default=1024)
+    parser.add_argument('--pci', help='PCI addresses of the DPDK ports, in port order (default: from dpdk-devbind.py)', nargs='+')
+    parser.add_argument('--junit', help='JUnit XML output (default=logs/junit-<date>.xml)')
+    parser.add_argument('--logdir', help='directory for the unit logs (default=logs)', default=os.path.join(test_dir, "logs"))
+    parser.add_argument('--workdir', help='directory for the generated configs (default=/tmp/mgtest)', default="/tmp/mgtest")
+    args = parser.parse_args()
+
+    tconfig = os.path.join(test_dir, "config", "tconfig.lua")
+    if not os.path.exists(tconfig):
+        print("[FAIL] "+tconfig+" not found, run config/autoconfig.sh first", file=sys.stderr)
+        sys.exit(1)
+    cards, pairs = read_tconfig(tconfig)
+    pci = args.pci or dpdk_ports()
+    if len(pci) < len(cards):
+        print("[FAIL] found "+str(len(pci))+" DPDK ports for "+str(len(cards))+" cards, use --pci", file=sys.stderr)
+        sys.exit(1)
+    if args.cores is None:
+        args.cores = list(range(1, os.cpu_count()))
+    tests = [os.path.abspath(t) for t in args.tests] or sorted(glob.glob(os.path.join(test_dir, "tests", "*.lua")))
+    os.makedirs(args.logdir, exist_ok=True)
+    os.makedirs(args.workdir, exist_ok=True)
+
+    units = make_units(tests, cards, pairs)
+    for i, u in enumerate(units):
+        u["index"] = i
+    start = time.time()
+    try:
+        run_units(units, cards, pairs, pci, args)
+    except KeyboardInterrupt:
+        for u in units:
+            if "proc" in u and u["proc"].poll() is None:
+                stop(u["proc"])
+        raise
+
+    junit = args.junit or os.path.join(args.logdir, "junit-"+time.strftime("%Y-%m-%d:%H:%M:%S")+".xml")
+    write_junit(units, junit)
+    print("---------------")
+    for u in units:
+        print("%-40s %-8s %7.1fs  %d assertions, %d failed" % (u["name"], u["status"], u["time"], u["tests"], u["failures"] + u["errors"]))
+    bad = [u for u in units if u["status"] != "passed"]
+    print("[INFO] ran "+str(len(units))+" units in %.1fs, %d not passed, results in %s" % (time.time() - start, len(bad), junit))
+    sys.exit(1 if bad else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+# checks of run-tests.py that need neither MoonGen nor network cards:  python -m pytest test/
+import os
+import re
+import importlib.util
+import xml.etree.ElementTree as ET
+
+import pytest
+
+spec = importlib.util.spec_from_file_location("run_tests", os.path.join(os.path.dirname(os.path.abspath(__file__)), "run-tests.py"))
+run_tests = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(run_tests)
+
+# what config/autoconfig.sh writes for four ports, port 2 without link
+TCONFIG = """local tconfig = {}
+
+local cards = {{0,"68:05:CA:00:00:01",10000},{1,"68:05:CA:00:00:02",10000},{3,"68:05:CA:00:00:04",1000}}
+
+function tconfig.cards()
+\treturn cards
+end
+
+local pairs = {{0,1},{1,3}}
+
+function tconfig.pairs()
+\treturn pairs
+end
+
+return tconfig
+"""
+
+PCI = ["0000:03:00.0", "0000:03:00.1", "0000:05:00.0", "0000:05:00.1"]
+
+
+@pytest.fixture
+def config(tmp_path):
+    path = tmp_path / "tconfig.lua"
+    path.write_text(TCONFIG)
+    return run_tests.read_tconfig(str(path))
+
+
+@pytest.fixture
+def tests(tmp_path):
+    scripts = {"00-basics.lua": "function master() end\n",
+               "01-send.lua": "function master(...) return testlib:masterSingle(...) end\n",
+               "03-timestamping.lua": "function master(...) return testlib:masterPairMulti(...) end\n"}
+    paths = []
+    for name, text in scripts.items():
+        (tmp_path / name).write_text(text)
+        paths.append(str(tmp_path / name))
+    return paths
+
+
+def test_read_tconfig(config):
+    (cards, pairs) = config
+    assert cards == [(0, "68:05:CA:00:00:01", 10000), (1, "68:05:CA:00:00:02", 10000), (3, "68:05:CA:00:00:04", 1000)]
+    assert pairs == [(0, 1), (1, 3)]
+
+
+def test_read_tconfig_without_speed_and_pairs(tmp_path):
+    # the intermediate tconfig.lua of autoconfig.sh, before the speed and pair detection
+    path = tmp_path / "tconfig.lua"
+    path.write_text('local tconfig = {}\nlocal cards = {{0,"00:00:00:00:00:01"},{1,"00:00:00:00:00:02"}}\n'
+                    'function tconfig.cards()\n\treturn cards\nend\nreturn tconfig\n')
+    assert run_tests.read_tconfig(str(path)) == ([(0, "00:00:00:00:00:01", None), (1, "00:00:00:00:00:02", None)], [])
+
+
+def test_make_units(config, tests):
+    (cards, pairs) = config
+    units = run_tests.make_units(tests, cards, pairs)
+    assert [(os.path.basename(u["test"]), u["ports"]) for u in units] == [
+        ("00-basics.lua", [0, 1, 3]),
+        ("01-send.lua", [0]), ("01-send.lua", [1]), ("01-send.lua", [3]),
+        ("03-timestamping.lua", [0, 1]), ("03-timestamping.lua", [1, 3])]
+    assert [u["name"] for u in units][-1] == "03-timestamping[1,3]"
+
+
+def test_unit_tconfig_is_renumbered(config, tmp_path):
+    (cards, pairs) = config
+    run_tests.write_tconfig(str(tmp_path), {"ports": [3, 1]}, cards, pairs)
+    # the whitelisted ports 1 and 3 are DPDK ports 0 and 1 of the unit
+    assert run_tests.read_tconfig(str(tmp_path / "tconfig.lua")) == \
+        ([(0, "68:05:CA:00:00:02", 10000), (1, "68:05:CA:00:00:04", 1000)], [(0, 1)])
+    run_tests.write_tconfig(str(tmp_path), {"ports": [0]}, cards, pairs)
+    assert run_tests.read_tconfig(str(tmp_path / "tconfig.lua")) == ([(0, "68:05:CA:00:00:01", 10000)], [])
+
+
+def test_dpdk_config(tmp_path):
+    unit = {"ports": [3, 1], "prefix": "mgtest7"}
+    filename = run_tests.write_dpdk_config(str(tmp_path), unit, PCI, [4, 5, 6], 512)
+    with open(filename) as f:
+        text = f.read()
+    assert re.search(r"cores = \{4, 5, 6\},", text)
+    # in port order, so DPDK numbers them like the unit's tconfig.lua
+    assert re.search(r'pciWhitelist = \{"0000:03:00.1", "0000:05:00.1"\},', text)
+    assert re.search(r'cli = \{"--file-prefix", "mgtest7", "-m", "512"\},', text)
+    assert text.startswith("DPDKConfig {") and text.rstrip().endswith("}")
+
+
+def unit(test, name, status, tests=3, failures=0, output="Ran 3 tests in 1.000 seconds"):
+    return {"test": test, "name": name, "status": status, "time": 1.5, "tests": tests,
+            "failures": failures, "errors": 0, "output": output}
+
+
+def test_junit(tmp_path):
+    units = [unit("/t/01-send.lua", "01-send[0]", "passed"),
+             unit("/t/01-send.lua", "01-send[1]", "failed", failures=1, output="Ran 3 tests, failures=1 <&>"),
+             unit("/t/02-receive.lua", "02-receive[0,1]", "timeout", tests=0, output="hung"),
+             unit("/t/03-timestamping.lua", "03-timestamping[0,1]", "error", tests=0, output="")]
+    filename = str(tmp_path / "junit.xml")
+    run_tests.write_junit(units, filename)
+    root = ET.parse(filename).getroot()
+    assert root.tag == "testsuites"
+    suites = {s.get("name"): s for s in root.findall("testsuite")}
+    assert sorted(suites) == ["01-send.lua", "02-receive.lua", "03-timestamping.lua"]
+    send = suites["01-send.lua"]
+    assert (send.get("tests"), send.get("failures"), send.get("errors"), send.get("time")) == ("2", "1", "0", "3.000")
+    cases = send.findall("testcase")
+    assert [c.get("name") for c in cases] == ["01-send[0]", "01-send[1]"]
+    assert all(c.get("classname") == "01-send" for c in cases)
+    assert cases[0].find("failure") is None
+    failure = cases[1].find("failure")
+    assert failure.get("message") == "1 of 3 assertions failed"
+    assert failure.text == "Ran 3 tests, failures=1 <&>"
+    assert suites["02-receive.lua"].get("errors") == "1"
+    assert suites["02-receive.lua"].find("testcase/error").get("message") == "timeout"
+    assert suites["03-timestamping.lua"].find("testcase/error").get("message") == "no test result"